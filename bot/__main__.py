@@ -1,32 +1,34 @@
 """程序入口"""
-import logging
-from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, filters
-
+from bot.app import create_app
+from bot.cluster import run_cluster
 from bot.config import Config
-from bot.handlers import start, help_cmd, chat_logic, sleep_on, sleep_off, sleep_status
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from bot.server import run
+from bot.services.logs import setup_logging, stop_logging
 
 
 def main():
-    app = ApplicationBuilder().token(Config.TELEGRAM_TOKEN).build()
+    # 日志经队列由后台线程格式化输出，处理器中写日志不做同步 I/O
+    setup_logging()
+    try:
+        _main()
+    finally:
+        stop_logging()
+
 
-    # 指令处理器
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_cmd))
-    app.add_handler(CommandHandler("sleepon", sleep_on))
-    app.add_handler(CommandHandler("sleepoff", sleep_off))
-    app.add_handler(CommandHandler("sleepstatus", sleep_status))
+def _main():
+    Config.validate()
 
-    # 消息处理器：过滤掉指令，只处理纯文本
-    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), chat_logic))
+    # 多进程分片：前端进程只接收和分发更新，工作进程各自持有一部分用户的状态
+    if Config.WORKERS > 1:
+        print(f"AI 机器人以 {Config.WORKERS} 个工作进程启动...")
+        run_cluster()
+        return
 
+    app = create_app()
     print("AI 机器人已启动...")
     print(f"睡眠提醒功能：用户可自定义提醒时间（默认 {Config.DEFAULT_REMINDER_TIME}）")
-    app.run_polling()
+    print(f"运行方式：{Config.BOT_MODE}")
+    run(app)
 
 
 if __name__ == '__main__':
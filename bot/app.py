@@ -0,0 +1,192 @@
+"""Application 工厂：校验配置并注册处理器；模型客户端在启动后后台预热"""
+import asyncio
+import functools
+import logging
+import time
+
+from telegram.ext import Application, ApplicationBuilder, MessageHandler, CommandHandler, filters
+
+from bot.config import Config
+from bot.handlers import start, help_cmd, chat_logic, media_logic, sleep_on, sleep_off, sleep_status
+from bot.server import DrainingApplication, InstrumentedRequest
+from bot.services import ai, media, prompts, reminder
+from bot.services.ai import warm_up
+from bot.services.groups import addressed
+from bot.services.inbox import chat_inbox
+from bot.services.logs import bind
+from bot.services.metrics import Counter, Gauge, Histogram, MetricsServer
+from bot.services.reminder import reminder_engine, restore_reminders
+from bot.services.storage import close_storage
+from bot.services.tracing import setup_tracing, shutdown_tracing, tracer
+
+HANDLER_CALLS = Counter("bot_handler_calls_total", "处理器调用次数", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "处理器抛出异常的次数", ["handler"])
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "处理器耗时（秒）", ["handler"])
+
+ACTIVE_SESSIONS = Gauge("bot_active_sessions", "内存中的聊天会话数")
+ACTIVE_SESSIONS.set_function(lambda: len(ai.user_chats))
+SCHEDULED_REMINDERS = Gauge("bot_scheduled_reminders", "已订阅的睡眠提醒数")
+SCHEDULED_REMINDERS.set_function(lambda: len(reminder_engine))
+
+
+def stats_gauge(name: str, documentation: str, stats, keys) -> Gauge:
+    """把 stats() 返回的各项导出为一个带 stat 标签的仪表，采集时才调用 stats()"""
+    gauge = Gauge(name, documentation, ["stat"])
+    for key in keys:
+        gauge.labels(key).set_function(lambda key=key: stats().get(key, 0))
+    return gauge
+
+
+# 各组件的运行统计（累计值与当前值）；限流器、发送器等可能被替换，采集时按模块属性取当前实例
+SESSION_STATS = stats_gauge(
+    "bot_session_store", "会话存储统计（命中、淘汰、过期、冷存储恢复等）", lambda: ai.user_chats.stats(),
+    ("sessions", "history_bytes", "spilled", "hits", "misses", "hit_rate", "evictions", "expirations", "rehydrations"),
+)
+INBOX_STATS = stats_gauge(
+    "bot_inbox", "消息收件箱统计（排队深度、合并比例）", lambda: chat_inbox.stats(),
+    ("queue_depth", "active_users", "messages", "turns", "coalesce_ratio"),
+)
+LIMITER_STATS = stats_gauge(
+    "bot_model_limiter", "模型调用限流器统计（并发上限、在途、排队、限流次数）", lambda: ai.limiter.stats(),
+    ("limit", "in_flight", "queued", "queued_users", "completed", "throttled"),
+)
+MODEL_CALL_STATS = stats_gauge(
+    "bot_model_calls", "模型调用统计（重试、对冲请求发出与胜出、改用备用模型）", lambda: ai.call_stats,
+    ("retries", "hedges", "hedge_wins", "fallbacks"),
+)
+CACHE_STATS = stats_gauge(
+    "bot_response_cache", "回复缓存统计（命中率、淘汰、过期；未启用时为 0）",
+    lambda: ai.response_cache.stats() if ai.response_cache is not None else {},
+    ("entries", "hits", "exact_hits", "semantic_hits", "misses", "hit_rate", "bypassed", "evictions", "expirations"),
+)
+BROADCAST_STATS = stats_gauge(
+    "bot_broadcaster", "提醒发送器统计（发送、失败、重试、被限流次数）", lambda: reminder.broadcaster.stats(),
+    ("sent", "failed", "permanent", "retries", "throttled"),
+)
+
+# 模型路由：各模型的在途请求数与冷却剩余秒数
+ROUTE_IN_FLIGHT = Gauge("bot_model_route_in_flight", "各模型的在途请求数", ["model"])
+ROUTE_COOLING = Gauge("bot_model_route_cooling_seconds", "各模型暂停使用的剩余秒数（0 表示可用）", ["model"])
+for _model in sorted({
+    prompts.registry.default.model,
+    *(profile.model for profile in prompts.registry.profiles.values()),
+    *filter(None, (ai.router.strong_model, ai.router.fallback_model)),
+}):
+    ROUTE_IN_FLIGHT.labels(_model).set_function(lambda model=_model: ai.router.stats()["in_flight"].get(model, 0))
+    ROUTE_COOLING.labels(_model).set_function(lambda model=_model: ai.router.stats()["cooling"].get(model, 0))
+
+# 后台预热任务（保留引用，避免任务被提前回收）
+_warm_up_task = None
+
+# 指标端点（METRICS_PORT 为 0 时不启动）
+_metrics_server = None
+
+
+def instrumented(callback, name: str = None):
+    """包装处理器：记录调用次数、异常次数与耗时，并把处理器名写入日志上下文"""
+    name = name or callback.__name__
+    calls = HANDLER_CALLS.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+    seconds = HANDLER_SECONDS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        calls.inc()
+        bind(handler=name)
+        tracer.annotate(handler=name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+async def start_metrics_server(port: int = None):
+    """按配置启动指标端点"""
+    global _metrics_server
+    port = Config.METRICS_PORT if port is None else port
+    if port <= 0 or _metrics_server is not None:
+        return
+    _metrics_server = MetricsServer(listen=Config.METRICS_LISTEN, port=port)
+    await _metrics_server.start()
+
+
+async def stop_metrics_server():
+    global _metrics_server
+    if _metrics_server is not None:
+        await _metrics_server.stop()
+        _metrics_server = None
+
+
+def start_warm_up():
+    """按配置在后台预热模型客户端"""
+    global _warm_up_task
+    if Config.AI_WARMUP and _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(_warm_up())
+
+
+async def _warm_up():
+    try:
+        await warm_up()
+    except Exception as e:
+        # 预热失败不影响启动，第一次聊天时会再次尝试创建
+        logging.warning(f"模型客户端预热失败: {e}")
+
+
+async def on_startup(app: Application):
+    """启动时恢复持久化的提醒任务（JobQueue 启动前批量加入），开始预热模型客户端，启动指标端点与链路追踪"""
+    setup_tracing()
+    restore_reminders(app.job_queue)
+    start_warm_up()
+    await start_metrics_server()
+
+
+async def on_shutdown(app: Application):
+    """退出时把待写入的数据落盘，关闭指标端点、媒体处理进程池并导出剩余的 trace"""
+    await stop_metrics_server()
+    await media.close()
+    shutdown_tracing()
+    close_storage()
+
+
+def create_app(request=None) -> Application:
+    """
+    校验配置，创建注册好全部处理器的 Application
+    request 为 Bot API 请求对象（同时用于 getUpdates），默认访问 Telegram；压测时传入本地假 Bot API
+    """
+    Config.validate()
+
+    # 允许并发处理不同用户的更新，AI 调用不再阻塞事件循环；退出时有限时排空处理中的更新
+    builder = (
+        ApplicationBuilder()
+        .application_class(DrainingApplication, kwargs={"drain_timeout": Config.SHUTDOWN_DRAIN_TIMEOUT})
+        .token(Config.TELEGRAM_TOKEN)
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is None:
+        builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    else:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
+
+    # 指令处理器（均记录调用次数与耗时）
+    app.add_handler(CommandHandler("start", instrumented(start)))
+    app.add_handler(CommandHandler("help", instrumented(help_cmd)))
+    app.add_handler(CommandHandler("sleepon", instrumented(sleep_on)))
+    app.add_handler(CommandHandler("sleepoff", instrumented(sleep_off)))
+    app.add_handler(CommandHandler("sleepstatus", instrumented(sleep_status)))
+
+    # 消息处理器：过滤掉指令，只处理纯文本；群组中只处理点名机器人的消息
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND) & addressed, instrumented(chat_logic)))
+    # 多模态输入：图片、语音、音频与文件
+    app.add_handler(MessageHandler(
+        (filters.PHOTO | filters.VOICE | filters.AUDIO | filters.Document.ALL) & addressed, instrumented(media_logic)
+    ))
+    return app
@@ -0,0 +1,409 @@
+"""
+多进程分片运行
+前端进程负责接收更新（长轮询或 Webhook），按一致性哈希分发给 N 个工作进程；
+工作进程运行完整的 Application，各自持有一部分用户的会话和提醒。
+增删工作进程时，归属改变的会话和提醒从旧进程交接给新进程。
+"""
+import asyncio
+import base64
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from bot.config import Config
+from bot.services.logs import setup_logging, stop_logging
+from bot.services.sharding import HashRing, shard_key
+
+# 单条消息的最大长度（交接的会话历史可能较大）
+_STREAM_LIMIT = 64 * 1024 * 1024
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+async def _receive(reader):
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+def _load_factory(path: str):
+    """按 "模块:函数" 导入 Application 工厂"""
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+# ---- 工作进程 ----
+
+
+def share_limits(workers: int):
+    """
+    按工作进程数平分全局限额
+    每个工作进程各有一个提醒发送器与模型限流器，而 Telegram 的发送上限、模型的 QPS / TPM / 并发配额
+    按整个机器人计算；不平分时 N 个进程合计会达到 N 倍
+    """
+    from bot.services import ai, reminder
+
+    workers = max(1, workers)
+    reminder.broadcaster.configure(Config.BROADCAST_RATE / workers)
+    ai.limiter.configure(
+        qps=Config.AI_QPS / workers,
+        tpm=Config.AI_TPM / workers,
+        max_concurrency=max(1, Config.AI_MAX_CONCURRENCY // workers),
+    )
+
+
+def worker_main(name: str, path: str, factory: str, nodes: list, restore: bool):
+    """工作进程入口"""
+    setup_logging(worker=name)
+    try:
+        asyncio.run(_serve_worker(name, path, factory, nodes, restore))
+    finally:
+        stop_logging()
+
+
+async def _serve_worker(name, path, factory, nodes, restore):
+    from bot.app import start_metrics_server, start_warm_up, stop_metrics_server
+    from bot.services.tracing import setup_tracing, shutdown_tracing
+    from bot.services import ai, reminder
+    from bot.services.storage import close_storage
+
+    app = _load_factory(factory)()
+    ring = HashRing(nodes)
+    stopped = asyncio.Event()
+    received = 0
+
+    def owns(key):
+        return ring.node_for(key) == name
+
+    async def drain():
+        """等待已收到的更新处理完（最多 SHUTDOWN_DRAIN_TIMEOUT 秒）"""
+        deadline = time.monotonic() + Config.SHUTDOWN_DRAIN_TIMEOUT
+        while (not app.update_queue.empty() or getattr(app, "in_flight", 0)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def handle(message):
+        nonlocal ring, received
+        kind = message["type"]
+        if kind == "update":
+            received += 1
+            await app.update_queue.put(Update.de_json(message["update"], app.bot))
+            return None
+        if kind == "rebalance":
+            # 交出归属改变的会话和提醒
+            await drain()
+            ring = HashRing(message["nodes"])
+            share_limits(len(message["nodes"]))
+            sessions = ai.export_sessions(keep=owns)
+            reminders = reminder.export_reminders(keep=owns)
+            return {
+                "sessions": {str(k): base64.b64encode(v).decode("ascii") for k, v in sessions.items()},
+                "reminders": reminders,
+            }
+        if kind == "import":
+            ai.import_sessions({int(k): base64.b64decode(v) for k, v in message["sessions"].items()})
+            reminder.schedule_reminders([tuple(r) for r in message["reminders"]])
+            return {"ok": True}
+        if kind == "share":
+            share_limits(message["workers"])
+            return {"ok": True}
+        if kind == "stats":
+            if message.get("drain"):
+                await drain()
+            return {
+                "received": received,
+                "queued": app.update_queue.qsize(),
+                "in_flight": getattr(app, "in_flight", 0),
+                "sessions": len(ai.user_chats),
+                "reminders": len(reminder.sleep_reminder_users),
+                "limits": {
+                    "broadcast_rate": reminder.broadcaster.global_bucket.rate,
+                    "ai_qps": ai.limiter.qps.rate,
+                    "ai_tpm": ai.limiter.tpm.rate * 60,
+                    "ai_max_concurrency": ai.limiter.max_concurrency,
+                },
+            }
+        if kind == "stop":
+            stopped.set()
+            return {"ok": True}
+        raise ValueError(f"未知的消息类型: {kind}")
+
+    async def serve(reader, writer):
+        while not stopped.is_set():
+            message = await _receive(reader)
+            if message is None:
+                break
+            reply = await handle(message)
+            if reply is not None:
+                writer.write(_encode(reply))
+                await writer.drain()
+        stopped.set()
+
+    share_limits(len(nodes))
+    async with app:
+        if restore:
+            reminder.restore_reminders(app.job_queue, owns=owns)
+        else:
+            reminder.reminder_engine.start(app.job_queue)
+        await app.start()
+        start_warm_up()
+        setup_tracing(**{"service.instance.id": name})
+        if Config.METRICS_PORT > 0:
+            await start_metrics_server(Config.METRICS_PORT + int(name.rsplit("-", 1)[-1]))
+        server = await asyncio.start_unix_server(serve, path=path, limit=_STREAM_LIMIT)
+        logging.info(f"工作进程 {name} 已就绪")
+        await stopped.wait()
+        server.close()
+        await stop_metrics_server()
+        await app.stop()
+        shutdown_tracing()
+    close_storage()
+
+
+# ---- 前端进程 ----
+
+
+class WorkerHandle:
+    """前端进程持有的工作进程连接"""
+
+    def __init__(self, name, process, reader, writer):
+        self.name = name
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+        self.routed = 0
+        self._lock = asyncio.Lock()
+
+    async def send_update(self, data: dict):
+        """转发一条更新（不等待处理结果）"""
+        self.writer.write(_encode({"type": "update", "update": data}))
+        self.routed += 1
+        await self.writer.drain()
+
+    async def call(self, message: dict) -> dict:
+        """发送控制消息并等待回复"""
+        async with self._lock:
+            self.writer.write(_encode(message))
+            await self.writer.drain()
+            reply = await _receive(self.reader)
+        if reply is None:
+            raise ConnectionError(f"工作进程 {self.name} 已断开")
+        return reply
+
+    async def close(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.call({"type": "stop"}), timeout)
+        except (ConnectionError, asyncio.TimeoutError, OSError) as e:
+            logging.warning(f"停止工作进程 {self.name} 失败: {e}")
+        self.writer.close()
+        await asyncio.get_running_loop().run_in_executor(None, self.process.join, timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class Cluster:
+    """
+    工作进程集群
+    - dispatch 按 shard_key 的一致性哈希把更新转发给工作进程
+    - add_worker / remove_worker 重新平衡，期间暂停转发，归属改变的状态交接完成后恢复
+    """
+
+    def __init__(self, factory: str = "bot.app:create_app", socket_dir=None, replicas: int = 100):
+        self.factory = factory
+        self.socket_dir = socket_dir
+        self.ring = HashRing(replicas=replicas)
+        self.workers = {}
+        self.handoffs = 0
+        self._owns_socket_dir = socket_dir is None
+        self._next_index = 0
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._context = multiprocessing.get_context("spawn")
+
+    async def start(self, count: int):
+        """启动 count 个工作进程（各自从持久化存储恢复归属自己的提醒）"""
+        if self.socket_dir is None:
+            self.socket_dir = tempfile.mkdtemp(prefix="bot-cluster-")
+        names = [self._new_name() for _ in range(count)]
+        for name in names:
+            self.ring.add(name)
+        handles = await asyncio.gather(*(self._spawn(name, restore=True) for name in names))
+        self.workers.update({handle.name: handle for handle in handles})
+
+    async def stop(self, timeout: float = None):
+        """停止全部工作进程（各自排空处理中的更新）"""
+        timeout = timeout if timeout is not None else Config.SHUTDOWN_DRAIN_TIMEOUT + 5
+        await asyncio.gather(*(handle.close(timeout) for handle in self.workers.values()))
+        self.workers.clear()
+        if self._owns_socket_dir and self.socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def dispatch(self, update):
+        """把一条更新转发给其归属的工作进程"""
+        if not self._ready.is_set():
+            await self._ready.wait()
+        data = update.to_dict() if isinstance(update, Update) else update
+        key = shard_key(update) if isinstance(update, Update) else shard_key(Update.de_json(data, None))
+        while self.workers:
+            handle = self.workers[self.ring.node_for(key)]
+            try:
+                await handle.send_update(data)
+                return
+            except (ConnectionError, OSError) as e:
+                # 工作进程异常退出：移出哈希环，它持有的内存状态丢失，持久化数据由新归属进程按需加载
+                logging.error(f"工作进程 {handle.name} 不可用，已移出: {e}")
+                self.ring.remove(handle.name)
+                del self.workers[handle.name]
+        raise RuntimeError("没有可用的工作进程")
+
+    async def add_worker(self) -> str:
+        """加入一个工作进程，并从其他进程接收归属它的状态"""
+        name = self._new_name()
+        handle = await self._spawn(name, restore=False, nodes=self.ring.nodes + [name])
+        self._ready.clear()
+        try:
+            self.ring.add(name)
+            self.workers[name] = handle
+            await self._rebalance(list(self.workers.values()))
+        finally:
+            self._ready.set()
+        return name
+
+    async def remove_worker(self, name: str):
+        """移除一个工作进程，它持有的状态交接给新的归属进程"""
+        handle = self.workers[name]
+        self._ready.clear()
+        try:
+            self.ring.remove(name)
+            del self.workers[name]
+            await self._rebalance([handle])
+        finally:
+            self._ready.set()
+        await handle.close(Config.SHUTDOWN_DRAIN_TIMEOUT + 5)
+
+    async def stats(self, drain: bool = False) -> dict:
+        """各工作进程的状态: {name: {...}}"""
+        replies = await asyncio.gather(
+            *(handle.call({"type": "stats", "drain": drain}) for handle in self.workers.values())
+        )
+        return {
+            handle.name: {**reply, "routed": handle.routed}
+            for handle, reply in zip(self.workers.values(), replies)
+        }
+
+    async def _rebalance(self, sources):
+        """让 sources 交出不再归属自己的状态，再按新的哈希环分给归属进程"""
+        nodes = self.ring.nodes
+        exports = await asyncio.gather(
+            *(handle.call({"type": "rebalance", "nodes": nodes}) for handle in sources)
+        )
+        imports = {}
+        for state in exports:
+            for user_id, blob in state["sessions"].items():
+                target = imports.setdefault(self.ring.node_for(int(user_id)), {"sessions": {}, "reminders": []})
+                target["sessions"][user_id] = blob
+            for chat_id, time_str in state["reminders"]:
+                target = imports.setdefault(self.ring.node_for(chat_id), {"sessions": {}, "reminders": []})
+                target["reminders"].append((chat_id, time_str))
+        await asyncio.gather(
+            *(self.workers[name].call({"type": "import", **state}) for name, state in imports.items())
+        )
+        # 工作进程数变化后重新平分限额（交出状态的进程已在 rebalance 时调整）
+        await asyncio.gather(
+            *(handle.call({"type": "share", "workers": len(nodes)})
+              for handle in self.workers.values() if handle not in sources)
+        )
+        moved = sum(len(s["sessions"]) + len(s["reminders"]) for s in imports.values())
+        self.handoffs += moved
+        logging.info(f"重新平衡完成：{len(nodes)} 个工作进程，交接 {moved} 项状态")
+
+    def _new_name(self) -> str:
+        name = f"worker-{self._next_index}"
+        self._next_index += 1
+        return name
+
+    async def _spawn(self, name, restore, nodes=None, timeout: float = 120):
+        path = os.path.join(self.socket_dir, f"{name}.sock")
+        process = self._context.Process(
+            target=worker_main,
+            args=(name, path, self.factory, nodes or self.ring.nodes, restore),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+
+        # 等待工作进程完成导入并开始监听
+        deadline = time.monotonic() + timeout
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(f"工作进程 {name} 启动失败（退出码 {process.exitcode}）")
+            try:
+                reader, writer = await asyncio.open_unix_connection(path, limit=_STREAM_LIMIT)
+                return WorkerHandle(name, process, reader, writer)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    process.terminate()
+                    raise RuntimeError(f"工作进程 {name} 启动超时")
+                await asyncio.sleep(0.05)
+
+
+async def _forward(queue: asyncio.Queue, cluster: Cluster):
+    """把前端收到的更新逐条转发给工作进程"""
+    while True:
+        update = await queue.get()
+        try:
+            await cluster.dispatch(update)
+        except Exception as e:
+            logging.error(f"转发更新失败: {e}")
+        finally:
+            queue.task_done()
+
+
+async def _run_front():
+    from bot.server import webhook_options
+
+    cluster = Cluster()
+    await cluster.start(Config.WORKERS)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    # SIGUSR1 增加、SIGUSR2 减少一个工作进程
+    loop.add_signal_handler(signal.SIGUSR1, lambda: loop.create_task(cluster.add_worker()))
+    loop.add_signal_handler(
+        signal.SIGUSR2,
+        lambda: len(cluster.workers) > 1 and loop.create_task(cluster.remove_worker(cluster.ring.nodes[-1])),
+    )
+
+    queue = asyncio.Queue()
+    updater = Updater(Bot(Config.TELEGRAM_TOKEN), queue)
+    try:
+        async with updater:
+            if Config.BOT_MODE == "webhook":
+                await updater.start_webhook(**webhook_options())
+            else:
+                await updater.start_polling()
+            forwarder = asyncio.create_task(_forward(queue, cluster))
+            await stop.wait()
+
+            # 停止接收，转发完已收到的更新
+            await updater.stop()
+            await queue.join()
+            forwarder.cancel()
+    finally:
+        await cluster.stop()
+
+
+def run_cluster():
+    """以前端 + 多个工作进程的方式运行，阻塞直到收到退出信号"""
+    asyncio.run(_run_front())
@@ -13,13 +13,151 @@ class Config:
     # Telegram 配置
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+    # 运行方式：polling（长轮询，默认）或 webhook
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+    # Webhook 配置：公网地址与路径、本地监听地址和端口、校验密钥、Telegram 最大并发连接数
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    # 证书与私钥；留空表示由前面的反向代理终止 TLS，本进程监听明文 HTTP
+    WEBHOOK_CERT = os.getenv("WEBHOOK_CERT", "")
+    WEBHOOK_KEY = os.getenv("WEBHOOK_KEY", "")
+
+    # 工作进程数：大于 1 时前端进程按一致性哈希把用户分发给多个工作进程
+    WORKERS = int(os.getenv("WORKERS", "1"))
+
+    # 指标端点：METRICS_PORT 大于 0 时在 METRICS_LISTEN:METRICS_PORT/metrics 提供 Prometheus 文本格式
+    # 多进程分片时第 i 个工作进程使用 METRICS_PORT + i
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+    # 日志：级别、格式（json 每行一条结构化记录，text 为传统格式）、DEBUG 记录的采样比例、队列容量（满时丢弃）
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    # 链路追踪：导出方式（留空关闭；file 写入本地文件；otlp 发往 OTLP/HTTP 接收端）、文件路径、接收端地址、服务名
+    # 耗时不低于 TRACE_SLOW_SECONDS 或出错的 trace 全部保留，其余按 TRACE_SAMPLE_RATE 采样
+    TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+    TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+    TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318")
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "telegram-ai-bot")
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+    TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+
+    # 退出时等待处理中的更新完成的最长秒数
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
+
     # Google Cloud Vertex AI 配置
     PROJECT_ID = os.getenv("PROJECT_ID")
     LOCATION = os.getenv("LOCATION", "us-central1")
 
+    # 模型与系统提示词：模型名；系统提示词模板（可用 {{bot_name}}、{{language}} 占位符，以 @ 开头表示从文件读取，留空使用内置模板）
+    AI_MODEL = os.getenv("AI_MODEL", "gemini-2.5-flash")
+    AI_SYSTEM_PROMPT = os.getenv("AI_SYSTEM_PROMPT", "")
+    # 生成参数：温度、最大输出 token 数（留空使用模型默认值）
+    AI_TEMPERATURE = os.getenv("AI_TEMPERATURE", "")
+    AI_MAX_OUTPUT_TOKENS = os.getenv("AI_MAX_OUTPUT_TOKENS", "")
+    # 按对话的模型配置（JSON 文件）：profiles 为命名配置，chats 把对话映射到配置名；留空表示全部对话使用上面的部署配置
+    AI_PROFILES_FILE = os.getenv("AI_PROFILES_FILE", "")
+
+    # 机器人名称（系统提示词占位符）；默认语言（zh / en）：系统提示词的语言，以及用户语言不受支持时命令回复的语言
+    BOT_NAME = os.getenv("BOT_NAME", "AI 助手")
+    BOT_LOCALE = os.getenv("BOT_LOCALE", "zh")
+
+    # 模型路由：强模型（提问较长、包含代码或历史较深时使用，留空表示每轮都用会话的模型）；
+    # 备用模型（主模型饱和或出错时使用，留空时只有强模型可以退回会话的模型）
+    AI_STRONG_MODEL = os.getenv("AI_STRONG_MODEL", "")
+    AI_FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL", "")
+    # 路由特征：提问达到多少字符、历史达到多少轮时使用强模型；按用户指定等级（"用户ID:strong,用户ID:fast"）
+    AI_ROUTE_LONG_PROMPT = int(os.getenv("AI_ROUTE_LONG_PROMPT", "800"))
+    AI_ROUTE_DEEP_HISTORY = int(os.getenv("AI_ROUTE_DEEP_HISTORY", "10"))
+    AI_ROUTE_USER_TIERS = os.getenv("AI_ROUTE_USER_TIERS", "")
+    # 单个模型的在途请求上限（达到视为饱和，0 表示不限）、连续失败多少次后暂停使用、暂停秒数
+    AI_ROUTE_MAX_IN_FLIGHT = int(os.getenv("AI_ROUTE_MAX_IN_FLIGHT", "0"))
+    AI_ROUTE_FAILURE_THRESHOLD = int(os.getenv("AI_ROUTE_FAILURE_THRESHOLD", "3"))
+    AI_ROUTE_COOLDOWN = float(os.getenv("AI_ROUTE_COOLDOWN", "30"))
+
+    # 启动后在后台预热模型客户端（导入 SDK、初始化 Vertex AI）；关闭时在第一次聊天时创建
+    AI_WARMUP = os.getenv("AI_WARMUP", "true").lower() == "true"
+
+    # 同步流式调用兜底线程池的最大线程数
+    AI_EXECUTOR_WORKERS = int(os.getenv("AI_EXECUTOR_WORKERS", "32"))
+
+    # 模型调用限流：每秒请求数、每分钟 token 数、最大并发、目标延迟（流式调用为首个分块的等待时间，秒）
+    AI_QPS = float(os.getenv("AI_QPS", "10"))
+    AI_TPM = float(os.getenv("AI_TPM", "1000000"))
+    AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "32"))
+    AI_LATENCY_TARGET = float(os.getenv("AI_LATENCY_TARGET", "15"))
+
+    # 模型调用重试：最大尝试次数、退避基数与上限（秒）
+    AI_RETRY_ATTEMPTS = int(os.getenv("AI_RETRY_ATTEMPTS", "3"))
+    AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+    AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "8"))
+
+    # 对冲请求：首个分块超过该秒数（建议取 p95）仍未到达时发出第二个请求，0 表示关闭
+    AI_HEDGE_AFTER = float(os.getenv("AI_HEDGE_AFTER", "0"))
+
+    # 回复缓存：是否启用、最大条目数、过期秒数
+    RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+    RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "1000"))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    # 带历史的请求：empty 不缓存，fingerprint 以历史指纹区分
+    RESPONSE_CACHE_HISTORY = os.getenv("RESPONSE_CACHE_HISTORY", "empty")
+    # 语义缓存：相似度阈值（0 表示只做精确匹配）与向量模型
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+    RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-005")
+
+    # 多模态输入：单个文件大小上限（Bot API 下载上限为 20 MB）、同时下载数、图片处理进程数、
+    # 图片缩放后的最长边与 JPEG 质量、处理结果缓存的总字节数（按 file_unique_id）
+    MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+    MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv("MEDIA_DOWNLOAD_CONCURRENCY", "4"))
+    MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+    MEDIA_IMAGE_MAX_SIDE = int(os.getenv("MEDIA_IMAGE_MAX_SIDE", "1024"))
+    MEDIA_IMAGE_QUALITY = int(os.getenv("MEDIA_IMAGE_QUALITY", "85"))
+    MEDIA_CACHE_BYTES = int(os.getenv("MEDIA_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+    # 同一用户连续消息的合并窗口（秒）
+    INBOX_DEBOUNCE = float(os.getenv("INBOX_DEBOUNCE", "0.5"))
+
+    # 会话存储配置：最大会话数、空闲过期秒数、历史总字节上限
+    SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+    SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+    SESSION_MAX_HISTORY_BYTES = int(os.getenv("SESSION_MAX_HISTORY_BYTES", str(256 * 1024 * 1024)))
+
+    # 对话历史配置：上下文 token 上限、保留的最近轮数、是否把更早的轮次折叠为摘要
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "8000"))
+    HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", "20"))
+    HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "true").lower() == "true"
+
+    # 持久化存储配置：sqlite（默认，WAL 模式）或 memory
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+    STORAGE_PATH = os.getenv("STORAGE_PATH", "bot.db")
+    STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "0.5"))
+
+    # 回复格式：html 把模型输出的 Markdown（代码块、粗体、列表等）渲染为 Telegram HTML，plain 按纯文本发送
+    REPLY_FORMAT = os.getenv("REPLY_FORMAT", "html")
+
+    # 流式回复配置：先发占位消息，再随生成进度编辑
+    STREAM_REPLY = os.getenv("STREAM_REPLY", "false").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+    STREAM_EDIT_BYTES = int(os.getenv("STREAM_EDIT_BYTES", "200"))
+
     # 睡眠提醒配置
     DEFAULT_REMINDER_TIME = os.getenv("DEFAULT_REMINDER_TIME", "23:30")
 
+    # 提醒批量发送限速：每秒总发送数、单个会话每秒发送数、并发数、单条消息最大尝试次数
+    # Telegram 限制约为全局 30 条/秒、单个会话 1 条/秒
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+    BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "16"))
+    BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+
     # 时区配置
     TIMEZONE = os.getenv("TIMEZONE", "Asia/Shanghai")
     BEIJING_TZ = pytz.timezone(TIMEZONE)
@@ -31,8 +169,8 @@ class Config:
             raise ValueError("TELEGRAM_TOKEN 未设置")
         if not cls.PROJECT_ID:
             raise ValueError("PROJECT_ID 未设置")
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            raise ValueError(f"未知的运行方式: {cls.BOT_MODE}")
+        if cls.BOT_MODE == "webhook" and not cls.WEBHOOK_URL:
+            raise ValueError("Webhook 模式需要设置 WEBHOOK_URL")
         return True
-
-
-# 验证配置
-Config.validate()
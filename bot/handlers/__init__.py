@@ -1,7 +1,7 @@
 """Telegram 命令处理器模块"""
 
 from bot.handlers.base import start, help_cmd
-from bot.handlers.chat import chat_logic
+from bot.handlers.chat import chat_logic, media_logic
 from bot.handlers.sleep import sleep_on, sleep_off, sleep_status
 
-__all__ = ["start", "help_cmd", "chat_logic", "sleep_on", "sleep_off", "sleep_status"]
+__all__ = ["start", "help_cmd", "chat_logic", "media_logic", "sleep_on", "sleep_off", "sleep_status"]
@@ -3,32 +3,86 @@ import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from bot.services.ai import get_user_chat
+from bot.config import Config
+from bot.services.ai import get_user_chat, touch_user_chat, stream_message, warm_up
+from bot.services.groups import conversation_key, group_prompt
+from bot.services.inbox import chat_inbox
+from bot.services.media import MediaError, message_parts
+from bot.services.reply import PipelinedReply, ReplyStreamer
 
 
 async def chat_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """AI 聊天处理逻辑"""
+    """AI 聊天处理逻辑（群组中只有点名机器人的消息会到达这里）"""
     user_id = update.effective_user.id
-    user_text = update.message.text
+    # 私聊按用户、群组按 (会话, 话题) 保存上下文
+    key = conversation_key(update)
 
     # 1. 显示 "typing..." 状态
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
 
-    # 2. 获取或创建该用户的聊天会话
-    chat = get_user_chat(user_id)
+    # 2. 同一对话的消息串行处理，短时间内的连续消息合并为一轮
+    async with chat_inbox.turn(key, group_prompt(update, update.message.text)) as user_text:
+        if user_text is None:
+            return
+        await _reply(update, key, user_id, user_text)
 
+
+async def media_logic(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """图片、语音与文件：下载并预处理后连同说明文字一起发给模型"""
+    user_id = update.effective_user.id
+    key = conversation_key(update)
+
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+
+    # 下载与预处理在进入收件箱之前进行，与合并窗口的等待重叠
     try:
-        # 3. 发送给 Vertex AI 并获取流式响应
-        response_stream = chat.send_message(user_text, stream=True)
+        parts = await message_parts(update.message)
+    except MediaError as e:
+        await update.message.reply_text(str(e))
+        return
+    except Exception as e:
+        logging.error(f"处理附件出错: {e}", exc_info=True)
+        await update.message.reply_text("抱歉，文件处理失败，请稍后再试。")
+        return
 
-        # 4. 拼接流式回复
-        full_response = ""
-        for chunk in response_stream:
-            full_response += chunk.text
+    if parts and isinstance(parts[-1], str):
+        parts[-1] = group_prompt(update, parts[-1])
+
+    # 与文字消息共用收件箱：相册中的多张图片、图片后紧跟的提问合并为一轮
+    async with chat_inbox.turn(key, parts) as content:
+        if content is None:
+            return
+        await _reply(update, key, user_id, content)
+
+
+async def _reply(update: Update, key, user_id, user_text):
+    """调用模型并回复一轮对话（key 为对话上下文的键，user_id 用于按用户公平限流）"""
+    # 获取或创建该对话的聊天会话（模型客户端尚未创建时在后台线程创建，不阻塞其他更新）
+    await warm_up()
+    chat = get_user_chat(key)
+
+    pipeline = None
+    try:
+        # 发送给 Vertex AI 并异步接收流式回复（不阻塞事件循环）
+        if Config.STREAM_REPLY:
+            # 流式模式：占位消息随分块到达节流编辑
+            streamer = ReplyStreamer(update.message)
+            await streamer.start()
+            async for text in stream_message(chat, user_text, user_id=user_id):
+                await streamer.feed(text)
+            await streamer.finish()
+            touch_user_chat(key)
+            return
 
-        # 5. 回复用户
-        await update.message.reply_text(full_response)
+        # 回复用户：超过单条消息上限的部分一旦确定就先发送，其余继续生成
+        pipeline = PipelinedReply(update.message)
+        async for text in stream_message(chat, user_text, user_id=user_id):
+            pipeline.feed(text)
+        touch_user_chat(key)
+        await pipeline.finish()
 
     except Exception as e:
-        logging.error(f"AI 聊天出错: {e}")
+        logging.error(f"AI 聊天出错: {e}", exc_info=True)
+        if pipeline is not None:
+            await pipeline.cancel()
         await update.message.reply_text("抱歉，我的大脑短路了，请稍后再试。")
@@ -0,0 +1,128 @@
+"""运行方式：长轮询或 Webhook；退出时在限定时间内排空处理中的更新"""
+import asyncio
+import logging
+import time
+
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from bot.config import Config
+from bot.services.logs import bind_update
+from bot.services.metrics import Histogram
+from bot.services.reminder import reminder_engine
+from bot.services.tracing import CLIENT, tracer
+
+UPDATE_SECONDS = Histogram("bot_update_seconds", "处理一条更新的耗时（秒）")
+TELEGRAM_API_SECONDS = Histogram(
+    "bot_telegram_api_seconds", "Telegram Bot API 调用耗时（秒），不含长轮询 getUpdates", ["method"]
+)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """记录每次 Bot API 调用耗时的 HTTP 请求类（按方法名分组）；在 trace 中时为每次调用记录子 span"""
+
+    __slots__ = ()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            with tracer.span(f"telegram.{endpoint}", kind=CLIENT, **{"telegram.method": endpoint}) as span:
+                code, payload = await super().do_request(url, method, request_data=request_data, **kwargs)
+                if span is not None:
+                    span.set_attribute("http.status_code", code)
+                return code, payload
+        finally:
+            TELEGRAM_API_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+
+
+class DrainingApplication(Application):
+    """
+    退出时有限时排空的 Application
+    停止接收新更新后，最多等待 drain_timeout 秒让处理中的更新与后台发送中的睡眠提醒完成，超时的直接取消，
+    避免一次卡住的模型调用或一大批限速发送拖住整个退出流程
+    """
+
+    __slots__ = ("drain_timeout", "_in_flight")
+
+    def __init__(self, *, drain_timeout: float = 10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.drain_timeout = drain_timeout
+        self._in_flight = set()
+
+    @property
+    def in_flight(self) -> int:
+        """处理中的更新数"""
+        return len(self._in_flight)
+
+    async def process_update(self, update):
+        started = time.perf_counter()
+        # 只跟踪并发模式下每个更新独占的任务，串行模式下当前任务是取更新的循环本身
+        task = asyncio.current_task() if self.concurrent_updates > 1 else None
+        if task is not None:
+            self._in_flight.add(task)
+        try:
+            # 处理期间的日志带上该更新的关联 ID、用户与会话；启用追踪时每个更新一条 trace
+            with bind_update(update) as context, tracer.trace(
+                "telegram.update",
+                **{
+                    "telegram.update_id": context["update_id"],
+                    "telegram.user_id": context["user_id"],
+                    "telegram.chat_id": context["chat_id"],
+                },
+            ) as span:
+                if span is not None:
+                    context["trace_id"] = span.trace.trace_id
+                return await super().process_update(update)
+        finally:
+            if task is not None:
+                self._in_flight.discard(task)
+            UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    async def stop(self):
+        deadline = time.monotonic() + self.drain_timeout
+        if self._in_flight:
+            logging.info(f"等待 {len(self._in_flight)} 个处理中的更新完成（最多 {self.drain_timeout}s）")
+            _, pending = await asyncio.wait(set(self._in_flight), timeout=self.drain_timeout)
+            if pending:
+                logging.warning(f"排空超时，取消 {len(pending)} 个未完成的更新")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        # 后台发送中的睡眠提醒与更新共用排空时限（Application.stop 会无限期等待这些任务）
+        await reminder_engine.drain(deadline - time.monotonic())
+        await super().stop()
+
+
+def webhook_url() -> str:
+    """Telegram 推送更新的公网地址"""
+    return f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH.lstrip('/')}"
+
+
+def webhook_options() -> dict:
+    """
+    run_webhook 的参数
+    配置了证书时由本进程终止 TLS；否则监听明文 HTTP，由前面的反向代理终止 TLS
+    """
+    options = {
+        "listen": Config.WEBHOOK_LISTEN,
+        "port": Config.WEBHOOK_PORT,
+        "url_path": Config.WEBHOOK_PATH.lstrip("/"),
+        "webhook_url": webhook_url(),
+        "secret_token": Config.WEBHOOK_SECRET_TOKEN or None,
+        "max_connections": Config.WEBHOOK_MAX_CONNECTIONS,
+    }
+    if Config.WEBHOOK_CERT:
+        options["cert"] = Config.WEBHOOK_CERT
+        options["key"] = Config.WEBHOOK_KEY or None
+    return options
+
+
+def run(app: Application):
+    """按 BOT_MODE 以长轮询或 Webhook 方式运行，阻塞直到收到退出信号"""
+    if Config.BOT_MODE == "webhook":
+        options = webhook_options()
+        logging.info(f"Webhook 模式：监听 {options['listen']}:{options['port']}，地址 {options['webhook_url']}")
+        app.run_webhook(**options)
+    else:
+        app.run_polling()
@@ -1,13 +1,59 @@
 """业务服务层模块"""
 
-from bot.services.ai import model, get_user_chat, reset_user_chat
-from bot.services.reminder import send_sleep_reminder, sleep_reminder_users, parse_time
+from bot.services.ai import get_model, warm_up, get_user_chat, reset_user_chat, touch_user_chat, stream_message
+from bot.services.session import SessionStore
+from bot.services.retry import RetryPolicy, is_retryable
+from bot.services.cache import ResponseCache
+from bot.services.sharding import HashRing, shard_key
+from bot.services.broadcast import Broadcaster, is_permanent
+from bot.services.inbox import UserInbox, chat_inbox
+from bot.services.reply import ReplyStreamer
+from bot.services.reminder import (
+    send_sleep_reminder,
+    sleep_reminder_users,
+    reminder_engine,
+    ReminderEngine,
+    ReminderSpecError,
+    parse_time,
+    parse_reminder,
+    get_zone,
+    restore_reminders,
+    schedule_reminders,
+    export_reminders,
+)
+from bot.services.storage import Storage, MemoryStorage, SQLiteStorage, get_storage
 
 __all__ = [
-    "model",
+    "get_model",
+    "warm_up",
     "get_user_chat",
     "reset_user_chat",
+    "touch_user_chat",
+    "stream_message",
+    "SessionStore",
+    "RetryPolicy",
+    "is_retryable",
+    "ResponseCache",
+    "HashRing",
+    "shard_key",
+    "Broadcaster",
+    "is_permanent",
+    "UserInbox",
+    "chat_inbox",
+    "ReplyStreamer",
     "send_sleep_reminder",
     "sleep_reminder_users",
+    "reminder_engine",
+    "ReminderEngine",
+    "ReminderSpecError",
     "parse_time",
+    "parse_reminder",
+    "get_zone",
+    "restore_reminders",
+    "schedule_reminders",
+    "export_reminders",
+    "Storage",
+    "MemoryStorage",
+    "SQLiteStorage",
+    "get_storage",
 ]
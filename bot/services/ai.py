@@ -1,26 +1,475 @@
 """Vertex AI 服务"""
+import asyncio
+import hashlib
 import logging
-import vertexai
-from vertexai.generative_models import GenerativeModel
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 from bot.config import Config
+from bot.services import prompts
+from bot.services.cache import ResponseCache
+from bot.services.history import HistoryManager, content_tokens, estimate_tokens, make_content
+from bot.services.limiter import AdaptiveLimiter
+from bot.services.media import MEDIA_PART_TOKENS
+from bot.services.metrics import Counter, Histogram
+from bot.services.retry import RetryPolicy, is_retryable
+from bot.services.routing import (
+    ROUTE_ERRORS,
+    ROUTE_FIRST_CHUNK_SECONDS,
+    ROUTE_SECONDS,
+    ROUTE_TOKENS,
+    ModelRouter,
+    parse_tiers,
+)
+from bot.services.session import SessionStore, dump_history, load_history
+from bot.services.storage import get_storage
+from bot.services.tracing import tracer
 
-# 初始化 Vertex AI
-vertexai.init(project=Config.PROJECT_ID, location=Config.LOCATION)
-model = GenerativeModel("gemini-2.5-flash")
+# 模型客户端在首次使用或后台预热时创建：导入 vertexai SDK 需要数秒，不放在模块导入时
+_model_lock = threading.Lock()
 
-# 用户聊天会话存储: {user_id: ChatSession}
-user_chats = {}
+# 按对话配置创建的模型客户端: ModelProfile.key -> GenerativeModel（部署配置的客户端保存在 ai.model）
+_models = {}
+
+# 使用按对话配置创建的会话 -> 其配置（对冲请求与回复缓存需要知道会话的配置）
+_session_profiles = weakref.WeakKeyDictionary()
+
+
+def get_model(profile=None):
+    """获取模型客户端（默认为部署配置），首次调用时导入 SDK 并初始化 Vertex AI（线程安全）"""
+    if profile is None or profile.key == prompts.registry.default.key:
+        cached, profile = globals(), prompts.registry.default
+        slot = "model"
+    else:
+        cached, slot = _models, profile.key
+    model = cached.get(slot)
+    if model is not None:
+        return model
+    with _model_lock:
+        model = cached.get(slot)
+        if model is None:
+            started = time.perf_counter()
+            import vertexai
+            from vertexai.generative_models import GenerativeModel
+
+            vertexai.init(project=Config.PROJECT_ID, location=Config.LOCATION)
+            model = GenerativeModel(profile.model, **profile.model_kwargs())
+            cached[slot] = model
+            logging.info(f"模型客户端已创建（{profile.name}: {profile.model}），耗时 {time.perf_counter() - started:.2f}s")
+    return model
+
+
+async def warm_up():
+    """在后台线程创建模型客户端，不阻塞事件循环；已创建时立即返回"""
+    if globals().get("model") is None:
+        await asyncio.to_thread(get_model)
+
+
+def __getattr__(name):
+    # 兼容 ai.model / ai.user_chats 的访问方式：首次访问时创建
+    if name == "model":
+        return get_model()
+    if name == "user_chats":
+        return get_user_chats()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def start_chat(history, key=None):
+    """用对话 key 对应的模型配置创建会话"""
+    profile = prompts.registry.profile_for(key)
+    chat = get_model(profile).start_chat(history=history)
+    if profile is not prompts.registry.default:
+        _session_profiles[chat] = profile
+    return chat
+
+
+def get_user_chats() -> SessionStore:
+    """
+    获取用户聊天会话存储: user_id -> ChatSession（有界 LRU + 空闲 TTL），首次调用时创建
+    溢出的会话写入持久化存储；sqlite 后端会创建数据库文件并启动写线程，因此不放在模块导入时
+    """
+    store = globals().get("user_chats")
+    if store is None:
+        store = globals()["user_chats"] = SessionStore(
+            factory=start_chat,
+            max_sessions=Config.SESSION_MAX,
+            ttl=Config.SESSION_TTL,
+            max_history_bytes=Config.SESSION_MAX_HISTORY_BYTES,
+            spill=get_storage().session_spill(Config.SESSION_MAX_HISTORY_BYTES),
+        )
+    return store
+
+
+async def summarize_history(previous: str, transcript: str) -> str:
+    """调用模型把较早的对话合并进滚动摘要"""
+    prompt = (
+        "请把下面的对话内容合并进已有摘要，保留用户的关键信息、偏好和未完成的话题，"
+        "用简洁的中文输出新的摘要，不超过 300 字。\n\n"
+        f"已有摘要：\n{previous or '（无）'}\n\n新的对话：\n{transcript}"
+    )
+    response = await get_model().generate_content_async(prompt)
+    return response.text.strip()
+
+
+# 对话历史管理：token 预算窗口 + 后台滚动摘要
+history_manager = HistoryManager(
+    max_tokens=Config.HISTORY_MAX_TOKENS,
+    window_turns=Config.HISTORY_WINDOW_TURNS,
+    summarizer=summarize_history if Config.HISTORY_SUMMARY else None,
+)
+
+# 全局模型调用限流：QPS / TPM + 自适应并发 + 按用户公平排队
+limiter = AdaptiveLimiter(
+    qps=Config.AI_QPS,
+    tpm=Config.AI_TPM,
+    max_concurrency=Config.AI_MAX_CONCURRENCY,
+    latency_target=Config.AI_LATENCY_TARGET,
+)
+
+# 模型调用重试策略
+retry_policy = RetryPolicy(
+    max_attempts=Config.AI_RETRY_ATTEMPTS,
+    base_delay=Config.AI_RETRY_BASE_DELAY,
+    max_delay=Config.AI_RETRY_MAX_DELAY,
+)
+
+# 模型路由：按轮次选择便宜的模型或强模型，主模型饱和或出错时改用备用模型（未配置时不启用）
+router = ModelRouter(
+    strong_model=Config.AI_STRONG_MODEL,
+    fallback_model=Config.AI_FALLBACK_MODEL,
+    long_prompt=Config.AI_ROUTE_LONG_PROMPT,
+    deep_history=Config.AI_ROUTE_DEEP_HISTORY,
+    user_tiers=parse_tiers(Config.AI_ROUTE_USER_TIERS),
+    max_in_flight=Config.AI_ROUTE_MAX_IN_FLIGHT,
+    failure_threshold=Config.AI_ROUTE_FAILURE_THRESHOLD,
+    cooldown=Config.AI_ROUTE_COOLDOWN,
+)
+
+# 调用统计：重试次数、对冲请求发出与胜出次数、改用备用模型的次数
+call_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0}
+
+# 模型调用指标（不含回复缓存命中）
+MODEL_FIRST_CHUNK_SECONDS = Histogram("bot_model_first_chunk_seconds", "模型回复首个分块的等待时间（秒）")
+MODEL_SECONDS = Histogram("bot_model_seconds", "模型回复从请求到最后一个分块的总耗时（秒）")
+MODEL_ERRORS = Counter("bot_model_errors_total", "重试后仍失败的模型调用次数")
+
+# 向量模型（按需加载）
+_embedding_model = None
+
+
+async def embed_text(text: str) -> list:
+    """计算文本向量（语义缓存使用）"""
+    global _embedding_model
+    if _embedding_model is None:
+        from vertexai.language_models import TextEmbeddingModel
+
+        _embedding_model = TextEmbeddingModel.from_pretrained(Config.RESPONSE_CACHE_EMBEDDING_MODEL)
+    embeddings = await _embedding_model.get_embeddings_async([text])
+    return embeddings[0].values
+
+
+# 回复缓存（可选）：精确匹配 + 语义相似度匹配
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_MAX,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    history_policy=Config.RESPONSE_CACHE_HISTORY,
+    similarity=Config.RESPONSE_CACHE_SIMILARITY,
+    embedder=embed_text,
+) if Config.RESPONSE_CACHE else None
+
+# 同步流式调用的兜底线程池（有界，按需创建）
+_executor = None
+
+# 同步迭代器结束标记
+_STREAM_END = object()
 
 
 def get_user_chat(user_id):
-    """获取或创建用户聊天会话"""
-    if user_id not in user_chats:
-        user_chats[user_id] = model.start_chat(history=[])
-    return user_chats[user_id]
+    """获取或创建用户聊天会话（被淘汰的会话会从冷存储恢复）"""
+    return get_user_chats().get(user_id)
 
 
 def reset_user_chat(user_id):
     """重置用户聊天会话"""
-    user_chats[user_id] = model.start_chat(history=[])
-    return user_chats[user_id]
+    history_manager.forget(user_id)
+    return get_user_chats().reset(user_id)
+
+
+def touch_user_chat(user_id):
+    """一轮对话结束后按 token 预算整理历史，并更新会话的内存占用统计"""
+    store = get_user_chats()
+    if user_id in store:
+        history_manager.compact(user_id, store[user_id])
+    store.touch(user_id)
+
+
+def export_sessions(keep) -> dict:
+    """交出 keep(user_id) 为 False 的会话，返回压缩的历史: {user_id: bytes}"""
+    moved = get_user_chats().handoff(keep)
+    for user_id in moved:
+        history_manager.forget(user_id)
+    return {user_id: dump_history(history) for user_id, history in moved.items() if history}
+
+
+def import_sessions(blobs: dict):
+    """接收其他进程交出的会话"""
+    store = get_user_chats()
+    for user_id, blob in blobs.items():
+        store.put(user_id, start_chat(load_history(blob), user_id))
+
+
+def _get_executor():
+    """获取 AI 调用专用线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=Config.AI_EXECUTOR_WORKERS,
+            thread_name_prefix="vertex-ai",
+        )
+    return _executor
+
+
+def estimate_request_tokens(chat, content) -> int:
+    """估算一次请求的输入 token 数（历史 + 新消息）"""
+    history = getattr(chat, "history", None)
+    tokens = sum(content_tokens(c) for c in history) if isinstance(history, list) else 0
+    if isinstance(content, str):
+        tokens += estimate_tokens(content)
+    elif isinstance(content, list):
+        # 多模态输入：文本按字符估算，附件按固定 token 数计
+        tokens += sum(estimate_tokens(part) if isinstance(part, str) else MEDIA_PART_TOKENS for part in content)
+    return tokens
+
+
+async def stream_message(chat, content, user_id=None):
+    """
+    异步发送消息并逐块产出回复文本
+    - 启用回复缓存时先查缓存，命中则直接返回并补写会话历史
+    - 启用模型路由时按本轮的特征选择模型
+    - 调用先经过全局限流器排队
+    - 尚未产出任何分块时遇到瞬时错误，先改用备用模型（如有），再按退避策略重试
+    - 首个分块迟迟未到时可发出对冲请求，先出结果的一方胜出
+    """
+    # 按轮次选择模型（配置了强模型或备用模型时）；先于查缓存，回复缓存按本轮实际使用的模型配置区分
+    route = router.route(chat, content, user_id, _profile_of(chat)) if router.enabled else None
+    profile = route.profile if route is not None else _profile_of(chat)
+
+    cache = response_cache
+    key = cache.key_for(chat, content, scope=_cache_scope(profile)) if cache is not None else None
+    if key is not None:
+        text = await cache.lookup(key)
+        if text is not None:
+            chat.history.extend([make_content("user", content), make_content("model", text)])
+            yield text
+            return
+
+    request_tokens = estimate_request_tokens(chat, content) if route is not None else 0
+
+    chunks = []
+    size = 0
+    started = time.perf_counter()
+    # 生成器会在多次 yield 之间挂起，span 不设为当前 span，手动结束
+    attributes = {"model.user_id": user_id}
+    if route is not None:
+        attributes.update({"model.route": route.name, "model.route_reason": route.reason})
+    span = tracer.start_span("model.stream", **attributes)
+    try:
+        async for text in _call_model(chat, content, user_id, route, span):
+            if not chunks:
+                first_chunk = time.perf_counter() - started
+                MODEL_FIRST_CHUNK_SECONDS.observe(first_chunk)
+                if route is not None:
+                    ROUTE_FIRST_CHUNK_SECONDS.labels(route.name, route.model).observe(first_chunk)
+                if span is not None:
+                    span.add_event("first_chunk")
+            chunks.append(text)
+            size += len(text)
+            if span is not None:
+                span.add_event("chunk", index=len(chunks), chars=len(text))
+            yield text
+        elapsed = time.perf_counter() - started
+        MODEL_SECONDS.observe(elapsed)
+        if route is not None:
+            ROUTE_SECONDS.labels(route.name, route.model).observe(elapsed)
+            ROUTE_TOKENS.labels(route.name, route.model, "input").inc(request_tokens)
+            ROUTE_TOKENS.labels(route.name, route.model, "output").inc(sum(estimate_tokens(text) for text in chunks))
+        if span is not None:
+            span.add_event("completion", chunks=len(chunks), chars=size)
+    except Exception as e:
+        MODEL_ERRORS.inc()
+        if span is not None:
+            span.end(error=e)
+        raise
+    finally:
+        # 调用方提前停止迭代或被取消时也结束 span
+        if span is not None:
+            span.end()
+    # 改用了备用模型的回复不写入本轮所选模型的缓存
+    if key is not None and (route is None or route.profile is profile):
+        cache.store(key, "".join(chunks))
+
+
+async def _call_model(chat, content, user_id, route=None, span=None):
+    """调用模型，带重试、对冲，以及主模型饱和或出错时改用备用模型"""
+    attempt = 0
+    while True:
+        started = False
+        # 路由选择的模型与会话的模型不同时，在同一段历史上创建该模型的会话，完成后把历史同步回来
+        session = chat if route is None else _routed_session(chat, route.profile)
+        base = len(session.history) if session is not chat else 0
+        # 改用备用模型会更新 route，释放与记录的是本次尝试使用的模型
+        model = route.model if route is not None else None
+        if model is not None:
+            router.acquire(model)
+        try:
+            async for text in _hedged_chunks(session, content, user_id):
+                started = True
+                yield text
+        except Exception as e:
+            if route is not None:
+                ROUTE_ERRORS.labels(route.name, model).inc()
+                if is_retryable(e):
+                    router.record(model, e)
+                    # 还没有输出时立即改用备用模型，不计入重试次数
+                    if not started and route.fall_back():
+                        call_stats["fallbacks"] += 1
+                        logging.warning(f"模型调用失败，改用备用模型 {route.model}: {e}")
+                        if span is not None:
+                            span.add_event("fallback", model=route.model)
+                        continue
+            attempt += 1
+            # 已经输出了部分内容就不能透明重试
+            if started or not retry_policy.should_retry(e, attempt):
+                raise
+            delay = retry_policy.delay(attempt)
+            call_stats["retries"] += 1
+            logging.warning(f"模型调用失败（第 {attempt} 次），{delay:.2f}s 后重试: {e}")
+        else:
+            if model is not None:
+                router.record(model)
+            if session is not chat:
+                _append_new_turns(chat, session, base)
+            return
+        finally:
+            if model is not None:
+                router.release(model)
+        await asyncio.sleep(delay)
+
+
+def _profile_of(chat):
+    """会话使用的模型配置"""
+    return _session_profiles.get(chat) or prompts.registry.default
+
+
+def _cache_scope(profile) -> str:
+    """回复缓存的分区：部署配置为空（与未启用路由时的缓存键一致），其他配置按 ModelProfile.key 区分"""
+    if profile.key == prompts.registry.default.key:
+        return ""
+    return hashlib.sha1(repr(profile.key).encode("utf-8")).hexdigest()[:16]
+
+
+def _append_new_turns(chat, session, base: int):
+    """
+    把副本会话在前 base 条之后新增的本轮问答追加到用户会话
+    调用期间后台摘要可能已改写用户会话的历史（替换摘要前言、裁剪窗口），不能用副本的历史整体覆盖
+    """
+    chat.history.extend(session.history[base:])
+
+
+def _routed_session(chat, profile):
+    """profile 与会话的配置相同时直接使用会话，否则用同一段历史创建该配置的会话"""
+    if profile.key == _profile_of(chat).key:
+        return chat
+    session = get_model(profile).start_chat(history=list(chat.history))
+    _session_profiles[session] = profile
+    return session
+
+
+def _clone_session(chat):
+    """复制会话用于对冲请求（共享同一段历史，使用同一模型配置）"""
+    return get_model(_session_profiles.get(chat)).start_chat(history=list(chat.history))
+
+
+async def _first_chunk(stream):
+    """取出流的第一个分块: (是否有分块, 文本)"""
+    try:
+        return True, await stream.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def _hedged_chunks(chat, content, user_id):
+    """产出一次（可能带对冲的）调用的回复分块"""
+    primary = _limited_chunks(chat, content, user_id)
+    streams = {asyncio.ensure_future(_first_chunk(primary)): (primary, chat)}
+    winner = None
+    try:
+        hedge_after = Config.AI_HEDGE_AFTER
+        if hedge_after > 0 and isinstance(getattr(chat, "history", None), list):
+            done, _ = await asyncio.wait(streams, timeout=hedge_after)
+            if not done:
+                clone = _clone_session(chat)
+                base = len(clone.history)
+                hedge = _limited_chunks(clone, content, user_id)
+                streams[asyncio.ensure_future(_first_chunk(hedge))] = (hedge, clone)
+                call_stats["hedges"] += 1
+
+        # 先成功返回首个分块的一方胜出；全部失败时抛出主请求的错误
+        pending = set(streams)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if winner is None and task.exception() is None:
+                    winner = task
+        if winner is None:
+            raise next(iter(streams)).exception()
+
+        stream, session = streams[winner]
+        if session is not chat:
+            call_stats["hedge_wins"] += 1
+        has_chunk, text = winner.result()
+        if has_chunk:
+            yield text
+            async for text in stream:
+                yield text
+        if session is not chat:
+            # 对冲请求胜出：把本轮问答同步回用户会话
+            _append_new_turns(chat, session, base)
+    finally:
+        # 取消落败的请求并关闭所有流
+        for task, (stream, _) in streams.items():
+            if task is not winner:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            await stream.aclose()
+
+
+async def _limited_chunks(chat, content, user_id):
+    """经过全局限流器逐块产出回复文本"""
+    async with limiter.acquire(user_id, estimate_request_tokens(chat, content)) as slot:
+        async for text in _stream_chunks(chat, content):
+            slot.first_chunk()
+            slot.add_tokens(estimate_tokens(text))
+            yield text
+
+
+async def _stream_chunks(chat, content):
+    """逐块产出模型回复文本"""
+    if getattr(type(chat), "send_message_async", None) is not None:
+        response_stream = await chat.send_message_async(content, stream=True)
+        async for chunk in response_stream:
+            yield chunk.text
+        return
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    iterator = await loop.run_in_executor(
+        executor, lambda: iter(chat.send_message(content, stream=True))
+    )
+    while True:
+        chunk = await loop.run_in_executor(executor, next, iterator, _STREAM_END)
+        if chunk is _STREAM_END:
+            break
+        yield chunk.text
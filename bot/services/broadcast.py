@@ -0,0 +1,193 @@
+"""批量发送：全局与按会话令牌桶限速，遵守 RetryAfter，只有永久错误才放弃该会话"""
+import asyncio
+import time
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from bot.services.limiter import TokenBucket
+from bot.services.metrics import Counter, Histogram
+from bot.services.reply import retry_after_seconds
+from bot.services.retry import RetryPolicy
+
+# 单次发送的结果
+SENT = "sent"
+FAILED = "failed"
+PERMANENT = "permanent"
+
+# 表示会话已不可达的 BadRequest 描述（小写）
+PERMANENT_DESCRIPTIONS = (
+    "chat not found",
+    "user not found",
+    "user is deactivated",
+    "group chat was deactivated",
+    "peer_id_invalid",
+)
+
+
+BROADCAST_LAG_SECONDS = Histogram(
+    "bot_broadcast_lag_seconds",
+    "批量发送（睡眠提醒）从计划时刻到送达的延迟（秒）",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+BROADCAST_RESULTS = Counter("bot_broadcast_messages_total", "批量发送的消息数（按结果）", ["result"])
+
+
+def is_permanent(error: Exception) -> bool:
+    """是否为永久错误：用户拉黑 / 机器人被移出群组（Forbidden）或会话不存在"""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return any(description in message for description in PERMANENT_DESCRIPTIONS)
+    return False
+
+
+def percentile(values, q: float) -> float:
+    """分位数（最近秩），values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+class Broadcaster:
+    """
+    限速批量发送器
+    - 全局令牌桶控制每秒总发送数，按 chat_id 的令牌桶控制单个会话的发送频率
+    - 收到 RetryAfter 时全体暂停指定秒数后重试；网络错误按退避重试；永久错误不重试
+    - 记录从计划发送到送达的延迟，用于统计分位数
+    """
+
+    def __init__(
+        self,
+        rate: float = 25.0,
+        per_chat_rate: float = 1.0,
+        concurrency: int = 16,
+        max_attempts: int = 5,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        max_chat_buckets: int = 10000,
+        max_samples: int = 10000,
+    ):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.per_chat_rate = per_chat_rate
+        self.max_chat_buckets = max_chat_buckets
+        self.retry_policy = RetryPolicy(max_attempts, retry_base_delay, retry_max_delay)
+        # 桶容量为 1：按固定间隔匀速发送，不在整分钟开头突发
+        self.global_bucket = TokenBucket(rate, 1.0)
+        self.lags = deque(maxlen=max_samples)
+
+        self.sent = 0
+        self.failed = 0
+        self.permanent = 0
+        self.retries = 0
+        self.throttled = 0
+
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+
+    def configure(self, rate: float):
+        """修改每秒总发送数（多进程时每个工作进程分得一份）"""
+        self.global_bucket.configure(rate, 1.0)
+
+    def stats(self) -> dict:
+        """发送结果与送达延迟分位数（秒）"""
+        lags = list(self.lags)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "permanent": self.permanent,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "lag_p50": percentile(lags, 0.50),
+            "lag_p95": percentile(lags, 0.95),
+            "lag_p99": percentile(lags, 0.99),
+        }
+
+    async def send(self, chat_id, request, scheduled_at: float = None):
+        """
+        限速发送一条消息，request() 每次调用返回一个新的发送协程
+        scheduled_at 为计划发送时刻（time.monotonic），用于计算送达延迟
+        返回 (结果, 最后一次错误)
+        """
+        scheduled_at = time.monotonic() if scheduled_at is None else scheduled_at
+        attempt = 0
+        while True:
+            await self._acquire(chat_id)
+            delay = 0.0
+            try:
+                await request()
+            except RetryAfter as e:
+                error = e
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after_seconds(e))
+            except Exception as e:
+                error = e
+                if is_permanent(e):
+                    self.permanent += 1
+                    BROADCAST_RESULTS.labels(PERMANENT).inc()
+                    return PERMANENT, e
+                # 其余 BadRequest（如消息内容不合法）重试也不会成功
+                if isinstance(e, BadRequest) or not isinstance(e, NetworkError):
+                    self.failed += 1
+                    BROADCAST_RESULTS.labels(FAILED).inc()
+                    return FAILED, e
+                delay = self.retry_policy.delay(attempt + 1)
+            else:
+                lag = time.monotonic() - scheduled_at
+                self.sent += 1
+                self.lags.append(lag)
+                BROADCAST_LAG_SECONDS.observe(lag)
+                BROADCAST_RESULTS.labels(SENT).inc()
+                return SENT, None
+
+            attempt += 1
+            if attempt >= self.max_attempts:
+                self.failed += 1
+                BROADCAST_RESULTS.labels(FAILED).inc()
+                return FAILED, error
+            self.retries += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def broadcast(self, chat_ids, deliver) -> dict:
+        """以最多 concurrency 个并发对每个会话执行 deliver(chat_id)，返回 {chat_id: 结果}"""
+        queue = deque(chat_ids)
+        results = {}
+
+        async def worker():
+            while queue:
+                chat_id = queue.popleft()
+                results[chat_id] = await deliver(chat_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(queue)))))
+        self._prune()
+        return results
+
+    async def _acquire(self, chat_id):
+        """等待全局暂停结束，并从全局与会话令牌桶各取一个令牌"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                self._prune()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1.0)
+        while True:
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self.global_bucket.wait_time(1, now),
+                bucket.wait_time(1, now),
+            )
+            if wait <= 0:
+                self.global_bucket.consume(1, now)
+                bucket.consume(1, now)
+                return
+            await asyncio.sleep(wait)
+
+    def _prune(self):
+        """丢弃已回满的会话令牌桶（与新建的桶等价）"""
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chat_buckets.items() if b.wait_time(b.capacity, now) <= 0]:
+            del self._chat_buckets[chat_id]
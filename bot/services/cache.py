@@ -0,0 +1,268 @@
+"""模型回复缓存：精确匹配 + 可选的语义相似度匹配"""
+import hashlib
+import logging
+import math
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from bot.services.history import content_text
+
+# 历史策略：empty 只缓存没有历史的请求；fingerprint 以历史指纹作为键的一部分
+HISTORY_POLICIES = ("empty", "fingerprint")
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "!?.~。！？～…，,"
+
+
+def normalize_prompt(text: str) -> str:
+    """归一化提问：全半角统一、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION + " ")
+
+
+def history_fingerprint(history) -> str:
+    """聊天历史的指纹，空历史为空字符串"""
+    if not history:
+        return ""
+    digest = hashlib.blake2b(digest_size=16)
+    for content in history:
+        digest.update(getattr(content, "role", "").encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(content_text(content).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+def _normalize_vector(vector) -> list:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def _dot(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class VectorIndex:
+    """
+    本地向量索引：随机超平面 LSH 分桶 + 余弦相似度
+    查询只比较同一分组内、签名相同或只差 1 位的桶中的向量，不随索引大小线性增长
+    """
+
+    def __init__(self, bits: int = 12, seed: int = 0):
+        self.bits = bits
+        self.seed = seed
+        self._planes = None
+        self._vectors = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _signature(self, vector) -> int:
+        if self._planes is None:
+            rng = random.Random(self.seed)
+            self._planes = [[rng.gauss(0, 1) for _ in vector] for _ in range(self.bits)]
+        signature = 0
+        for i, plane in enumerate(self._planes):
+            if _dot(plane, vector) >= 0:
+                signature |= 1 << i
+        return signature
+
+    def add(self, key, vector, group=""):
+        """加入向量（同一 key 会被替换）"""
+        self.remove(key)
+        vector = _normalize_vector(vector)
+        bucket = (group, self._signature(vector))
+        self._vectors[key] = (vector, bucket)
+        self._buckets.setdefault(bucket, set()).add(key)
+
+    def remove(self, key):
+        """删除向量"""
+        item = self._vectors.pop(key, None)
+        if item is None:
+            return
+        _, bucket = item
+        keys = self._buckets[bucket]
+        keys.discard(key)
+        if not keys:
+            del self._buckets[bucket]
+
+    def search(self, vector, group="", threshold: float = 0.0):
+        """返回相似度不低于 threshold 的最近邻: (key, 相似度)，没有时返回 None"""
+        if not self._vectors:
+            return None
+        vector = _normalize_vector(vector)
+        signature = self._signature(vector)
+        best, best_score = None, threshold
+        for probe in [signature] + [signature ^ (1 << i) for i in range(self.bits)]:
+            for key in self._buckets.get((group, probe), ()):
+                score = _dot(vector, self._vectors[key][0])
+                if score >= best_score:
+                    best, best_score = key, score
+        return None if best is None else (best, best_score)
+
+    def clear(self):
+        """清空索引"""
+        self._vectors.clear()
+        self._buckets.clear()
+
+
+class CacheKey:
+    """一次请求的缓存键：归一化提问 + 历史指纹（语义层会附带提问的向量）"""
+
+    __slots__ = ("prompt", "fingerprint", "vector")
+
+    def __init__(self, prompt, fingerprint):
+        self.prompt = prompt
+        self.fingerprint = fingerprint
+        self.vector = None
+
+    @property
+    def exact(self):
+        return self.prompt, self.fingerprint
+
+
+class _CacheEntry:
+    __slots__ = ("text", "expires")
+
+    def __init__(self, text, expires):
+        self.text = text
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    模型回复缓存
+    - 精确层：以归一化提问 + 历史指纹为键
+    - 语义层（可选）：embedder 把提问转成向量，同一历史指纹下相似度超过 similarity 即命中
+    - 条目按 LRU 与 ttl 淘汰；history_policy 决定带历史的请求是否参与缓存
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        history_policy: str = "empty",
+        similarity: float = 0.0,
+        embedder=None,
+        max_prompt_chars: int = 512,
+    ):
+        if history_policy not in HISTORY_POLICIES:
+            raise ValueError(f"未知的缓存历史策略: {history_policy}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_policy = history_policy
+        self.similarity = similarity
+        self.embedder = embedder if similarity > 0 else None
+        self.max_prompt_chars = max_prompt_chars
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._entries = OrderedDict()
+        self._index = VectorIndex()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key_for(self, chat, content, scope: str = ""):
+        """计算请求的缓存键（scope 区分不同的模型配置）；不可缓存时返回 None"""
+        history = getattr(chat, "history", None)
+        if not isinstance(content, str) or not isinstance(history, list):
+            self.bypassed += 1
+            return None
+        prompt = normalize_prompt(content)
+        if not prompt or len(prompt) > self.max_prompt_chars:
+            self.bypassed += 1
+            return None
+        if history and self.history_policy == "empty":
+            self.bypassed += 1
+            return None
+        fingerprint = history_fingerprint(history)
+        return CacheKey(prompt, f"{scope}:{fingerprint}" if scope else fingerprint)
+
+    async def lookup(self, key: CacheKey):
+        """查找缓存的回复，未命中返回 None"""
+        now = time.monotonic()
+        text = self._get(key.exact, now)
+        if text is not None:
+            self.exact_hits += 1
+            return text
+
+        if self.embedder is not None:
+            try:
+                key.vector = await self.embedder(key.prompt)
+            except Exception as e:
+                logging.warning(f"计算提问向量失败: {e}")
+            if key.vector is not None:
+                found = self._index.search(key.vector, key.fingerprint, self.similarity)
+                if found is not None:
+                    text = self._get(found[0], now)
+                    if text is not None:
+                        self.semantic_hits += 1
+                        return text
+
+        self.misses += 1
+        return None
+
+    def store(self, key: CacheKey, text: str):
+        """保存一次完整的回复"""
+        if not text:
+            return
+        exact = key.exact
+        self._entries[exact] = _CacheEntry(text, time.monotonic() + self.ttl)
+        self._entries.move_to_end(exact)
+        if key.vector is not None:
+            self._index.add(exact, key.vector, key.fingerprint)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存与统计"""
+        self._entries.clear()
+        self._index.clear()
+        self.exact_hits = self.semantic_hits = self.misses = 0
+        self.bypassed = self.evictions = self.expirations = 0
+
+    def stats(self) -> dict:
+        """命中率等统计"""
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _get(self, exact, now):
+        entry = self._entries.get(exact)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            self._remove(exact)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(exact)
+        return entry.text
+
+    def _remove(self, exact):
+        self._entries.pop(exact, None)
+        self._index.remove(exact)
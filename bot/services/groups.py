@@ -0,0 +1,97 @@
+"""
+群组支持
+- 群组中只响应提及机器人、回复机器人的消息（命令由 CommandHandler 处理）；
+  判断在过滤器中完成，未被点名的消息不进入处理器，不产生任何模型调用或网络 I/O
+- 私聊按用户保存上下文；群组按 (会话, 话题) 共享上下文，成员的发言带上称呼
+"""
+import hashlib
+import re
+
+from telegram.ext import filters
+
+from bot.services.metrics import Counter
+
+GROUP_TYPES = ("group", "supergroup")
+
+GROUP_UPDATES = Counter("bot_group_updates_total", "群组中的聊天消息数（processed 为点名机器人的消息）", ["result"])
+_PROCESSED = GROUP_UPDATES.labels("processed")
+_DROPPED = GROUP_UPDATES.labels("dropped")
+
+
+def is_group(chat) -> bool:
+    return getattr(chat, "type", None) in GROUP_TYPES
+
+
+def session_key(chat_id: int, thread_id: int = None) -> int:
+    """
+    群组会话的键：整个群组共用 chat_id；论坛话题按 (chat_id, 话题) 映射到一个负的 63 位整数
+    （用户 ID 为正、群组 ID 为负的较小整数，三者不会冲突；仍是整数，可直接用作存储主键与分片键）
+    """
+    if thread_id is None:
+        return chat_id
+    digest = hashlib.blake2b(f"{chat_id}:{thread_id}".encode(), digest_size=8).digest()
+    return -(int.from_bytes(digest, "big") >> 1) - 1
+
+
+def conversation_key(update) -> int:
+    """更新所属对话上下文的键：私聊为用户 ID，群组为会话（及话题）"""
+    chat = update.effective_chat
+    if not is_group(chat):
+        return update.effective_user.id
+    message = update.effective_message
+    thread_id = message.message_thread_id if getattr(message, "is_topic_message", False) else None
+    return session_key(chat.id, thread_id)
+
+
+class AddressedFilter(filters.MessageFilter):
+    """私聊消息全部通过；群组消息只有提及机器人或回复机器人的消息通过，并计数"""
+
+    def __init__(self):
+        super().__init__(name="addressed")
+        self.username = None
+        self.bot_id = None
+        self._mention = None
+
+    def configure(self, username: str, bot_id: int):
+        """设置机器人的用户名与 ID（默认在第一次过滤群组消息时从 Bot 对象读取）"""
+        self.username = username
+        self.bot_id = bot_id
+        self._mention = re.compile(rf"@{re.escape(username)}\b", re.IGNORECASE)
+
+    def filter(self, message) -> bool:
+        if not is_group(message.chat):
+            return True
+        if self._mention is None:
+            bot = message.get_bot()
+            self.configure(bot.username, bot.id)
+        if self.addressed(message):
+            _PROCESSED.inc()
+            return True
+        _DROPPED.inc()
+        return False
+
+    def addressed(self, message) -> bool:
+        reply = message.reply_to_message
+        if reply is not None and reply.from_user is not None and reply.from_user.id == self.bot_id:
+            return True
+        text = message.text or message.caption
+        return bool(text) and "@" in text and self._mention.search(text) is not None
+
+    def strip_mention(self, text: str) -> str:
+        """去掉文本中对机器人的提及"""
+        if self._mention is None or not text:
+            return text
+        return re.sub(r" {2,}", " ", self._mention.sub("", text)).strip()
+
+
+# 聊天与多模态消息共用的过滤器
+addressed = AddressedFilter()
+
+
+def group_prompt(update, text: str) -> str:
+    """群组消息发给模型前：去掉对机器人的提及，并注明发言的成员；私聊原样返回"""
+    if not text or not is_group(update.effective_chat):
+        return text
+    user = update.effective_user
+    name = (user.full_name or user.username or str(user.id)) if user is not None else "成员"
+    return f"{name}：{addressed.strip_mention(text)}"
@@ -0,0 +1,196 @@
+"""对话历史管理：按 token 预算截取滑动窗口，较早的轮次折叠为滚动摘要"""
+import asyncio
+import logging
+
+# 摘要前言的固定前缀，用于在历史中识别摘要
+SUMMARY_PREFIX = "【之前对话的摘要】\n"
+SUMMARY_ACK = "好的，我会参考这些内容继续对话。"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符约 1 token，其余约 4 字符 1 token"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def content_text(content) -> str:
+    """提取 Content 中的全部文本"""
+    texts = []
+    for part in getattr(content, "parts", ()):
+        try:
+            texts.append(part.text)
+        except (AttributeError, ValueError):
+            continue
+    return "".join(texts)
+
+
+def content_tokens(content) -> int:
+    """估算单条 Content 的 token 数"""
+    return estimate_tokens(content_text(content))
+
+
+def has_preamble(history) -> bool:
+    """历史开头是否为摘要前言"""
+    return bool(history) and content_text(history[0]).startswith(SUMMARY_PREFIX)
+
+
+def make_content(role: str, text: str):
+    """构造文本 Content"""
+    from vertexai.generative_models import Content, Part
+
+    return Content(role=role, parts=[Part.from_text(text)])
+
+
+class HistoryManager:
+    """
+    对话历史管理器
+    - 只保留最近 window_turns 轮，且总 token 数不超过 max_tokens；
+      超出时收缩到上限的 3/4，使摘要每隔若干轮才计算一次
+    - 窗口外的轮次交给后台任务折叠进滚动摘要，摘要以一问一答的形式放在历史开头
+    - 摘要在后台计算，不占用处理器的响应时间；计算完成前被折叠的轮次暂不出现在上下文中
+    """
+
+    def __init__(self, max_tokens: int, window_turns: int, summarizer=None):
+        self.max_tokens = max_tokens
+        self.window_turns = window_turns
+        self.summarizer = summarizer
+
+        self.compactions = 0
+        self.summaries_computed = 0
+
+        # 正在更新中的摘要: {user_id: 摘要文本}（更新完成后保存在会话历史开头）
+        self._summaries = {}
+        # 等待折叠的轮次: {user_id: [Content]}
+        self._pending = {}
+        self._tasks = {}
+        self._sessions = {}
+
+    def forget(self, user_id):
+        """丢弃用户的摘要和待折叠内容（如 /start 重置）"""
+        self._summaries.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._sessions.pop(user_id, None)
+        task = self._tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+
+    def clear(self):
+        """清空全部状态"""
+        for user_id in list(self._tasks):
+            self.forget(user_id)
+        self._summaries.clear()
+        self._pending.clear()
+        self._sessions.clear()
+
+    def compact(self, user_id, chat) -> bool:
+        """
+        一轮对话结束后整理历史（原地修改 chat.history）
+        返回是否发生了折叠
+        """
+        history = getattr(chat, "history", None)
+        if not isinstance(history, list) or not history:
+            return False
+
+        # 识别历史开头的摘要前言
+        summary = self._current_summary(user_id, history)
+        body = history[2:] if has_preamble(history) else history
+
+        # 未超出轮数和 token 预算时不做处理
+        budget = self.max_tokens - self._preamble_tokens(summary)
+        if len(body) <= self.window_turns * 2 and sum(content_tokens(c) for c in body) <= budget:
+            return False
+
+        # 超出后收缩到上限的 3/4，留出余量，避免每轮都触发一次摘要
+        target_turns = max(1, self.window_turns * 3 // 4)
+        target_budget = budget * 3 // 4
+        keep = 0
+        used = 0
+        limit = min(len(body), target_turns * 2)
+        while keep < limit:
+            cost = sum(content_tokens(c) for c in body[max(0, len(body) - keep - 2):len(body) - keep])
+            if keep >= 2 and used + cost > target_budget:
+                break
+            used += cost
+            keep += 2
+        keep = min(keep, len(body))
+
+        if keep == len(body):
+            return False
+
+        folded = body[:len(body) - keep]
+        window = body[len(body) - keep:]
+        self._pending.setdefault(user_id, []).extend(folded)
+        history[:] = self._preamble(summary) + window
+        self._sessions[user_id] = chat
+        self.compactions += 1
+        self._schedule_summary(user_id)
+        return True
+
+    def _current_summary(self, user_id, history) -> str:
+        """优先取正在更新的摘要，否则从历史开头的前言中读取"""
+        summary = self._summaries.get(user_id)
+        if summary is None and has_preamble(history):
+            summary = content_text(history[0])[len(SUMMARY_PREFIX):]
+        return summary or ""
+
+    def _preamble(self, summary: str) -> list:
+        if not summary:
+            return []
+        return [make_content("user", SUMMARY_PREFIX + summary), make_content("model", SUMMARY_ACK)]
+
+    def _preamble_tokens(self, summary: str) -> int:
+        if not summary:
+            return 0
+        return estimate_tokens(SUMMARY_PREFIX + summary + SUMMARY_ACK)
+
+    def _schedule_summary(self, user_id):
+        """在后台计算摘要，每个用户同一时间只有一个摘要任务"""
+        if self.summarizer is None:
+            self._pending.pop(user_id, None)
+            return
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._pending.pop(user_id, None)
+            return
+        self._tasks[user_id] = loop.create_task(self._summarize(user_id))
+
+    async def _summarize(self, user_id):
+        """把待折叠的轮次合并进滚动摘要"""
+        try:
+            while self._pending.get(user_id):
+                folded = self._pending.pop(user_id)
+                transcript = "\n".join(
+                    f"{'用户' if c.role == 'user' else '助手'}: {content_text(c)}" for c in folded
+                )
+                chat = self._sessions.get(user_id)
+                previous = self._current_summary(user_id, getattr(chat, "history", None) or [])
+                summary = await self.summarizer(previous, transcript)
+                self._summaries[user_id] = summary
+                self.summaries_computed += 1
+                self._refresh_preamble(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"生成对话摘要失败 {user_id}: {e}")
+        finally:
+            # 摘要已写入会话历史开头，随会话一起淘汰和持久化，这里不再保留
+            self._tasks.pop(user_id, None)
+            self._sessions.pop(user_id, None)
+            if not self._pending.get(user_id):
+                self._summaries.pop(user_id, None)
+
+    def _refresh_preamble(self, user_id):
+        """摘要更新后替换会话历史开头的摘要前言"""
+        chat = self._sessions.get(user_id)
+        history = getattr(chat, "history", None)
+        if not isinstance(history, list):
+            return
+        preamble = self._preamble(self._summaries[user_id])
+        if has_preamble(history):
+            history[:2] = preamble
+        else:
+            history[:0] = preamble
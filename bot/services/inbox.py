@@ -0,0 +1,102 @@
+"""用户消息收件箱：按用户串行处理对话轮次，并合并短时间内的连续消息"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from bot.config import Config
+
+
+class _InboxState:
+    """单个用户的收件箱状态"""
+
+    __slots__ = ("lock", "pending", "collecting", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = []
+        self.collecting = False
+        self.refs = 0
+
+
+def _merge(batch: list):
+    """合并一轮中的消息：全是文本时以换行连接，含附件时展开为 [附件 Part, 文本, ...]"""
+    if all(isinstance(item, str) for item in batch):
+        return "\n".join(batch)
+    parts = []
+    for item in batch:
+        if isinstance(item, str):
+            parts.append(item)
+        else:
+            parts.extend(item)
+    return parts
+
+
+class UserInbox:
+    """
+    按用户串行化对话轮次，不同用户之间互不阻塞
+    第一条消息等待 debounce 秒（以及上一轮结束）后，把期间到达的消息合并为一轮；
+    被合并的消息不再单独调用模型
+    """
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.messages = 0
+        self.turns = 0
+        self._states = {}
+
+    @property
+    def depth(self) -> int:
+        """等待处理的消息总数"""
+        return sum(len(state.pending) for state in self._states.values())
+
+    def stats(self) -> dict:
+        """队列深度与合并比例"""
+        return {
+            "queue_depth": self.depth,
+            "active_users": len(self._states),
+            "messages": self.messages,
+            "turns": self.turns,
+            "coalesce_ratio": self.messages / self.turns if self.turns else 0.0,
+        }
+
+    @asynccontextmanager
+    async def turn(self, key, text):
+        """
+        提交一条消息（文本，或附件与说明文字组成的列表）
+        产出合并后的内容；若该消息已并入同一用户的另一轮，则产出 None
+        """
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _InboxState()
+        state.pending.append(text)
+        state.refs += 1
+        self.messages += 1
+        try:
+            if state.collecting:
+                # 已有消息在等待，本条消息随它一起处理
+                yield None
+                return
+
+            state.collecting = True
+            try:
+                await asyncio.sleep(self.debounce)
+                await state.lock.acquire()
+            except asyncio.CancelledError:
+                # 等待期间被取消（退出排空、更新超时）：放弃本轮及并入它的消息，之后的消息重新开始收集
+                state.collecting = False
+                state.pending.clear()
+                raise
+            try:
+                batch, state.pending = state.pending, []
+                state.collecting = False
+                self.turns += 1
+                yield _merge(batch)
+            finally:
+                state.lock.release()
+        finally:
+            state.refs -= 1
+            if state.refs == 0 and not state.pending:
+                self._states.pop(key, None)
+
+
+# 全局聊天收件箱
+chat_inbox = UserInbox(Config.INBOX_DEBOUNCE)
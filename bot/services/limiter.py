@@ -0,0 +1,237 @@
+"""Vertex AI 调用限流：QPS / TPM 令牌桶 + AIMD 自适应并发 + 按用户公平排队"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from google.api_core import exceptions as google_exceptions
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """是否为配额 / 限流错误（HTTP 429）"""
+    return isinstance(error, google_exceptions.TooManyRequests) or getattr(error, "code", None) == 429
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离可以取出 amount 个令牌还需等待的秒数"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def configure(self, rate: float, capacity: float):
+        """修改补充速率与容量（已有令牌不超过新容量）"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def consume(self, amount: float, now: float):
+        """取出令牌（允许为负，用于事后补扣实际用量）"""
+        self._refill(now)
+        self.tokens -= amount
+
+
+class _Waiter:
+    """排队中的一次调用"""
+
+    __slots__ = ("future", "tokens")
+
+    def __init__(self, future, tokens):
+        self.future = future
+        self.tokens = tokens
+
+
+class _Slot:
+    """已获得的调用名额，可补报实际消耗的 token 数，并记录首个分块的等待时间"""
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self.started = time.monotonic()
+        self.first_chunk_latency = None
+
+    def add_tokens(self, tokens: int):
+        self._limiter.tpm.consume(tokens, time.monotonic())
+
+    def first_chunk(self):
+        """首个分块到达：之后的生成时间与调用方消费回复的时间（编辑消息、等待 RetryAfter）不计入延迟"""
+        if self.first_chunk_latency is None:
+            self.first_chunk_latency = time.monotonic() - self.started
+
+    @property
+    def latency(self) -> float:
+        """AIMD 使用的延迟：流式调用为首个分块的等待时间，没有分块时为整个调用的耗时"""
+        if self.first_chunk_latency is not None:
+            return self.first_chunk_latency
+        return time.monotonic() - self.started
+
+
+class AdaptiveLimiter:
+    """
+    全局模型调用限流器
+    - QPS 与每分钟 token 数（TPM）两个令牌桶
+    - 并发上限按 AIMD 调整：调用成功且延迟达标时缓慢增加，遇到 429 或延迟超标时成倍减小；
+      流式调用的延迟为首个分块的等待时间，长回复的生成时间不会压低并发上限
+    - 等待中的调用按用户轮转出队，单个用户的大量请求不会饿死其他用户
+    """
+
+    def __init__(
+        self,
+        qps: float,
+        tpm: float,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        latency_target: float = 15.0,
+        decrease_cooldown: float = 1.0,
+    ):
+        self.qps = TokenBucket(qps, max(1.0, qps))
+        self.tpm = TokenBucket(tpm / 60.0, tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.decrease_cooldown = decrease_cooldown
+
+        # 从较小的并发开始，按成功情况逐步放开
+        self.limit = float(max(min_concurrency, min(max_concurrency, 8)))
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+
+        self._queues = OrderedDict()
+        self._timer = None
+        self._last_decrease = float("-inf")
+
+    def configure(self, qps: float, tpm: float, max_concurrency: int):
+        """修改限额（多进程时每个工作进程分得一份）；并发上限不超过新的最大并发"""
+        self.qps.configure(qps, max(1.0, qps))
+        self.tpm.configure(tpm / 60.0, tpm)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = min(self.limit, float(self.max_concurrency))
+        self._dispatch()
+
+    @property
+    def queued(self) -> int:
+        """排队等待的调用数"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        """并发上限、在途与排队情况"""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_users": len(self._queues),
+            "completed": self.completed,
+            "throttled": self.throttled,
+        }
+
+    @asynccontextmanager
+    async def acquire(self, key, tokens: int = 0):
+        """
+        获取一次调用名额，退出时根据结果调整并发上限
+        key 为公平排队的分组（通常是 user_id），tokens 为预估 token 数
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(future, tokens)
+        self._queues.setdefault(key, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配名额但调用方取消，归还名额
+                self._release()
+            else:
+                self._remove(key, waiter)
+            raise
+
+        slot = _Slot(self)
+        try:
+            yield slot
+        except Exception as e:
+            if is_rate_limited(e):
+                self.throttled += 1
+                # 后端拒绝说明当前在途数已超出容量，上限不应高于它
+                self.limit = min(self.limit, float(max(self.min_concurrency, self.in_flight - 1)))
+                self._decrease()
+            raise
+        else:
+            self.completed += 1
+            if slot.latency <= self.latency_target:
+                self._increase()
+            else:
+                self._decrease()
+        finally:
+            self._release()
+
+    def _increase(self):
+        """加性增：每个“窗口”内并发上限约 +1"""
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def _decrease(self):
+        """乘性减：冷却期内只减一次，避免同一波 429 把上限压到最低"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _remove(self, key, waiter):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[key]
+
+    def _dispatch(self):
+        """按用户轮转放行排队的调用，直到并发或令牌不足"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queues and self.in_flight < int(self.limit):
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                continue
+
+            now = time.monotonic()
+            wait = max(self.qps.wait_time(1, now), self.tpm.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            self.qps.consume(1, now)
+            self.tpm.consume(min(waiter.tokens, self.tpm.capacity), now)
+            queue.popleft()
+            # 该用户还有排队的调用时移到队尾，轮到其他用户
+            del self._queues[key]
+            if queue:
+                self._queues[key] = queue
+            self.in_flight += 1
+            waiter.future.set_result(None)
@@ -0,0 +1,202 @@
+"""日志：经队列交给后台线程格式化与输出（JSON），记录带上当前更新的关联 ID、用户与耗时"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import traceback
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from bot.config import Config
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# 当前正在处理的更新：关联 ID、用户、会话、处理器与开始时间（每个更新的任务各自一份）
+update_context = contextvars.ContextVar("update_context", default=None)
+
+# 写入日志记录的上下文字段
+CONTEXT_FIELDS = ("correlation_id", "trace_id", "update_id", "user_id", "chat_id", "handler")
+
+# LogRecord 自带的属性，其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# 当前生效的队列处理器、所在 logger 与后台监听线程
+_handler = None
+_logger = None
+_listener = None
+
+
+@contextmanager
+def bind_update(update):
+    """在处理一个更新期间绑定日志上下文（关联 ID 取 update_id，跨工作进程保持一致）"""
+    user = getattr(update, "effective_user", None)
+    chat = getattr(update, "effective_chat", None)
+    update_id = getattr(update, "update_id", None)
+    context = {
+        "correlation_id": f"u{update_id}" if update_id is not None else f"x{random.getrandbits(48):012x}",
+        "update_id": update_id,
+        "user_id": user.id if user is not None else None,
+        "chat_id": chat.id if chat is not None else None,
+        "started": time.perf_counter(),
+    }
+    token = update_context.set(context)
+    try:
+        yield context
+    finally:
+        update_context.reset(token)
+
+
+def bind(**fields):
+    """向当前更新的日志上下文追加字段（如处理器名），不在更新中时忽略"""
+    context = update_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class ContextFilter(logging.Filter):
+    """在产生日志的任务中把更新上下文与耗时写入记录（后台线程取不到 contextvars）"""
+
+    def __init__(self, **static_fields):
+        super().__init__()
+        self.static_fields = static_fields
+
+    def filter(self, record):
+        for key, value in self.static_fields.items():
+            setattr(record, key, value)
+        context = update_context.get()
+        if context is not None:
+            for key in CONTEXT_FIELDS:
+                value = context.get(key)
+                if value is not None and not hasattr(record, key):
+                    setattr(record, key, value)
+            record.elapsed_ms = round((time.perf_counter() - context["started"]) * 1000, 1)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按比例采样 DEBUG 及以下的记录，INFO 及以上全部保留
+    有关联 ID 时按 ID 决定去留，同一更新的调试日志要么全部保留、要么全部丢弃
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id is not None:
+            keep = zlib.crc32(correlation_id.encode()) % 10000 < self.rate * 10000
+        else:
+            keep = random.random() < self.rate
+        if not keep:
+            self.dropped += 1
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON：时间、级别、来源、消息、上下文与 extra 字段、异常堆栈"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    只把记录放入队列的处理器：格式化与 I/O 在后台线程完成，不阻塞事件循环
+    队列满时丢弃并计数，而不是让处理器等待
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只合并消息参数（参数对象之后可能被修改），格式化与异常堆栈交给后台线程
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    """后台输出线程；停止时阻塞等待队列腾出位置放入结束标记（队列可能已满）"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(level: str = None, fmt: str = None, stream=None, sample_rate: float = None,
+                  queue_size: int = None, logger: logging.Logger = None, **static_fields):
+    """
+    配置异步日志：logger（默认根 logger）只挂一个队列处理器，后台线程负责格式化与输出
+    static_fields 为每条记录固定附带的字段（如工作进程名）
+    返回 (队列处理器, 监听线程)
+    """
+    global _handler, _logger, _listener
+    stop_logging()
+    logger = logger or logging.getLogger()
+    level = level or Config.LOG_LEVEL
+    fmt = fmt or Config.LOG_FORMAT
+    sample_rate = Config.LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate
+    queue_size = Config.LOG_QUEUE_SIZE if queue_size is None else queue_size
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        prefix = "".join(f"{value} - " for value in static_fields.values())
+        output.setFormatter(logging.Formatter(TEXT_FORMAT.replace("%(name)s", prefix + "%(name)s", 1)))
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(ContextFilter(**static_fields))
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    listener = _Listener(handler.queue, output)
+    listener.start()
+    _handler, _logger, _listener = handler, logger, listener
+    return handler, listener
+
+
+def stop_logging():
+    """把队列中的记录全部输出后停止后台线程"""
+    global _handler, _logger, _listener
+    if _listener is None:
+        return
+    _logger.removeHandler(_handler)
+    _listener.stop()
+    _handler = _logger = _listener = None
@@ -0,0 +1,262 @@
+"""
+模型输出的 Markdown 增量转换为 Telegram HTML
+- 随分块到达线性处理，解析状态（代码块、行首、已打开的标签）跨分块保留，不重复渲染已处理的部分
+- 无法立即确定含义的尾部（如单独的 *、未闭合的链接、行首的标记）留待下一个分块
+- html 属性在已渲染内容后补上未闭合标签的结束标签，每次编辑的消息都是合法的 HTML
+支持：代码块（含语言）、行内代码、**粗体**、*斜体*、~~删除线~~、[链接](url)、标题、无序列表
+"""
+import re
+from html import escape
+
+# 标题与无序列表的行首标记
+_HEADING = re.compile(r" {0,3}#{1,6}[ \t]+")
+_BULLET = re.compile(r"( *)[-*+][ \t]+")
+# 分隔线
+_RULE = re.compile(r" {0,3}([-*_])( *\1){2,} *")
+# 只由行首标记字符组成的未完成行：还不能确定是否为标题 / 列表 / 代码块
+_AMBIGUOUS_LINE = re.compile(r"[ \t#*+\-_`]*")
+# 链接
+_LINK = re.compile(r"\[([^\[\]\n]+)\]\(([^()\s]+)\)")
+# 行内需要处理的字符
+_SPECIAL = re.compile(r"[*`~\[\n]")
+_SPECIAL_IN_CODE = re.compile(r"[`\n]")
+
+# 等待链接闭合的最大字符数，超过后按普通文本输出
+_MAX_LINK = 500
+
+_TAGS = {"b": ("<b>", "</b>"), "i": ("<i>", "</i>"), "s": ("<s>", "</s>")}
+
+
+def _pre_open(language: str) -> str:
+    if language:
+        return f'<pre><code class="language-{escape(language)}">'
+    return "<pre><code>"
+
+
+class MarkdownRenderer:
+    """Markdown → Telegram HTML 的增量渲染器"""
+
+    def __init__(self):
+        self._out = []
+        self._pending = ""
+        self._line_start = True
+        # 所在代码块的语言（不在代码块中为 None）
+        self._code = None
+        # 行内代码
+        self._code_span = False
+        # 当前行是否为标题（整行加粗，行内的 ** 不再生效）
+        self._heading = False
+        # 已打开的行内标签（b / i / s）
+        self._stack = []
+        # 上一个已处理的字符（判断 * 两侧是否为空白）
+        self._prev = ""
+
+    @property
+    def html(self) -> str:
+        """已渲染的 HTML，补上未闭合标签的结束标签"""
+        return "".join(self._out) + self._closing()
+
+    def feed(self, chunk: str):
+        """写入一个分块（只处理新内容，需要时再通过 html 取出结果）"""
+        self._pending += chunk
+        self._consume(final=False)
+
+    def finish(self) -> str:
+        """输入结束：处理剩余内容并关闭全部标签"""
+        self._consume(final=True)
+        self._out.append(self._closing())
+        self._stack.clear()
+        self._code = None
+        self._code_span = self._heading = False
+        if len(self._out) > 1:
+            self._out = ["".join(self._out)]
+        return self.html
+
+    def _closing(self) -> str:
+        if self._code is not None:
+            return "</code></pre>"
+        tags = "</code>" if self._code_span else ""
+        tags += "".join(_TAGS[tag][1] for tag in reversed(self._stack))
+        return tags + ("</b>" if self._heading else "")
+
+    def _consume(self, final: bool):
+        text = self._pending
+        i = 0
+        end = len(text)
+        out = self._out
+        while i < end:
+            if self._line_start:
+                j = self._line(text, i, final)
+                if j is None:
+                    break
+                i = j
+                continue
+
+            if self._code is not None:
+                # 代码块内：原样输出到行尾
+                newline = text.find("\n", i)
+                j = end if newline < 0 else newline + 1
+                out.append(escape(text[i:j], quote=False))
+                self._line_start = newline >= 0
+                i = j
+                continue
+
+            if self._code_span:
+                match = _SPECIAL_IN_CODE.search(text, i)
+                j = end if match is None else match.start()
+                if j > i:
+                    out.append(escape(text[i:j], quote=False))
+                    i = j
+                    continue
+            else:
+                match = _SPECIAL.search(text, i)
+                j = end if match is None else match.start()
+                if j > i:
+                    out.append(escape(text[i:j], quote=False))
+                    i = j
+                    continue
+
+            j = self._special(text, i, final)
+            if j is None:
+                break
+            i = j
+        if i > 0:
+            self._prev = text[i - 1]
+        self._pending = text[i:]
+        if len(out) > 256:
+            # 合并片段，html 拼接时不必遍历大量小字符串
+            self._out = ["".join(out)]
+
+    def _line(self, text: str, i: int, final: bool):
+        """处理行首：代码块围栏、标题、列表、分隔线；需要更多输入时返回 None"""
+        newline = text.find("\n", i)
+        line = text[i:] if newline < 0 else text[i:newline]
+        complete = newline >= 0 or final
+        stripped = line.lstrip(" ")
+
+        if self._code is not None:
+            if stripped.startswith("```") or (not complete and "```".startswith(stripped)):
+                if not complete:
+                    return None
+                if stripped.rstrip() == "```":
+                    # 代码块结束（围栏所在行的换行不输出）
+                    self._out.append("</code></pre>")
+                    self._code = None
+                    return i + len(line) + (newline >= 0)
+            self._line_start = False
+            return i
+
+        if not complete and _AMBIGUOUS_LINE.fullmatch(line):
+            return None
+        if stripped.startswith("```"):
+            if not complete:
+                return None
+            self._close_inline()
+            self._out.append(_pre_open(stripped[3:].strip()))
+            self._code = ""
+            return i + len(line) + (newline >= 0)
+        if complete and _RULE.fullmatch(line):
+            self._out.append("——————")
+            self._line_start = False
+            return i + len(line)
+
+        self._line_start = False
+        match = _HEADING.match(line)
+        if match:
+            self._out.append("<b>")
+            self._heading = True
+            return i + match.end()
+        match = _BULLET.match(line)
+        if match:
+            self._out.append(match.group(1) + "• ")
+            return i + match.end()
+        return i
+
+    def _special(self, text: str, i: int, final: bool):
+        """处理行内的特殊字符；需要更多输入时返回 None"""
+        ch = text[i]
+        end = len(text)
+        if ch == "\n":
+            self._close_inline()
+            self._out.append("\n")
+            self._line_start = True
+            return i + 1
+        if ch == "`":
+            self._out.append("</code>" if self._code_span else "<code>")
+            self._code_span = not self._code_span
+            return i + 1
+        if ch == "[":
+            match = _LINK.match(text, i)
+            if match:
+                label, url = match.groups()
+                self._out.append(f'<a href="{escape(url)}">{escape(label, quote=False)}</a>')
+                return match.end()
+            newline = text.find("\n", i)
+            if not final and newline < 0 and end - i < _MAX_LINK:
+                return None
+            self._out.append("[")
+            return i + 1
+
+        # * / ~ 需要看后面的字符
+        if i + 1 >= end and not final:
+            return None
+        double = text[i + 1:i + 2] == ch
+        if ch == "~" and not double:
+            self._out.append("~")
+            return i + 1
+        tag = "b" if (ch == "*" and double) else ("s" if ch == "~" else "i")
+        width = 2 if double else 1
+        after = text[i + width:i + width + 1]
+        if not after and not final:
+            return None
+        before = text[i - 1] if i > 0 else self._prev
+        if tag in self._stack and before and not before.isspace():
+            if tag == "b" and after == "*" and self._stack[-1] == "i":
+                # ***粗斜体*** 的结尾：先关斜体再关粗体
+                self._toggle("i")
+                self._toggle("b")
+                return i + 3
+            self._toggle(tag)
+        elif tag not in self._stack and after and not after.isspace():
+            if tag == "b" and self._heading:
+                # 标题整行已加粗
+                return i + width
+            self._toggle(tag)
+        else:
+            self._out.append(escape(ch * width, quote=False))
+        return i + width
+
+    def _toggle(self, tag: str):
+        """打开或关闭行内标签；关闭非栈顶的标签时先关闭其上方的标签，再重新打开"""
+        if tag not in self._stack:
+            self._stack.append(tag)
+            self._out.append(_TAGS[tag][0])
+            return
+        reopen = []
+        while True:
+            top = self._stack.pop()
+            self._out.append(_TAGS[top][1])
+            if top == tag:
+                break
+            reopen.append(top)
+        for top in reversed(reopen):
+            self._stack.append(top)
+            self._out.append(_TAGS[top][0])
+
+    def _close_inline(self):
+        """行尾关闭行内代码、行内标签与标题"""
+        if self._code_span:
+            self._out.append("</code>")
+            self._code_span = False
+        while self._stack:
+            self._out.append(_TAGS[self._stack.pop()][1])
+        if self._heading:
+            self._out.append("</b>")
+            self._heading = False
+
+
+def render_markdown(text: str) -> str:
+    """一次性把完整的 Markdown 转换为 Telegram HTML"""
+    renderer = MarkdownRenderer()
+    renderer.feed(text)
+    return renderer.finish()
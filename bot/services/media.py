@@ -0,0 +1,344 @@
+"""
+多模态输入：图片、语音与文件
+- 以流的形式下载到有界缓冲区，超过上限立即中止，不先把整个响应读入内存再检查
+- 图片的缩放 / 转码在进程池中进行（需要 Pillow），不占用事件循环
+- 处理结果按 file_unique_id 缓存，转发或重复发送的同一文件不再下载与处理
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+
+from bot.config import Config
+from bot.services.metrics import Counter, Histogram
+
+# 模型可以直接接收的图片格式，其余图片格式转码为 JPEG / PNG
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp", "image/heic", "image/heif")
+# 模型可以直接接收的其他文件类型（前缀）
+PASSTHROUGH_PREFIXES = ("audio/", "video/", "text/", "application/pdf")
+
+# 单张图片按约 258 token 计（用于限流器估算）
+MEDIA_PART_TOKENS = 258
+
+MEDIA_SECONDS = Histogram("bot_media_prepare_seconds", "下载与预处理媒体的耗时（秒，不含缓存命中）", ["kind"])
+MEDIA_CACHE_HITS = Counter("bot_media_cache_hits_total", "媒体处理结果的缓存命中次数（含等待同一文件的处理）")
+
+
+class MediaError(Exception):
+    """媒体无法处理，消息文本直接回复给用户"""
+
+
+class MediaTooLarge(MediaError):
+    """文件超过大小上限"""
+
+
+class UnsupportedMedia(MediaError):
+    """模型不支持的文件类型"""
+
+
+def too_large(limit: int) -> MediaTooLarge:
+    return MediaTooLarge(f"文件太大了（上限 {limit // (1024 * 1024)} MB），请压缩后再发。")
+
+
+class BoundedBuffer:
+    """下载缓冲区：写入超过 limit 字节时抛出 MediaTooLarge"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._data = bytearray()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.limit:
+            raise too_large(self.limit)
+        self._data += chunk
+
+    def getvalue(self) -> bytes:
+        return bytes(self._data)
+
+
+# ---- 下载 ----
+
+# 下载用的 HTTP 客户端（首次下载时创建）
+_client = None
+
+# 同时进行的下载数，峰值内存不超过 MEDIA_DOWNLOAD_CONCURRENCY × MEDIA_MAX_BYTES
+_download_slots = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+    return _client
+
+
+async def download(file, limit: int = None) -> bytes:
+    """以流的形式下载 Telegram 文件到有界缓冲区"""
+    global _download_slots
+    limit = Config.MEDIA_MAX_BYTES if limit is None else limit
+    if file.file_size and file.file_size > limit:
+        raise too_large(limit)
+    if _download_slots is None:
+        _download_slots = asyncio.Semaphore(Config.MEDIA_DOWNLOAD_CONCURRENCY)
+
+    path = file.file_path
+    async with _download_slots:
+        if not path.startswith(("http://", "https://")):
+            # 本地 Bot API 服务器直接给出文件路径
+            return await asyncio.to_thread(_read_local, path, limit)
+        async with _get_client().stream("GET", path) as response:
+            response.raise_for_status()
+            expected = int(response.headers.get("content-length") or 0)
+            if expected > limit:
+                raise too_large(limit)
+            buffer = BoundedBuffer(limit)
+            async for chunk in response.aiter_bytes():
+                buffer.write(chunk)
+            return buffer.getvalue()
+
+
+def _read_local(path: str, limit: int) -> bytes:
+    buffer = BoundedBuffer(limit)
+    with open(path, "rb") as f:
+        while chunk := f.read(64 * 1024):
+            buffer.write(chunk)
+    return buffer.getvalue()
+
+
+# ---- 图片处理（进程池） ----
+
+# 图片处理进程池（首次使用时创建）
+_pool = None
+
+
+def pillow_available() -> bool:
+    return find_spec("PIL") is not None
+
+
+async def process_in_pool(fn, *args):
+    """在进程池中执行 CPU 密集的函数（fn 与参数需可 pickle）"""
+    global _pool
+    if _pool is None:
+        methods = multiprocessing.get_all_start_methods()
+        # forkserver 的子进程不继承事件循环与各种线程
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        _pool = ProcessPoolExecutor(max_workers=Config.MEDIA_WORKERS, mp_context=context)
+    return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+
+
+def transcode_image(data: bytes, max_side: int, quality: int) -> tuple:
+    """
+    把图片缩放到最长边不超过 max_side，返回 (数据, MIME 类型)
+    已是模型支持的格式且尺寸不超限时原样返回；带透明通道的转为 PNG，其余转为 JPEG
+    """
+    import io
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        mime = _unchanged_mime(image, max_side)
+        if mime:
+            return data, mime
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png"
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), "image/jpeg"
+
+
+def _unchanged_mime(image, max_side: int) -> str:
+    """已是模型支持的格式且尺寸不超限（无需处理）时返回 MIME 类型，否则返回空字符串"""
+    from PIL import Image
+
+    mime = Image.MIME.get(image.format, "")
+    return mime if mime in IMAGE_TYPES and max(image.size) <= max_side else ""
+
+
+def passthrough_mime(data: bytes, max_side: int) -> str:
+    """只读取文件头判断图片能否原样发送，返回 MIME 类型；需要处理或无法识别时返回空字符串"""
+    import io
+
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return _unchanged_mime(image, max_side)
+    except (OSError, ValueError):
+        # 无法识别的图片交给进程池，由 transcode_image 报告错误
+        return ""
+
+
+async def prepare_image(data: bytes, mime: str) -> tuple:
+    """
+    缩放 / 转码图片；未安装 Pillow 时只接受模型支持的格式并原样发送
+    先在事件循环中读取文件头，无需处理的图片不传给进程池（省去两次 pickle 整张图片）
+    """
+    if pillow_available():
+        max_side = Config.MEDIA_IMAGE_MAX_SIDE
+        unchanged = passthrough_mime(data, max_side)
+        if unchanged:
+            return data, unchanged
+        return await process_in_pool(transcode_image, data, max_side, Config.MEDIA_IMAGE_QUALITY)
+    if mime not in IMAGE_TYPES:
+        raise UnsupportedMedia("暂不支持这种图片格式，请发送 JPEG 或 PNG。")
+    return data, mime
+
+
+# ---- 缓存 ----
+
+
+class _Abandoned(Exception):
+    """正在处理的调用方被取消，结果不会到来"""
+
+
+class MediaCache:
+    """
+    按 file_unique_id 缓存处理后的 (数据, MIME 类型)，LRU 淘汰，总字节数不超过 max_bytes
+    同一文件正在处理时，后来的请求等待同一个结果
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def get(self, key, factory):
+        """
+        返回 key 的处理结果，没有时调用 factory() 处理并缓存
+        正在处理的调用方被取消时，等待同一结果的调用方改用自己的 factory() 重新处理
+        """
+        while True:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                MEDIA_CACHE_HITS.inc()
+                return value
+            future = self._pending.get(key)
+            if future is None:
+                break
+            try:
+                value = await asyncio.shield(future)
+            except _Abandoned:
+                continue
+            self.hits += 1
+            MEDIA_CACHE_HITS.inc()
+            return value
+
+        self.misses += 1
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await factory()
+        except asyncio.CancelledError:
+            # 不取消 future：取消只属于本调用方，等待者收到 _Abandoned 后重新处理
+            future.set_exception(_Abandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时不报告 “exception was never retrieved”
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(value)
+        self._store(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def _store(self, key, value):
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (data, _) = self._entries.popitem(last=False)
+            self._size -= len(data)
+
+
+# 全局媒体缓存
+media_cache = MediaCache(Config.MEDIA_CACHE_BYTES)
+
+
+# ---- 消息 ----
+
+
+def attachment(message) -> tuple:
+    """消息中的附件: (附件对象, 类型, MIME 类型)；没有附件时返回 (None, None, None)"""
+    if message.photo:
+        # 按尺寸排列，最后一个最大
+        return message.photo[-1], "image", "image/jpeg"
+    if message.voice:
+        return message.voice, "audio", message.voice.mime_type or "audio/ogg"
+    if message.audio:
+        return message.audio, "audio", message.audio.mime_type or "audio/mpeg"
+    document = message.document
+    if document:
+        mime = document.mime_type or ""
+        if mime.startswith("image/"):
+            return document, "image", mime
+        if mime.startswith(PASSTHROUGH_PREFIXES):
+            return document, "file", mime
+        raise UnsupportedMedia("暂不支持这种文件类型，可以发送图片、语音、PDF 或文本文件。")
+    return None, None, None
+
+
+async def prepare(source, kind: str, mime: str) -> tuple:
+    """下载并预处理附件，返回 (数据, MIME 类型)"""
+    started = time.perf_counter()
+    file = await source.get_file()
+    data = await download(file)
+    if kind == "image":
+        data, mime = await prepare_image(data, mime)
+    MEDIA_SECONDS.labels(kind).observe(time.perf_counter() - started)
+    return data, mime
+
+
+async def message_parts(message) -> list:
+    """把消息中的附件转为模型输入：[附件 Part, 说明文字]（没有说明文字时只有附件）"""
+    from vertexai.generative_models import Part
+
+    source, kind, mime = attachment(message)
+    if source is None:
+        return [message.text] if message.text else []
+    data, mime = await media_cache.get(source.file_unique_id, lambda: prepare(source, kind, mime))
+    parts = [Part.from_data(data, mime_type=mime)]
+    if message.caption:
+        parts.append(message.caption)
+    return parts
+
+
+async def close():
+    """关闭下载客户端与进程池"""
+    global _client, _pool
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        logging.info("媒体处理进程池已关闭")
@@ -0,0 +1,161 @@
+"""
+模型配置与系统提示词模板
+- 模型名、系统提示词与生成参数按部署（环境变量）设置，可再按对话（AI_PROFILES_FILE）覆盖
+- 模板在启动时编译一次：占位符替换为最终文本、生成参数校验并转换类型，之后创建会话只做一次字典查找
+- 编译结果相同的配置共用同一个模型客户端（ai.get_model 按 ModelProfile.key 缓存）
+"""
+import json
+import re
+from string import Template
+
+from bot.config import Config
+from bot.services.groups import session_key
+from bot.services.texts import LANGUAGES, default_locale
+
+# 内置的系统提示词模板（按 BOT_LOCALE 选择）
+DEFAULT_SYSTEM_PROMPTS = {
+    "zh": (
+        "你是{{bot_name}}，一个在 Telegram 上与用户聊天的 AI 助手。\n"
+        "- 使用用户所用的语言回答，无法判断时使用{{language}}\n"
+        "- 回答简洁直接，需要时使用 Markdown（代码块、列表、粗体、链接）\n"
+        "- 群组中的每条消息以“成员名：”开头注明发言者，回复时不要重复这个前缀"
+    ),
+    "en": (
+        "You are {{bot_name}}, an AI assistant chatting with users on Telegram.\n"
+        "- Reply in the user's language; use {{language}} when it is unclear\n"
+        "- Keep answers concise and direct; use Markdown (code blocks, lists, bold, links) when helpful\n"
+        "- In groups every message starts with \"name：\" to identify the speaker; do not repeat that prefix"
+    ),
+}
+
+# 可配置的生成参数及其类型
+GENERATION_FIELDS = {
+    "temperature": float,
+    "top_p": float,
+    "top_k": int,
+    "max_output_tokens": int,
+}
+
+
+class PromptTemplate(Template):
+    """{{name}} 形式的占位符（$ 与 ${VAR} 会被 .env 的变量插值替换，不能使用）"""
+
+    delimiter = "{{"
+    pattern = r"""
+    \{\{(?:
+      (?P<escaped>(?!)) |
+      \s*(?P<named>[_a-z][_a-z0-9]*)\s*\}\} |
+      (?P<braced>(?!)) |
+      (?P<invalid>)
+    )
+    """
+    flags = re.IGNORECASE | re.ASCII | re.VERBOSE
+
+
+def compile_prompt(template: str, variables: dict) -> str:
+    """编译系统提示词模板（@path 从文件读取），替换占位符；有未知占位符时抛出 ValueError"""
+    if template.startswith("@"):
+        with open(template[1:], encoding="utf-8") as f:
+            template = f.read()
+    compiled = PromptTemplate(template)
+    unknown = set(compiled.get_identifiers()) - set(variables)
+    if unknown:
+        raise ValueError(f"系统提示词中有未知的占位符: {', '.join(sorted(unknown))}")
+    # 不是占位符的 {{（如提示词里的代码示例）原样保留
+    return compiled.safe_substitute(variables).strip()
+
+
+def generation_config(values: dict) -> dict:
+    """校验并转换生成参数，去掉未设置的项"""
+    config = {}
+    for name, value in values.items():
+        if value is None or value == "":
+            continue
+        kind = GENERATION_FIELDS.get(name)
+        if kind is None:
+            raise ValueError(f"未知的生成参数: {name}")
+        config[name] = kind(value)
+    return config
+
+
+class ModelProfile:
+    """编译好的模型配置：模型名、系统提示词（已替换占位符）、生成参数"""
+
+    __slots__ = ("name", "model", "system_instruction", "generation_config", "key")
+
+    def __init__(self, name: str, model: str, system_instruction: str = "", generation_config: dict = None):
+        self.name = name
+        self.model = model
+        self.system_instruction = system_instruction
+        self.generation_config = dict(generation_config or {})
+        # 模型客户端的缓存键：内容相同的配置共用同一个客户端
+        self.key = (model, system_instruction, tuple(sorted(self.generation_config.items())))
+
+    def __repr__(self):
+        return f"ModelProfile({self.name!r}, {self.model!r})"
+
+    def model_kwargs(self) -> dict:
+        """创建 GenerativeModel 的关键字参数（未设置的项不传）"""
+        kwargs = {}
+        if self.system_instruction:
+            kwargs["system_instruction"] = self.system_instruction
+        if self.generation_config:
+            kwargs["generation_config"] = dict(self.generation_config)
+        return kwargs
+
+
+class ProfileRegistry:
+    """部署配置、命名配置，以及对话到配置的映射"""
+
+    def __init__(self, default: ModelProfile, profiles: dict = None, chats: dict = None):
+        self.default = default
+        self.profiles = profiles or {}
+        self._chats = chats or {}
+
+    def profile_for(self, key) -> ModelProfile:
+        """对话上下文的键（私聊为用户 ID，群组为会话 / 话题）对应的配置"""
+        return self._chats.get(key, self.default)
+
+
+def parse_chat_key(text: str) -> int:
+    """配置文件中的对话：chat_id，论坛话题为 chat_id:thread_id"""
+    chat_id, _, thread_id = str(text).partition(":")
+    return session_key(int(chat_id), int(thread_id) if thread_id else None)
+
+
+def load_profiles(path: str = None) -> ProfileRegistry:
+    """编译部署配置与配置文件中的按对话配置；配置有误时抛出 ValueError（启动时失败）"""
+    locale = default_locale()
+    variables = {"bot_name": Config.BOT_NAME, "language": LANGUAGES[locale]}
+    default = ModelProfile(
+        "default",
+        Config.AI_MODEL,
+        compile_prompt(Config.AI_SYSTEM_PROMPT or DEFAULT_SYSTEM_PROMPTS[locale], variables),
+        generation_config({"temperature": Config.AI_TEMPERATURE, "max_output_tokens": Config.AI_MAX_OUTPUT_TOKENS}),
+    )
+
+    path = Config.AI_PROFILES_FILE if path is None else path
+    if not path:
+        return ProfileRegistry(default)
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    profiles = {}
+    for name, spec in data.get("profiles", {}).items():
+        prompt = spec.get("system_prompt")
+        profiles[name] = ModelProfile(
+            name,
+            spec.get("model", default.model),
+            default.system_instruction if prompt is None else compile_prompt(prompt, variables),
+            {**default.generation_config, **generation_config(spec.get("generation_config", {}))},
+        )
+    chats = {}
+    for chat, name in data.get("chats", {}).items():
+        if name not in profiles:
+            raise ValueError(f"对话 {chat} 使用了未定义的模型配置: {name}")
+        chats[parse_chat_key(chat)] = profiles[name]
+    return ProfileRegistry(default, profiles, chats)
+
+
+# 启动时编译的模型配置
+registry = load_profiles()
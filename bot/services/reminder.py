@@ -1,48 +1,469 @@
 """睡眠提醒服务"""
+import asyncio
+import bisect
+import heapq
 import logging
-from datetime import time
+import time as timer
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 
-from telegram.ext import ContextTypes
+import pytz
+from telegram.ext import ContextTypes, JobQueue
 
 from bot.config import Config
+from bot.services.broadcast import PERMANENT, SENT, Broadcaster
+from bot.services.storage import get_storage
+from bot.services.texts import LANGUAGES, catalog_for, default_locale
 
 # 存储需要接收睡眠提醒的用户配置
-# 结构：{chat_id: {"time": time对象}}
+# 结构：{chat_id: {"time": time对象, "time_str": 用户输入的时间, "tz": 时区名, "locale": 提醒文本的语言}}
 sleep_reminder_users = {}
 
+# 定时器错过若干分钟（如进程卡顿）时最多补发的分钟数
+MAX_CATCH_UP_MINUTES = 10
 
-def parse_time(time_str: str) -> time:
+MINUTES_PER_DAY = 24 * 60
+
+
+class ReminderSpecError(ValueError):
+    """提醒设置无效：key 为 texts 中的错误文本，按用户的语言展示；str() 为默认语言的文本（用于日志）"""
+
+    def __init__(self, key: str, **values):
+        self.key = key
+        self.values = values
+        super().__init__(self.message())
+
+    def message(self, catalog=None) -> str:
+        return (catalog or catalog_for()).format(self.key, **self.values)
+
+
+@lru_cache(maxsize=None)
+def get_zone(name: str):
+    """按名称获取时区对象（缓存，不在每次请求时调用 pytz.timezone）"""
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise ReminderSpecError("error_unknown_zone", zone=name)
+
+
+def parse_time(time_str: str, tz=None) -> time:
     """
     解析用户输入的时间字符串
-    支持格式：HH:MM (24小时制)
+    支持格式：HH:MM (24小时制)，tz 为时区对象，默认使用配置的时区
     """
-    time_str = time_str.strip()
+    parts = time_str.strip().split(":")
+    if len(parts) != 2:
+        raise ReminderSpecError("error_time_format")
     try:
-        parts = time_str.split(":")
-        if len(parts) != 2:
-            raise ValueError("时间格式应为 HH:MM")
         hour = int(parts[0])
         minute = int(parts[1])
-        if not (0 <= hour <= 23 and 0 <= minute <= 59):
-            raise ValueError("时间超出有效范围")
-        return time(hour=hour, minute=minute, tzinfo=Config.BEIJING_TZ)
-    except ValueError as e:
-        raise ValueError(f"时间格式错误: {e}")
+    except ValueError:
+        raise ReminderSpecError("error_time_format")
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ReminderSpecError("error_time_range")
+    return time(hour=hour, minute=minute, tzinfo=tz or Config.BEIJING_TZ)
 
 
-async def send_sleep_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """定时任务：发送睡眠提醒给特定用户"""
-    chat_id = context.job.data.get("chat_id")
-    time_str = context.job.data.get("time_str")
+def parse_reminder(spec: str):
+    """
+    解析提醒设置 "HH:MM [时区]"，如 "23:30" 或 "23:30 Europe/Berlin"
+    返回 (time对象, 时间字符串, 时区名)
+    """
+    parts = spec.split()
+    if not parts or len(parts) > 2:
+        raise ReminderSpecError("error_spec_format")
+    zone = get_zone(parts[1]) if len(parts) == 2 else get_zone(Config.TIMEZONE)
+    return parse_time(parts[0], zone), parts[0], zone.zone
 
-    try:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"🌙 晚安！现在是北京时间 {time_str}，该睡觉啦！\n\n早睡早起身体好，明天又是元气满满的一天！💤"
+
+def _split_locale(spec: str) -> tuple:
+    """持久化的设置末尾可带提醒文本的语言（"HH:MM [时区] [语言]"），返回 (不含语言的设置, 语言)"""
+    parts = spec.split()
+    if len(parts) > 1 and parts[-1] in LANGUAGES:
+        return " ".join(parts[:-1]), parts[-1]
+    return spec, None
+
+
+def _utc_offset_minutes(zone, now: datetime) -> int:
+    """时区在 now 时刻相对 UTC 的偏移（分钟）"""
+    return int(now.astimezone(zone).utcoffset().total_seconds() // 60)
+
+
+def _next_transition(zone, now: datetime):
+    """时区在 now 之后的下一次偏移变化（夏令时切换）时刻，没有时返回 None"""
+    transitions = getattr(zone, "_utc_transition_times", None)
+    if not transitions:
+        return None
+    index = bisect.bisect_right(transitions, now.astimezone(pytz.utc).replace(tzinfo=None))
+    if index >= len(transitions):
+        return None
+    return pytz.utc.localize(transitions[index])
+
+
+class ReminderEngine:
+    """
+    按 UTC 分钟分桶的提醒调度器
+    - 索引结构：{UTC 当日分钟: set(chat_id)}，订阅、取消、查询状态均为 O(1)
+    - 每个时区记录当前 UTC 偏移和下一次夏令时切换时刻；切换时只移动该时区的订阅，
+      发送时无论有多少个时区都只查一个桶
+    - 全局只有一个每分钟触发的定时任务，触发时把当前分钟桶里的提醒一次性发出
+    """
+
+    def __init__(self, subscriptions: dict):
+        self.subscriptions = subscriptions
+        self.sent = 0
+        self.failed = 0
+        self.rebuilds = 0
+        self._buckets = {}
+        # {时区名: {本地当日分钟: set(chat_id)}} 与 {时区名: 当前 UTC 偏移分钟}
+        self._zones = {}
+        self._offsets = {}
+        # 各时区下一次偏移变化的最小堆 [(UTC 时刻, 时区名)]，以及每个时区在堆中的那一项 {时区名: UTC 时刻}
+        # 时区的订阅全部取消时保留这一项，重新订阅时不再重复入堆；出堆时与之不符的项已过期，直接丢弃
+        self._transitions = []
+        self._pending = {}
+        self._job = None
+        self._last_minute = None
+        # 后台发送中的分钟批次: {task: "HH:MM"（UTC）}，退出时限时等待
+        self._dispatches = {}
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def __contains__(self, chat_id):
+        return chat_id in self.subscriptions
+
+    def subscribe(self, chat_id, spec: str, locale: str = None) -> time:
+        """
+        订阅（或修改）提醒，spec 为 "HH:MM [时区] [语言]"，格式或时区错误时抛出 ReminderSpecError
+        locale 为提醒文本的语言（spec 中带语言时以其为准），未指定时使用默认语言
+        """
+        spec, spec_locale = _split_locale(spec)
+        reminder_time, time_str, zone_name = parse_reminder(spec)
+        self.unsubscribe(chat_id)
+        self.subscriptions[chat_id] = {
+            "time": reminder_time,
+            "time_str": time_str,
+            "tz": zone_name,
+            "locale": spec_locale or locale,
+        }
+        local_minute = reminder_time.hour * 60 + reminder_time.minute
+        self._zone_minutes(zone_name).setdefault(local_minute, set()).add(chat_id)
+        self._bucket_add(self._utc_key(zone_name, local_minute), chat_id)
+        return reminder_time
+
+    def unsubscribe(self, chat_id) -> bool:
+        """取消提醒，返回之前是否已订阅"""
+        subscription = self.subscriptions.pop(chat_id, None)
+        if subscription is None:
+            return False
+        zone_name = subscription.get("tz") or Config.TIMEZONE
+        local_minute = subscription["time"].hour * 60 + subscription["time"].minute
+        minutes = self._zones.get(zone_name)
+        if minutes is None:
+            return True
+        chats = minutes.get(local_minute)
+        if chats is not None and chat_id in chats:
+            chats.discard(chat_id)
+            if not chats:
+                del minutes[local_minute]
+            self._bucket_discard(self._utc_key(zone_name, local_minute), chat_id)
+        if not minutes:
+            del self._zones[zone_name]
+            del self._offsets[zone_name]
+        return True
+
+    def status(self, chat_id):
+        """提醒设置，未订阅时返回 None"""
+        return self.subscriptions.get(chat_id)
+
+    def due(self, hour: int, minute: int, tz=None) -> set:
+        """某一时刻（tz 时区的本地时间，默认配置的时区）需要提醒的 chat_id"""
+        zone = tz or Config.BEIJING_TZ
+        offset = _utc_offset_minutes(zone, self._utc_now())
+        return self._buckets.get((hour * 60 + minute - offset) % MINUTES_PER_DAY, set())
+
+    def next_run(self, chat_id, now: datetime = None):
+        """下次提醒的时间（用户所在时区），未订阅时返回 None"""
+        subscription = self.subscriptions.get(chat_id)
+        if subscription is None:
+            return None
+        tz = get_zone(subscription.get("tz") or Config.TIMEZONE)
+        now = (now or self._utc_now()).astimezone(tz)
+        at = time(subscription["time"].hour, subscription["time"].minute)
+        candidate = tz.localize(datetime.combine(now.date(), at))
+        if candidate <= now:
+            candidate = tz.localize(datetime.combine(now.date() + timedelta(days=1), at))
+        return candidate
+
+    def spec(self, chat_id) -> str:
+        """持久化用的提醒设置：默认时区只存时间，其他时区存 "HH:MM 时区"；非默认语言时末尾再加语言"""
+        subscription = self.subscriptions[chat_id]
+        zone_name = subscription.get("tz") or Config.TIMEZONE
+        spec = self.time_str(chat_id)
+        if zone_name != Config.TIMEZONE:
+            spec = f"{spec} {zone_name}"
+        locale = subscription.get("locale")
+        if locale and locale != default_locale():
+            spec = f"{spec} {locale}"
+        return spec
+
+    def refresh(self, now: datetime = None) -> int:
+        """处理已到达的夏令时切换：只移动偏移发生变化的时区的订阅，返回移动的订阅数"""
+        now = now or self._utc_now()
+        moved = 0
+        while self._transitions and self._transitions[0][0] <= now:
+            transition, zone_name = heapq.heappop(self._transitions)
+            if self._pending.get(zone_name) != transition:
+                continue
+            del self._pending[zone_name]
+            if zone_name not in self._zones:
+                continue
+            zone = get_zone(zone_name)
+            offset = _utc_offset_minutes(zone, now)
+            old = self._offsets[zone_name]
+            if offset != old:
+                self._offsets[zone_name] = offset
+                for local_minute, chats in self._zones[zone_name].items():
+                    old_key = (local_minute - old) % MINUTES_PER_DAY
+                    new_key = (local_minute - offset) % MINUTES_PER_DAY
+                    for chat_id in chats:
+                        self._bucket_discard(old_key, chat_id)
+                        self._bucket_add(new_key, chat_id)
+                    moved += len(chats)
+                self.rebuilds += 1
+            self._push_transition(zone_name, zone, now)
+        if moved:
+            logging.info(f"夏令时切换，已移动 {moved} 个提醒")
+        return moved
+
+    def clear(self):
+        """清空全部订阅并停止调度任务"""
+        self.subscriptions.clear()
+        self._buckets.clear()
+        self._zones.clear()
+        self._offsets.clear()
+        self._transitions.clear()
+        self._pending.clear()
+        self._last_minute = None
+        for task in self._dispatches:
+            task.cancel()
+        self._dispatches.clear()
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+    def stats(self) -> dict:
+        """订阅数、分钟桶数、时区数与发送结果"""
+        return {
+            "subscriptions": len(self.subscriptions),
+            "buckets": len(self._buckets),
+            "zones": len(self._zones),
+            "rebuilds": self.rebuilds,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+    def start(self, job_queue: JobQueue):
+        """注册每分钟触发一次的定时任务（从下一个整分钟开始）"""
+        if self._job is not None:
+            return
+        now = self._utc_now()
+        first = 60 - now.second - now.microsecond / 1_000_000
+        self._job = job_queue.run_repeating(self._tick, interval=60, first=first, name="sleep_reminder_tick")
+
+    async def _tick(self, context: ContextTypes.DEFAULT_TYPE):
+        # 定时器可能略早或略晚触发，取最近的整分钟
+        now = self._utc_now() + timedelta(seconds=30)
+        minute = now.replace(second=0, microsecond=0)
+        self.refresh(minute)
+        # 大的分钟桶按限速发送可能需要数分钟，放到后台任务中发送并立即返回：
+        # 定时任务同一时刻只运行一个实例，等待发送完成会让之后的触发被跳过
+        for due_minute in self._minutes_to_dispatch(minute):
+            task = context.application.create_task(
+                self.dispatch(context.bot, due_minute.hour, due_minute.minute, pytz.utc),
+                name=f"sleep_reminder_{due_minute:%H%M}",
+            )
+            self._dispatches[task] = f"{due_minute:%H:%M}"
+            task.add_done_callback(lambda done: self._dispatches.pop(done, None))
+
+    async def drain(self, timeout: float) -> list:
+        """
+        退出时等待后台发送中的批次，最多 timeout 秒，超时的取消
+        Application.stop 会无限期等待 create_task 创建的任务，须在它之前调用；返回未发送完的分钟（UTC）
+        """
+        if not self._dispatches:
+            return []
+        logging.info(f"等待 {len(self._dispatches)} 批睡眠提醒发送完成（最多 {timeout}s）")
+        _, pending = await asyncio.wait(set(self._dispatches), timeout=max(0.0, timeout))
+        if not pending:
+            return []
+        minutes = sorted(self._dispatches.get(task, "?") for task in pending)
+        logging.warning(f"退出时取消未发送完的睡眠提醒（UTC {', '.join(minutes)}），剩余的提醒不再发送")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return minutes
+
+    def _minutes_to_dispatch(self, minute: datetime) -> list:
+        """本次需要发送的分钟：正常为当前分钟，错过的分钟补发，重复触发时跳过"""
+        last = self._last_minute
+        if last is not None and minute <= last:
+            return []
+        self._last_minute = minute
+        if last is None:
+            return [minute]
+        missed = int((minute - last).total_seconds() // 60)
+        if missed > MAX_CATCH_UP_MINUTES:
+            logging.warning(
+                f"定时器错过 {missed} 分钟，只补发最近 {MAX_CATCH_UP_MINUTES} 分钟的提醒，"
+                f"{last:%H:%M} 之后的 {missed - MAX_CATCH_UP_MINUTES} 分钟不再发送"
+            )
+            missed = MAX_CATCH_UP_MINUTES
+        return [minute - timedelta(minutes=i) for i in range(missed - 1, -1, -1)]
+
+    async def dispatch(self, bot, hour: int, minute: int, tz=None) -> int:
+        """经限速发送器发送某一分钟（tz 时区的本地时间）的全部提醒，返回成功数"""
+        # 发送过程中可能有人取消订阅，先取出时间字符串、时区与语言
+        settings = {
+            chat_id: (
+                self.time_str(chat_id),
+                self.subscriptions[chat_id].get("tz"),
+                self.subscriptions[chat_id].get("locale"),
+            )
+            for chat_id in self.due(hour, minute, tz)
+        }
+        if not settings:
+            return 0
+        started = timer.monotonic()
+        results = await broadcaster.broadcast(
+            settings,
+            lambda chat_id: send_sleep_reminder(
+                bot, chat_id, settings[chat_id][0], started, tz=settings[chat_id][1], locale=settings[chat_id][2]
+            ),
+        )
+        delivered = sum(results.values())
+        self.sent += delivered
+        self.failed += len(results) - delivered
+        stats = broadcaster.stats()
+        logging.info(
+            f"{hour:02d}:{minute:02d} 发送睡眠提醒 {delivered}/{len(settings)}，"
+            f"耗时 {timer.monotonic() - started:.2f}s，"
+            f"送达延迟 p50={stats['lag_p50']:.2f}s p95={stats['lag_p95']:.2f}s p99={stats['lag_p99']:.2f}s"
         )
-    except Exception as e:
-        logging.error(f"发送睡眠提醒给 {chat_id} 失败: {e}")
-        # 发送失败，移除任务和数据
-        context.job.schedule_removal()
-        if chat_id in sleep_reminder_users:
-            del sleep_reminder_users[chat_id]
+        return delivered
+
+    def time_str(self, chat_id) -> str:
+        """用户设置的提醒时间字符串"""
+        subscription = self.subscriptions[chat_id]
+        reminder_time = subscription["time"]
+        return subscription.get("time_str") or f"{reminder_time.hour:02d}:{reminder_time.minute:02d}"
+
+    def _utc_now(self) -> datetime:
+        return datetime.now(pytz.utc)
+
+    def _zone_minutes(self, zone_name: str) -> dict:
+        """时区的本地分钟索引；新时区记录当前偏移并登记下一次切换"""
+        minutes = self._zones.get(zone_name)
+        if minutes is None:
+            zone = get_zone(zone_name)
+            now = self._utc_now()
+            minutes = self._zones[zone_name] = {}
+            self._offsets[zone_name] = _utc_offset_minutes(zone, now)
+            self._push_transition(zone_name, zone, now)
+        return minutes
+
+    def _push_transition(self, zone_name: str, zone, now: datetime):
+        """登记时区的下一次切换；每个时区在堆中只保留一项"""
+        transition = _next_transition(zone, now)
+        if transition is None or self._pending.get(zone_name) == transition:
+            return
+        self._pending[zone_name] = transition
+        heapq.heappush(self._transitions, (transition, zone_name))
+
+    def _utc_key(self, zone_name: str, local_minute: int) -> int:
+        return (local_minute - self._offsets[zone_name]) % MINUTES_PER_DAY
+
+    def _bucket_add(self, key: int, chat_id):
+        self._buckets.setdefault(key, set()).add(chat_id)
+
+    def _bucket_discard(self, key: int, chat_id):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.discard(chat_id)
+            if not bucket:
+                del self._buckets[key]
+
+
+# 全局提醒调度器，订阅数据即 sleep_reminder_users
+reminder_engine = ReminderEngine(sleep_reminder_users)
+
+# 提醒发送器：按 Telegram 的全局与单会话频率限制匀速发送
+broadcaster = Broadcaster(
+    rate=Config.BROADCAST_RATE,
+    per_chat_rate=Config.BROADCAST_PER_CHAT_RATE,
+    concurrency=Config.BROADCAST_CONCURRENCY,
+    max_attempts=Config.BROADCAST_MAX_ATTEMPTS,
+)
+
+
+async def send_sleep_reminder(bot, chat_id, time_str: str, scheduled_at: float = None, tz: str = None,
+                              locale: str = None) -> bool:
+    """
+    限速发送睡眠提醒给特定用户（按订阅时的语言），返回是否成功
+    只有永久错误（被拉黑、会话不存在）才取消订阅；限流与网络错误由发送器重试，仍失败时保留订阅
+    """
+    texts = catalog_for(locale)
+    text = texts.format("sleep_reminder", zone=texts.zone_label(tz), time=time_str)
+    result, error = await broadcaster.send(
+        chat_id,
+        lambda: bot.send_message(chat_id=chat_id, text=text),
+        scheduled_at,
+    )
+    if result == SENT:
+        return True
+    logging.error(f"发送睡眠提醒给 {chat_id} 失败: {error}")
+    if result == PERMANENT:
+        # 会话已不可达，取消订阅并删除持久化数据
+        reminder_engine.unsubscribe(chat_id)
+        get_storage().delete_reminder(chat_id)
+    return False
+
+
+def restore_reminders(job_queue: JobQueue, owns=None) -> int:
+    """
+    启动时从持久化存储批量恢复提醒，并启动每分钟的调度任务
+    owns(chat_id) 用于多进程分片时只恢复归属本进程的提醒
+    """
+    started = timer.perf_counter()
+    rows = get_storage().load_reminders()
+    if owns is not None:
+        rows = [(chat_id, time_str) for chat_id, time_str in rows if owns(chat_id)]
+    restored = schedule_reminders(rows)
+    reminder_engine.start(job_queue)
+
+    elapsed = timer.perf_counter() - started
+    logging.info(f"已恢复 {restored} 个睡眠提醒，耗时 {elapsed:.2f}s")
+    return restored
+
+
+def schedule_reminders(rows) -> int:
+    """批量订阅提醒: rows 为 [(chat_id, "HH:MM [时区] [语言]")]，返回成功订阅的数量"""
+    scheduled = 0
+    for chat_id, time_str in rows:
+        try:
+            reminder_engine.subscribe(chat_id, time_str)
+        except ValueError:
+            logging.warning(f"跳过无效的提醒设置 {chat_id}: {time_str}")
+            continue
+        scheduled += 1
+    return scheduled
+
+
+def export_reminders(keep) -> list:
+    """交出 keep(chat_id) 为 False 的提醒（取消本进程的订阅），返回 [(chat_id, "HH:MM [时区] [语言]")]"""
+    moved = []
+    for chat_id in [c for c in sleep_reminder_users if not keep(c)]:
+        moved.append((chat_id, reminder_engine.spec(chat_id)))
+        reminder_engine.unsubscribe(chat_id)
+    return moved
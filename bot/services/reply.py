@@ -0,0 +1,277 @@
+"""
+渐进式回复服务：边生成边编辑消息；超过单条消息上限的回复拆成多条，边生成边发送
+REPLY_FORMAT=html 时把模型输出的 Markdown 渲染为 HTML 发送，Telegram 无法解析时退回纯文本
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from bot.config import Config
+from bot.services.markdown import MarkdownRenderer, render_markdown
+from bot.services.splitter import MAX_MESSAGE_LENGTH, ReplySplitter, cut, message_length
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """获取 RetryAfter 的等待秒数（兼容 int 与 timedelta）"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def is_parse_error(error: Exception) -> bool:
+    """Telegram 无法解析消息中的格式（如标签不合法）"""
+    return isinstance(error, BadRequest) and "parse entities" in str(error).lower()
+
+
+async def _edit(sent, text: str, html: str = None) -> str:
+    """编辑消息；html 不为空时以 HTML 发送，无法解析时退回纯文本。返回实际展示的内容"""
+    if html is not None:
+        try:
+            await sent.edit_text(html, parse_mode=ParseMode.HTML)
+            return html
+        except BadRequest as e:
+            if not is_parse_error(e):
+                raise
+            logging.warning(f"HTML 格式解析失败，改为纯文本: {e}")
+    await sent.edit_text(text)
+    return text
+
+
+class ReplyStreamer:
+    """
+    先发送占位消息，再随流式分块到达编辑该消息
+    分块先写入缓冲区，只在刷新时拼接；
+    刷新受时间间隔与字节数双重限制，遇到限流时自适应放慢；
+    当前消息超过 limit 时在段落 / 代码块边界处定稿，剩余内容转到新的一条消息继续编辑
+    """
+
+    def __init__(
+        self,
+        message,
+        min_interval: float = None,
+        min_bytes: int = None,
+        max_interval: float = 10.0,
+        placeholder: str = "…",
+        limit: int = MAX_MESSAGE_LENGTH,
+        rich: bool = None,
+    ):
+        self.message = message
+        self.limit = limit
+        # 是否渲染为 HTML（默认按 REPLY_FORMAT）
+        self.rich = Config.REPLY_FORMAT == "html" if rich is None else rich
+        self.min_interval = Config.STREAM_EDIT_INTERVAL if min_interval is None else min_interval
+        self.min_bytes = Config.STREAM_EDIT_BYTES if min_bytes is None else min_bytes
+        self.max_interval = max_interval
+        self.placeholder = placeholder
+        self.interval = self.min_interval
+        self.edits = 0
+        # 已定稿的消息文本（超过上限后转到新消息之前的部分）
+        self.parts = []
+
+        self._sent = None
+        self._chunks = []
+        self._length = 0
+        # 当前消息的增量渲染器（纯文本模式或解析失败后为 None）
+        self._renderer = MarkdownRenderer() if self.rich else None
+        self._pending_bytes = 0
+        self._shown = ""
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self) -> str:
+        """当前已接收的完整文本"""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    async def start(self):
+        """发送占位消息"""
+        self._sent = await self.message.reply_text(self.placeholder)
+        return self._sent
+
+    async def feed(self, chunk: str):
+        """写入一个分块，满足时间与字节预算时刷新"""
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        if self._renderer is not None:
+            self._renderer.feed(chunk)
+        self._pending_bytes += len(chunk.encode("utf-8"))
+        self._length += message_length(chunk)
+        if self._length > self.limit:
+            await self._roll_over()
+
+        now = time.monotonic()
+        if now < self._next_edit_at:
+            return
+        # 首个分块立即展示，之后攒够字节数或等待超过两个间隔再刷新
+        first = not self._shown
+        overdue = now - self._next_edit_at >= self.interval
+        if first or overdue or self._pending_bytes >= self.min_bytes:
+            await self._flush()
+
+    async def finish(self) -> str:
+        """流结束：确保最终文本已展示，返回全部消息的文本"""
+        text = self.text
+        if self._renderer is not None:
+            self._renderer.finish()
+        while text and self._body() != self._shown:
+            wait = self._next_edit_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._flush()
+        return "\n".join(self.parts + [text]) if self.parts else text
+
+    def _body(self) -> str:
+        """当前消息应展示的内容：渲染后的 HTML 或纯文本"""
+        return self._renderer.html if self._renderer is not None else self.text
+
+    async def _roll_over(self):
+        """当前消息超过上限：定稿前一部分，剩余内容发送为新消息"""
+        rest = self.text
+        while message_length(rest) > self.limit:
+            part, rest, reopen = cut(rest, self.limit)
+            rest = reopen + rest
+            await self._finalize(part)
+            self.parts.append(part)
+            if message_length(rest) > self.limit:
+                self._sent = await _send(self.message, self.placeholder)
+        self._chunks = [rest]
+        self._length = message_length(rest)
+        self._pending_bytes = 0
+        # 新消息重新开始渲染（代码块已在 rest 开头重新打开）
+        self._renderer = MarkdownRenderer() if self.rich else None
+        if self._renderer is not None:
+            self._renderer.feed(rest)
+        body = self._body()
+        if body.strip():
+            self._sent = await _send(self.message, rest, body if self._renderer is not None else None)
+            self._shown = body
+        else:
+            self._sent = await _send(self.message, self.placeholder)
+            self._shown = ""
+
+    async def _finalize(self, text: str):
+        """把当前消息编辑为定稿文本（限流时等待后重试）"""
+        html = render_markdown(text) if self.rich else None
+        while True:
+            try:
+                await _edit(self._sent, text, html)
+                self.edits += 1
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                return
+
+    async def _flush(self):
+        """把缓冲区拼接（渲染）后编辑到占位消息"""
+        text = self.text
+        body = self._body()
+        if not text or body == self._shown:
+            return
+        try:
+            body = await _edit(self._sent, text, body if self._renderer is not None else None)
+        except RetryAfter as e:
+            # 被限流：按服务端要求推迟，并加倍编辑间隔
+            retry_after = retry_after_seconds(e)
+            self.interval = min(self.max_interval, max(self.interval * 2, retry_after))
+            self._next_edit_at = time.monotonic() + retry_after
+            logging.warning(f"编辑消息被限流，{retry_after} 秒后重试")
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        # 编辑成功：间隔逐步回落到下限
+        if self._renderer is not None and body == text and text != self._renderer.html:
+            # 本条消息的 HTML 无法解析，之后按纯文本编辑
+            self._renderer = None
+        self.edits += 1
+        self._shown = body
+        self._pending_bytes = 0
+        self.interval = max(self.min_interval, self.interval * 0.8)
+        self._next_edit_at = time.monotonic() + self.interval
+
+
+async def _send(message, text: str, html: str = None):
+    """回复一条消息（限流时等待后重试）；html 不为空时以 HTML 发送，无法解析时退回纯文本"""
+    while True:
+        try:
+            if html is not None:
+                try:
+                    return await message.reply_text(html, parse_mode=ParseMode.HTML)
+                except BadRequest as e:
+                    if not is_parse_error(e):
+                        raise
+                    logging.warning(f"HTML 格式解析失败，改为纯文本: {e}")
+                    html = None
+            return await message.reply_text(text)
+        except RetryAfter as e:
+            logging.warning(f"发送消息被限流，{retry_after_seconds(e)} 秒后重试")
+            await asyncio.sleep(retry_after_seconds(e))
+
+
+class PipelinedReply:
+    """
+    非流式模式的长回复：按上限拆分，已经完整的部分由后台任务按顺序发送，
+    模型同时继续生成后续内容；第一条消息不必等整个回复生成完
+    """
+
+    def __init__(self, message, limit: int = MAX_MESSAGE_LENGTH, rich: bool = None):
+        self.message = message
+        self.rich = Config.REPLY_FORMAT == "html" if rich is None else rich
+        self.splitter = ReplySplitter(limit)
+        self.sent = 0
+        self._queued = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def feed(self, chunk: str):
+        """写入一个分块，切出的完整部分进入发送队列"""
+        for part in self.splitter.feed(chunk):
+            self._enqueue(part)
+
+    async def finish(self):
+        """发送剩余部分并等待全部发送完成（发送失败时抛出异常）"""
+        text = self.splitter.pending
+        parts = self.splitter.finish()
+        if not parts and not self._queued:
+            # 空白回复保持原有行为：原样回复
+            parts = [text]
+        for part in parts:
+            self._enqueue(part)
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+
+    async def cancel(self):
+        """放弃尚未发送的部分"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def _enqueue(self, part: str):
+        self._queued += 1
+        self._queue.put_nowait(part)
+        if self._task is None:
+            self._task = asyncio.create_task(self._deliver())
+
+    async def _deliver(self):
+        while True:
+            part = await self._queue.get()
+            if part is None:
+                return
+            # 每一部分的代码块都是闭合的，可以单独渲染
+            html = render_markdown(part) if self.rich and part.strip() else None
+            await _send(self.message, part, html)
+            self.sent += 1
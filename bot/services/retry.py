@@ -0,0 +1,45 @@
+"""模型调用重试策略：错误分类 + 带抖动的指数退避"""
+import random
+
+from google.api_core import exceptions as google_exceptions
+
+# 可重试的瞬时错误：限流、服务不可用、超时、内部错误
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
+
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """判断错误是否可重试；参数错误、权限错误、内容被拦截等视为致命错误"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+
+class RetryPolicy:
+    """
+    重试策略
+    第 n 次重试前等待 [0, min(max_delay, base_delay * 2^n)] 内的随机时间（full jitter）
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        """attempt 为已失败的次数"""
+        return attempt < self.max_attempts and is_retryable(error)
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次失败后的退避时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
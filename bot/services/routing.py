@@ -0,0 +1,194 @@
+"""
+模型路由：按轮次在便宜的模型与强模型之间选择，主模型饱和或出错时改用备用模型
+- 只用廉价特征判断：用户等级覆盖、是否包含代码、提问长度、历史轮数；不额外调用模型
+- 每个模型统计在途请求与连续失败：在途请求达到上限视为饱和，连续失败达到阈值后在冷却时间内不再选择
+- 按路由导出选择次数、延迟与 token 指标，用真实流量调整路由策略
+"""
+import logging
+import re
+import time
+
+from bot.services.metrics import Counter, Histogram
+from bot.services.prompts import ModelProfile
+
+TIERS = ("fast", "strong")
+
+ROUTE_DECISIONS = Counter("bot_model_route_decisions_total", "模型路由的选择次数（reason 为选择原因）", ["route", "reason"])
+ROUTE_FIRST_CHUNK_SECONDS = Histogram("bot_model_route_first_chunk_seconds", "按路由的首个分块等待时间（秒）", ["route", "model"])
+ROUTE_SECONDS = Histogram("bot_model_route_seconds", "按路由的模型回复总耗时（秒）", ["route", "model"])
+ROUTE_TOKENS = Counter("bot_model_route_tokens_total", "按路由估算的 token 数（input 含历史，output 为回复）",
+                       ["route", "model", "direction"])
+ROUTE_ERRORS = Counter("bot_model_route_errors_total", "按路由的模型调用失败次数（含改用备用模型之前的失败）", ["route", "model"])
+
+# 代码特征：围栏、行内代码、函数 / 类定义、导入语句、SQL，以及以 { } ; 结尾的行
+_CODE = re.compile(
+    r"```|`[^`\n]+`"
+    r"|^[ \t]*(?:def|function|func|fn)[ \t]+\w+[ \t]*\("
+    r"|^[ \t]*class[ \t]+\w+[ \t]*[:({]"
+    r"|^[ \t]*(?:import[ \t]+[\w.]+[ \t]*$|from[ \t]+[\w.]+[ \t]+import\b|#include[ \t]*[<\"])"
+    r"|\bSELECT\b.+\bFROM\b"
+    r"|[{};][ \t]*$",
+    re.MULTILINE,
+)
+
+
+def parse_tiers(text: str) -> dict:
+    """用户等级覆盖："123:strong,456:fast" -> {123: "strong", 456: "fast"}"""
+    tiers = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        user_id, _, tier = item.partition(":")
+        tier = tier.strip()
+        if tier not in TIERS:
+            raise ValueError(f"未知的用户等级: {item}")
+        tiers[int(user_id)] = tier
+    return tiers
+
+
+def prompt_text(content) -> str:
+    """提问中的文字（多模态输入只取文字部分）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part for part in content if isinstance(part, str))
+    return ""
+
+
+class Route:
+    """一轮对话的路由：路由名、选择原因、模型配置与备用模型配置（改用备用模型时原地更新）"""
+
+    __slots__ = ("name", "reason", "profile", "fallback")
+
+    def __init__(self, name: str, reason: str, profile: ModelProfile, fallback: ModelProfile = None):
+        self.name = name
+        self.reason = reason
+        self.profile = profile
+        self.fallback = fallback
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.reason!r}, {self.model!r})"
+
+    @property
+    def model(self) -> str:
+        return self.profile.model
+
+    def fall_back(self) -> bool:
+        """改用备用模型；没有备用模型或已经在用时返回 False"""
+        if self.fallback is None:
+            return False
+        self.name, self.profile, self.fallback = "fallback", self.fallback, None
+        return True
+
+
+class ModelRouter:
+    """
+    按轮次选择模型
+    strong_model 为空时不按特征选择（全部使用会话的模型）；fallback_model 为空时只有强模型可以退回会话的模型
+    """
+
+    def __init__(
+        self,
+        strong_model: str = "",
+        fallback_model: str = "",
+        long_prompt: int = 800,
+        deep_history: int = 10,
+        user_tiers: dict = None,
+        max_in_flight: int = 0,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+    ):
+        self.strong_model = strong_model
+        self.fallback_model = fallback_model
+        self.long_prompt = long_prompt
+        self.deep_history = deep_history
+        self.user_tiers = user_tiers or {}
+        self.max_in_flight = max_in_flight
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        # 换了模型名的配置: (原配置的 key, 模型名) -> ModelProfile
+        self._profiles = {}
+        self._in_flight = {}
+        self._failures = {}
+        self._open_until = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.strong_model or self.fallback_model)
+
+    def classify(self, content, history_len: int, user_id=None) -> tuple:
+        """(路由, 原因)：用户等级覆盖 > 代码 > 提问长度 > 历史轮数，都不满足时使用便宜的模型"""
+        tier = self.user_tiers.get(user_id)
+        if tier is not None:
+            return tier, "tier"
+        if not self.strong_model:
+            return "fast", "default"
+        text = prompt_text(content)
+        if _CODE.search(text):
+            return "strong", "code"
+        if len(text) >= self.long_prompt:
+            return "strong", "length"
+        # 历史为 user / model 交替的 Content，两条为一轮
+        if history_len >= 2 * self.deep_history:
+            return "strong", "history"
+        return "fast", "default"
+
+    def route(self, chat, content, user_id, base: ModelProfile) -> Route:
+        """为一轮对话选择模型；base 为会话本身的模型配置（便宜的模型）"""
+        history = getattr(chat, "history", None)
+        name, reason = self.classify(content, len(history) if isinstance(history, list) else 0, user_id)
+        profile = self.derive(base, self.strong_model) if name == "strong" and self.strong_model else base
+        # 没有配置备用模型时，强模型不可用退回会话本身的模型
+        fallback_model = self.fallback_model or base.model
+        fallback = self.derive(base, fallback_model) if fallback_model != profile.model else None
+        route = Route(name, reason, profile, fallback)
+        if not self.available(profile.model) and route.fall_back():
+            route.reason = "unavailable"
+        ROUTE_DECISIONS.labels(route.name, route.reason).inc()
+        return route
+
+    def derive(self, base: ModelProfile, model: str) -> ModelProfile:
+        """base 换用另一个模型（系统提示词与生成参数不变），按内容缓存"""
+        if model == base.model:
+            return base
+        key = (base.key, model)
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = self._profiles[key] = ModelProfile(
+                f"{base.name}/{model}", model, base.system_instruction, base.generation_config
+            )
+        return profile
+
+    # ---- 模型健康状态 ----
+
+    def available(self, model: str) -> bool:
+        """模型未在冷却中，且在途请求未达上限"""
+        if self._open_until.get(model, 0.0) > time.monotonic():
+            return False
+        return not self.max_in_flight or self._in_flight.get(model, 0) < self.max_in_flight
+
+    def acquire(self, model: str):
+        self._in_flight[model] = self._in_flight.get(model, 0) + 1
+
+    def release(self, model: str):
+        self._in_flight[model] -= 1
+
+    def record(self, model: str, error: Exception = None):
+        """记录一次调用结果（只应传入限流、服务不可用等瞬时错误）；连续失败达到阈值后暂停使用该模型"""
+        if error is None:
+            self._failures.pop(model, None)
+            return
+        failures = self._failures.get(model, 0) + 1
+        if failures < self.failure_threshold:
+            self._failures[model] = failures
+            return
+        self._failures.pop(model, None)
+        self._open_until[model] = time.monotonic() + self.cooldown
+        logging.warning(f"模型 {model} 连续失败 {failures} 次，{self.cooldown:.0f}s 内改用备用模型: {error}")
+
+    def stats(self) -> dict:
+        """各模型的在途请求数与冷却剩余秒数"""
+        now = time.monotonic()
+        return {
+            "in_flight": {model: count for model, count in self._in_flight.items() if count},
+            "cooling": {model: until - now for model, until in self._open_until.items() if until > now},
+        }
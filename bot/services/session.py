@@ -0,0 +1,279 @@
+"""聊天会话存储：有界 LRU + 空闲 TTL 淘汰"""
+import json
+import time
+import zlib
+from collections import OrderedDict
+
+
+def history_bytes(history) -> int:
+    """估算聊天历史的字节数（文本与图片、语音等内联数据）"""
+    total = 0
+    for content in history:
+        for part in getattr(content, "parts", ()):
+            try:
+                total += len(part.text.encode("utf-8"))
+                continue
+            except (AttributeError, ValueError, TypeError):
+                pass
+            data = getattr(getattr(part, "inline_data", None), "data", None)
+            if isinstance(data, bytes):
+                total += len(data)
+    return total
+
+
+def dump_history(history) -> bytes:
+    """把聊天历史序列化为压缩的 JSON"""
+    data = [content.to_dict() for content in history]
+    return zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def load_history(blob: bytes) -> list:
+    """从压缩的 JSON 恢复聊天历史"""
+    from vertexai.generative_models import Content
+
+    data = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return [Content.from_dict(item) for item in data]
+
+
+class MemorySpill:
+    """
+    进程内冷存储：保存被淘汰会话的压缩历史
+    总字节数有上限，超出时丢弃最久未用的记录
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._blobs = OrderedDict()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def save(self, user_id, history):
+        """保存会话历史"""
+        self.discard(user_id)
+        blob = dump_history(history)
+        self._blobs[user_id] = blob
+        self.total_bytes += len(blob)
+        while self.total_bytes > self.max_bytes and self._blobs:
+            _, dropped = self._blobs.popitem(last=False)
+            self.total_bytes -= len(dropped)
+
+    def load(self, user_id):
+        """取出会话历史，不存在时返回 None"""
+        blob = self._blobs.pop(user_id, None)
+        if blob is None:
+            return None
+        self.total_bytes -= len(blob)
+        return load_history(blob)
+
+    def keys(self):
+        """冷存储中的全部 user_id"""
+        return list(self._blobs)
+
+    def discard(self, user_id):
+        """删除会话历史"""
+        blob = self._blobs.pop(user_id, None)
+        if blob is not None:
+            self.total_bytes -= len(blob)
+
+    def clear(self):
+        """清空冷存储"""
+        self._blobs.clear()
+        self.total_bytes = 0
+
+
+class _Entry:
+    """热存储中的一条会话记录"""
+
+    __slots__ = ("session", "last_used", "history_head", "history_len", "history_bytes")
+
+    def __init__(self, session, now):
+        self.session = session
+        self.last_used = now
+        self.history_head = None
+        self.history_len = 0
+        self.history_bytes = 0
+
+
+class SessionStore:
+    """
+    有界会话存储
+    - 按最近使用顺序（LRU）淘汰，空闲超过 ttl 秒的会话直接过期
+    - 会话数与历史总字节数均有上限
+    - 淘汰的会话历史写入冷存储，用户再次访问时透明恢复
+    新会话由 factory(历史, user_id) 创建
+    """
+
+    def __init__(self, factory, max_sessions: int, ttl: float, max_history_bytes: int, spill=None):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history_bytes = max_history_bytes
+        self.spill = spill if spill is not None else MemorySpill(max_history_bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rehydrations = 0
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __getitem__(self, user_id):
+        return self._entries[user_id].session
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def history_bytes(self) -> int:
+        """热存储中历史的总字节数"""
+        return self._total_bytes
+
+    def get(self, user_id):
+        """获取用户会话，不存在时从冷存储恢复或新建"""
+        now = time.monotonic()
+        self._expire(now)
+
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            entry.last_used = now
+            self._entries.move_to_end(user_id)
+            self._measure(entry)
+            self._enforce_budget(keep=user_id)
+            return entry.session
+
+        self.misses += 1
+        history = self.spill.load(user_id)
+        if history:
+            self.rehydrations += 1
+        return self._insert(user_id, self.factory(history or [], user_id), now)
+
+    def touch(self, user_id):
+        """一轮对话结束后刷新会话的历史字节数并检查预算；持久化冷存储会同时写入"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        self._measure(entry)
+        if getattr(self.spill, "write_through", False) and entry.history_len:
+            self.spill.save(user_id, entry.session.history)
+        self._enforce_budget(keep=user_id)
+
+    def reset(self, user_id):
+        """丢弃用户的会话与冷存储历史，创建新会话"""
+        self.discard(user_id)
+        return self._insert(user_id, self.factory([], user_id), time.monotonic())
+
+    def put(self, user_id, session):
+        """替换用户会话"""
+        self._drop(user_id)
+        return self._insert(user_id, session, time.monotonic())
+
+    def discard(self, user_id):
+        """删除用户会话（热存储与冷存储）"""
+        self._drop(user_id)
+        self.spill.discard(user_id)
+
+    def evict(self, user_id):
+        """把用户会话移入冷存储"""
+        if self._spill(user_id):
+            self.evictions += 1
+
+    def handoff(self, keep) -> dict:
+        """
+        交出不再归本进程所有的会话（分片重新平衡时使用）: {user_id: 历史}
+        keep(user_id) 为 False 的会话从热存储和进程内冷存储中移除；持久化冷存储为各进程共享，不需要交出
+        """
+        moved = {}
+        for user_id in [u for u in self._entries if not keep(u)]:
+            entry = self._drop(user_id)
+            moved[user_id] = list(getattr(entry.session, "history", None) or [])
+        if not getattr(self.spill, "write_through", False):
+            for user_id in [u for u in self.spill.keys() if not keep(u) and u not in moved]:
+                moved[user_id] = self.spill.load(user_id)
+        return moved
+
+    def clear(self):
+        """清空所有会话与统计"""
+        self._entries.clear()
+        self._total_bytes = 0
+        self.spill.clear()
+        self.hits = self.misses = self.evictions = self.expirations = self.rehydrations = 0
+
+    def stats(self) -> dict:
+        """命中 / 未命中 / 淘汰等统计"""
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "history_bytes": self._total_bytes,
+            "spilled": len(self.spill),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rehydrations": self.rehydrations,
+        }
+
+    def _insert(self, user_id, session, now):
+        entry = _Entry(session, now)
+        self._entries[user_id] = entry
+        self._measure(entry)
+        self._enforce_budget(keep=user_id)
+        return session
+
+    def _spill(self, user_id) -> bool:
+        entry = self._drop(user_id)
+        if entry is None:
+            return False
+        history = list(getattr(entry.session, "history", None) or [])
+        if history:
+            self.spill.save(user_id, history)
+        return True
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.history_bytes
+        return entry
+
+    def _measure(self, entry):
+        """增量统计历史字节数（历史通常只追加，只需计算新增部分；被改写时全量重算）"""
+        history = getattr(entry.session, "history", None) or []
+        if not isinstance(history, list):
+            return
+        head = history[0] if history else None
+        if len(history) < entry.history_len or head is not entry.history_head:
+            entry.history_head = head
+            entry.history_len = 0
+            self._total_bytes -= entry.history_bytes
+            entry.history_bytes = 0
+        added = history_bytes(history[entry.history_len:])
+        entry.history_len = len(history)
+        entry.history_bytes += added
+        self._total_bytes += added
+
+    def _expire(self, now):
+        """淘汰空闲超时的会话（LRU 顺序即空闲顺序，只需检查队首）"""
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_used <= self.ttl:
+                break
+            self._spill(user_id)
+            self.expirations += 1
+
+    def _enforce_budget(self, keep):
+        """超出会话数或字节数上限时，从最久未用的会话开始淘汰"""
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_sessions or self._total_bytes > self.max_history_bytes
+        ):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self.evict(oldest)
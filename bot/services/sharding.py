@@ -0,0 +1,86 @@
+"""分片路由：一致性哈希把用户 / 会话映射到工作进程"""
+import bisect
+import hashlib
+
+from bot.services.groups import conversation_key, is_group
+
+# 按 chat_id 路由的命令：提醒按 chat_id 保存，群组内任何成员都能查看和关闭
+CHAT_SCOPED_COMMANDS = {"sleepon", "sleepoff", "sleepstatus"}
+
+
+def _hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    一致性哈希环
+    每个节点在环上放置 replicas 个虚拟节点；增删节点时只有约 1/N 的键改变归属
+    """
+
+    def __init__(self, nodes=(), replicas: int = 100):
+        self.replicas = replicas
+        self._positions = []
+        self._owners = []
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    @property
+    def nodes(self) -> list:
+        return sorted(self._nodes)
+
+    def add(self, node):
+        """加入节点"""
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.replicas):
+            position = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._positions, position)
+            self._positions.insert(index, position)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        """移除节点"""
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        kept = [(p, o) for p, o in zip(self._positions, self._owners) if o != node]
+        self._positions = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def node_for(self, key):
+        """键所属的节点；环为空时返回 None"""
+        if not self._positions:
+            return None
+        index = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._owners[index]
+
+
+def shard_key(update):
+    """
+    更新的路由键
+    聊天会话按 user_id 保存，普通消息按用户路由；提醒按 chat_id 保存，提醒命令按会话路由。
+    私聊中两者相同，同一用户的全部状态落在同一个工作进程；
+    群组的聊天会话按 (会话, 话题) 共享，群组中的其他消息按该会话键路由
+    """
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) or ""
+    chat = getattr(update, "effective_chat", None)
+    if text.startswith("/") and chat is not None:
+        command = text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+        if command in CHAT_SCOPED_COMMANDS:
+            return chat.id
+    if is_group(chat) and message is not None:
+        return conversation_key(update)
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    return chat.id if chat is not None else 0
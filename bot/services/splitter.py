@@ -0,0 +1,158 @@
+"""
+长回复拆分：Telegram 单条消息最多 4096 个字符（按 UTF-16 计），超过时发送失败
+优先在代码块外的段落边界拆分；不得不在代码块内拆分时，本部分末尾补上围栏，下一部分重新打开同一语言的代码块
+"""
+import re
+
+# Telegram 单条消息的长度上限（UTF-16 码元）
+MAX_MESSAGE_LENGTH = 4096
+
+FENCE = "```"
+# 代码块内拆分时补在本部分末尾的围栏
+_CLOSE_FENCE = "\n" + FENCE
+
+# 句末标点（其后拆分不会截断句子）
+_SENTENCE_END = re.compile(r"[。！？；.!?;](?=\s|$)|[。！？；]")
+
+
+def message_length(text: str) -> int:
+    """Telegram 计算的消息长度（UTF-16 码元数，emoji 等占 2）"""
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+
+def _fence_lines(text: str) -> list:
+    """所有围栏行：[(行首位置, 是否为开始围栏, 语言)]"""
+    fences = []
+    inside = False
+    position = 0
+    for line in text.splitlines(keepends=True):
+        if line.lstrip(" ").startswith(FENCE) and len(line) - len(line.lstrip(" ")) <= 3:
+            language = "" if inside else line.strip()[len(FENCE):].strip()
+            fences.append((position, not inside, language))
+            inside = not inside
+        position += len(line)
+    return fences
+
+
+def _state_at(fences: list, position: int) -> tuple:
+    """position 处是否在代码块内，以及该代码块的语言"""
+    inside, language = False, ""
+    for start, opening, lang in fences:
+        if start >= position:
+            break
+        inside, language = opening, lang
+    return inside, language
+
+
+def _window_end(text: str, budget: int) -> int:
+    """最长的前缀长度，使其 UTF-16 长度不超过 budget"""
+    end = min(len(text), budget)
+    while end > 0 and message_length(text[:end]) > budget:
+        end -= (message_length(text[:end]) - budget + 1) // 2 or 1
+    return end
+
+
+def _cut_position(text: str, end: int, fences: list) -> int:
+    """在 text[:end] 内选择拆分位置：段落 > 换行 > 代码块内换行 > 句末 > 空格 > 硬切"""
+    floor = end // 2
+
+    def outside(position):
+        return not _state_at(fences, position)[0]
+
+    # 段落边界（空行之后），以及代码块结束围栏所在行之后
+    after_closing = _after_closing(text, fences)
+    position = end
+    while True:
+        position = text.rfind("\n", floor, position)
+        if position < 0:
+            break
+        if outside(position + 1) and (text[position - 1:position] == "\n" or position + 1 in after_closing):
+            return position + 1
+    for inside_ok in (False, True):
+        position = end
+        while True:
+            position = text.rfind("\n", floor, position)
+            if position < 0:
+                break
+            if inside_ok or outside(position + 1):
+                return position + 1
+    best = 0
+    for match in _SENTENCE_END.finditer(text, floor, end):
+        if outside(match.end()):
+            best = match.end()
+    if best:
+        return best
+    position = text.rfind(" ", floor, end)
+    if position > 0:
+        return position + 1
+    return end
+
+
+def _after_closing(text: str, fences: list) -> set:
+    """代码块结束围栏所在行的下一行行首位置"""
+    positions = set()
+    for start, opening, _ in fences:
+        if not opening:
+            newline = text.find("\n", start)
+            if newline >= 0:
+                positions.add(newline + 1)
+    return positions
+
+
+def cut(text: str, limit: int = MAX_MESSAGE_LENGTH) -> tuple:
+    """
+    从 text 开头切出一条不超过 limit 的消息
+    返回 (本部分, 剩余文本, 下一部分开头需要补上的围栏)
+    """
+    fences = _fence_lines(text)
+    end = _window_end(text, limit - len(_CLOSE_FENCE))
+    position = _cut_position(text, end, fences)
+    inside, language = _state_at(fences, position)
+    part, rest = text[:position].rstrip(), text[position:]
+    if inside:
+        part += _CLOSE_FENCE
+        if rest.lstrip(" ").startswith(FENCE):
+            # 拆分点恰好在结束围栏之前：本部分已补上围栏，去掉原来的结束围栏
+            newline = rest.find("\n")
+            rest, reopen = (rest[newline + 1:] if newline >= 0 else ""), ""
+        else:
+            reopen = f"{FENCE}{language}\n"
+    else:
+        rest, reopen = rest.lstrip("\n"), ""
+    return part, rest, reopen
+
+
+def split_reply(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list:
+    """把完整回复拆分为不超过 limit 的若干条消息"""
+    splitter = ReplySplitter(limit)
+    return splitter.feed(text) + splitter.finish()
+
+
+class ReplySplitter:
+    """
+    增量拆分：feed(chunk) 返回已经确定、可以立即发送的部分，finish() 返回剩余部分
+    只有缓冲超过上限时才切出一部分，保证每一部分都尽量接近上限
+    """
+
+    def __init__(self, limit: int = MAX_MESSAGE_LENGTH):
+        self.limit = limit
+        self._buffer = ""
+        self._reopen = ""
+
+    @property
+    def pending(self) -> str:
+        """尚未切出的文本（含需要补上的围栏）"""
+        return self._reopen + self._buffer
+
+    def feed(self, chunk: str) -> list:
+        self._buffer += chunk
+        parts = []
+        while message_length(self.pending) > self.limit:
+            part, self._buffer, self._reopen = cut(self.pending, self.limit)
+            parts.append(part)
+        return parts
+
+    def finish(self) -> list:
+        text = self.pending
+        self._buffer = self._reopen = ""
+        return [text] if text.strip() else []
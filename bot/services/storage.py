@@ -0,0 +1,266 @@
+"""持久化存储：聊天会话与睡眠提醒"""
+import logging
+import sqlite3
+import threading
+
+from bot.config import Config
+from bot.services.session import MemorySpill, dump_history, load_history
+
+
+class Storage:
+    """存储后端接口"""
+
+    def session_spill(self, max_bytes: int):
+        """返回 SessionStore 使用的冷存储"""
+        raise NotImplementedError
+
+    def save_reminder(self, chat_id, time_str: str):
+        """保存提醒设置"""
+        raise NotImplementedError
+
+    def delete_reminder(self, chat_id):
+        """删除提醒设置"""
+        raise NotImplementedError
+
+    def load_reminders(self) -> list:
+        """读取全部提醒设置: [(chat_id, time_str)]"""
+        raise NotImplementedError
+
+    def flush(self):
+        """把待写入的数据落盘"""
+
+    def close(self):
+        """落盘并释放资源"""
+        self.flush()
+
+
+class MemoryStorage(Storage):
+    """进程内存储：重启即丢失，适用于测试和无状态部署"""
+
+    def __init__(self):
+        self.reminders = {}
+
+    def session_spill(self, max_bytes: int):
+        return MemorySpill(max_bytes)
+
+    def save_reminder(self, chat_id, time_str: str):
+        self.reminders[chat_id] = time_str
+
+    def delete_reminder(self, chat_id):
+        self.reminders.pop(chat_id, None)
+
+    def load_reminders(self) -> list:
+        return list(self.reminders.items())
+
+
+class StorageSpill:
+    """
+    基于持久化存储的会话冷存储
+    write_through=True：每轮对话结束都会写入（后台批量落盘）
+    """
+
+    write_through = True
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __len__(self):
+        return self.storage.count_sessions()
+
+    def save(self, user_id, history):
+        self.storage.save_session(user_id, list(history))
+
+    def load(self, user_id):
+        return self.storage.load_session(user_id)
+
+    def discard(self, user_id):
+        self.storage.delete_session(user_id)
+
+    def clear(self):
+        # 持久化数据不随进程内状态一起清空
+        pass
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite 存储（WAL 模式）
+    写操作先进入待写队列，同一键的多次写入会合并，
+    由后台线程按 flush_interval 或 batch_size 批量提交，处理器无需等待 fsync
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._writer_conn = self._connect()
+        self._reader_conn = self._connect()
+        self._writer_conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                history BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reminders (
+                chat_id INTEGER PRIMARY KEY,
+                time_str TEXT NOT NULL
+            );
+            """
+        )
+
+        # 待写入: {(表名, 主键): 值}，值为 None 表示删除
+        self._pending = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run_writer, name="storage-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def session_spill(self, max_bytes: int):
+        return StorageSpill(self)
+
+    # ---- 会话 ----
+
+    def save_session(self, user_id, history):
+        self._enqueue("sessions", user_id, history)
+
+    def delete_session(self, user_id):
+        self._enqueue("sessions", user_id, None)
+
+    def load_session(self, user_id):
+        found, history = self._lookup("sessions", user_id)
+        if found:
+            return history
+        with self._reader_lock:
+            row = self._reader_conn.execute(
+                "SELECT history FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return load_history(row[0]) if row else None
+
+    def count_sessions(self) -> int:
+        with self._reader_lock:
+            return self._reader_conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    # ---- 提醒 ----
+
+    def save_reminder(self, chat_id, time_str: str):
+        self._enqueue("reminders", chat_id, time_str)
+
+    def delete_reminder(self, chat_id):
+        self._enqueue("reminders", chat_id, None)
+
+    def load_reminders(self) -> list:
+        self.flush()
+        with self._reader_lock:
+            return self._reader_conn.execute("SELECT chat_id, time_str FROM reminders").fetchall()
+
+    # ---- 批量写入 ----
+
+    def _enqueue(self, table, key, value):
+        with self._lock:
+            self._pending[(table, key)] = value
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _lookup(self, table, key):
+        """先查未落盘的写入，保证读到自己的写"""
+        with self._lock:
+            for pending in (self._pending, self._inflight):
+                if (table, key) in pending:
+                    return True, pending[(table, key)]
+        return False, None
+
+    def _run_writer(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"存储批量写入失败: {e}")
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._inflight, self._pending = self._pending, {}
+            batch = self._inflight
+
+            session_rows, reminder_rows = [], []
+            session_deletes, reminder_deletes = [], []
+            for (table, key), value in batch.items():
+                if table == "sessions":
+                    if value is None:
+                        session_deletes.append((key,))
+                    else:
+                        session_rows.append((key, dump_history(value)))
+                elif value is None:
+                    reminder_deletes.append((key,))
+                else:
+                    reminder_rows.append((key, value))
+
+            conn = self._writer_conn
+            try:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?)", session_rows)
+                conn.executemany("DELETE FROM sessions WHERE user_id = ?", session_deletes)
+                conn.executemany("INSERT OR REPLACE INTO reminders VALUES (?, ?)", reminder_rows)
+                conn.executemany("DELETE FROM reminders WHERE chat_id = ?", reminder_deletes)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                # 写入失败：放回队列，较新的写入优先
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._writer_conn.close()
+        self._reader_conn.close()
+
+
+# 全局存储实例（按需创建）
+_storage = None
+
+
+def create_storage() -> Storage:
+    """根据配置创建存储后端"""
+    if Config.STORAGE_BACKEND == "memory":
+        return MemoryStorage()
+    if Config.STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(Config.STORAGE_PATH, flush_interval=Config.STORAGE_FLUSH_INTERVAL)
+    raise ValueError(f"未知的存储后端: {Config.STORAGE_BACKEND}")
+
+
+def get_storage() -> Storage:
+    """获取全局存储实例"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def close_storage():
+    """把待写入的数据落盘并关闭全局存储实例；从未使用过存储时什么也不做"""
+    global _storage
+    if _storage is not None:
+        _storage.close()
+        _storage = None
@@ -0,0 +1,177 @@
+"""
+命令回复文本
+- 按语言在启动时生成：不含变量的文本（欢迎、帮助等）直接是最终字符串，含变量的文本预先编译为模板
+- 语言按用户的 Telegram 语言选择，不受支持时使用 BOT_LOCALE
+"""
+from string import Template
+
+from bot.config import Config
+
+# 支持的语言及其名称（系统提示词的 {{language}} 占位符）
+LANGUAGES = {"zh": "中文", "en": "English"}
+
+_CATALOG = {
+    "zh": {
+        "start": (
+            "你好！我是你的 AI 助手。我们开始聊天吧！\n\n"
+            "可用命令：\n"
+            "/start - 清空记忆重新开始\n"
+            "/help - 查看所有命令\n"
+            "/sleepon [HH:MM] [时区] - 开启睡眠提醒（可自定义时间和时区）\n"
+            "/sleepoff - 关闭睡眠提醒\n"
+            "/sleepstatus - 查看睡眠提醒状态"
+        ),
+        "help": (
+            "🤖 AI 助手命令列表：\n\n"
+            "📝 聊天命令：\n"
+            "/start - 清空对话记忆，重新开始\n"
+            "/help - 显示此帮助信息\n\n"
+            "💤 睡眠提醒命令：\n"
+            "/sleepon [HH:MM] [时区] - 开启提醒，可指定时间和时区（默认 ${default_time}，如 23:30 Europe/Berlin）\n"
+            "/sleepoff - 关闭睡眠提醒\n"
+            "/sleepstatus - 查看当前提醒设置\n\n"
+            "💡 直接发送文字即可与 AI 聊天！"
+        ),
+        "sleep_invalid": "⚠️ ${error}\n\n正确格式示例: 23:30, 22:10, 9:00, 23:30 Europe/Berlin",
+        "sleep_on": (
+            "✅ 睡眠提醒已开启！\n"
+            "提醒时间：每天 ${time}（${zone}）\n\n"
+            "💡 提示：\n"
+            "- /sleepoff 关闭提醒\n"
+            "- /sleepon HH:MM [时区] 修改时间\n"
+            "- /sleepstatus 查看设置"
+        ),
+        "sleep_not_on": "⚠️ 你还没有开启睡眠提醒。",
+        "sleep_off": "❌ 睡眠提醒已关闭。",
+        "sleep_status_off": (
+            "💤 睡眠提醒状态：未开启\n\n"
+            "使用 /sleepon 开启提醒\n"
+            "默认时间：${default_time}"
+        ),
+        "sleep_status_on": (
+            "💤 睡眠提醒状态：已开启\n\n"
+            "📅 提醒时间：每天 ${time}（${zone}）\n"
+            "⏰ 下次提醒：${next_run}\n\n"
+            "管理命令：\n"
+            "/sleepon HH:MM [时区] - 修改时间\n"
+            "/sleepoff - 关闭提醒"
+        ),
+        "zone_shanghai": "北京时间",
+        "zone": "${zone} 时间",
+        "sleep_reminder": "🌙 晚安！现在是${zone} ${time}，该睡觉啦！\n\n早睡早起身体好，明天又是元气满满的一天！💤",
+        "error_time_format": "时间格式错误: 时间格式应为 HH:MM",
+        "error_time_range": "时间格式错误: 时间超出有效范围",
+        "error_spec_format": "时间格式错误: 格式应为 HH:MM [时区]",
+        "error_unknown_zone": "未知的时区: ${zone}",
+    },
+    "en": {
+        "start": (
+            "Hi! I'm your AI assistant. Let's chat!\n\n"
+            "Commands:\n"
+            "/start - clear memory and start over\n"
+            "/help - list all commands\n"
+            "/sleepon [HH:MM] [timezone] - turn on the bedtime reminder (custom time and timezone)\n"
+            "/sleepoff - turn off the bedtime reminder\n"
+            "/sleepstatus - show the bedtime reminder status"
+        ),
+        "help": (
+            "🤖 AI assistant commands:\n\n"
+            "📝 Chat:\n"
+            "/start - clear the conversation and start over\n"
+            "/help - show this help\n\n"
+            "💤 Bedtime reminder:\n"
+            "/sleepon [HH:MM] [timezone] - turn on the reminder, optionally with time and timezone "
+            "(default ${default_time}, e.g. 23:30 Europe/Berlin)\n"
+            "/sleepoff - turn off the reminder\n"
+            "/sleepstatus - show the current settings\n\n"
+            "💡 Just send a message to chat with the AI!"
+        ),
+        "sleep_invalid": "⚠️ ${error}\n\nExamples: 23:30, 22:10, 9:00, 23:30 Europe/Berlin",
+        "sleep_on": (
+            "✅ Bedtime reminder is on!\n"
+            "Reminder time: every day at ${time} (${zone})\n\n"
+            "💡 Tips:\n"
+            "- /sleepoff turn it off\n"
+            "- /sleepon HH:MM [timezone] change the time\n"
+            "- /sleepstatus show the settings"
+        ),
+        "sleep_not_on": "⚠️ The bedtime reminder is not on.",
+        "sleep_off": "❌ Bedtime reminder turned off.",
+        "sleep_status_off": (
+            "💤 Bedtime reminder: off\n\n"
+            "Use /sleepon to turn it on\n"
+            "Default time: ${default_time}"
+        ),
+        "sleep_status_on": (
+            "💤 Bedtime reminder: on\n\n"
+            "📅 Reminder time: every day at ${time} (${zone})\n"
+            "⏰ Next reminder: ${next_run}\n\n"
+            "Commands:\n"
+            "/sleepon HH:MM [timezone] - change the time\n"
+            "/sleepoff - turn it off"
+        ),
+        "zone_shanghai": "Beijing time",
+        "zone": "${zone} time",
+        "sleep_reminder": "🌙 Good night! It's ${time} ${zone} — time for bed!\n\nSleep well and wake up full of energy tomorrow! 💤",
+        "error_time_format": "Invalid time: use HH:MM",
+        "error_time_range": "Invalid time: out of range",
+        "error_spec_format": "Invalid time: use HH:MM [timezone]",
+        "error_unknown_zone": "Unknown timezone: ${zone}",
+    },
+}
+
+
+class Catalog:
+    """一种语言的全部文本：部署级变量在构造时替换，仍含变量的文本保存为编译好的模板"""
+
+    def __init__(self, locale: str, entries: dict, variables: dict):
+        self.locale = locale
+        self._texts = {}
+        for key, raw in entries.items():
+            text = Template(raw).safe_substitute(variables)
+            template = Template(text)
+            self._texts[key] = template if template.get_identifiers() else text
+
+    def __getitem__(self, key: str) -> str:
+        """不含变量的文本（预先生成的字符串）"""
+        return self._texts[key]
+
+    def format(self, key: str, **values) -> str:
+        """替换含变量文本中的变量（不含变量的文本原样返回）"""
+        text = self._texts[key]
+        return text if isinstance(text, str) else text.substitute(values)
+
+    def zone_label(self, zone_name: str = None) -> str:
+        """回复中展示的时区名称"""
+        zone_name = zone_name or Config.TIMEZONE
+        return self["zone_shanghai"] if zone_name == "Asia/Shanghai" else self.format("zone", zone=zone_name)
+
+
+def default_locale() -> str:
+    return Config.BOT_LOCALE if Config.BOT_LOCALE in LANGUAGES else "zh"
+
+
+def build_catalogs() -> dict:
+    """生成全部语言的文本: {语言: Catalog}"""
+    variables = {"default_time": Config.DEFAULT_REMINDER_TIME}
+    return {locale: Catalog(locale, entries, variables) for locale, entries in _CATALOG.items()}
+
+
+# 启动时生成的文本
+catalogs = build_catalogs()
+
+
+def catalog_for(locale: str = None) -> Catalog:
+    """按语言代码选择文本，不支持或未指定时使用默认语言"""
+    return catalogs.get(locale) or catalogs[default_locale()]
+
+
+def texts_for(update) -> Catalog:
+    """按用户的 Telegram 语言（如 en-US、zh-hans）选择文本"""
+    user = update.effective_user
+    code = getattr(user, "language_code", None) if user is not None else None
+    if isinstance(code, str):
+        catalog = catalogs.get(code[:2].lower())
+        if catalog is not None:
+            return catalog
+    return catalogs[default_locale()]
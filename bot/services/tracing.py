@@ -0,0 +1,317 @@
+"""
+链路追踪：每个更新一条 trace，子 span 覆盖 Bot API 调用与模型流式回复
+trace 在根 span 结束后按尾部采样决定去留（慢请求与出错的请求一定保留），
+导出为 OTLP JSON：发往 OTLP/HTTP 接收端（/v1/traces），或逐行写入本地文件离线查看
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from bot.config import Config
+
+# span 类型（OTLP SpanKind）
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# span 状态（OTLP StatusCode）
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# 当前任务中正在进行的 span
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """一条 trace：根 span 与已结束的 span"""
+
+    __slots__ = ("trace_id", "root", "spans")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.root = None
+        self.spans = []
+
+
+class Span:
+    """一个 span；事件用于记录流式回复中的首个分块、每个分块与完成"""
+
+    __slots__ = ("tracer", "trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "events", "status", "status_message")
+
+    def __init__(self, tracer, trace, parent_id, name, kind, attributes):
+        self.tracer = tracer
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.events = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒），未结束时为到目前为止的耗时"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def end(self, error: BaseException = None):
+        """结束 span（重复调用无效）；error 不为空时标记为出错"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.status_message = f"{type(error).__name__}: {error}"
+        self.tracer._finish(self)
+
+
+class Tracer:
+    """
+    追踪器：exporter 为空时不记录任何 span
+    根 span 结束时：耗时不低于 slow_threshold 秒或有 span 出错的 trace 一定保留，
+    其余按 sample_rate 随机保留
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = 0.0, slow_threshold: float = None):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def trace(self, name: str, kind: int = SERVER, **attributes):
+        """开始一条新 trace 并把根 span 设为当前 span"""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace()
+        span = trace.root = Span(self, trace, None, name, kind, attributes)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, **attributes):
+        """在当前 span 下开始子 span 并设为当前 span；不在 trace 中时什么也不做"""
+        parent = current_span.get() if self.enabled else None
+        if parent is None:
+            yield None
+            return
+        with self._activate(Span(self, parent.trace, parent.span_id, name, kind, attributes)) as span:
+            yield span
+
+    def start_span(self, name: str, kind: int = INTERNAL, **attributes):
+        """
+        在当前 span 下开始子 span，但不设为当前 span，需手动 end()
+        用于异步生成器等跨越多次挂起的范围（避免把 span 泄漏给调用方）；不在 trace 中时返回 None
+        """
+        parent = current_span.get() if self.enabled else None
+        if parent is None:
+            return None
+        return Span(self, parent.trace, parent.span_id, name, kind, attributes)
+
+    def annotate(self, **attributes):
+        """给当前 span 添加属性"""
+        span = current_span.get()
+        if span is not None:
+            for key, value in attributes.items():
+                span.set_attribute(key, value)
+
+    @contextmanager
+    def _activate(self, span):
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def _finish(self, span):
+        trace = span.trace
+        trace.spans.append(span)
+        if span is trace.root:
+            if self._sampled(trace):
+                self.exported += 1
+                self.exporter.export(trace.spans)
+            else:
+                self.dropped += 1
+
+    def _sampled(self, trace) -> bool:
+        if self.slow_threshold is not None and trace.root.duration >= self.slow_threshold:
+            return True
+        if any(span.status == STATUS_ERROR for span in trace.spans):
+            return True
+        return random.random() < self.sample_rate
+
+
+# ---- OTLP JSON ----
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _otlp_span(span) -> dict:
+    data = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "events": [
+            {"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attributes)}
+            for ts, name, attributes in span.events
+        ],
+        "status": {"code": span.status},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    if span.status_message:
+        data["status"]["message"] = span.status_message
+    return data
+
+
+def otlp_payload(spans, service_name: str, resource: dict = None) -> dict:
+    """OTLP/JSON 的 ExportTraceServiceRequest"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name, **(resource or {})})},
+            "scopeSpans": [{"scope": {"name": "bot"}, "spans": [_otlp_span(span) for span in spans]}],
+        }]
+    }
+
+
+# ---- 导出 ----
+
+
+class FileExporter:
+    """把每批 span 作为一行 OTLP JSON 追加到本地文件"""
+
+    def __init__(self, path: str, service_name: str, resource: dict = None):
+        self.path = path
+        self.service_name = service_name
+        self.resource = resource
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(otlp_payload(spans, self.service_name, self.resource), ensure_ascii=False) + "\n")
+
+
+class OTLPExporter:
+    """以 OTLP/HTTP（JSON 编码）发送到接收端，如 OpenTelemetry Collector、Jaeger、Tempo"""
+
+    def __init__(self, endpoint: str, service_name: str, resource: dict = None, client=None, timeout: float = 5.0):
+        import httpx
+
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.resource = resource
+        self.client = client or httpx.Client(timeout=timeout)
+
+    def export(self, spans):
+        response = self.client.post(self.url, json=otlp_payload(spans, self.service_name, self.resource))
+        response.raise_for_status()
+
+
+class BatchExporter:
+    """
+    把采样保留的 trace 放入队列，由后台线程攒批后交给 exporter，导出的 I/O 不在事件循环中进行
+    队列满时丢弃
+    """
+
+    def __init__(self, exporter, max_queue: int = 2048, max_batch: int = 512, interval: float = 1.0):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans):
+        try:
+            self._queue.put_nowait(list(spans))
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self):
+        """导出队列中剩余的 trace 后停止后台线程"""
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = []
+            try:
+                batch.extend(self._queue.get(timeout=self.interval))
+                while len(batch) < self.max_batch:
+                    batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    logging.warning(f"导出 trace 失败: {e}")
+
+
+# 全局追踪器（setup_tracing 之前不记录）
+tracer = Tracer()
+
+
+def setup_tracing(**resource):
+    """按配置启用追踪；resource 为附加的资源属性（如工作进程名）"""
+    if Config.TRACE_EXPORTER == "file":
+        exporter = FileExporter(Config.TRACE_FILE, Config.TRACE_SERVICE_NAME, resource)
+    elif Config.TRACE_EXPORTER == "otlp":
+        exporter = OTLPExporter(Config.TRACE_OTLP_ENDPOINT, Config.TRACE_SERVICE_NAME, resource)
+    else:
+        return
+    tracer.exporter = BatchExporter(exporter)
+    tracer.sample_rate = Config.TRACE_SAMPLE_RATE
+    tracer.slow_threshold = Config.TRACE_SLOW_SECONDS
+    logging.info(f"链路追踪已启用：{Config.TRACE_EXPORTER}，慢请求阈值 {Config.TRACE_SLOW_SECONDS}s")
+
+
+def shutdown_tracing():
+    """导出剩余的 trace 并停用追踪"""
+    exporter, tracer.exporter = tracer.exporter, None
+    if isinstance(exporter, BatchExporter):
+        exporter.shutdown()
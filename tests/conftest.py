@@ -6,6 +6,22 @@ import pytest
 # 将项目根目录添加到 Python 路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# 配置在导入时从环境变量读取，先给出测试用的默认值（不再需要在命令行设置）
+os.environ.setdefault("TELEGRAM_TOKEN", "test_token_12345")
+os.environ.setdefault("PROJECT_ID", "test-project-id")
+# 测试默认使用内存存储，避免在工作目录创建数据库文件
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+# 测试中不等待消息合并窗口
+os.environ.setdefault("INBOX_DEBOUNCE", "0")
+# 测试中默认按纯文本回复（HTML 渲染由单独的测试覆盖）
+os.environ.setdefault("REPLY_FORMAT", "plain")
+# 测试中放宽模型调用限流
+os.environ.setdefault("AI_QPS", "1000")
+# 测试中不在后台预热模型客户端（多进程测试的工作进程会继承该设置）
+os.environ.setdefault("AI_WARMUP", "false")
+# 测试中放宽提醒发送限速
+os.environ.setdefault("BROADCAST_RATE", "1000")
+
 # 导入所有 fixtures 使它们可用
 from tests.fixtures.telegram import *
 from tests.fixtures.vertex import *
@@ -35,10 +51,39 @@ def reset_global_state():
     # 重置 AI 服务的用户聊天存储
     from bot.services import ai
     ai.user_chats.clear()
+    ai.history_manager.clear()
+
+    # 重置模型调用限流器与调用统计（上一个测试可能压低了并发上限或耗尽令牌）
+    from bot.services.limiter import AdaptiveLimiter
+    ai.limiter = AdaptiveLimiter(
+        qps=ai.Config.AI_QPS,
+        tpm=ai.Config.AI_TPM,
+        max_concurrency=ai.Config.AI_MAX_CONCURRENCY,
+        latency_target=ai.Config.AI_LATENCY_TARGET,
+    )
+    for key in ai.call_stats:
+        ai.call_stats[key] = 0
+    if ai.response_cache is not None:
+        ai.response_cache.clear()
 
-    # 重置睡眠提醒用户存储
+    # 重置睡眠提醒用户存储与发送器
     from bot.services import reminder
-    reminder.sleep_reminder_users.clear()
+    from bot.services.broadcast import Broadcaster
+    reminder.reminder_engine.clear()
+    reminder.broadcaster = Broadcaster(
+        rate=reminder.Config.BROADCAST_RATE,
+        per_chat_rate=reminder.Config.BROADCAST_PER_CHAT_RATE,
+        concurrency=reminder.Config.BROADCAST_CONCURRENCY,
+        max_attempts=reminder.Config.BROADCAST_MAX_ATTEMPTS,
+    )
+
+    # 重置媒体处理结果缓存
+    from bot.services import media
+    media.media_cache.clear()
+
+    # 重置持久化存储
+    from bot.services import storage
+    storage._storage = None
 
 
 # 配置 pytest 标记
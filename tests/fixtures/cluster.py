@@ -0,0 +1,46 @@
+"""多进程分片测试用的工作进程 Application"""
+import hashlib
+
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+
+from bot.handlers import sleep_off, sleep_on
+from bot.server import DrainingApplication
+from tests.fixtures.telegram_api import FakeBotAPI
+from tests.fixtures.vertex import FaultyModel
+
+
+async def _chat(update, context):
+    """模拟一轮对话：记录会话历史，并消耗固定的 CPU 时间代替模型调用前后的本地开销"""
+    from bot.services.ai import get_user_chat, touch_user_chat
+    from bot.services.history import make_content
+
+    digest = update.message.text.encode("utf-8")
+    for _ in range(2000):
+        digest = hashlib.sha256(digest).digest()
+
+    user_id = update.effective_user.id
+    chat = get_user_chat(user_id)
+    chat.history.extend([make_content("user", update.message.text), make_content("model", digest.hex()[:8])])
+    touch_user_chat(user_id)
+    await update.message.reply_text(digest.hex()[:8])
+
+
+def create_app():
+    """不访问网络的工作进程 Application：模型客户端换成假模型，不导入也不初始化 vertexai SDK"""
+    from bot.services import ai
+
+    ai.__dict__["model"] = FaultyModel(latency=0)
+    api = FakeBotAPI()
+    app = (
+        ApplicationBuilder()
+        .application_class(DrainingApplication, kwargs={"drain_timeout": 5})
+        .token("123:TEST")
+        .request(api)
+        .get_updates_request(api)
+        .concurrent_updates(True)
+        .build()
+    )
+    app.add_handler(CommandHandler("sleepon", sleep_on))
+    app.add_handler(CommandHandler("sleepoff", sleep_off))
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), _chat))
+    return app
@@ -1,4 +1,6 @@
 """Telegram Bot API mock fixtures"""
+import asyncio
+
 import pytest
 from unittest.mock import MagicMock, AsyncMock
 
@@ -67,6 +69,16 @@ def mock_context():
     context.job.data = {}
     context.job.schedule_removal = MagicMock()
 
+    # Mock application.create_task：在当前事件循环启动任务，并记录在 application.tasks 中供测试等待
+    context.application.tasks = []
+
+    def create_task(coroutine, update=None, *, name=None):
+        task = asyncio.get_running_loop().create_task(coroutine, name=name)
+        context.application.tasks.append(task)
+        return task
+
+    context.application.create_task = MagicMock(side_effect=create_task)
+
     return context
 
 
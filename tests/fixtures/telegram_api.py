@@ -0,0 +1,142 @@
+"""本地假 Telegram Bot API：驱动真实 Application 做传输层基准"""
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "TestBot", "username": "test_bot"}
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    """构造私聊文本消息的 Update 数据（以 / 开头时标记为命令）"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+class FakeBotAPI(BaseRequest):
+    """
+    假 Bot API：作为 Application 的 request 使用，不访问网络
+    - 每次调用模拟 rtt 秒的网络往返（去程、回程各一半）；rtt 也可以是 rtt(random) -> 秒数 的采样函数
+    - getUpdates 为长轮询，从 push 进来的更新中按 offset 取出
+    - sendMessage 等发送类调用记录到 sent，并按 update 对应的 chat_id 记录送达时间
+    - 可选模拟频率限制：最近 1 秒内发送超过 flood_limit 条、或同一会话两次发送间隔小于
+      chat_interval 秒时返回 429 与 retry_after；向 blocked 中的会话发送返回 403
+    """
+
+    def __init__(self, rtt: float = 0.0, flood_limit: int = None, chat_interval: float = None,
+                 retry_after: int = 1, blocked=(), seed=None):
+        self.rtt = rtt
+        self.random = random.Random(seed)
+        self.flood_limit = flood_limit
+        self.chat_interval = chat_interval
+        self.retry_after = retry_after
+        self.blocked = set(blocked)
+        self.sent = []
+        self.calls = {}
+        self.rejected = {}
+        self._recent = deque()
+        self._last_sent = {}
+        self._updates = []
+        self._offset = 0
+        self._arrived = asyncio.Event()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def push(self, update: dict):
+        """Telegram 收到一条新消息（长轮询模式下等待 getUpdates 取走）"""
+        self._updates.append(update)
+        self._arrived.set()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+        rtt = self.rtt(self.random) if callable(self.rtt) else self.rtt
+        await asyncio.sleep(rtt / 2)
+        if endpoint == "getUpdates":
+            result = await self._get_updates(params)
+        else:
+            error = self._reject(endpoint, params) if endpoint == "sendMessage" else None
+            if error is not None:
+                await asyncio.sleep(rtt / 2)
+                status, body = error
+                self.rejected[status] = self.rejected.get(status, 0) + 1
+                return status, json.dumps(body).encode("utf-8")
+            result = self._handle(endpoint, params)
+        await asyncio.sleep(rtt / 2)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    def _reject(self, endpoint, params):
+        """按拉黑名单与频率限制决定是否拒绝发送，返回 (状态码, 响应体) 或 None"""
+        chat_id = int(params["chat_id"])
+        if chat_id in self.blocked:
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1.0:
+            self._recent.popleft()
+        too_fast = self.flood_limit is not None and len(self._recent) >= self.flood_limit
+        last = self._last_sent.get(chat_id)
+        if self.chat_interval is not None and last is not None and now - last < self.chat_interval:
+            too_fast = True
+        if too_fast:
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        self._recent.append(now)
+        self._last_sent[chat_id] = now
+        return None
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    def _handle(self, endpoint, params):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("deleteWebhook", "setWebhook", "sendChatAction", "close", "logOut"):
+            return True
+        if endpoint in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            chat_id = int(params["chat_id"])
+            self.sent.append((time.perf_counter(), endpoint, chat_id, params.get("text")))
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        raise NotImplementedError(endpoint)
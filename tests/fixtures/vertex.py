@@ -1,4 +1,8 @@
 """Vertex AI mock fixtures"""
+import asyncio
+import random
+import time
+
 import pytest
 from unittest.mock import MagicMock
 
@@ -58,3 +62,111 @@ def mock_stream_response():
             yield c
 
     return generate_chunks()
+
+
+class FakeChatSession:
+    """
+    同步流式假会话：send_message 阻塞 latency 秒后逐块返回
+    用于验证线程池兜底路径不会阻塞事件循环
+    """
+
+    def __init__(self, chunks=None, latency=0.0):
+        self.chunks = chunks or ["Hello! ", "How ", "can ", "I ", "help ", "you?"]
+        self.latency = latency
+        self.history = []
+
+    def send_message(self, content, stream=False):
+        time.sleep(self.latency)
+        for text in self.chunks:
+            c = MagicMock()
+            c.text = text
+            yield c
+
+
+class FakeAsyncChatSession(FakeChatSession):
+    """原生异步假会话：提供 send_message_async，延迟通过 asyncio.sleep 模拟"""
+
+    async def send_message_async(self, content, stream=False):
+        await asyncio.sleep(self.latency)
+
+        async def generate():
+            for text in self.chunks:
+                c = MagicMock()
+                c.text = text
+                yield c
+
+        return generate()
+
+
+class FaultyModel:
+    """
+    注入故障的假模型：按 error_rate 抛出 503，按 slow_rate 让首个分块延迟 slow_latency 秒
+    start_chat 返回共享故障设置的原生异步会话，用于测量重试与对冲对尾延迟的影响
+    latency 可以是秒数，也可以是 latency(random) -> 秒数 的采样函数（压测用的延迟分布）；
+    chunk_interval 为相邻分块之间的间隔（秒），模拟逐块生成
+    """
+
+    def __init__(self, error_rate=0.0, slow_rate=0.0, latency=0.01, slow_latency=1.0,
+                 chunks=None, seed=None, chunk_interval=0.0):
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.chunk_interval = chunk_interval
+        self.chunks = chunks or ["ok"]
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def start_chat(self, history=None):
+        return FaultyChatSession(self, history)
+
+
+class FaultyChatSession:
+    """FaultyModel 的会话：流结束后把本轮问答追加到历史"""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, content, stream=False):
+        from google.api_core.exceptions import ServiceUnavailable
+
+        model = self.model
+        model.calls += 1
+        slow = model.random.random() < model.slow_rate
+        failed = model.random.random() < model.error_rate
+        latency = model.latency(model.random) if callable(model.latency) else model.latency
+        await asyncio.sleep(model.slow_latency if slow else latency)
+        if failed:
+            model.failures += 1
+            raise ServiceUnavailable("injected fault")
+
+        async def generate():
+            for i, text in enumerate(model.chunks):
+                if i and model.chunk_interval:
+                    await asyncio.sleep(model.chunk_interval)
+                c = MagicMock()
+                c.text = text
+                yield c
+            self.history.extend([content, "".join(model.chunks)])
+
+        return generate()
+
+
+@pytest.fixture
+def faulty_model():
+    """注入故障的假模型"""
+    return FaultyModel(seed=0)
+
+
+@pytest.fixture
+def fake_chat_session():
+    """同步流式假会话"""
+    return FakeChatSession()
+
+
+@pytest.fixture
+def fake_async_chat_session():
+    """原生异步假会话"""
+    return FakeAsyncChatSession()
@@ -40,10 +40,11 @@ class TestBotIntegration:
         assert Config.TIMEZONE is not None
         assert Config.BEIJING_TZ is not None
 
-    def test_user_chats_dict_exists(self):
-        """测试用户聊天字典存在"""
+    def test_user_chats_store_exists(self):
+        """测试用户聊天会话存储存在"""
         from bot.services.ai import user_chats
-        assert isinstance(user_chats, dict)
+        from bot.services.session import SessionStore
+        assert isinstance(user_chats, SessionStore)
 
     def test_sleep_reminder_users_dict_exists(self):
         """测试睡眠提醒用户字典存在"""
@@ -0,0 +1,93 @@
+"""提醒批量发送：对接执行频率限制的本地假 Telegram（不访问网络）"""
+import asyncio
+import time
+
+import pytest
+from telegram import Bot
+
+from bot.services import reminder
+from bot.services.broadcast import Broadcaster, percentile
+from bot.services.reminder import reminder_engine, sleep_reminder_users
+from tests.fixtures.telegram_api import FakeBotAPI
+
+
+async def make_bot(api):
+    bot = Bot("123:TEST", request=api)
+    await bot.initialize()
+    return bot
+
+
+def subscribe_all(count, time_str="23:30"):
+    for chat_id in range(1, count + 1):
+        reminder_engine.subscribe(chat_id, time_str)
+
+
+class TestReminderBroadcast:
+    """测试提醒整分钟批量发送"""
+
+    @pytest.mark.asyncio
+    async def test_paced_broadcast_stays_under_flood_limit(self, monkeypatch):
+        """测试按限速发送不触发 429，只有拉黑的会话被取消订阅"""
+        api = FakeBotAPI(flood_limit=100, chat_interval=1.0, blocked={7})
+        bot = await make_bot(api)
+        monkeypatch.setattr(reminder, "broadcaster", Broadcaster(rate=90, concurrency=8))
+        subscribe_all(60)
+
+        delivered = await reminder_engine.dispatch(bot, 23, 30)
+
+        assert delivered == 59
+        assert api.rejected == {403: 1}
+        assert set(sleep_reminder_users) == set(range(1, 61)) - {7}
+        assert reminder.broadcaster.stats()["lag_p99"] > 0
+
+    @pytest.mark.asyncio
+    async def test_flood_limit_is_honoured_without_unsubscribing(self, monkeypatch):
+        """测试限速高于服务端限制时：收到 429 后按 retry_after 暂停重发，不取消任何订阅"""
+        api = FakeBotAPI(flood_limit=20, retry_after=1)
+        bot = await make_bot(api)
+        monkeypatch.setattr(reminder, "broadcaster", Broadcaster(rate=1000, per_chat_rate=1000, concurrency=8))
+        subscribe_all(40)
+
+        delivered = await reminder_engine.dispatch(bot, 23, 30)
+
+        assert delivered == 40
+        assert api.rejected.get(429, 0) > 0
+        assert reminder.broadcaster.stats()["throttled"] == api.rejected[429]
+        assert len(sleep_reminder_users) == 40
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_unpaced_vs_paced_fan_out(self, monkeypatch):
+        """基准：同一分钟 3000 个提醒，不限速并发发送与限速发送的送达率与延迟"""
+        count = 3000
+        flood_limit = 300
+
+        # 不限速：全部同时发送，失败即视为丢失（原实现会因此取消订阅）
+        api = FakeBotAPI(rtt=0.05, flood_limit=flood_limit)
+        bot = await make_bot(api)
+        started = time.monotonic()
+        lags = []
+
+        async def send(chat_id):
+            await bot.send_message(chat_id=chat_id, text="🌙")
+            lags.append(time.monotonic() - started)
+
+        results = await asyncio.gather(*(send(c) for c in range(1, count + 1)), return_exceptions=True)
+        lost = sum(1 for r in results if isinstance(r, Exception))
+        print(f"\n不限速: 送达 {count - lost}/{count}，丢失 {lost}，"
+              f"p50={percentile(lags, 0.5):.2f}s p99={percentile(lags, 0.99):.2f}s")
+
+        # 限速：按服务端限制的 90% 匀速发送
+        api = FakeBotAPI(rtt=0.05, flood_limit=flood_limit)
+        bot = await make_bot(api)
+        monkeypatch.setattr(reminder, "broadcaster", Broadcaster(rate=flood_limit * 0.9, concurrency=32))
+        subscribe_all(count)
+
+        delivered = await reminder_engine.dispatch(bot, 23, 30)
+        stats = reminder.broadcaster.stats()
+        print(f"限速: 送达 {delivered}/{count}，429 次数 {api.rejected.get(429, 0)}，"
+              f"p50={stats['lag_p50']:.2f}s p95={stats['lag_p95']:.2f}s p99={stats['lag_p99']:.2f}s")
+
+        assert lost > 0
+        assert delivered == count
+        assert len(sleep_reminder_users) == count
@@ -0,0 +1,122 @@
+"""多进程分片集成测试（工作进程使用假 Telegram API，不访问网络）"""
+import asyncio
+import time
+
+import pytest
+
+from bot.cluster import Cluster
+from tests.fixtures.telegram_api import make_update
+
+FACTORY = "tests.fixtures.cluster:create_app"
+
+
+async def wait_processed(cluster, count, timeout=60):
+    """等待全部工作进程处理完 count 条更新"""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = await cluster.stats()
+        if (sum(s["received"] for s in stats.values()) >= count
+                and all(s["queued"] == 0 and s["in_flight"] == 0 for s in stats.values())):
+            return stats
+        assert time.monotonic() < deadline, "更新未全部处理完"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+class TestCluster:
+    """测试分发与重新平衡"""
+
+    @pytest.mark.asyncio
+    async def test_routes_users_and_hands_off_state(self):
+        """测试同一用户固定路由到一个工作进程，增删工作进程时会话和提醒随归属交接"""
+        cluster = Cluster(factory=FACTORY)
+        await cluster.start(2)
+        try:
+            users = list(range(1, 41))
+            for i, user_id in enumerate(users * 2, start=1):
+                await cluster.dispatch(make_update(i, user_id, f"hi {i}"))
+            for user_id in users[:10]:
+                await cluster.dispatch(make_update(1000 + user_id, user_id, "/sleepon 23:00"))
+            stats = await wait_processed(cluster, len(users) * 2 + 10)
+
+            assert sum(s["sessions"] for s in stats.values()) == len(users)
+            assert sum(s["reminders"] for s in stats.values()) == 10
+            assert all(s["sessions"] > 0 for s in stats.values())
+
+            # 加入工作进程：约 1/3 的用户迁移过去，总数不变
+            new = await cluster.add_worker()
+            stats = await cluster.stats(drain=True)
+            assert sum(s["sessions"] for s in stats.values()) == len(users)
+            assert sum(s["reminders"] for s in stats.values()) == 10
+            assert stats[new]["sessions"] > 0
+            assert cluster.handoffs == stats[new]["sessions"] + stats[new]["reminders"]
+
+            # 移除工作进程：它的状态全部交给剩下的进程
+            await cluster.remove_worker("worker-0")
+            stats = await cluster.stats(drain=True)
+            assert set(stats) == {"worker-1", new}
+            assert sum(s["sessions"] for s in stats.values()) == len(users)
+            assert sum(s["reminders"] for s in stats.values()) == 10
+        finally:
+            await cluster.stop()
+
+    @pytest.mark.asyncio
+    async def test_limits_are_shared_across_workers(self):
+        """测试各工作进程平分发送与模型限额：增删工作进程后合计仍等于配置的全局限额"""
+        from bot.config import Config
+
+        def totals(stats):
+            limits = [s["limits"] for s in stats.values()]
+            return {key: sum(limit[key] for limit in limits) for key in limits[0]}
+
+        expected = {
+            "broadcast_rate": Config.BROADCAST_RATE,
+            "ai_qps": Config.AI_QPS,
+            "ai_tpm": Config.AI_TPM,
+        }
+        cluster = Cluster(factory=FACTORY)
+        await cluster.start(2)
+        try:
+            for change in (None, cluster.add_worker, lambda: cluster.remove_worker("worker-0")):
+                if change is not None:
+                    await change()
+                stats = await cluster.stats()
+                combined = totals(stats)
+                for key, value in expected.items():
+                    assert combined[key] == pytest.approx(value), key
+                assert combined["ai_max_concurrency"] <= Config.AI_MAX_CONCURRENCY
+        finally:
+            await cluster.stop()
+
+    @pytest.mark.asyncio
+    async def test_throughput_by_worker_count(self):
+        """基准：1 / 2 / 4 个工作进程处理 2000 条更新（每条约 2ms CPU）的吞吐"""
+        import os
+
+        users = range(1, 201)
+        warm_up = [make_update(i, user_id, "hi") for i, user_id in enumerate(users, start=1)]
+        updates = [make_update(1000 + i, i % 200 + 1, f"msg {i}") for i in range(1, 2001)]
+        results = {}
+        for workers in (1, 2, 4):
+            cluster = Cluster(factory=FACTORY)
+            await cluster.start(workers)
+            try:
+                # 先让每个用户对话一次：会话创建与首次导入的开销不计入吞吐
+                for update in warm_up:
+                    await cluster.dispatch(update)
+                await wait_processed(cluster, len(warm_up))
+
+                started = time.perf_counter()
+                for update in updates:
+                    await cluster.dispatch(update)
+                stats = await wait_processed(cluster, len(warm_up) + len(updates))
+                elapsed = time.perf_counter() - started
+            finally:
+                await cluster.stop()
+            results[workers] = len(updates) / elapsed
+            routed = sorted(s["routed"] for s in stats.values())
+            print(f"\n{workers} 个工作进程: {results[workers]:.0f} updates/s，分布 {routed}")
+
+        # 加速比取决于 CPU 核数（单核环境下多进程不会更快），只输出结果不做断言
+        print(f"CPU 核数: {os.cpu_count()}")
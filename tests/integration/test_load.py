@@ -0,0 +1,92 @@
+"""压测工具：以假 Bot API 与假模型驱动真实 Application"""
+import json
+import random
+
+import pytest
+
+from tests.load import main, parse_latency, run_load
+
+
+class TestParseLatency:
+    """测试延迟分布解析"""
+
+    def test_constant(self):
+        """测试固定值"""
+        assert parse_latency("0.2")(random.Random(0)) == 0.2
+        assert parse_latency("const:0.3")(random.Random(0)) == 0.3
+
+    def test_distributions(self):
+        """测试均匀、指数与对数正态分布的取值范围"""
+        rng = random.Random(0)
+
+        assert all(0.1 <= parse_latency("uniform:0.1,0.5")(rng) <= 0.5 for _ in range(100))
+        assert all(parse_latency("exp:0.2")(rng) >= 0 for _ in range(100))
+        samples = sorted(parse_latency("lognormal:0.2,0.5")(rng) for _ in range(1001))
+        assert 0.15 < samples[500] < 0.25
+
+    def test_invalid(self):
+        """测试无法解析的分布报错"""
+        with pytest.raises(ValueError):
+            parse_latency("pareto:1")
+        with pytest.raises(ValueError):
+            parse_latency("uniform:0.1")
+
+
+@pytest.mark.integration
+class TestLoadHarness:
+    """测试压测流程与报告"""
+
+    @pytest.mark.asyncio
+    async def test_small_run(self):
+        """测试少量用户的完整压测：每条消息都被处理，报告可序列化"""
+        report = await run_load(users=20, messages=3, think_time=0, ramp_up=0.1,
+                                model_latency="0.01", chunk_interval=0, api_rtt="0")
+
+        assert report["updates"] == 60
+        assert report["errors"] == 0
+        latency = report["latency_seconds"]
+        assert latency["chat"]["count"] + latency["command"]["count"] == 60
+        assert 0 < latency["all"]["p50"] <= latency["all"]["p99"] <= latency["all"]["max"]
+        assert report["model"]["calls"] == latency["chat"]["count"]
+        # 每条消息（聊天或命令）都有一条回复
+        assert report["bot_api_calls"]["sendMessage"] == 60
+        json.loads(json.dumps(report))
+
+    @pytest.mark.asyncio
+    async def test_model_errors_are_answered(self):
+        """测试模型故障时用户仍收到回复，处理器不抛出异常"""
+        report = await run_load(users=10, messages=2, command_ratio=0, think_time=0, ramp_up=0,
+                                model_latency="0.01", chunk_interval=0, api_rtt="0", error_rate=1.0)
+
+        assert report["errors"] == 0
+        assert report["model"]["failures"] > 0
+        assert report["bot_api_calls"]["sendMessage"] == 20
+
+    def test_cli_appends_json_lines(self, tmp_path, capsys):
+        """测试命令行把报告追加为 JSON Lines，并按 p99 上限设置退出状态"""
+        output = tmp_path / "load.jsonl"
+        args = ["--users", "5", "--messages", "1", "--think-time", "0", "--ramp-up", "0",
+                "--model-latency", "0.01", "--chunk-interval", "0", "--api-rtt", "0", "--output", str(output)]
+
+        assert main(args) == 0
+        assert main(args + ["--max-p99", "0"]) == 1
+
+        lines = output.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])["updates"] == 5
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_thousands_of_users(self):
+        """压测：2000 个用户并发聊天与设置提醒，输出吞吐、延迟分位数与内存增长"""
+        report = await run_load(users=2000, messages=3, think_time=0.5, ramp_up=2.0)
+
+        latency = report["latency_seconds"]
+        memory = report["memory_bytes"]
+        print(f"\n{report['updates']} 条更新，{report['throughput_per_second']:.0f} 条/秒；"
+              f"聊天 p50={latency['chat']['p50']:.2f}s p95={latency['chat']['p95']:.2f}s "
+              f"p99={latency['chat']['p99']:.2f}s；命令 p99={latency['command']['p99'] * 1000:.0f}ms；"
+              f"内存增长 {memory['growth'] / 2 ** 20:.1f}MB（每用户 {memory['per_user'] / 1024:.1f}KB）")
+
+        assert report["updates"] == 6000
+        assert report["errors"] == 0
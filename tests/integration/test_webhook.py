@@ -0,0 +1,161 @@
+"""长轮询与 Webhook 传输基准（本地假 Telegram，不访问网络）"""
+import asyncio
+import socket
+import time
+
+import httpx
+import pytest
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from bot.server import DrainingApplication
+from tests.fixtures.telegram_api import FakeBotAPI, make_update
+
+SECRET = "test-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def echo(update, context):
+    await update.message.reply_text(update.message.text)
+
+
+def build_app(api):
+    app = (
+        ApplicationBuilder()
+        .application_class(DrainingApplication, kwargs={"drain_timeout": 5})
+        .token("123:TEST")
+        .request(api)
+        .get_updates_request(api)
+        .concurrent_updates(True)
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    return app
+
+
+async def wait_delivered(api, count, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while sum(1 for s in api.sent if s[1] == "sendMessage") < count:
+        assert time.perf_counter() < deadline, "回复未全部送达"
+        await asyncio.sleep(0.01)
+
+
+def summarize(api, pushed):
+    latencies = sorted(sent_at - pushed[int(text)] for sent_at, endpoint, _, text in api.sent
+                       if endpoint == "sendMessage")
+    elapsed = max(s[0] for s in api.sent) - min(pushed.values())
+    return {
+        "updates_per_second": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+async def run_polling(updates, rtt, interval):
+    api = FakeBotAPI(rtt=rtt)
+    app = build_app(api)
+    pushed = {}
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        for update in updates:
+            pushed[update["update_id"]] = time.perf_counter()
+            api.push(update)
+            await asyncio.sleep(interval)
+        await wait_delivered(api, len(updates))
+        await app.updater.stop()
+        await app.stop()
+    return summarize(api, pushed)
+
+
+async def run_webhook(updates, rtt, interval, max_connections=40):
+    api = FakeBotAPI(rtt=rtt)
+    app = build_app(api)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/telegram"
+    pushed = {}
+    connections = asyncio.Semaphore(max_connections)
+
+    async def deliver(client, update):
+        # Telegram 到本进程的单程延迟
+        await asyncio.sleep(rtt / 2)
+        async with connections:
+            response = await client.post(url, json=update,
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            assert response.status_code == 200
+
+    async with app:
+        await app.start()
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="telegram", webhook_url=url,
+            secret_token=SECRET, max_connections=max_connections,
+        )
+        async with httpx.AsyncClient() as client:
+            tasks = []
+            for update in updates:
+                pushed[update["update_id"]] = time.perf_counter()
+                tasks.append(asyncio.create_task(deliver(client, update)))
+                await asyncio.sleep(interval)
+            await asyncio.gather(*tasks)
+        await wait_delivered(api, len(updates))
+        await app.updater.stop()
+        await app.stop()
+    return summarize(api, pushed)
+
+
+@pytest.mark.integration
+class TestWebhookServer:
+    """测试 Webhook 服务器收发"""
+
+    @pytest.mark.asyncio
+    async def test_webhook_rejects_wrong_secret(self):
+        """测试密钥不匹配的推送被拒绝"""
+        api = FakeBotAPI()
+        app = build_app(api)
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/telegram"
+        async with app:
+            await app.start()
+            await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                            webhook_url=url, secret_token=SECRET)
+            async with httpx.AsyncClient() as client:
+                response = await client.post(url, json=make_update(1, 1, "1"),
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            await app.updater.stop()
+            await app.stop()
+
+        assert response.status_code == 403
+        assert api.sent == []
+
+    @pytest.mark.asyncio
+    async def test_webhook_delivers_updates(self):
+        """测试推送的更新被处理并回复"""
+        result = await run_webhook([make_update(i, i % 5 + 1, str(i)) for i in range(1, 21)],
+                                   rtt=0, interval=0)
+
+        assert result["updates_per_second"] > 0
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+class TestTransportBenchmark:
+    """基准：长轮询与 Webhook 的吞吐和延迟"""
+
+    @pytest.mark.asyncio
+    async def test_polling_vs_webhook(self):
+        """模拟 100ms 往返延迟，每 5ms 到达一条消息"""
+        rtt = 0.1
+        updates = [make_update(i, i % 50 + 1, str(i)) for i in range(1, 401)]
+
+        polling = await run_polling(updates, rtt=rtt, interval=0.005)
+        webhook = await run_webhook(updates, rtt=rtt, interval=0.005)
+
+        for name, result in [("polling", polling), ("webhook", webhook)]:
+            print(f"\n{name}: {result['updates_per_second']:.0f} updates/s, "
+                  f"p50={result['p50'] * 1000:.0f}ms, p95={result['p95'] * 1000:.0f}ms")
+
+        assert webhook["p50"] < polling["p50"]
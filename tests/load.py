@@ -0,0 +1,306 @@
+"""
+压测：用本地假 Bot API 与假流式模型驱动真实 Application（bot.app.create_app，长轮询）
+模拟大量并发用户发送聊天消息与睡眠提醒命令，输出吞吐、延迟分位数与内存增长（JSON，便于跟踪回归）
+
+用法：
+    python -m tests.load --users 2000 --messages 3 --output load.jsonl
+
+每个用户发出一条消息后等待处理完成，再按 think-time 停顿发下一条（闭环）。
+延迟为从消息到达假 Bot API 到处理器执行完毕的时间；配置（限流、合并窗口、流式回复等）沿用环境变量
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# 配置在导入时从环境变量读取：不访问 Telegram / Vertex AI，使用内存存储
+os.environ.setdefault("TELEGRAM_TOKEN", "123:LOAD")
+os.environ.setdefault("PROJECT_ID", "load-test")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("AI_WARMUP", "false")
+# 假模型没有配额，默认放宽限流；需要测量限流本身时显式设置 AI_QPS
+os.environ.setdefault("AI_QPS", "1000")
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from bot.app import create_app
+from bot.services import ai
+from bot.services.broadcast import percentile
+from bot.services.reminder import reminder_engine
+from tests.fixtures.telegram_api import FakeBotAPI, make_update
+from tests.fixtures.vertex import FaultyModel
+
+# 报告格式版本，字段含义变化时递增
+REPORT_VERSION = 1
+
+# 用户发送的命令（按 command_ratio 的比例替代聊天消息）
+COMMANDS = ("/sleepon 23:30", "/sleepon 7:00 Europe/Berlin", "/sleepstatus", "/sleepoff", "/help")
+
+
+def parse_latency(spec):
+    """
+    解析延迟分布（秒），返回 sample(random) -> 秒数
+    - "0.2" 或 "const:0.2"：固定值
+    - "uniform:0.1,0.5"：均匀分布
+    - "exp:0.2"：均值为 0.2 的指数分布
+    - "lognormal:0.2,0.5"：中位数 0.2、对数标准差 0.5 的对数正态分布（长尾）
+    """
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        kind, args = "const", kind
+    try:
+        values = [float(v) for v in args.split(",")]
+        if kind == "const" and len(values) == 1:
+            value = values[0]
+            return lambda rng: value
+        if kind == "uniform" and len(values) == 2:
+            low, high = values
+            return lambda rng: rng.uniform(low, high)
+        if kind == "exp" and len(values) == 1:
+            mean = values[0]
+            return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if kind == "lognormal" and len(values) == 2:
+            mu, sigma = math.log(values[0]), values[1]
+            return lambda rng: rng.lognormvariate(mu, sigma)
+    except ValueError:
+        pass
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+
+def summarize(values) -> dict:
+    """延迟分位数（秒）"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values, default=0.0),
+    }
+
+
+def rss_bytes() -> int:
+    """当前常驻内存（字节）；没有 /proc 时退化为峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def run_load(
+    users: int = 1000,
+    messages: int = 3,
+    command_ratio: float = 0.3,
+    think_time: float = 0.5,
+    ramp_up: float = 1.0,
+    model_latency="lognormal:0.5,0.6",
+    chunks: int = 8,
+    chunk_interval: float = 0.05,
+    error_rate: float = 0.0,
+    api_rtt="uniform:0.02,0.08",
+    seed: int = 0,
+    timeout: float = 600.0,
+) -> dict:
+    """运行一次压测，返回报告"""
+    rng = random.Random(seed)
+    api = FakeBotAPI(rtt=parse_latency(api_rtt), seed=seed)
+    model = FaultyModel(
+        latency=parse_latency(model_latency), error_rate=error_rate, seed=seed,
+        chunks=[f"第{i + 1}段回复。" for i in range(chunks)], chunk_interval=chunk_interval,
+    )
+    # 替换模型客户端（get_model 直接返回已创建的实例）
+    saved_model = ai.__dict__.get("model")
+    ai.__dict__["model"] = model
+
+    app = create_app(request=api)
+    pending = {}
+    errors = []
+    latencies = {"chat": [], "command": []}
+    update_ids = itertools.count(1)
+
+    async def finished(update, context):
+        # group 1 在处理器（group 0）执行完毕后运行，标记该更新处理完成
+        future = pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    app.add_handler(TypeHandler(Update, finished), group=1)
+    app.add_error_handler(on_error)
+
+    async def user(user_id: int):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(rng.uniform(0, ramp_up))
+        for n in range(messages):
+            command = rng.random() < command_ratio
+            text = rng.choice(COMMANDS) if command else f"你好，这是第 {n + 1} 条消息"
+            update_id = next(update_ids)
+            pending[update_id] = future = loop.create_future()
+            started = time.perf_counter()
+            api.push(make_update(update_id, user_id, text))
+            latencies["command" if command else "chat"].append(await future - started)
+            if think_time:
+                await asyncio.sleep(rng.expovariate(1 / think_time))
+
+    rss_start = rss_bytes()
+    try:
+        async with app:
+            if app.post_init:
+                await app.post_init(app)
+            await app.start()
+            await app.updater.start_polling(poll_interval=0, timeout=10)
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(user(user_id) for user_id in range(1, users + 1))), timeout
+                )
+                elapsed = time.perf_counter() - started
+                rss_end = rss_bytes()
+                sessions = len(ai.user_chats)
+                history_bytes = ai.user_chats.history_bytes
+                reminders = len(reminder_engine)
+            finally:
+                # 清理本次压测的会话与订阅（同一进程中可以再次运行），提醒定时任务须在 JobQueue 停止前移除
+                reminder_engine.clear()
+                ai.user_chats.clear()
+                await app.updater.stop()
+                await app.stop()
+                if app.post_shutdown:
+                    await app.post_shutdown(app)
+    finally:
+        if saved_model is None:
+            ai.__dict__.pop("model", None)
+        else:
+            ai.__dict__["model"] = saved_model
+
+    all_latencies = latencies["chat"] + latencies["command"]
+    config = ai.Config
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "users": users,
+            "messages": messages,
+            "command_ratio": command_ratio,
+            "think_time": think_time,
+            "ramp_up": ramp_up,
+            "model_latency": str(model_latency),
+            "chunks": chunks,
+            "chunk_interval": chunk_interval,
+            "error_rate": error_rate,
+            "api_rtt": str(api_rtt),
+            "seed": seed,
+        },
+        "config": {
+            "ai_qps": config.AI_QPS,
+            "ai_max_concurrency": config.AI_MAX_CONCURRENCY,
+            "inbox_debounce": config.INBOX_DEBOUNCE,
+            "stream_reply": config.STREAM_REPLY,
+        },
+        "updates": len(all_latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "all": summarize(all_latencies),
+            "chat": summarize(latencies["chat"]),
+            "command": summarize(latencies["command"]),
+        },
+        "memory_bytes": {
+            "rss_start": rss_start,
+            "rss_end": rss_end,
+            "growth": rss_end - rss_start,
+            "peak_rss": peak_rss_bytes(),
+            "per_user": (rss_end - rss_start) / users if users else 0.0,
+        },
+        "state": {
+            "sessions": sessions,
+            "session_history_bytes": history_bytes,
+            "reminders": reminders,
+        },
+        "model": {"calls": model.calls, "failures": model.failures},
+        "bot_api_calls": dict(api.calls),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="以假 Bot API 与假模型压测机器人")
+    parser.add_argument("--users", type=int, default=1000, help="并发用户数")
+    parser.add_argument("--messages", type=int, default=3, help="每个用户发送的消息数")
+    parser.add_argument("--command-ratio", type=float, default=0.3, help="命令（睡眠提醒、帮助）所占比例")
+    parser.add_argument("--think-time", type=float, default=0.5, help="用户两条消息之间的平均停顿（秒）")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="用户在该秒数内陆续上线")
+    parser.add_argument("--model-latency", default="lognormal:0.5,0.6", help="模型首个分块延迟分布")
+    parser.add_argument("--chunks", type=int, default=8, help="每次回复的分块数")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="相邻分块间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模型调用返回 503 的比例")
+    parser.add_argument("--api-rtt", default="uniform:0.02,0.08", help="Bot API 往返延迟分布")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600.0, help="整体超时（秒）")
+    parser.add_argument("--output", help="把报告作为一行 JSON 追加到该文件（JSON Lines）")
+    parser.add_argument("--max-p99", type=float, help="p99 延迟超过该秒数时以非零状态退出")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    report = asyncio.run(run_load(
+        users=args.users,
+        messages=args.messages,
+        command_ratio=args.command_ratio,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        model_latency=args.model_latency,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        api_rtt=args.api_rtt,
+        seed=args.seed,
+        timeout=args.timeout,
+    ))
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    p99 = report["latency_seconds"]["all"]["p99"]
+    if args.max_p99 is not None and p99 > args.max_p99:
+        print(f"p99 延迟 {p99:.3f}s 超过上限 {args.max_p99}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Application 工厂与延迟初始化单元测试"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from telegram.ext import CommandHandler
+
+from bot import app as app_module
+from bot.server import DrainingApplication
+from bot.services import ai, prompts
+
+# 导入 bot.__main__ 的耗时上限（秒）：不含 vertexai SDK 时约 0.3s，留出余量应对慢机器
+IMPORT_TIME_BUDGET = 1.5
+
+
+@pytest.fixture
+def fresh_model():
+    """移除已创建的模型客户端，测试结束后恢复"""
+    saved = ai.__dict__.pop("model", None)
+    yield
+    ai.__dict__.pop("model", None)
+    if saved is not None:
+        ai.__dict__["model"] = saved
+
+
+class TestCreateApp:
+    """测试 create_app 工厂"""
+
+    def test_registers_handlers(self):
+        """测试创建注册好全部命令的 Application"""
+        app = app_module.create_app()
+
+        assert isinstance(app, DrainingApplication)
+        commands = {
+            command
+            for handler in app.handlers[0] if isinstance(handler, CommandHandler)
+            for command in handler.commands
+        }
+        assert commands == {"start", "help", "sleepon", "sleepoff", "sleepstatus"}
+
+    def test_group_chatter_is_filtered(self, mocker):
+        """测试群组中未点名机器人的消息不匹配任何处理器"""
+        import re
+
+        from telegram import Update
+
+        from bot.services.groups import addressed
+        from tests.fixtures.telegram_api import make_update
+
+        # 机器人的用户名通常在启动后从 getMe 得到，这里直接给出
+        mocker.patch.object(addressed, "_mention", re.compile(r"@test_bot\b", re.IGNORECASE))
+        mocker.patch.object(addressed, "bot_id", 999)
+        app = app_module.create_app()
+        data = make_update(1, 100, "大家好")
+        data["message"]["chat"] = {"id": -500, "type": "group"}
+        chatter = Update.de_json(data, app.bot)
+        private = Update.de_json(make_update(2, 100, "你好"), app.bot)
+
+        assert not any(handler.check_update(chatter) for handler in app.handlers[0])
+        assert any(handler.check_update(private) for handler in app.handlers[0])
+
+    def test_validates_config(self, mocker):
+        """测试配置无效时在创建时报错，而不是在导入时"""
+        mocker.patch.object(app_module.Config, "BOT_MODE", "carrier-pigeon")
+
+        with pytest.raises(ValueError):
+            app_module.create_app()
+
+    @pytest.mark.asyncio
+    async def test_startup_starts_warm_up(self, mocker):
+        """测试启动后在后台预热模型客户端"""
+        mocker.patch.object(app_module.Config, "AI_WARMUP", True)
+        mocker.patch.object(app_module, "_warm_up_task", None)
+        warm_up = mocker.patch.object(app_module, "warm_up", AsyncMock())
+
+        await app_module.on_startup(MagicMock())
+        await app_module._warm_up_task
+
+        warm_up.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_warm_up_failure_does_not_raise(self, mocker):
+        """测试预热失败不影响启动"""
+        mocker.patch.object(app_module, "warm_up", AsyncMock(side_effect=RuntimeError("no credentials")))
+
+        await app_module._warm_up()
+
+
+class TestLazyModel:
+    """测试模型客户端延迟创建"""
+
+    def test_model_created_once(self, fresh_model, mock_vertexai_init, mock_generative_model_class):
+        """测试首次使用时创建，之后复用"""
+        first = ai.get_model()
+        second = ai.get_model()
+
+        assert first is second
+        mock_vertexai_init.assert_called_once()
+        mock_generative_model_class.assert_called_once_with(
+            "gemini-2.5-flash", system_instruction=prompts.registry.default.system_instruction
+        )
+
+    def test_module_attribute_is_lazy(self, fresh_model, mock_vertexai_init, mock_generative_model_class):
+        """测试 ai.model 首次访问时创建"""
+        assert "model" not in ai.__dict__
+
+        assert ai.model is mock_generative_model_class.return_value
+        assert ai.__dict__["model"] is ai.model
+
+    @pytest.mark.asyncio
+    async def test_warm_up_creates_model_off_loop(self, fresh_model, mock_vertexai_init,
+                                                  mock_generative_model_class):
+        """测试预热在后台线程创建模型客户端"""
+        import threading
+
+        threads = []
+        mock_vertexai_init.side_effect = lambda **kwargs: threads.append(threading.current_thread())
+
+        await ai.warm_up()
+        await ai.warm_up()
+
+        assert threads and threads[0] is not threading.main_thread()
+        mock_generative_model_class.assert_called_once()
+
+    def test_models_cached_by_profile(self, fresh_model, mock_vertexai_init, mock_generative_model_class, mocker):
+        """测试按对话配置创建模型客户端，内容相同的配置共用同一个客户端"""
+        default = prompts.registry.default
+        coder = prompts.ModelProfile("coder", "gemini-2.5-pro", "写代码", {"temperature": 0.2})
+        twin = prompts.ModelProfile("twin", "gemini-2.5-pro", "写代码", {"temperature": 0.2})
+        same_as_default = prompts.ModelProfile("plain", default.model, default.system_instruction)
+        mocker.patch.object(ai, "_models", {})
+        mock_generative_model_class.side_effect = lambda *args, **kwargs: MagicMock()
+
+        assert ai.get_model(coder) is ai.get_model(twin)
+        assert ai.get_model(same_as_default) is ai.get_model()
+        assert ai.get_model(coder) is not ai.get_model()
+        mock_generative_model_class.assert_any_call(
+            "gemini-2.5-pro", system_instruction="写代码", generation_config={"temperature": 0.2}
+        )
+        assert mock_generative_model_class.call_count == 2
+
+    def test_session_uses_chat_profile(self, fresh_model, mock_vertexai_init, mock_generative_model_class, mocker):
+        """测试配置了模型配置的对话用对应的客户端创建会话，对冲请求复制会话时沿用"""
+        coder = prompts.ModelProfile("coder", "gemini-2.5-pro", "写代码")
+        registry = prompts.ProfileRegistry(prompts.registry.default, {"coder": coder}, {-100: coder})
+        mocker.patch.object(prompts, "registry", registry)
+        mocker.patch.object(ai, "_models", {})
+        models = {}
+
+        def create(name, **kwargs):
+            models[name] = MagicMock()
+            return models[name]
+
+        mock_generative_model_class.side_effect = create
+
+        chat = ai.start_chat([], -100)
+        ai.start_chat([], 42)
+
+        assert chat is models["gemini-2.5-pro"].start_chat.return_value
+        assert models["gemini-2.5-flash"].start_chat.called
+        ai._clone_session(chat)
+        assert models["gemini-2.5-pro"].start_chat.call_count == 2
+
+    def test_session_factory_uses_lazy_model(self, fresh_model, mock_vertexai_init, mock_generative_model_class):
+        """测试新会话通过延迟创建的模型客户端创建"""
+        chat = ai.get_user_chat(42)
+
+        assert chat is mock_generative_model_class.return_value.start_chat.return_value
+
+
+class TestImportTime:
+    """测试导入耗时（python -X importtime）"""
+
+    def test_import_does_not_load_vertex_sdk(self):
+        """测试导入入口模块不加载 vertexai SDK，且耗时不超过预算"""
+        code = (
+            "import json, sys, time\n"
+            "started = time.perf_counter()\n"
+            "import bot.__main__\n"
+            "elapsed = time.perf_counter() - started\n"
+            "print(json.dumps({'elapsed': elapsed, 'vertexai': 'vertexai' in sys.modules}))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, check=True,
+        )
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        # 输出按累计耗时排序的前几项，便于定位回归来源
+        rows = []
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                rows.append((int(parts[1]), parts[2].rstrip()))
+        for cumulative, module in sorted(rows, reverse=True)[:5]:
+            print(f"{cumulative / 1000:8.1f}ms {module}")
+        print(f"导入 bot.__main__ 耗时 {report['elapsed']:.2f}s")
+
+        assert report["vertexai"] is False
+        assert report["elapsed"] < IMPORT_TIME_BUDGET
+
+    def test_import_does_not_open_storage(self, tmp_path):
+        """测试导入处理器与入口模块不创建数据库文件、不启动存储写线程（会话存储在首次使用时创建）"""
+        code = (
+            "import json, threading\n"
+            "import bot.handlers, bot.__main__\n"
+            "print(json.dumps([t.name for t in threading.enumerate()]))\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = {**os.environ, "STORAGE_BACKEND": "sqlite", "STORAGE_PATH": "bot.db",
+               "PYTHONPATH": os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))}
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=tmp_path, env=env, capture_output=True, text=True, check=True,
+        )
+        threads = json.loads(result.stdout.strip().splitlines()[-1])
+
+        assert list(tmp_path.iterdir()) == []
+        assert "storage-writer" not in threads
@@ -86,6 +86,27 @@ class TestConfig:
         # conftest 设置了所有必需的环境变量
         assert Config.validate() is True
 
+    def test_validate_rejects_unknown_bot_mode(self, monkeypatch):
+        """测试未知的运行方式验证失败"""
+        from bot.config import Config
+
+        monkeypatch.setattr(Config, 'BOT_MODE', 'carrier-pigeon')
+
+        with pytest.raises(ValueError):
+            Config.validate()
+
+    def test_validate_webhook_requires_url(self, monkeypatch):
+        """测试 Webhook 模式必须配置公网地址"""
+        from bot.config import Config
+
+        monkeypatch.setattr(Config, 'BOT_MODE', 'webhook')
+        monkeypatch.setattr(Config, 'WEBHOOK_URL', '')
+        with pytest.raises(ValueError):
+            Config.validate()
+
+        monkeypatch.setattr(Config, 'WEBHOOK_URL', 'https://bot.example.com')
+        assert Config.validate() is True
+
     def test_config_has_required_attributes(self):
         """测试 Config 类有所有必需的属性"""
         from bot.config import Config
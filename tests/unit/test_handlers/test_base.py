@@ -91,3 +91,19 @@ class TestHelpCommand:
 
         # 应该包含一些格式符号
         assert len(message) > 50  # 足够详细
+
+
+class TestLocale:
+    """测试按用户语言回复"""
+
+    @pytest.mark.asyncio
+    async def test_help_in_english(self, mock_update, mock_context):
+        """测试 Telegram 语言为英文的用户收到英文帮助"""
+        mock_update.effective_user.language_code = "en"
+
+        await help_cmd(mock_update, mock_context)
+
+        message = mock_update.message.reply_text.call_args[0][0]
+        assert message.startswith("🤖 AI assistant commands")
+        assert "/sleepstatus" in message
+
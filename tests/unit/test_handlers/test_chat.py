@@ -2,7 +2,8 @@
 import pytest
 from unittest.mock import MagicMock, AsyncMock
 
-from bot.handlers.chat import chat_logic
+from bot.handlers.chat import chat_logic, media_logic
+from bot.services.media import UnsupportedMedia
 
 
 class MockAsyncIterator:
@@ -141,3 +142,121 @@ class TestChatLogic:
         await chat_logic(mock_update, mock_context)
 
         mock_update.message.reply_text.assert_called_once_with("")
+
+    @pytest.mark.asyncio
+    async def test_chat_logic_splits_long_response(self, mock_update, mock_context, mocker):
+        """测试超过 4096 字符的回复按段落拆成多条发送，而不是回复出错"""
+        mock_update.effective_user.id = 12345
+        mock_update.message.text = "写一篇长文"
+
+        mock_chat = mocker.MagicMock()
+        paragraphs = ["段落" * 1500 + "\n\n", "段落" * 1500 + "\n\n", "段落" * 1500]
+        mock_chat.send_message = MagicMock(return_value=MockAsyncIterator(paragraphs))
+        mocker.patch('bot.handlers.chat.get_user_chat', return_value=mock_chat)
+
+        await chat_logic(mock_update, mock_context)
+
+        sent = [c.args[0] for c in mock_update.message.reply_text.call_args_list]
+        assert sent == ["段落" * 1500] * 3
+
+    @pytest.mark.asyncio
+    async def test_chat_logic_stream_reply_mode(self, mock_update, mock_context, mocker):
+        """测试流式模式：发送占位消息后编辑为完整回复"""
+        mock_update.effective_user.id = 12345
+        mock_update.message.text = "Hello"
+        mocker.patch('bot.handlers.chat.Config.STREAM_REPLY', True)
+
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+        mock_update.message.reply_text = AsyncMock(return_value=placeholder)
+
+        mock_chat = mocker.MagicMock()
+        mock_chat.send_message = MagicMock(return_value=MockAsyncIterator(["Hi ", "there"]))
+        mocker.patch('bot.handlers.chat.get_user_chat', return_value=mock_chat)
+
+        await chat_logic(mock_update, mock_context)
+
+        mock_update.message.reply_text.assert_called_once_with("…")
+        placeholder.edit_text.assert_called_with("Hi there")
+
+    @pytest.mark.asyncio
+    async def test_chat_logic_merges_rapid_messages(self, mock_update, mock_context, mocker):
+        """测试同一用户快速连发的消息合并为一次模型调用"""
+        import asyncio
+        from bot.services import inbox
+
+        mocker.patch.object(inbox.chat_inbox, 'debounce', 0.05)
+        mock_chat = mocker.MagicMock()
+        mock_chat.send_message = MagicMock(return_value=MockAsyncIterator(["ok"]))
+        mocker.patch('bot.handlers.chat.get_user_chat', return_value=mock_chat)
+
+        updates = []
+        for text in ["第一句", "第二句", "第三句"]:
+            update = MagicMock()
+            update.effective_user.id = 12345
+            update.effective_chat.id = 12345
+            update.message.text = text
+            update.message.reply_text = AsyncMock()
+            updates.append(update)
+
+        await asyncio.gather(*(chat_logic(u, mock_context) for u in updates))
+
+        mock_chat.send_message.assert_called_once_with("第一句\n第二句\n第三句", stream=True)
+        updates[0].message.reply_text.assert_called_once_with("ok")
+        updates[1].message.reply_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_group_shares_context_per_chat(self, mock_context, mocker):
+        """测试群组中不同成员共用该群组的会话，发言去掉提及并注明成员"""
+        from bot.services import groups
+
+        addressed = groups.AddressedFilter()
+        addressed.configure("test_bot", 999)
+        mocker.patch('bot.services.groups.addressed', addressed)
+        mock_chat = mocker.MagicMock()
+        mock_chat.send_message = MagicMock(return_value=MockAsyncIterator(["ok"]))
+        get_chat = mocker.patch('bot.handlers.chat.get_user_chat', return_value=mock_chat)
+
+        for user_id, name in [(1, "Alice"), (2, "Bob")]:
+            update = MagicMock()
+            update.effective_user.id = user_id
+            update.effective_user.full_name = name
+            update.effective_chat.id = -500
+            update.effective_chat.type = "supergroup"
+            update.effective_message.is_topic_message = False
+            update.message.text = "@test_bot 你好"
+            update.message.reply_text = AsyncMock()
+            await chat_logic(update, mock_context)
+
+        assert [c.args[0] for c in get_chat.call_args_list] == [-500, -500]
+        assert [c.args[0] for c in mock_chat.send_message.call_args_list] == ["Alice：你好", "Bob：你好"]
+
+
+class TestMediaLogic:
+    """测试 media_logic 函数"""
+
+    @pytest.mark.asyncio
+    async def test_media_is_sent_with_caption(self, mock_update, mock_context, mocker):
+        """测试附件与说明文字一起发给模型"""
+        image = MagicMock()
+        mocker.patch('bot.handlers.chat.message_parts', AsyncMock(return_value=[image, "这是什么？"]))
+        mock_chat = mocker.MagicMock()
+        mock_chat.send_message = MagicMock(return_value=MockAsyncIterator(["一朵花"]))
+        mocker.patch('bot.handlers.chat.get_user_chat', return_value=mock_chat)
+
+        await media_logic(mock_update, mock_context)
+
+        mock_context.bot.send_chat_action.assert_called_once()
+        mock_chat.send_message.assert_called_once_with([image, "这是什么？"], stream=True)
+        mock_update.message.reply_text.assert_called_once_with("一朵花")
+
+    @pytest.mark.asyncio
+    async def test_unsupported_media_is_explained(self, mock_update, mock_context, mocker):
+        """测试无法处理的附件直接回复原因，不调用模型"""
+        mocker.patch('bot.handlers.chat.message_parts', AsyncMock(side_effect=UnsupportedMedia("暂不支持")))
+        get_chat = mocker.patch('bot.handlers.chat.get_user_chat')
+
+        await media_logic(mock_update, mock_context)
+
+        mock_update.message.reply_text.assert_called_once_with("暂不支持")
+        get_chat.assert_not_called()
@@ -1,10 +1,9 @@
 """睡眠提醒命令处理器单元测试"""
 import pytest
-from datetime import time, datetime
-from unittest.mock import MagicMock, AsyncMock
+from datetime import time
 
 from bot.handlers.sleep import sleep_on, sleep_off, sleep_status
-from bot.services.reminder import sleep_reminder_users
+from bot.services.reminder import reminder_engine, sleep_reminder_users
 from bot.config import Config
 
 
@@ -19,11 +18,11 @@ class TestSleepOnCommand:
 
         await sleep_on(mock_update, mock_context)
 
-        # 验证创建了任务
-        mock_context.job_queue.run_daily.assert_called_once()
-        call_args = mock_context.job_queue.run_daily.call_args
-        assert call_args[1]["name"] == "sleep_reminder_12345"
-        assert call_args[1]["data"]["chat_id"] == 12345
+        # 验证订阅到默认时间的分钟桶，不再为每个用户创建任务
+        default_time = reminder_engine.status(12345)["time"]
+        assert reminder_engine.status(12345)["time_str"] == Config.DEFAULT_REMINDER_TIME
+        assert 12345 in reminder_engine.due(default_time.hour, default_time.minute)
+        mock_context.job_queue.run_daily.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_sleep_on_with_custom_time(self, mock_update, mock_context):
@@ -33,10 +32,54 @@ class TestSleepOnCommand:
 
         await sleep_on(mock_update, mock_context)
 
-        # 验证创建了任务
-        mock_context.job_queue.run_daily.assert_called_once()
-        call_args = mock_context.job_queue.run_daily.call_args
-        assert call_args[1]["data"]["time_str"] == "22:00"
+        assert reminder_engine.due(22, 0) == {12345}
+        assert reminder_engine.status(12345)["time_str"] == "22:00"
+
+    @pytest.mark.asyncio
+    async def test_sleep_on_with_timezone(self, mock_update, mock_context):
+        """测试 /sleepon 指定时区"""
+        from bot.services.storage import get_storage
+
+        mock_update.effective_chat.id = 12345
+        mock_context.args = ["23:30", "Europe/Berlin"]
+
+        await sleep_on(mock_update, mock_context)
+
+        assert reminder_engine.status(12345)["tz"] == "Europe/Berlin"
+        assert get_storage().load_reminders() == [(12345, "23:30 Europe/Berlin")]
+        message = mock_update.message.reply_text.call_args[0][0]
+        assert "Europe/Berlin" in message
+
+    @pytest.mark.asyncio
+    async def test_sleep_on_with_unknown_timezone(self, mock_update, mock_context):
+        """测试 /sleepon 使用未知时区"""
+        mock_update.effective_chat.id = 12345
+        mock_context.args = ["23:30", "Mars/Olympus"]
+
+        await sleep_on(mock_update, mock_context)
+
+        message = mock_update.message.reply_text.call_args[0][0]
+        assert "未知的时区" in message
+        assert 12345 not in sleep_reminder_users
+
+    @pytest.mark.asyncio
+    async def test_sleep_on_in_users_language(self, mock_update, mock_context):
+        """测试错误提示与之后的提醒使用用户的 Telegram 语言"""
+        from bot.services.storage import get_storage
+
+        mock_update.effective_chat.id = 12345
+        mock_update.effective_user.language_code = "en-US"
+        mock_context.args = ["23:30", "Mars/Olympus"]
+
+        await sleep_on(mock_update, mock_context)
+
+        assert "Unknown timezone: Mars/Olympus" in mock_update.message.reply_text.call_args[0][0]
+
+        mock_context.args = ["23:30"]
+        await sleep_on(mock_update, mock_context)
+
+        assert reminder_engine.status(12345)["locale"] == "en"
+        assert get_storage().load_reminders() == [(12345, "23:30 en")]
 
     @pytest.mark.asyncio
     async def test_sleep_on_with_invalid_time(self, mock_update, mock_context):
@@ -52,20 +95,16 @@ class TestSleepOnCommand:
         assert "时间格式错误" in message or "格式示例" in message
 
     @pytest.mark.asyncio
-    async def test_sleep_on_removes_existing_job(self, mock_update, mock_context):
-        """测试 /sleepon 删除已存在的任务"""
+    async def test_sleep_on_replaces_existing_time(self, mock_update, mock_context):
+        """测试 /sleepon 修改时间时替换旧的提醒"""
         mock_update.effective_chat.id = 12345
+        reminder_engine.subscribe(12345, "22:00")
         mock_context.args = ["23:00"]
 
-        # 模拟已存在的任务
-        existing_job = MagicMock()
-        existing_job.schedule_removal = MagicMock()
-        mock_context.job_queue.get_jobs_by_name.return_value = [existing_job]
-
         await sleep_on(mock_update, mock_context)
 
-        # 验证删除了旧任务
-        existing_job.schedule_removal.assert_called_once()
+        assert reminder_engine.due(22, 0) == set()
+        assert reminder_engine.due(23, 0) == {12345}
 
     @pytest.mark.asyncio
     async def test_sleep_on_stores_reminder_in_dict(self, mock_update, mock_context):
@@ -80,6 +119,18 @@ class TestSleepOnCommand:
         assert chat_id in sleep_reminder_users
         assert "time" in sleep_reminder_users[chat_id]
 
+    @pytest.mark.asyncio
+    async def test_sleep_on_persists_reminder(self, mock_update, mock_context):
+        """测试 /sleepon 持久化提醒设置"""
+        from bot.services.storage import get_storage
+
+        mock_update.effective_chat.id = 12345
+        mock_context.args = ["22:30"]
+
+        await sleep_on(mock_update, mock_context)
+
+        assert get_storage().load_reminders() == [(12345, "22:30")]
+
     @pytest.mark.asyncio
     async def test_sleep_on_sends_confirmation(self, mock_update, mock_context):
         """测试 /sleepon 发送确认消息"""
@@ -118,18 +169,25 @@ class TestSleepOffCommand:
         # 先添加用户到字典
         sleep_reminder_users[chat_id] = {"time": time(23, 30)}
 
-        # 模拟任务存在
-        mock_job = MagicMock()
-        mock_job.schedule_removal = MagicMock()
-        mock_context.job_queue.get_jobs_by_name.return_value = [mock_job]
-
         await sleep_off(mock_update, mock_context)
 
-        # 验证删除了任务
-        mock_job.schedule_removal.assert_called_once()
         # 验证从字典中移除
         assert chat_id not in sleep_reminder_users
 
+    @pytest.mark.asyncio
+    async def test_sleep_off_deletes_persisted_reminder(self, mock_update, mock_context):
+        """测试 /sleepoff 删除持久化的提醒"""
+        from bot.services.storage import get_storage
+
+        chat_id = 12345
+        mock_update.effective_chat.id = chat_id
+        sleep_reminder_users[chat_id] = {"time": time(23, 30)}
+        get_storage().save_reminder(chat_id, "23:30")
+
+        await sleep_off(mock_update, mock_context)
+
+        assert get_storage().load_reminders() == []
+
     @pytest.mark.asyncio
     async def test_sleep_off_when_not_enabled(self, mock_update, mock_context):
         """测试 /sleepoff 当提醒未开启时"""
@@ -147,10 +205,6 @@ class TestSleepOffCommand:
         mock_update.effective_chat.id = chat_id
         sleep_reminder_users[chat_id] = {"time": time(23, 30)}
 
-        mock_job = MagicMock()
-        mock_job.schedule_removal = MagicMock()
-        mock_context.job_queue.get_jobs_by_name.return_value = [mock_job]
-
         await sleep_off(mock_update, mock_context)
 
         message = mock_update.message.reply_text.call_args[0][0]
@@ -193,16 +247,13 @@ class TestSleepStatusCommand:
         mock_update.effective_chat.id = chat_id
         sleep_reminder_users[chat_id] = {"time": time(22, 30)}
 
-        # 模拟任务存在并设置下次运行时间
-        mock_job = MagicMock()
-        next_time = datetime(2024, 1, 1, 22, 30, 0)
-        mock_job.next_t = next_time
-        mock_context.job_queue.get_jobs_by_name.return_value = [mock_job]
+        reminder_engine.subscribe(chat_id, "22:30")
 
         await sleep_status(mock_update, mock_context)
 
         message = mock_update.message.reply_text.call_args[0][0]
         assert "下次提醒" in message
+        assert reminder_engine.next_run(chat_id).strftime("%Y-%m-%d %H:%M:%S") in message
 
     @pytest.mark.asyncio
     async def test_sleep_status_includes_management_commands(self, mock_update, mock_context):
@@ -0,0 +1,166 @@
+"""运行方式与退出排空单元测试"""
+import asyncio
+import time
+
+import pytest
+from unittest.mock import MagicMock
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from bot import server
+from bot.server import DrainingApplication
+from tests.fixtures.telegram_api import FakeBotAPI, make_update
+
+
+class TestWebhookOptions:
+    """测试 Webhook 参数"""
+
+    def test_options_behind_tls_proxy(self, mocker):
+        """测试未配置证书时监听明文 HTTP，由反向代理终止 TLS"""
+        config = server.Config
+        mocker.patch.multiple(
+            config,
+            WEBHOOK_URL="https://bot.example.com/",
+            WEBHOOK_PATH="/hook",
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=8080,
+            WEBHOOK_SECRET_TOKEN="s3cret",
+            WEBHOOK_MAX_CONNECTIONS=80,
+            WEBHOOK_CERT="",
+        )
+
+        options = server.webhook_options()
+
+        assert options == {
+            "listen": "127.0.0.1",
+            "port": 8080,
+            "url_path": "hook",
+            "webhook_url": "https://bot.example.com/hook",
+            "secret_token": "s3cret",
+            "max_connections": 80,
+        }
+
+    def test_options_with_certificate(self, mocker):
+        """测试配置证书时由本进程终止 TLS"""
+        mocker.patch.multiple(
+            server.Config,
+            WEBHOOK_URL="https://bot.example.com",
+            WEBHOOK_CERT="cert.pem",
+            WEBHOOK_KEY="key.pem",
+            WEBHOOK_SECRET_TOKEN="",
+        )
+
+        options = server.webhook_options()
+
+        assert options["cert"] == "cert.pem"
+        assert options["key"] == "key.pem"
+        assert options["secret_token"] is None
+
+
+class TestRun:
+    """测试按配置选择运行方式"""
+
+    def test_polling_by_default(self, mocker):
+        """测试默认使用长轮询"""
+        mocker.patch.object(server.Config, 'BOT_MODE', 'polling')
+        app = MagicMock()
+
+        server.run(app)
+
+        app.run_polling.assert_called_once_with()
+        app.run_webhook.assert_not_called()
+
+    def test_webhook_mode(self, mocker):
+        """测试 webhook 模式以配置参数启动 Webhook 服务器"""
+        mocker.patch.multiple(server.Config, BOT_MODE="webhook", WEBHOOK_URL="https://bot.example.com")
+        app = MagicMock()
+
+        server.run(app)
+
+        app.run_webhook.assert_called_once_with(**server.webhook_options())
+        app.run_polling.assert_not_called()
+
+
+def build_app(api, handler, drain_timeout):
+    app = (
+        ApplicationBuilder()
+        .application_class(DrainingApplication, kwargs={"drain_timeout": drain_timeout})
+        .token("123:TEST")
+        .request(api)
+        .get_updates_request(api)
+        .concurrent_updates(True)
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT, handler))
+    return app
+
+
+class TestDrainingApplication:
+    """测试退出时排空处理中的更新"""
+
+    @pytest.mark.asyncio
+    async def test_stop_waits_for_in_flight_updates(self):
+        """测试退出时等待处理中的更新完成"""
+        finished = []
+
+        async def handler(update, context):
+            await asyncio.sleep(0.2)
+            finished.append(update.update_id)
+
+        app = build_app(FakeBotAPI(), handler, drain_timeout=5)
+        async with app:
+            await app.start()
+            for i in range(1, 4):
+                await app.update_queue.put(Update.de_json(make_update(i, i, "hi"), app.bot))
+            await asyncio.sleep(0.05)
+            assert app.in_flight == 3
+            await app.stop()
+
+        assert sorted(finished) == [1, 2, 3]
+        assert app.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_stop_cancels_after_drain_timeout(self):
+        """测试超过排空时限的更新被取消，退出不被拖住"""
+        cancelled = []
+
+        async def handler(update, context):
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(update.update_id)
+                raise
+
+        app = build_app(FakeBotAPI(), handler, drain_timeout=0.1)
+        async with app:
+            await app.start()
+            await app.update_queue.put(Update.de_json(make_update(1, 1, "hi"), app.bot))
+            await asyncio.sleep(0.05)
+
+            started = time.perf_counter()
+            await app.stop()
+            elapsed = time.perf_counter() - started
+
+        assert cancelled == [1]
+        assert elapsed < 2
+
+    @pytest.mark.asyncio
+    async def test_stop_bounds_reminder_broadcasts(self):
+        """测试后台发送中的睡眠提醒与更新共用排空时限，超时取消，退出不被一大批限速发送拖住"""
+        from bot.services.reminder import reminder_engine
+
+        async def handler(update, context):
+            pass
+
+        app = build_app(FakeBotAPI(), handler, drain_timeout=0.1)
+        async with app:
+            await app.start()
+            task = app.create_task(asyncio.sleep(30))
+            reminder_engine._dispatches[task] = "15:30"
+
+            started = time.perf_counter()
+            await app.stop()
+            elapsed = time.perf_counter() - started
+
+        assert task.cancelled()
+        assert elapsed < 2
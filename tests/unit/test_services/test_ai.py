@@ -77,13 +77,14 @@ class TestResetUserChat:
 
 
 class TestUserChats:
-    """测试 user_chats 全局字典"""
+    """测试 user_chats 全局会话存储"""
 
-    def test_user_chats_is_dict(self):
-        """测试 user_chats 是字典"""
+    def test_user_chats_is_session_store(self):
+        """测试 user_chats 是有界会话存储"""
         from bot.services.ai import user_chats
+        from bot.services.session import SessionStore
 
-        assert isinstance(user_chats, dict)
+        assert isinstance(user_chats, SessionStore)
 
     def test_user_chats_persists_across_calls(self):
         """测试 user_chats 在调用间持久化"""
@@ -112,3 +113,555 @@ class TestVertexAIInitialization:
         from bot.services.ai import model
 
         assert hasattr(model, '_model_name') or hasattr(model, 'model_name')
+
+
+class TestStreamMessage:
+    """测试 stream_message 异步流式调用"""
+
+    @pytest.mark.asyncio
+    async def test_stream_message_uses_native_async(self):
+        """测试优先使用原生 send_message_async"""
+        from bot.services.ai import stream_message
+        from tests.fixtures.vertex import FakeAsyncChatSession
+
+        chat = FakeAsyncChatSession(chunks=["a", "b", "c"])
+        chat.send_message = MagicMock(side_effect=AssertionError("不应调用同步接口"))
+
+        result = [text async for text in stream_message(chat, "hi")]
+
+        assert result == ["a", "b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_stream_message_falls_back_to_executor(self):
+        """测试不支持原生异步时使用线程池迭代同步流"""
+        from bot.services.ai import stream_message
+        from tests.fixtures.vertex import FakeChatSession
+
+        chat = FakeChatSession(chunks=["x", "y"])
+
+        result = [text async for text in stream_message(chat, "hi")]
+
+        assert result == ["x", "y"]
+
+    @pytest.mark.asyncio
+    async def test_stream_message_propagates_errors(self):
+        """测试同步接口的异常会传递给调用方"""
+        from bot.services.ai import stream_message
+
+        chat = MagicMock()
+        chat.send_message = MagicMock(side_effect=RuntimeError("boom"))
+
+        with pytest.raises(RuntimeError, match="boom"):
+            async for _ in stream_message(chat, "hi"):
+                pass
+
+    @pytest.mark.asyncio
+    async def test_stream_message_goes_through_limiter(self):
+        """测试调用经过全局限流器并计入完成数"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FakeAsyncChatSession
+
+        before = ai.limiter.completed
+
+        result = [text async for text in ai.stream_message(FakeAsyncChatSession(chunks=["a"]), "hi", user_id=1)]
+
+        assert result == ["a"]
+        assert ai.limiter.completed == before + 1
+        assert ai.limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_slow_consumer_does_not_lower_concurrency(self, mocker):
+        """测试限流器按首个分块的等待时间调整并发：调用方消费回复较慢（编辑消息、等待限流）不压低并发上限"""
+        import asyncio
+        from bot.services import ai
+        from tests.fixtures.vertex import FakeAsyncChatSession
+
+        mocker.patch.object(ai.limiter, "latency_target", 0.02)
+        mocker.patch.object(ai.limiter, "limit", 8.0)
+
+        async for _ in ai.stream_message(FakeAsyncChatSession(chunks=["a", "b", "c"]), "hi", user_id=1):
+            await asyncio.sleep(0.02)
+
+        assert ai.limiter.limit > 8.0
+
+    @pytest.mark.asyncio
+    async def test_stream_message_does_not_block_event_loop(self):
+        """测试同步流式调用期间事件循环仍可调度其他任务"""
+        import asyncio
+        from bot.services.ai import stream_message
+        from tests.fixtures.vertex import FakeChatSession
+
+        chat = FakeChatSession(chunks=["ok"], latency=0.3)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        async for _ in stream_message(chat, "hi"):
+            pass
+        task.cancel()
+
+        # 阻塞 0.3 秒期间 ticker 应持续运行
+        assert ticks >= 10
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("session_cls", ["FakeChatSession", "FakeAsyncChatSession"])
+    async def test_concurrent_users_complete_in_max_latency(self, session_cls):
+        """负载基准：N 个并发用户的总耗时约为 max(latency) 而非 sum(latency)"""
+        import asyncio
+        import time
+        from bot.services.ai import stream_message
+        from tests.fixtures import vertex
+
+        users = 16
+        latency = 0.2
+        chats = [getattr(vertex, session_cls)(chunks=["ok"], latency=latency) for _ in range(users)]
+
+        async def one_turn(chat):
+            return [text async for text in stream_message(chat, "hi")]
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one_turn(chat) for chat in chats))
+        elapsed = time.perf_counter() - started
+
+        print(f"\n{session_cls}: {users} 个并发用户耗时 {elapsed:.3f}s "
+              f"(max={latency:.3f}s, sum={latency * users:.3f}s)")
+        assert all(r == ["ok"] for r in results)
+        assert elapsed < latency * 3
+
+
+class TestRetryAndHedge:
+    """测试模型调用的重试与对冲请求"""
+
+    @pytest.fixture(autouse=True)
+    def fast_retry(self, mocker):
+        """退避时间缩短为 0，避免测试等待"""
+        from bot.services import ai
+
+        mocker.patch.object(ai.retry_policy, 'base_delay', 0)
+        mocker.patch.object(ai.retry_policy, 'max_attempts', 3)
+        ai.call_stats.update(retries=0, hedges=0, hedge_wins=0)
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_error_before_first_chunk(self):
+        """测试首个分块前的瞬时错误会被重试"""
+        from google.api_core.exceptions import ServiceUnavailable
+        from bot.services import ai
+        from tests.fixtures.vertex import FakeAsyncChatSession
+
+        chat = FakeAsyncChatSession(chunks=["ok"])
+        original = chat.send_message_async
+        calls = []
+
+        async def flaky(content, stream=False):
+            calls.append(content)
+            if len(calls) < 3:
+                raise ServiceUnavailable("down")
+            return await original(content, stream=stream)
+
+        chat.send_message_async = flaky
+
+        result = [text async for text in ai.stream_message(chat, "hi")]
+
+        assert result == ["ok"]
+        assert len(calls) == 3
+        assert ai.call_stats["retries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self):
+        """测试超过最大次数后抛出最后一次的错误"""
+        from google.api_core.exceptions import ServiceUnavailable
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        chat = FaultyModel(error_rate=1.0, latency=0).start_chat()
+
+        with pytest.raises(ServiceUnavailable):
+            [text async for text in ai.stream_message(chat, "hi")]
+
+        assert chat.model.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_fatal_error_is_not_retried(self):
+        """测试致命错误不重试"""
+        from bot.services import ai
+
+        chat = MagicMock()
+        chat.send_message.side_effect = ValueError("blocked")
+
+        with pytest.raises(ValueError):
+            [text async for text in ai.stream_message(chat, "hi")]
+
+        assert chat.send_message.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_no_retry_after_partial_output(self):
+        """测试已输出部分内容后出错不重试，避免重复内容"""
+        from google.api_core.exceptions import ServiceUnavailable
+        from bot.services import ai
+
+        def broken(content, stream=False):
+            yield MagicMock(text="part")
+            raise ServiceUnavailable("down")
+
+        chat = MagicMock()
+        chat.send_message.side_effect = broken
+
+        received = []
+        with pytest.raises(ServiceUnavailable):
+            async for text in ai.stream_message(chat, "hi"):
+                received.append(text)
+
+        assert received == ["part"]
+        assert chat.send_message.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_hedge_wins_when_primary_is_slow(self, mocker):
+        """测试主请求首个分块迟迟未到时，对冲请求胜出并同步历史"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyChatSession, FaultyModel
+
+        mocker.patch.object(ai.Config, 'AI_HEDGE_AFTER', 0.05)
+        fast = FaultyModel(latency=0.01, chunks=["fast"])
+        slow = FaultyModel(latency=5, chunks=["slow"])
+        chat = FaultyChatSession(slow)
+        mocker.patch.object(ai, 'model', fast)
+
+        result = [text async for text in ai.stream_message(chat, "hi")]
+
+        assert result == ["fast"]
+        assert chat.history == ["hi", "fast"]
+        assert ai.call_stats["hedges"] == 1
+        assert ai.call_stats["hedge_wins"] == 1
+        assert ai.limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_hedge_win_keeps_summary_written_during_call(self, mocker):
+        """测试对冲请求胜出时只追加本轮问答，保留调用期间后台摘要对用户会话历史的改写"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyChatSession, FaultyModel
+
+        mocker.patch.object(ai.Config, 'AI_HEDGE_AFTER', 0.05)
+        fast = FaultyModel(latency=0.01, chunks=["fast"])
+        slow = FaultyModel(latency=5, chunks=["slow"])
+        chat = FaultyChatSession(slow, ["问题一", "回答一", "问题二", "回答二"])
+        mocker.patch.object(ai, 'model', fast)
+
+        result = []
+        async for text in ai.stream_message(chat, "hi"):
+            result.append(text)
+            chat.history[:] = ["摘要", "好的"]
+
+        assert result == ["fast"]
+        assert chat.history == ["摘要", "好的", "hi", "fast"]
+        assert ai.call_stats["hedge_wins"] == 1
+
+    @pytest.mark.asyncio
+    async def test_no_hedge_when_primary_is_fast(self, mocker):
+        """测试主请求及时返回时不发出对冲请求"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        mocker.patch.object(ai.Config, 'AI_HEDGE_AFTER', 0.5)
+        model = FaultyModel(latency=0.01)
+        mocker.patch.object(ai, 'model', model)
+        chat = model.start_chat()
+
+        result = [text async for text in ai.stream_message(chat, "hi")]
+
+        assert result == ["ok"]
+        assert model.calls == 1
+        assert ai.call_stats["hedges"] == 0
+
+    @pytest.mark.asyncio
+    @pytest.mark.slow
+    async def test_tail_latency_benchmark(self, mocker):
+        """基准：注入 10% 错误与 5% 慢请求，比较不重试 / 重试 / 重试 + 对冲的成功率与尾延迟"""
+        import asyncio
+        import time
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        requests = 400
+
+        async def run(attempts, hedge_after):
+            model = FaultyModel(error_rate=0.1, slow_rate=0.05, latency=0.02, slow_latency=1.0, seed=1)
+            mocker.patch.object(ai, 'model', model)
+            mocker.patch.object(ai.retry_policy, 'max_attempts', attempts)
+            mocker.patch.object(ai.Config, 'AI_HEDGE_AFTER', hedge_after)
+
+            async def one():
+                started = time.perf_counter()
+                try:
+                    [text async for text in ai.stream_message(model.start_chat(), "hi")]
+                except Exception:
+                    return None
+                return time.perf_counter() - started
+
+            results = await asyncio.gather(*(one() for _ in range(requests)))
+            latencies = sorted(r for r in results if r is not None)
+            success = len(latencies) / requests
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            return success, p50, p99
+
+        mocker.patch.object(ai.limiter, 'max_concurrency', 1000)
+        mocker.patch.object(ai.limiter, 'limit', 1000.0)
+        baseline = await run(1, 0)
+        retried = await run(3, 0)
+        hedged = await run(3, 0.1)
+
+        for name, (success, p50, p99) in [("不重试", baseline), ("重试", retried), ("重试+对冲", hedged)]:
+            print(f"\n{name}: 成功率 {success:.1%}, p50={p50 * 1000:.0f}ms, p99={p99 * 1000:.0f}ms")
+
+        assert retried[0] > baseline[0]
+        assert hedged[0] >= 0.99
+        assert hedged[2] < retried[2] / 2
+
+
+class TestResponseCache:
+    """测试回复缓存与模型调用的衔接"""
+
+    @pytest.fixture
+    def cache(self, mocker):
+        from bot.services import ai
+        from bot.services.cache import ResponseCache
+
+        cache = ResponseCache(max_entries=10, ttl=60)
+        mocker.patch.object(ai, 'response_cache', cache)
+        return cache
+
+    @pytest.mark.asyncio
+    async def test_cache_hit_skips_model(self, cache):
+        """测试相同提问第二次命中缓存，不调用模型并补写历史"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        model = FaultyModel(chunks=["你好", "！"])
+        first = model.start_chat()
+        second = model.start_chat()
+
+        assert [t async for t in ai.stream_message(first, "你好")] == ["你好", "！"]
+        assert [t async for t in ai.stream_message(second, "你好")] == ["你好！"]
+
+        assert model.calls == 1
+        assert len(second.history) == 2
+        assert cache.stats()["hit_rate"] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_failed_call_is_not_cached(self, cache, mocker):
+        """测试调用失败时不写入缓存"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        mocker.patch.object(ai.retry_policy, 'max_attempts', 1)
+        chat = FaultyModel(error_rate=1.0, latency=0).start_chat()
+
+        with pytest.raises(Exception):
+            [t async for t in ai.stream_message(chat, "hi")]
+
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_cache_disabled_by_default(self):
+        """测试默认不启用回复缓存"""
+        from bot.services import ai
+
+        assert ai.response_cache is None
+
+
+class TestModelRouting:
+    """测试按轮次选择模型与改用备用模型"""
+
+    @pytest.fixture
+    def models(self, mocker):
+        """会话使用的便宜模型、强模型与备用模型（按派生配置注入模型客户端缓存）"""
+        from bot.services import ai, prompts
+        from bot.services.routing import ModelRouter
+        from tests.fixtures.vertex import FaultyModel
+
+        router = ModelRouter(strong_model="strong", fallback_model="backup", long_prompt=50, failure_threshold=2)
+        mocker.patch.object(ai, 'router', router)
+        mocker.patch.object(ai.retry_policy, 'base_delay', 0)
+        fast = FaultyModel(latency=0, chunks=["fast"])
+        strong = FaultyModel(latency=0, chunks=["strong"])
+        backup = FaultyModel(latency=0, chunks=["backup"])
+        mocker.patch.object(ai, 'model', fast)
+        default = prompts.registry.default
+        mocker.patch.object(ai, '_models', {
+            router.derive(default, "strong").key: strong,
+            router.derive(default, "backup").key: backup,
+        })
+        return fast, strong, backup
+
+    @pytest.mark.asyncio
+    async def test_short_turn_uses_session_model(self, models):
+        """测试简短的提问使用会话本身的模型"""
+        from bot.services import ai
+
+        fast, strong, _ = models
+        chat = fast.start_chat()
+
+        assert [t async for t in ai.stream_message(chat, "你好", user_id=1)] == ["fast"]
+        assert strong.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_complex_turn_uses_strong_model(self, models):
+        """测试包含代码的提问使用强模型，本轮问答同步回用户会话"""
+        from bot.services import ai
+        from bot.services.routing import ROUTE_SECONDS, ROUTE_TOKENS
+
+        fast, strong, _ = models
+        chat = fast.start_chat()
+        chat.history.extend(["之前", "的对话"])
+        seconds = ROUTE_SECONDS.labels("strong", "strong")
+        before = seconds.count
+
+        result = [t async for t in ai.stream_message(chat, "```\nprint(1)\n```", user_id=1)]
+
+        assert result == ["strong"]
+        assert (fast.calls, strong.calls) == (0, 1)
+        assert chat.history == ["之前", "的对话", "```\nprint(1)\n```", "strong"]
+        assert seconds.count == before + 1
+        assert ROUTE_TOKENS.labels("strong", "strong", "output").value > 0
+
+    @pytest.mark.asyncio
+    async def test_routed_turn_keeps_summary_written_during_call(self, models):
+        """测试路由期间后台摘要改写了用户会话的历史：只追加本轮问答，不用副本的历史覆盖"""
+        from bot.services import ai
+
+        fast, _, _ = models
+        chat = fast.start_chat()
+        chat.history.extend(["问题一", "回答一", "问题二", "回答二"])
+
+        result = []
+        async for text in ai.stream_message(chat, "```\nprint(1)\n```", user_id=1):
+            result.append(text)
+            chat.history[:] = ["摘要", "好的"]
+
+        assert result == ["strong"]
+        assert chat.history == ["摘要", "好的", "```\nprint(1)\n```", "strong"]
+
+    @pytest.mark.asyncio
+    async def test_falls_back_when_primary_errors(self, models):
+        """测试主模型出错时立即改用备用模型，连续失败后直接路由到备用模型"""
+        from bot.services import ai
+
+        fast, _, backup = models
+        fast.error_rate = 1.0
+
+        for _ in range(2):
+            assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=1)] == ["backup"]
+        assert (fast.calls, backup.calls) == (2, 2)
+        assert ai.call_stats["fallbacks"] == 2
+        assert ai.call_stats["retries"] == 0
+
+        # 主模型进入冷却：不再尝试
+        assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=1)] == ["backup"]
+        assert fast.calls == 2
+        assert ai.router.stats()["in_flight"] == {}
+
+    @pytest.mark.asyncio
+    async def test_cache_is_scoped_by_routed_model(self, models, mocker):
+        """测试回复缓存按本轮路由到的模型区分：强模型的回复不会返回给便宜模型的轮次，反之亦然；备用模型的回复不缓存"""
+        from bot.services import ai
+        from bot.services.cache import ResponseCache
+
+        mocker.patch.object(ai, 'response_cache', ResponseCache(max_entries=10, ttl=60))
+        mocker.patch.object(ai.router, 'user_tiers', {2: "strong"})
+        fast, strong, backup = models
+
+        assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=1)] == ["fast"]
+        assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=2)] == ["strong"]
+        assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=3)] == ["fast"]
+        assert [t async for t in ai.stream_message(fast.start_chat(), "你好", user_id=2)] == ["strong"]
+        assert (fast.calls, strong.calls) == (1, 1)
+
+        strong.error_rate = 1.0
+        assert [t async for t in ai.stream_message(fast.start_chat(), "再见", user_id=2)] == ["backup"]
+        strong.error_rate = 0.0
+        assert [t async for t in ai.stream_message(fast.start_chat(), "再见", user_id=2)] == ["strong"]
+        assert backup.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_non_transient_error_does_not_fall_back(self, models):
+        """测试内容被拦截等非瞬时错误不改用备用模型"""
+        from bot.services import ai
+
+        chat = MagicMock()
+        chat.history = []
+        chat.send_message.side_effect = ValueError("blocked")
+
+        with pytest.raises(ValueError):
+            [t async for t in ai.stream_message(chat, "你好")]
+        assert models[2].calls == 0
+
+
+class TestSessionHandoff:
+    """测试分片重新平衡时的会话交接"""
+
+    def test_export_and_import_sessions(self):
+        """测试交出的会话在另一进程恢复为带历史的新会话"""
+        from bot.services import ai
+        from bot.services.history import make_content
+
+        for user_id in (1, 2):
+            ai.get_user_chat(user_id).history.extend(
+                [make_content("user", f"hi {user_id}"), make_content("model", "hello")]
+            )
+
+        blobs = ai.export_sessions(keep=lambda user_id: user_id == 2)
+
+        assert set(blobs) == {1}
+        assert 1 not in ai.user_chats and 2 in ai.user_chats
+
+        ai.import_sessions(blobs)
+
+        history = ai.user_chats[1].history
+        assert [c.role for c in history] == ["user", "model"]
+        assert history[0].parts[0].text == "hi 1"
+
+
+class TestHistoryIntegration:
+    """测试会话与历史管理的衔接"""
+
+    def test_touch_user_chat_compacts_history(self, mocker):
+        """测试每轮结束后按预算整理历史"""
+        from bot.services import ai
+
+        mock_compact = mocker.patch.object(ai.history_manager, 'compact')
+        chat = ai.get_user_chat(12345)
+
+        ai.touch_user_chat(12345)
+
+        mock_compact.assert_called_once_with(12345, chat)
+
+    def test_reset_user_chat_forgets_summary(self, mocker):
+        """测试重置会话时丢弃摘要状态"""
+        from bot.services import ai
+
+        mock_forget = mocker.patch.object(ai.history_manager, 'forget')
+
+        ai.reset_user_chat(12345)
+
+        mock_forget.assert_called_once_with(12345)
+
+    @pytest.mark.asyncio
+    async def test_summarize_history_calls_model(self, mocker):
+        """测试摘要通过模型异步生成"""
+        from bot.services import ai
+
+        response = MagicMock()
+        response.text = " 新摘要 "
+        mocker.patch.object(ai.model, 'generate_content_async', AsyncMock(return_value=response))
+
+        result = await ai.summarize_history("旧摘要", "用户: hi")
+
+        assert result == "新摘要"
+        prompt = ai.model.generate_content_async.call_args[0][0]
+        assert "旧摘要" in prompt and "用户: hi" in prompt
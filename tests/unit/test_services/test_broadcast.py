@@ -0,0 +1,193 @@
+"""限速批量发送单元测试"""
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from bot.services.broadcast import (
+    FAILED,
+    PERMANENT,
+    SENT,
+    Broadcaster,
+    is_permanent,
+    percentile,
+)
+
+
+class TestIsPermanent:
+    """测试永久错误判定"""
+
+    def test_blocked_and_kicked_are_permanent(self):
+        assert is_permanent(Forbidden("Forbidden: bot was blocked by the user"))
+        assert is_permanent(Forbidden("Forbidden: bot was kicked from the group chat"))
+
+    def test_chat_not_found_is_permanent(self):
+        assert is_permanent(BadRequest("Chat not found"))
+
+    def test_transient_errors_are_not_permanent(self):
+        assert not is_permanent(RetryAfter(1))
+        assert not is_permanent(TimedOut())
+        assert not is_permanent(NetworkError("connection reset"))
+        assert not is_permanent(BadRequest("Message text is empty"))
+        assert not is_permanent(Exception("unknown"))
+
+
+class TestPercentile:
+    """测试分位数计算"""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile([], 0.5) == 0.0
+
+
+class TestBroadcaster:
+    """测试限速发送器"""
+
+    @pytest.mark.asyncio
+    async def test_send_success_records_lag(self):
+        """测试发送成功并记录送达延迟"""
+        broadcaster = Broadcaster(rate=1000)
+        request = AsyncMock()
+
+        result, error = await broadcaster.send(1, request, scheduled_at=time.monotonic() - 2)
+
+        assert (result, error) == (SENT, None)
+        assert broadcaster.stats()["sent"] == 1
+        assert broadcaster.stats()["lag_p50"] >= 2
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_then_retries(self):
+        """测试 RetryAfter 后暂停指定时间再重试"""
+        broadcaster = Broadcaster(rate=1000, per_chat_rate=1000)
+        request = AsyncMock(side_effect=[RetryAfter(0.2), None])
+
+        started = time.monotonic()
+        result, _ = await broadcaster.send(1, request)
+
+        assert result == SENT
+        assert request.await_count == 2
+        assert time.monotonic() - started >= 0.2
+        assert broadcaster.stats()["throttled"] == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_other_chats(self):
+        """测试 RetryAfter 期间其他会话也暂停发送"""
+        broadcaster = Broadcaster(rate=1000, per_chat_rate=1000)
+        broadcaster._paused_until = time.monotonic() + 0.2
+
+        started = time.monotonic()
+        await broadcaster.send(2, AsyncMock())
+
+        assert time.monotonic() - started >= 0.15
+
+    @pytest.mark.asyncio
+    async def test_permanent_error_is_not_retried(self):
+        """测试永久错误不重试"""
+        broadcaster = Broadcaster(rate=1000)
+        error = Forbidden("Forbidden: bot was blocked by the user")
+        request = AsyncMock(side_effect=error)
+
+        assert await broadcaster.send(1, request) == (PERMANENT, error)
+        assert request.await_count == 1
+        assert broadcaster.stats()["permanent"] == 1
+
+    @pytest.mark.asyncio
+    async def test_other_bad_request_fails_without_retry(self):
+        """测试其他 BadRequest 直接失败"""
+        broadcaster = Broadcaster(rate=1000)
+        request = AsyncMock(side_effect=BadRequest("Message text is empty"))
+
+        result, _ = await broadcaster.send(1, request)
+
+        assert result == FAILED
+        assert request.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_network_error_retried_with_backoff(self, mocker):
+        """测试网络错误退避后重试"""
+        broadcaster = Broadcaster(rate=1000, per_chat_rate=1000)
+        delay = mocker.patch.object(broadcaster.retry_policy, "delay", return_value=0.01)
+        request = AsyncMock(side_effect=[TimedOut(), NetworkError("reset"), None])
+
+        result, _ = await broadcaster.send(1, request)
+
+        assert result == SENT
+        assert [c.args[0] for c in delay.call_args_list] == [1, 2]
+        assert broadcaster.stats()["retries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self, mocker):
+        """测试超过最大尝试次数后放弃"""
+        broadcaster = Broadcaster(rate=1000, per_chat_rate=1000, max_attempts=3)
+        mocker.patch.object(broadcaster.retry_policy, "delay", return_value=0)
+        request = AsyncMock(side_effect=TimedOut())
+
+        result, error = await broadcaster.send(1, request)
+
+        assert result == FAILED
+        assert isinstance(error, TimedOut)
+        assert request.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_global_rate_paces_sends(self):
+        """测试全局速率：不在开头突发，按固定间隔发送"""
+        broadcaster = Broadcaster(rate=50, per_chat_rate=1000)
+        sent_at = []
+
+        async def record():
+            sent_at.append(time.monotonic())
+
+        for chat_id in range(11):
+            await broadcaster.send(chat_id, record)
+
+        assert sent_at[-1] - sent_at[0] >= 0.18
+
+    @pytest.mark.asyncio
+    async def test_per_chat_rate_paces_same_chat(self):
+        """测试单会话速率"""
+        broadcaster = Broadcaster(rate=1000, per_chat_rate=10)
+        request = AsyncMock()
+
+        started = time.monotonic()
+        for _ in range(3):
+            await broadcaster.send(1, request)
+
+        assert time.monotonic() - started >= 0.18
+
+    @pytest.mark.asyncio
+    async def test_broadcast_bounds_concurrency(self):
+        """测试批量发送的并发上限"""
+        import asyncio
+
+        broadcaster = Broadcaster(rate=10000, concurrency=4)
+        active = 0
+        peak = 0
+
+        async def deliver(chat_id):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return chat_id % 2 == 0
+
+        results = await broadcaster.broadcast(range(20), deliver)
+
+        assert len(results) == 20
+        assert sum(results.values()) == 10
+        assert peak == 4
+
+    @pytest.mark.asyncio
+    async def test_idle_chat_buckets_are_pruned(self):
+        """测试回满的会话令牌桶被清理"""
+        broadcaster = Broadcaster(rate=10000, per_chat_rate=1000, max_chat_buckets=5)
+        for chat_id in range(5):
+            await broadcaster.send(chat_id, AsyncMock())
+        time.sleep(0.01)
+
+        await broadcaster.send(99, AsyncMock())
+
+        assert set(broadcaster._chat_buckets) == {99}
@@ -0,0 +1,220 @@
+"""回复缓存单元测试"""
+import pytest
+from unittest.mock import MagicMock
+
+from bot.services.cache import (
+    ResponseCache,
+    VectorIndex,
+    history_fingerprint,
+    normalize_prompt,
+)
+
+
+def make_chat(history=None):
+    chat = MagicMock()
+    chat.history = list(history or [])
+    return chat
+
+
+def make_content(role, text):
+    content = MagicMock()
+    content.role = role
+    content.parts = [MagicMock(text=text)]
+    return content
+
+
+class TestNormalizePrompt:
+    """测试提问归一化"""
+
+    def test_case_whitespace_and_trailing_punctuation(self):
+        """测试大小写、空白和结尾标点不影响键"""
+        assert normalize_prompt("  Hello   World!! ") == "hello world"
+        assert normalize_prompt("你好！") == normalize_prompt("你好")
+
+    def test_fullwidth_characters(self):
+        """测试全角字符统一为半角"""
+        assert normalize_prompt("ＡＢＣ？") == "abc"
+
+
+class TestHistoryFingerprint:
+    """测试历史指纹"""
+
+    def test_empty_history(self):
+        """测试空历史的指纹为空字符串"""
+        assert history_fingerprint([]) == ""
+
+    def test_fingerprint_depends_on_content_and_role(self):
+        """测试内容或角色不同时指纹不同"""
+        a = history_fingerprint([make_content("user", "hi"), make_content("model", "hello")])
+        b = history_fingerprint([make_content("user", "hi"), make_content("model", "hey")])
+        c = history_fingerprint([make_content("model", "hi"), make_content("model", "hello")])
+        same = history_fingerprint([make_content("user", "hi"), make_content("model", "hello")])
+
+        assert a == same
+        assert len({a, b, c}) == 3
+
+
+class TestVectorIndex:
+    """测试本地向量索引"""
+
+    def test_search_finds_nearest_above_threshold(self):
+        """测试返回阈值以上最相似的向量"""
+        index = VectorIndex()
+        index.add("a", [1.0, 0.0, 0.0])
+        index.add("b", [0.0, 1.0, 0.0])
+
+        key, score = index.search([0.99, 0.05, 0.0], threshold=0.9)
+
+        assert key == "a"
+        assert score > 0.99
+        assert index.search([0.0, 0.0, 1.0], threshold=0.9) is None
+
+    def test_groups_are_isolated(self):
+        """测试不同分组（历史指纹）之间不会互相命中"""
+        index = VectorIndex()
+        index.add("a", [1.0, 0.0], group="g1")
+
+        assert index.search([1.0, 0.0], group="g2", threshold=0.5) is None
+        assert index.search([1.0, 0.0], group="g1", threshold=0.5)[0] == "a"
+
+    def test_remove(self):
+        """测试删除后不再命中"""
+        index = VectorIndex()
+        index.add("a", [1.0, 0.0])
+        index.remove("a")
+        index.remove("missing")
+
+        assert len(index) == 0
+        assert index.search([1.0, 0.0]) is None
+
+
+class TestResponseCache:
+    """测试回复缓存"""
+
+    @pytest.mark.asyncio
+    async def test_exact_hit_after_store(self):
+        """测试存入后相同（归一化后）提问命中"""
+        cache = ResponseCache(max_entries=10, ttl=60)
+        cache.store(cache.key_for(make_chat(), "你好"), "你好！有什么可以帮你？")
+
+        key = cache.key_for(make_chat(), " 你好！")
+
+        assert await cache.lookup(key) == "你好！有什么可以帮你？"
+        assert cache.stats()["exact_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_miss_is_counted(self):
+        """测试未命中计入统计"""
+        cache = ResponseCache(max_entries=10, ttl=60)
+
+        assert await cache.lookup(cache.key_for(make_chat(), "hi")) is None
+
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_entries_expire_after_ttl(self, mocker):
+        """测试超过 ttl 的条目失效"""
+        clock = mocker.patch("bot.services.cache.time.monotonic", return_value=100.0)
+        cache = ResponseCache(max_entries=10, ttl=60)
+        key = cache.key_for(make_chat(), "hi")
+        cache.store(key, "hello")
+
+        clock.return_value = 161.0
+
+        assert await cache.lookup(key) is None
+        assert cache.stats()["expirations"] == 1
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        """测试超出条目上限时淘汰最久未用的条目"""
+        cache = ResponseCache(max_entries=2, ttl=60)
+        chat = make_chat()
+        cache.store(cache.key_for(chat, "a"), "A")
+        cache.store(cache.key_for(chat, "b"), "B")
+        await cache.lookup(cache.key_for(chat, "a"))
+        cache.store(cache.key_for(chat, "c"), "C")
+
+        assert await cache.lookup(cache.key_for(chat, "a")) == "A"
+        assert await cache.lookup(cache.key_for(chat, "b")) is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_history_policy_empty_bypasses_history(self):
+        """测试 empty 策略下带历史的请求不参与缓存"""
+        cache = ResponseCache(max_entries=10, ttl=60, history_policy="empty")
+
+        assert cache.key_for(make_chat([make_content("user", "x")]), "hi") is None
+        assert cache.stats()["bypassed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_history_policy_fingerprint(self):
+        """测试 fingerprint 策略下只有历史相同才命中"""
+        cache = ResponseCache(max_entries=10, ttl=60, history_policy="fingerprint")
+        history = [make_content("user", "x"), make_content("model", "y")]
+        cache.store(cache.key_for(make_chat(history), "hi"), "cached")
+
+        assert await cache.lookup(cache.key_for(make_chat(history), "hi")) == "cached"
+        assert await cache.lookup(cache.key_for(make_chat(), "hi")) is None
+
+    def test_uncacheable_requests(self):
+        """测试非文本内容、无历史列表或过长的提问不缓存"""
+        cache = ResponseCache(max_entries=10, ttl=60, max_prompt_chars=10)
+        chat = make_chat()
+
+        assert cache.key_for(chat, ["part"]) is None
+        assert cache.key_for(MagicMock(), "hi") is None
+        assert cache.key_for(chat, "x" * 11) is None
+        assert cache.key_for(chat, "！") is None
+
+    def test_unknown_history_policy(self):
+        """测试未知的历史策略报错"""
+        with pytest.raises(ValueError):
+            ResponseCache(max_entries=10, ttl=60, history_policy="always")
+
+    @pytest.mark.asyncio
+    async def test_semantic_hit(self):
+        """测试语义层：相似提问命中"""
+        vectors = {"怎么早睡": [1.0, 0.0, 0.1], "如何早睡": [1.0, 0.0, 0.12], "天气": [0.0, 1.0, 0.0]}
+
+        async def embedder(text):
+            return vectors[text]
+
+        cache = ResponseCache(max_entries=10, ttl=60, similarity=0.95, embedder=embedder)
+        key = cache.key_for(make_chat(), "怎么早睡")
+        assert await cache.lookup(key) is None
+        cache.store(key, "放下手机")
+
+        assert await cache.lookup(cache.key_for(make_chat(), "如何早睡")) == "放下手机"
+        assert await cache.lookup(cache.key_for(make_chat(), "天气")) is None
+        stats = cache.stats()
+        assert stats["semantic_hits"] == 1
+        assert stats["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_embedder_failure_falls_back_to_exact(self):
+        """测试向量计算失败时只做精确匹配"""
+        async def embedder(text):
+            raise RuntimeError("quota")
+
+        cache = ResponseCache(max_entries=10, ttl=60, similarity=0.9, embedder=embedder)
+        key = cache.key_for(make_chat(), "hi")
+
+        assert await cache.lookup(key) is None
+        cache.store(key, "hello")
+        assert await cache.lookup(cache.key_for(make_chat(), "hi")) == "hello"
+
+    @pytest.mark.asyncio
+    async def test_evicted_entry_leaves_index(self):
+        """测试被淘汰的条目同时从向量索引中删除"""
+        async def embedder(text):
+            return [1.0, float(len(text))]
+
+        cache = ResponseCache(max_entries=1, ttl=60, similarity=0.5, embedder=embedder)
+        for prompt in ("a", "bb"):
+            key = cache.key_for(make_chat(), prompt)
+            await cache.lookup(key)
+            cache.store(key, prompt.upper())
+
+        assert len(cache._index) == 1
@@ -0,0 +1,129 @@
+"""群组支持单元测试"""
+import time
+
+import pytest
+from telegram import Update
+from unittest.mock import MagicMock
+
+from bot.services.groups import GROUP_UPDATES, AddressedFilter, conversation_key, group_prompt, session_key
+from tests.fixtures.telegram_api import make_update
+
+BOT_ID = 999
+
+
+def group_update(text, chat_type="supergroup", reply_to_bot=False, thread_id=None, caption=False):
+    """构造群组中的消息"""
+    data = make_update(1, 100, text)
+    message = data["message"]
+    message["chat"] = {"id": -500, "type": chat_type}
+    message["from"]["last_name"] = "Li"
+    if caption:
+        message["caption"] = message.pop("text")
+        message["photo"] = [{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]
+    if reply_to_bot:
+        message["reply_to_message"] = {
+            "message_id": 0, "date": message["date"], "chat": message["chat"],
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": "test_bot"},
+            "text": "之前的回复",
+        }
+    if thread_id is not None:
+        message.update(message_thread_id=thread_id, is_topic_message=True)
+    return Update.de_json(data, None)
+
+
+@pytest.fixture
+def addressed():
+    addressed = AddressedFilter()
+    addressed.configure("test_bot", BOT_ID)
+    return addressed
+
+
+def count(result) -> float:
+    return GROUP_UPDATES.labels(result).value
+
+
+class TestAddressedFilter:
+    """测试群组消息的点名判断"""
+
+    def test_private_messages_pass(self, addressed):
+        """测试私聊消息全部通过，不计入群组计数"""
+        dropped = count("dropped")
+
+        assert addressed.check_update(Update.de_json(make_update(1, 100, "hello"), None))
+        assert count("dropped") == dropped
+
+    def test_unaddressed_group_messages_are_dropped(self, addressed):
+        """测试群组中未点名机器人的消息被丢弃并计数"""
+        dropped, processed = count("dropped"), count("processed")
+
+        assert not addressed.check_update(group_update("大家好"))
+        assert not addressed.check_update(group_update("邮件发到 a@example.com"))
+        assert not addressed.check_update(group_update("@test_bot_helper 你好"))
+
+        assert count("dropped") == dropped + 3
+        assert count("processed") == processed
+
+    @pytest.mark.parametrize("text", ["@test_bot 你好", "你好 @Test_Bot", "问一下@test_bot，今天几号"])
+    def test_mentions_pass(self, addressed, text):
+        """测试提及机器人（不区分大小写）的消息通过"""
+        processed = count("processed")
+
+        assert addressed.check_update(group_update(text))
+        assert count("processed") == processed + 1
+
+    def test_reply_to_bot_passes(self, addressed):
+        """测试回复机器人消息的消息通过"""
+        assert addressed.check_update(group_update("继续说", reply_to_bot=True))
+
+    def test_caption_mention_passes(self, addressed):
+        """测试图片说明文字中的提及"""
+        assert addressed.check_update(group_update("@test_bot 这是什么", caption=True))
+
+    def test_configures_from_bot(self):
+        """测试未配置时从 Bot 对象读取用户名与 ID"""
+        addressed = AddressedFilter()
+        message = MagicMock(text="@my_bot hi", reply_to_message=None)
+        message.chat.type = "group"
+        message.get_bot.return_value = MagicMock(username="my_bot", id=1)
+
+        assert addressed.filter(message)
+        assert (addressed.username, addressed.bot_id) == ("my_bot", 1)
+
+
+class TestConversation:
+    """测试群组上下文的键与发给模型的文本"""
+
+    def test_conversation_key(self):
+        """测试私聊按用户、群组按会话、论坛话题按 (会话, 话题)"""
+        assert conversation_key(Update.de_json(make_update(1, 100, "hi"), None)) == 100
+        assert conversation_key(group_update("hi")) == -500
+        assert conversation_key(group_update("hi", thread_id=7)) == session_key(-500, 7)
+        assert session_key(-500, 7) != session_key(-500, 8)
+        assert session_key(-500, 7) < -(2 ** 40) and session_key(-500, 7) >= -(2 ** 63)
+
+    def test_group_prompt(self, mocker, addressed):
+        """测试群组消息去掉提及并注明发言成员"""
+        mocker.patch("bot.services.groups.addressed", addressed)
+
+        assert group_prompt(group_update("@test_bot  今天几号？"), "@test_bot  今天几号？") == "user100 Li：今天几号？"
+        assert group_prompt(Update.de_json(make_update(1, 100, "hi"), None), "hi") == "hi"
+
+
+@pytest.mark.slow
+class TestFilterBenchmark:
+    """基准：未点名的群组消息在过滤器中的开销"""
+
+    def test_unaddressed_cost(self, addressed):
+        """10 万条群组闲聊消息经过过滤器的平均耗时"""
+        updates = [group_update(f"闲聊消息 {i}，今天天气不错") for i in range(100)]
+        rounds = 1000
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for update in updates:
+                addressed.check_update(update)
+        elapsed = time.perf_counter() - started
+
+        per_update = elapsed / (rounds * len(updates))
+        print(f"\n未点名的群组消息：每条 {per_update * 1e6:.2f}µs")
+        assert per_update < 50e-6
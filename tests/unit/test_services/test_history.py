@@ -0,0 +1,188 @@
+"""对话历史管理单元测试"""
+import asyncio
+import time
+
+import pytest
+
+from bot.services.history import (
+    HistoryManager,
+    SUMMARY_PREFIX,
+    content_text,
+    content_tokens,
+    estimate_tokens,
+    has_preamble,
+    make_content,
+)
+
+
+class FakeSession:
+    """模拟 ChatSession：每轮把一问一答追加到历史"""
+
+    def __init__(self):
+        self.history = []
+        self.sent_tokens = []
+
+    def turn(self, text, reply):
+        # 记录本轮请求携带的上下文大小（历史 + 新消息）
+        self.sent_tokens.append(sum(content_tokens(c) for c in self.history) + estimate_tokens(text))
+        self.history.append(make_content("user", text))
+        self.history.append(make_content("model", reply))
+
+
+def fake_summarizer(calls):
+    """记录调用的假摘要器"""
+
+    async def summarize(previous, transcript):
+        calls.append((previous, transcript))
+        await asyncio.sleep(0)
+        return f"摘要#{len(calls)}"
+
+    return summarize
+
+
+class TestEstimateTokens:
+    """测试 estimate_tokens 函数"""
+
+    def test_ascii_text(self):
+        """测试英文约 4 字符 1 token"""
+        assert estimate_tokens("abcdefgh") == 2
+
+    def test_cjk_text(self):
+        """测试中文约 1 字 1 token"""
+        assert estimate_tokens("你好世界") == 4
+
+
+class TestHistoryManager:
+    """测试 HistoryManager 类"""
+
+    def test_short_history_is_untouched(self):
+        """测试未超出预算时不修改历史"""
+        manager = HistoryManager(max_tokens=1000, window_turns=10)
+        chat = FakeSession()
+        chat.turn("hi", "hello")
+
+        assert manager.compact(1, chat) is False
+        assert len(chat.history) == 2
+
+    def test_window_keeps_recent_turns(self):
+        """测试只保留最近的若干轮"""
+        manager = HistoryManager(max_tokens=10_000, window_turns=4)
+        chat = FakeSession()
+        for i in range(4):
+            chat.turn(f"q{i}", f"a{i}")
+        assert manager.compact(1, chat) is False
+
+        chat.turn("q4", "a4")
+
+        # 超出 4 轮后收缩到 3 轮
+        assert manager.compact(1, chat) is True
+        assert [content_text(c) for c in chat.history] == ["q2", "a2", "q3", "a3", "q4", "a4"]
+
+    def test_token_budget_trims_window(self):
+        """测试 token 预算进一步缩小窗口（至少保留最后一轮）"""
+        manager = HistoryManager(max_tokens=30, window_turns=10)
+        chat = FakeSession()
+        for i in range(3):
+            chat.turn("x" * 40, "y" * 40)
+
+        manager.compact(1, chat)
+
+        assert len(chat.history) == 2
+
+    @pytest.mark.asyncio
+    async def test_folded_turns_become_summary(self):
+        """测试窗口外的轮次在后台折叠为摘要前言"""
+        calls = []
+        manager = HistoryManager(max_tokens=10_000, window_turns=3, summarizer=fake_summarizer(calls))
+        chat = FakeSession()
+        for i in range(4):
+            chat.turn(f"q{i}", f"a{i}")
+
+        manager.compact(1, chat)
+        # 摘要尚未完成时，历史只包含窗口
+        assert not has_preamble(chat.history)
+
+        await asyncio.sleep(0.01)
+
+        assert len(calls) == 1
+        assert "q0" in calls[0][1] and "a1" in calls[0][1]
+        assert has_preamble(chat.history)
+        assert content_text(chat.history[0]) == SUMMARY_PREFIX + "摘要#1"
+        assert [content_text(c) for c in chat.history[2:]] == ["q2", "a2", "q3", "a3"]
+
+    @pytest.mark.asyncio
+    async def test_summary_rolls_forward(self):
+        """测试新的折叠会基于已有摘要继续合并"""
+        calls = []
+        manager = HistoryManager(max_tokens=10_000, window_turns=1, summarizer=fake_summarizer(calls))
+        chat = FakeSession()
+        chat.turn("q0", "a0")
+        chat.turn("q1", "a1")
+        manager.compact(1, chat)
+        await asyncio.sleep(0.01)
+
+        chat.turn("q2", "a2")
+        manager.compact(1, chat)
+        await asyncio.sleep(0.01)
+
+        assert calls[1][0] == "摘要#1"
+        assert content_text(chat.history[0]) == SUMMARY_PREFIX + "摘要#2"
+        assert [content_text(c) for c in chat.history[2:]] == ["q2", "a2"]
+
+    @pytest.mark.asyncio
+    async def test_summarizer_failure_keeps_window(self, mocker):
+        """测试摘要失败时记录错误并保留窗口"""
+        async def broken(previous, transcript):
+            raise RuntimeError("quota")
+
+        mock_logger = mocker.patch('bot.services.history.logging.error')
+        manager = HistoryManager(max_tokens=10_000, window_turns=1, summarizer=broken)
+        chat = FakeSession()
+        chat.turn("q0", "a0")
+        chat.turn("q1", "a1")
+
+        manager.compact(1, chat)
+        await asyncio.sleep(0.01)
+
+        mock_logger.assert_called_once()
+        assert [content_text(c) for c in chat.history] == ["q1", "a1"]
+
+    def test_forget_drops_pending_state(self):
+        """测试 forget 丢弃待折叠内容"""
+        manager = HistoryManager(max_tokens=10_000, window_turns=1)
+        manager._pending[1] = ["x"]
+
+        manager.forget(1)
+
+        assert 1 not in manager._pending
+
+
+class TestHistoryBenchmark:
+    """长对话基准"""
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_500_turn_conversation_has_flat_payload(self):
+        """500 轮对话中每轮请求的上下文大小与整理耗时保持平稳"""
+        calls = []
+        manager = HistoryManager(max_tokens=2000, window_turns=20, summarizer=fake_summarizer(calls))
+        chat = FakeSession()
+        compact_times = []
+
+        for i in range(500):
+            chat.turn(f"第 {i} 个问题：" + "内容" * 30, f"第 {i} 个回答：" + "回复" * 60)
+            started = time.perf_counter()
+            manager.compact(1, chat)
+            compact_times.append(time.perf_counter() - started)
+            await asyncio.sleep(0)
+
+        early = max(chat.sent_tokens[50:100])
+        late = max(chat.sent_tokens[450:500])
+        print(f"\n每轮上下文 token：第 50-100 轮最大 {early}，第 450-500 轮最大 {late}；"
+              f"整理耗时最大 {max(compact_times) * 1000:.2f}ms；摘要次数 {len(calls)}")
+
+        assert late <= 2000 + 500
+        assert late <= early * 1.2
+        # 收缩留有余量，摘要远少于轮数
+        assert len(calls) < 500 / 3
+        assert max(compact_times[400:]) < max(0.005, max(compact_times[50:100]) * 5)
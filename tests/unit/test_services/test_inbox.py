@@ -0,0 +1,160 @@
+"""用户消息收件箱单元测试"""
+import asyncio
+
+import pytest
+
+from bot.services.inbox import UserInbox
+
+
+async def submit(inbox, key, text, log, hold=0.0):
+    """提交一条消息，若成为一轮则记录合并文本"""
+    async with inbox.turn(key, text) as merged:
+        if merged is None:
+            return
+        log.append(("start", key, merged))
+        await asyncio.sleep(hold)
+        log.append(("end", key, merged))
+
+
+class TestUserInbox:
+    """测试 UserInbox 类"""
+
+    @pytest.mark.asyncio
+    async def test_single_message_passes_through(self):
+        """测试单条消息原样成为一轮"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        await submit(inbox, 1, "hi", log)
+
+        assert log == [("start", 1, "hi"), ("end", 1, "hi")]
+        assert inbox.stats()["active_users"] == 0
+
+    @pytest.mark.asyncio
+    async def test_attachments_are_merged_with_text(self):
+        """测试附件与紧随其后的文字合并为一轮：[附件, 说明文字, 文字]"""
+        inbox = UserInbox(debounce=0.05)
+        log = []
+        image = object()
+
+        await asyncio.gather(
+            submit(inbox, 1, [image, "看这张图"], log),
+            submit(inbox, 1, "是什么花？", log),
+        )
+
+        assert log[0] == ("start", 1, [image, "看这张图", "是什么花？"])
+
+    @pytest.mark.asyncio
+    async def test_burst_is_coalesced(self):
+        """测试防抖窗口内的连续消息合并为一轮"""
+        inbox = UserInbox(debounce=0.05)
+        log = []
+
+        await asyncio.gather(*(submit(inbox, 1, f"m{i}", log) for i in range(5)))
+
+        assert [entry for entry in log if entry[0] == "start"] == [("start", 1, "m0\nm1\nm2\nm3\nm4")]
+        stats = inbox.stats()
+        assert stats["messages"] == 5
+        assert stats["turns"] == 1
+        assert stats["coalesce_ratio"] == 5.0
+
+    @pytest.mark.asyncio
+    async def test_turns_of_one_user_are_serialized(self):
+        """测试同一用户的轮次不会重叠，且保持顺序"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        first = asyncio.create_task(submit(inbox, 1, "a", log, hold=0.05))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(submit(inbox, 1, "b", log, hold=0.01))
+        await asyncio.gather(first, second)
+
+        assert log == [("start", 1, "a"), ("end", 1, "a"), ("start", 1, "b"), ("end", 1, "b")]
+
+    @pytest.mark.asyncio
+    async def test_messages_during_a_turn_are_merged_into_next(self):
+        """测试上一轮进行中到达的多条消息合并为下一轮"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        first = asyncio.create_task(submit(inbox, 1, "a", log, hold=0.05))
+        await asyncio.sleep(0.01)
+        rest = [asyncio.create_task(submit(inbox, 1, t, log)) for t in ["b", "c"]]
+        await asyncio.gather(first, *rest)
+
+        starts = [entry[2] for entry in log if entry[0] == "start"]
+        assert starts == ["a", "b\nc"]
+
+    @pytest.mark.asyncio
+    async def test_different_users_run_in_parallel(self):
+        """测试不同用户的轮次并行执行"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        await asyncio.gather(submit(inbox, 1, "a", log, hold=0.05), submit(inbox, 2, "b", log, hold=0.05))
+
+        # 两个用户都在对方结束前开始
+        assert [entry[0] for entry in log[:2]] == ["start", "start"]
+
+    @pytest.mark.asyncio
+    async def test_queue_depth(self):
+        """测试队列深度统计"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        first = asyncio.create_task(submit(inbox, 1, "a", log, hold=0.05))
+        await asyncio.sleep(0.01)
+        waiting = [asyncio.create_task(submit(inbox, 1, t, log)) for t in ["b", "c"]]
+        await asyncio.sleep(0.01)
+
+        assert inbox.depth == 2
+
+        await asyncio.gather(first, *waiting)
+        assert inbox.depth == 0
+
+    @pytest.mark.asyncio
+    async def test_error_releases_user_lock(self):
+        """测试处理出错后不会阻塞该用户的后续消息"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        with pytest.raises(RuntimeError):
+            async with inbox.turn(1, "a"):
+                raise RuntimeError("boom")
+
+        await submit(inbox, 1, "b", log)
+        assert log[0] == ("start", 1, "b")
+
+    @pytest.mark.asyncio
+    async def test_cancel_during_debounce_resets_user(self):
+        """测试防抖等待期间被取消后，该用户之后的消息仍会处理"""
+        inbox = UserInbox(debounce=0.5)
+        log = []
+
+        first = asyncio.create_task(submit(inbox, 1, "a", log))
+        await asyncio.sleep(0.01)
+        await submit(inbox, 1, "b", log)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+
+        assert inbox.stats()["active_users"] == 0
+        inbox.debounce = 0
+        await submit(inbox, 1, "c", log)
+        assert log == [("start", 1, "c"), ("end", 1, "c")]
+
+    @pytest.mark.asyncio
+    async def test_cancel_while_waiting_for_previous_turn(self):
+        """测试等待上一轮结束时被取消，不影响上一轮与之后的消息"""
+        inbox = UserInbox(debounce=0)
+        log = []
+
+        first = asyncio.create_task(submit(inbox, 1, "a", log, hold=0.05))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(submit(inbox, 1, "b", log))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+
+        await submit(inbox, 1, "c", log)
+        assert log == [("start", 1, "a"), ("end", 1, "a"), ("start", 1, "c"), ("end", 1, "c")]
+        assert inbox.stats()["active_users"] == 0
@@ -0,0 +1,289 @@
+"""模型调用限流单元测试"""
+import asyncio
+import random
+import statistics
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from bot.services.limiter import AdaptiveLimiter, TokenBucket, is_rate_limited
+
+
+class SimulatedBackend:
+    """
+    模拟的模型后端：同时处理的请求超过 capacity 时返回 429
+    """
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+
+    async def call(self):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.in_flight > self.capacity:
+                self.rejected += 1
+                raise google_exceptions.ResourceExhausted("quota exceeded")
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+
+async def call_with_retry(limiter, backend, key, finished):
+    """经过限流器调用后端，被限流时退避后重新排队"""
+    attempt = 0
+    while True:
+        try:
+            async with limiter.acquire(key, tokens=100):
+                await backend.call()
+            finished.append((key, time.monotonic()))
+            return
+        except google_exceptions.ResourceExhausted:
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, min(0.2, 0.01 * 2 ** attempt)))
+
+
+class TestIsRateLimited:
+    """测试 is_rate_limited 函数"""
+
+    def test_resource_exhausted(self):
+        """测试 ResourceExhausted 视为限流"""
+        assert is_rate_limited(google_exceptions.ResourceExhausted("quota"))
+
+    def test_other_errors(self):
+        """测试其他错误不视为限流"""
+        assert not is_rate_limited(google_exceptions.InvalidArgument("bad"))
+        assert not is_rate_limited(RuntimeError("boom"))
+
+
+class TestTokenBucket:
+    """测试 TokenBucket 类"""
+
+    def test_wait_time_after_drain(self):
+        """测试取空后按速率计算等待时间"""
+        bucket = TokenBucket(rate=10, capacity=10)
+        now = bucket.updated
+        bucket.consume(10, now)
+
+        assert bucket.wait_time(1, now) == pytest.approx(0.1)
+        assert bucket.wait_time(1, now + 0.11) == 0.0
+
+    def test_amount_is_clamped_to_capacity(self):
+        """测试超过容量的请求不会永久等待"""
+        bucket = TokenBucket(rate=1, capacity=5)
+
+        assert bucket.wait_time(100, bucket.updated) == 0.0
+
+
+    def test_configure_shares_rate(self):
+        """测试修改速率与容量（多进程平分限额），已有令牌不超过新容量"""
+        bucket = TokenBucket(rate=30, capacity=30)
+
+        bucket.configure(10, 10)
+
+        assert (bucket.rate, bucket.capacity, bucket.tokens) == (10, 10, 10)
+
+
+class TestAdaptiveLimiter:
+    """测试 AdaptiveLimiter 类"""
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_capped(self):
+        """测试在途调用数不超过并发上限"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=4)
+        limiter.limit = 2
+        backend = SimulatedBackend(capacity=100, latency=0.02)
+
+        async def one():
+            async with limiter.acquire("u"):
+                await backend.call()
+
+        await asyncio.gather(*(one() for _ in range(6)))
+
+        assert backend.peak <= 3
+
+    @pytest.mark.asyncio
+    async def test_qps_bucket_paces_calls(self):
+        """测试 QPS 令牌桶限制调用速率"""
+        limiter = AdaptiveLimiter(qps=20, tpm=10**9, max_concurrency=100)
+        limiter.qps.tokens = 0
+
+        started = time.monotonic()
+
+        async def one():
+            async with limiter.acquire("u"):
+                pass
+
+        await asyncio.gather(*(one() for _ in range(4)))
+
+        assert time.monotonic() - started >= 0.15
+
+    @pytest.mark.asyncio
+    async def test_tpm_bucket_paces_large_requests(self):
+        """测试 TPM 令牌桶限制 token 消耗"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=6000, max_concurrency=100)
+        limiter.tpm.tokens = 0
+
+        started = time.monotonic()
+        async with limiter.acquire("u", tokens=10):
+            pass
+
+        # 每秒补充 100 token，需要约 0.1 秒
+        assert time.monotonic() - started >= 0.08
+
+    @pytest.mark.asyncio
+    async def test_rate_limit_halves_concurrency(self):
+        """测试遇到 429 时并发上限减半"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=16)
+        limiter.limit = 8
+        release = asyncio.Event()
+
+        async def holder():
+            async with limiter.acquire("u"):
+                await release.wait()
+
+        holders = [asyncio.create_task(holder()) for _ in range(6)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(google_exceptions.ResourceExhausted):
+            async with limiter.acquire("u"):
+                raise google_exceptions.ResourceExhausted("quota")
+
+        # 7 个在途时被拒绝：上限先压到 6，再减半
+        assert limiter.limit == 3
+        assert limiter.stats()["throttled"] == 1
+
+        release.set()
+        await asyncio.gather(*holders)
+        assert limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_success_increases_concurrency(self):
+        """测试成功调用缓慢提升并发上限"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=16)
+        limiter.limit = 4
+
+        for _ in range(4):
+            async with limiter.acquire("u"):
+                pass
+
+        assert 4.9 < limiter.limit < 5.1
+
+    @pytest.mark.asyncio
+    async def test_slow_calls_decrease_concurrency(self):
+        """测试延迟超过目标时减小并发上限"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=16, latency_target=0.01)
+        limiter.limit = 8
+
+        async with limiter.acquire("u"):
+            await asyncio.sleep(0.03)
+
+        assert limiter.limit == 4
+
+    @pytest.mark.asyncio
+    async def test_first_chunk_latency_drives_concurrency(self):
+        """测试记录了首个分块时按首个分块的等待时间判断延迟，之后的耗时不计入"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=16, latency_target=0.01)
+        limiter.limit = 8
+
+        async with limiter.acquire("u") as slot:
+            slot.first_chunk()
+            await asyncio.sleep(0.03)
+            slot.first_chunk()
+        assert limiter.limit > 8
+
+        limiter.limit = 8
+        async with limiter.acquire("u") as slot:
+            await asyncio.sleep(0.03)
+            slot.first_chunk()
+        assert limiter.limit == 4
+
+    def test_configure_lowers_limits(self):
+        """测试按工作进程分得的限额调整 QPS、TPM 与并发上限"""
+        limiter = AdaptiveLimiter(qps=100, tpm=60000, max_concurrency=32)
+        limiter.limit = 16
+
+        limiter.configure(qps=25, tpm=15000, max_concurrency=8)
+
+        assert limiter.qps.rate == 25
+        assert limiter.tpm.rate * 60 == 15000
+        assert (limiter.max_concurrency, limiter.limit) == (8, 8)
+
+    @pytest.mark.asyncio
+    async def test_fair_queuing_across_users(self):
+        """测试排队按用户轮转，重度用户不会饿死其他用户"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=1)
+        limiter.limit = 1
+        order = []
+
+        async def one(key):
+            async with limiter.acquire(key):
+                order.append(key)
+                await asyncio.sleep(0.001)
+
+        tasks = [asyncio.create_task(one("heavy")) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(one("light")))
+        await asyncio.gather(*tasks)
+
+        # light 应在 heavy 的 5 个请求全部完成前得到处理
+        assert order.index("light") <= 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_is_removed(self):
+        """测试取消排队中的调用不会泄漏名额"""
+        limiter = AdaptiveLimiter(qps=1000, tpm=10**9, max_concurrency=1)
+        limiter.limit = 1
+        release = asyncio.Event()
+
+        async def holder():
+            async with limiter.acquire("a"):
+                await release.wait()
+
+        first = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        second.cancel()
+        release.set()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+        assert limiter.in_flight == 0
+        assert limiter.queued == 0
+
+
+class TestLimiterStress:
+    """模拟后端压力测试"""
+
+    @pytest.mark.slow
+    @pytest.mark.asyncio
+    async def test_adapts_to_backend_capacity_and_stays_fair(self):
+        """压力测试：并发上限收敛到后端容量附近，轻度用户不被重度用户饿死"""
+        backend = SimulatedBackend(capacity=8, latency=0.01)
+        limiter = AdaptiveLimiter(qps=10_000, tpm=10**9, max_concurrency=64, decrease_cooldown=0.01)
+        limiter.limit = 32
+        finished = []
+
+        heavy = [call_with_retry(limiter, backend, "heavy", finished) for _ in range(300)]
+        light = [call_with_retry(limiter, backend, f"light-{i}", finished) for i in range(20)]
+        started = time.monotonic()
+        await asyncio.gather(*heavy, *light)
+
+        light_done = [t - started for key, t in finished if key.startswith("light")]
+        heavy_done = [t - started for key, t in finished if key == "heavy"]
+        total = len(finished) + backend.rejected
+        print(f"\n完成 {len(finished)} 次，429 {backend.rejected} 次（{backend.rejected / total:.1%}），"
+              f"最终并发上限 {limiter.limit:.1f}，轻度用户中位完成 {statistics.median(light_done):.3f}s，"
+              f"重度用户中位完成 {statistics.median(heavy_done):.3f}s")
+
+        assert len(finished) == 320
+        assert backend.rejected / total < 0.2
+        assert limiter.limit <= 16
+        assert max(light_done) < statistics.median(heavy_done)
@@ -0,0 +1,264 @@
+"""异步结构化日志单元测试"""
+import asyncio
+import io
+import json
+import logging
+import time
+
+import pytest
+from unittest.mock import MagicMock
+
+from bot.services.broadcast import percentile
+from bot.services.logs import bind, bind_update, setup_logging, stop_logging
+
+
+@pytest.fixture
+def logger():
+    """独立的 logger，不影响根 logger 与 pytest 的日志捕获"""
+    logger = logging.getLogger("test_logs")
+    logger.propagate = False
+    yield logger
+    stop_logging()
+    logger.handlers.clear()
+
+
+def make_update(update_id=7, user_id=42, chat_id=-100):
+    update = MagicMock()
+    update.update_id = update_id
+    update.effective_user.id = user_id
+    update.effective_chat.id = chat_id
+    return update
+
+
+def records(stream) -> list:
+    stop_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class SlowStream(io.StringIO):
+    """写入较慢的输出（如被阻塞的管道 / 日志收集进程），每次写入耗时 delay 秒"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+class TestStructuredLogging:
+    """测试 JSON 记录与更新上下文"""
+
+    def test_json_record(self, logger):
+        """测试每条记录为一行 JSON，包含级别、消息与 extra 字段"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="json", stream=stream, logger=logger)
+
+        logger.info("已恢复 %d 个提醒", 3, extra={"elapsed": 0.5})
+
+        [entry] = records(stream)
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "test_logs"
+        assert entry["msg"] == "已恢复 3 个提醒"
+        assert entry["elapsed"] == 0.5
+        assert "correlation_id" not in entry
+
+    def test_update_context(self, logger):
+        """测试处理更新期间的记录带上关联 ID、用户、会话、处理器与耗时"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="json", stream=stream, logger=logger)
+
+        with bind_update(make_update()):
+            bind(handler="chat_logic")
+            logger.error("AI 聊天出错")
+        logger.info("更新之外")
+
+        first, second = records(stream)
+        assert first["correlation_id"] == "u7"
+        assert first["update_id"] == 7
+        assert first["user_id"] == 42
+        assert first["chat_id"] == -100
+        assert first["handler"] == "chat_logic"
+        assert first["elapsed_ms"] >= 0
+        assert "correlation_id" not in second
+
+    @pytest.mark.asyncio
+    async def test_context_is_per_task(self, logger):
+        """测试并发处理的更新各自保留自己的上下文"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="json", stream=stream, logger=logger)
+
+        async def handle(update_id):
+            with bind_update(make_update(update_id, user_id=update_id)):
+                await asyncio.sleep(0.01 * (3 - update_id))
+                logger.info("处理完成")
+
+        await asyncio.gather(handle(1), handle(2))
+
+        assert {(e["update_id"], e["user_id"]) for e in records(stream)} == {(1, 1), (2, 2)}
+
+    def test_exception_traceback(self, logger):
+        """测试异常堆栈在后台线程格式化进 exc 字段"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="json", stream=stream, logger=logger)
+
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("出错了")
+
+        [entry] = records(stream)
+        assert entry["msg"] == "出错了"
+        assert "RuntimeError: boom" in entry["exc"]
+
+    def test_text_format_with_static_fields(self, logger):
+        """测试 text 格式在来源前带上工作进程名"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="text", stream=stream, logger=logger, worker="worker-1")
+
+        logger.info("工作进程已就绪")
+        stop_logging()
+
+        assert " - worker-1 - test_logs - INFO - 工作进程已就绪" in stream.getvalue()
+
+
+class TestSamplingAndQueue:
+    """测试调试日志采样与队列"""
+
+    def test_debug_records_are_sampled(self, logger):
+        """测试 DEBUG 按比例采样，INFO 及以上全部保留"""
+        stream = io.StringIO()
+        handler, _ = setup_logging(level="DEBUG", fmt="json", stream=stream, logger=logger, sample_rate=0.1)
+
+        for i in range(1000):
+            logger.debug("分块 %d", i)
+        logger.warning("限流")
+
+        entries = records(stream)
+        debug = [e for e in entries if e["level"] == "DEBUG"]
+        assert 50 < len(debug) < 150
+        assert [e["msg"] for e in entries if e["level"] == "WARNING"] == ["限流"]
+
+    def test_sampling_keeps_whole_updates(self, logger):
+        """测试同一更新的调试日志要么全部保留，要么全部丢弃"""
+        stream = io.StringIO()
+        setup_logging(level="DEBUG", fmt="json", stream=stream, logger=logger, sample_rate=0.5)
+
+        for update_id in range(100):
+            with bind_update(make_update(update_id)):
+                for _ in range(5):
+                    logger.debug("分块")
+
+        counts = {}
+        for entry in records(stream):
+            counts[entry["update_id"]] = counts.get(entry["update_id"], 0) + 1
+        assert counts and set(counts.values()) == {5}
+        assert 20 < len(counts) < 80
+
+    def test_full_queue_drops(self, logger):
+        """测试队列满时丢弃记录并计数，不阻塞调用方"""
+        stream = SlowStream(delay=0.05)
+        handler, _ = setup_logging(level="INFO", fmt="json", stream=stream, logger=logger, queue_size=2)
+
+        started = time.perf_counter()
+        for i in range(50):
+            logger.info("消息 %d", i)
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 0.05
+        assert handler.dropped > 0
+        assert len(records(stream)) == 50 - handler.dropped
+
+    def test_stop_flushes_queue(self, logger):
+        """测试停止时输出队列中剩余的全部记录"""
+        stream = io.StringIO()
+        setup_logging(level="INFO", fmt="json", stream=stream, logger=logger)
+
+        for i in range(100):
+            logger.info("消息 %d", i)
+
+        assert len(records(stream)) == 100
+
+
+class TestServerContext:
+    """测试更新处理时绑定日志上下文"""
+
+    @pytest.mark.asyncio
+    async def test_process_update_binds_context(self, mocker):
+        """测试 DrainingApplication 处理更新时，处理器中的日志带上该更新的上下文"""
+        from telegram.ext import Application
+
+        from bot.server import DrainingApplication
+        from bot.services.logs import update_context
+
+        seen = []
+
+        async def process(self, update):
+            seen.append(dict(update_context.get()))
+
+        mocker.patch.object(Application, "process_update", process)
+        app = DrainingApplication.__new__(DrainingApplication)
+        app._in_flight = set()
+        mocker.patch.object(DrainingApplication, "concurrent_updates", 1)
+
+        await app.process_update(make_update(update_id=9, user_id=5))
+
+        assert seen[0]["correlation_id"] == "u9"
+        assert seen[0]["user_id"] == 5
+        assert update_context.get() is None
+
+
+@pytest.mark.slow
+class TestLoggingBenchmark:
+    """基准：高消息速率下日志对处理器延迟的影响"""
+
+    @pytest.mark.asyncio
+    async def test_handler_latency(self, logger):
+        """2000 个并发处理器各写 3 条日志：同步 StreamHandler 与队列 + 后台线程对比"""
+        updates = 2000
+        delay = 0.0002
+
+        async def run() -> tuple:
+            # 每个处理器在写日志上花费的时间（同步调用部分，处理器之间的切换不计入）
+            latencies = []
+
+            async def handle(update_id):
+                with bind_update(make_update(update_id)):
+                    started = time.perf_counter()
+                    logger.info("收到消息 %d", update_id)
+                    spent = time.perf_counter() - started
+                    await asyncio.sleep(0)
+                    started = time.perf_counter()
+                    logger.info("模型回复完成", extra={"chunks": 8})
+                    logger.debug("分块详情")
+                    latencies.append(spent + time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(handle(i) for i in range(updates)))
+            return latencies, time.perf_counter() - started
+
+        results = {}
+        for sink in ("fast", "slow"):
+            # 同步：basicConfig 式的 StreamHandler，在事件循环中格式化并写出
+            stream = SlowStream(delay) if sink == "slow" else io.StringIO()
+            direct = logging.StreamHandler(stream)
+            direct.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+            logger.handlers[:] = [direct]
+            logger.setLevel(logging.INFO)
+            results[(sink, "sync")] = await run()
+
+            # 异步：队列处理器 + 后台线程输出 JSON
+            stream = SlowStream(delay) if sink == "slow" else io.StringIO()
+            setup_logging(level="DEBUG", fmt="json", stream=stream, logger=logger, sample_rate=0.01)
+            results[(sink, "queue")] = await run()
+            stop_logging()
+
+        print()
+        for (sink, mode), (latencies, elapsed) in results.items():
+            print(f"{sink:>4} 输出 / {mode:>5}: p50={percentile(latencies, 0.5) * 1e6:.0f}µs "
+                  f"p99={percentile(latencies, 0.99) * 1e6:.0f}µs，{updates / elapsed:.0f} 条/秒")
+
+        slow_sync, _ = results[("slow", "sync")]
+        slow_queue, _ = results[("slow", "queue")]
+        assert percentile(slow_queue, 0.99) < percentile(slow_sync, 0.99)
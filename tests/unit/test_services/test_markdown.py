@@ -0,0 +1,154 @@
+"""Markdown 增量渲染单元测试"""
+import random
+import time
+from html.parser import HTMLParser
+
+import pytest
+
+from bot.services.markdown import MarkdownRenderer, render_markdown
+
+SAMPLE = (
+    "# 快速排序\n\n"
+    "**快速排序**是一种*分治*算法，平均复杂度 `O(n log n)`，参见 [维基百科](https://zh.wikipedia.org/wiki/快速排序)。\n\n"
+    "- 选择基准\n"
+    "- 划分：`a < pivot` 放左边\n\n"
+    "```python\n"
+    "def qsort(a):\n"
+    "    return a if len(a) < 2 else qsort([x for x in a[1:] if x < a[0]]) + [a[0]]  # **不是粗体**\n"
+    "```\n\n"
+    "注意 2 * 3 = 6，~~已废弃~~的写法 & <tag>。"
+)
+
+
+class TagChecker(HTMLParser):
+    """检查标签是否配对且正确嵌套"""
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.ok = True
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.ok = False
+
+
+def balanced(html: str) -> bool:
+    checker = TagChecker()
+    checker.feed(html)
+    checker.close()
+    return checker.ok and not checker.stack
+
+
+def feed_randomly(text: str, seed: int, check=None) -> str:
+    renderer = MarkdownRenderer()
+    rng = random.Random(seed)
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        renderer.feed(text[position:position + size])
+        position += size
+        if check is not None:
+            check(renderer.html)
+    return renderer.finish()
+
+
+class TestRenderMarkdown:
+    """测试 Markdown → Telegram HTML"""
+
+    def test_inline_formatting(self):
+        """测试粗体、斜体、删除线、行内代码与链接"""
+        html = render_markdown("**粗** *斜* ~~删~~ `a<b` [链接](https://a.b/?x=1&y=2)")
+
+        assert html == ('<b>粗</b> <i>斜</i> <s>删</s> <code>a&lt;b</code> '
+                        '<a href="https://a.b/?x=1&amp;y=2">链接</a>')
+
+    def test_code_block(self):
+        """测试代码块带语言，内容原样转义，不解析其中的 Markdown"""
+        html = render_markdown("```python\nif a < b:  # **x**\n    pass\n```\n结束")
+
+        assert html == '<pre><code class="language-python">if a &lt; b:  # **x**\n    pass\n</code></pre>结束'
+
+    def test_headings_and_lists(self):
+        """测试标题加粗、无序列表换成圆点"""
+        assert render_markdown("## 标题\n- 一\n  * 二") == "<b>标题</b>\n• 一\n  • 二"
+
+    def test_literal_characters(self):
+        """测试乘号、单独的波浪线、下划线与 HTML 字符按原样输出"""
+        assert render_markdown("2 * 3 ~ snake_case <b> & [x]") == "2 * 3 ~ snake_case &lt;b&gt; &amp; [x]"
+
+    def test_unclosed_markers_are_closed(self):
+        """测试未闭合的粗体在行尾关闭，未闭合的代码块在结束时关闭"""
+        assert render_markdown("**未闭合\n下一行") == "<b>未闭合</b>\n下一行"
+        assert render_markdown("```\ncode") == "<pre><code>code</code></pre>"
+
+    def test_nested_tags(self):
+        """测试交叉的标记也能得到正确嵌套的标签"""
+        html = render_markdown("***粗斜*** **a *b** c*")
+
+        assert html.startswith("<b><i>粗斜</i></b>")
+        assert balanced(html)
+
+
+class TestIncremental:
+    """测试增量渲染"""
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_chunked_matches_whole(self, seed):
+        """测试任意分块的结果与一次性渲染相同"""
+        assert feed_randomly(SAMPLE, seed) == render_markdown(SAMPLE)
+
+    def test_every_intermediate_state_is_valid(self):
+        """测试每个分块之后的 HTML 标签都是配对的（可以直接用于编辑消息）"""
+        states = []
+        feed_randomly(SAMPLE, seed=1, check=states.append)
+
+        assert all(balanced(html) for html in states)
+        assert "<pre>" in states[-1]
+
+    def test_ambiguous_tail_waits(self):
+        """测试无法确定含义的尾部等待下一个分块"""
+        renderer = MarkdownRenderer()
+        renderer.feed("价格 *")
+        assert renderer.html == "价格 "
+        renderer.feed("重要*")
+        assert renderer.html == "价格 <i>重要</i>"
+
+        renderer = MarkdownRenderer()
+        renderer.feed("见 [文档](https://exa")
+        assert renderer.html == "见 "
+        renderer.feed("mple.com)")
+        assert renderer.html == '见 <a href="https://example.com">文档</a>'
+
+
+@pytest.mark.slow
+class TestRenderBenchmark:
+    """基准：增量渲染与每次编辑重新渲染整个缓冲区"""
+
+    def test_incremental_vs_rerender(self):
+        """约 8000 字符的回复分 400 个分块到达，每个分块后取一次 HTML"""
+        text = SAMPLE * 30
+        size = len(text) // 400 + 1
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+
+        started = time.perf_counter()
+        renderer = MarkdownRenderer()
+        for chunk in chunks:
+            renderer.feed(chunk)
+            renderer.html
+        renderer.finish()
+        incremental = time.perf_counter() - started
+
+        started = time.perf_counter()
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            render_markdown(buffer)
+        rerender = time.perf_counter() - started
+
+        print(f"\n{len(text)} 字符 / {len(chunks)} 个分块：增量 {incremental * 1e3:.1f}ms，"
+              f"每次重新渲染 {rerender * 1e3:.1f}ms")
+        assert incremental < rerender
@@ -0,0 +1,276 @@
+"""多模态输入单元测试"""
+import asyncio
+
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services import media
+from bot.services.media import (
+    BoundedBuffer,
+    MediaCache,
+    MediaTooLarge,
+    UnsupportedMedia,
+    attachment,
+    download,
+    message_parts,
+)
+
+
+def telegram_file(data: bytes, path="https://api.telegram.org/file/botTOKEN/photos/file_1.jpg", size=None):
+    file = MagicMock()
+    file.file_path = path
+    file.file_size = len(data) if size is None else size
+    return file
+
+
+def photo_message(file_unique_id="AQADxyz", caption=None):
+    """带一张图片（三种尺寸）的消息"""
+    sizes = [MagicMock(file_unique_id=f"{file_unique_id}-{i}") for i in range(3)]
+    sizes[-1].file_unique_id = file_unique_id
+    sizes[-1].get_file = AsyncMock(return_value=telegram_file(b"\xff\xd8jpeg"))
+    message = MagicMock(photo=sizes, voice=None, audio=None, document=None, caption=caption, text=None)
+    return message
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """下载请求交给本地处理函数，记录请求次数"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=b"\xff\xd8jpeg")
+
+    monkeypatch.setattr(media, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(media, "pillow_available", lambda: False)
+    yield requests
+    media._client = None
+
+
+class TestDownload:
+    """测试流式下载到有界缓冲区"""
+
+    def test_bounded_buffer(self):
+        """测试超过上限时抛出 MediaTooLarge"""
+        buffer = BoundedBuffer(limit=5)
+        buffer.write(b"abc")
+
+        with pytest.raises(MediaTooLarge):
+            buffer.write(b"def")
+
+    @pytest.mark.asyncio
+    async def test_stream_download(self, monkeypatch):
+        """测试分块读取响应"""
+        chunks = [b"a" * 1000] * 5
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        def handler(request):
+            return httpx.Response(200, content=stream())
+
+        monkeypatch.setattr(media, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+        assert await download(telegram_file(b"", size=0)) == b"a" * 5000
+
+    @pytest.mark.asyncio
+    async def test_oversized_stream_is_aborted(self, monkeypatch):
+        """测试未知大小的文件超过上限时中止下载"""
+        received = []
+
+        async def stream():
+            for _ in range(100):
+                received.append(1)
+                yield b"a" * 1000
+
+        def handler(request):
+            return httpx.Response(200, content=stream())
+
+        monkeypatch.setattr(media, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+        with pytest.raises(MediaTooLarge):
+            await download(telegram_file(b"", size=0), limit=3500)
+        assert len(received) == 4
+
+    @pytest.mark.asyncio
+    async def test_declared_size_is_checked_first(self, transport):
+        """测试已知文件大小超过上限时不发起下载"""
+        with pytest.raises(MediaTooLarge, match="上限 20 MB"):
+            await download(telegram_file(b"", size=30 * 1024 * 1024))
+        assert transport == []
+
+    @pytest.mark.asyncio
+    async def test_local_file(self, tmp_path):
+        """测试本地 Bot API 服务器给出的文件路径"""
+        path = tmp_path / "voice.ogg"
+        path.write_bytes(b"OggS" * 100)
+
+        assert await download(telegram_file(b"", path=str(path), size=0)) == b"OggS" * 100
+
+
+class TestMediaCache:
+    """测试按 file_unique_id 缓存处理结果"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_processing(self):
+        """测试同一文件并发到达时只处理一次"""
+        cache = MediaCache(max_bytes=1000)
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return b"data", "image/jpeg"
+
+        results = await asyncio.gather(*(cache.get("id", factory) for _ in range(5)))
+
+        assert calls == [1]
+        assert results == [(b"data", "image/jpeg")] * 5
+        assert (cache.hits, cache.misses) == (4, 1)
+
+    @pytest.mark.asyncio
+    async def test_waiters_retry_when_first_caller_is_cancelled(self):
+        """测试首个调用方在处理途中被取消时，等待者不会被取消，而是改用自己的 factory 处理一次"""
+        cache = MediaCache(max_bytes=1000)
+        started = asyncio.Event()
+        calls = []
+
+        async def stalled():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return b"data", "image/jpeg"
+
+        first = asyncio.create_task(cache.get("id", stalled))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.get("id", factory)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await asyncio.gather(*waiters) == [(b"data", "image/jpeg")] * 3
+        assert calls == [1]
+        assert await cache.get("id", factory) == (b"data", "image/jpeg")
+
+    @pytest.mark.asyncio
+    async def test_failure_is_not_cached(self):
+        """测试处理失败不写入缓存，下次重新处理"""
+        cache = MediaCache(max_bytes=1000)
+        factory = AsyncMock(side_effect=[RuntimeError("boom"), (b"data", "image/jpeg")])
+
+        with pytest.raises(RuntimeError):
+            await cache.get("id", factory)
+
+        assert await cache.get("id", factory) == (b"data", "image/jpeg")
+
+    @pytest.mark.asyncio
+    async def test_evicts_by_total_bytes(self):
+        """测试总字节数超过上限时淘汰最久未使用的结果"""
+        cache = MediaCache(max_bytes=10)
+        for key in ("a", "b", "c"):
+            await cache.get(key, AsyncMock(return_value=(b"x" * 4, "image/jpeg")))
+
+        assert len(cache) == 2
+        assert cache.size == 8
+        assert "a" not in cache._entries
+
+
+class TestMessageParts:
+    """测试把消息附件转为模型输入"""
+
+    @pytest.mark.asyncio
+    async def test_photo_with_caption(self, transport):
+        """测试取最大尺寸的图片，说明文字放在附件之后"""
+        message = photo_message(caption="这是什么？")
+
+        image, caption = await message_parts(message)
+
+        assert image.inline_data.mime_type == "image/jpeg"
+        assert image.inline_data.data == b"\xff\xd8jpeg"
+        assert caption == "这是什么？"
+        message.photo[-1].get_file.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_duplicate_media_is_not_reprocessed(self, transport):
+        """测试转发的同一文件（file_unique_id 相同）不再下载"""
+        await message_parts(photo_message())
+        forwarded = photo_message()
+
+        [image] = await message_parts(forwarded)
+
+        assert len(transport) == 1
+        forwarded.photo[-1].get_file.assert_not_called()
+        assert image.inline_data.data == b"\xff\xd8jpeg"
+
+    def test_voice_and_documents(self):
+        """测试语音与文件的 MIME 类型，不支持的文件类型抛出 UnsupportedMedia"""
+        voice = MagicMock(photo=(), voice=MagicMock(mime_type=None))
+        assert attachment(voice)[1:] == ("audio", "audio/ogg")
+
+        pdf = MagicMock(photo=(), voice=None, audio=None, document=MagicMock(mime_type="application/pdf"))
+        assert attachment(pdf)[1:] == ("file", "application/pdf")
+
+        archive = MagicMock(photo=(), voice=None, audio=None, document=MagicMock(mime_type="application/zip"))
+        with pytest.raises(UnsupportedMedia):
+            attachment(archive)
+
+    @pytest.mark.asyncio
+    async def test_unsupported_image_without_pillow(self, monkeypatch):
+        """测试未安装 Pillow 时拒绝模型不支持的图片格式"""
+        monkeypatch.setattr(media, "pillow_available", lambda: False)
+
+        with pytest.raises(UnsupportedMedia):
+            await media.prepare_image(b"GIF89a", "image/gif")
+
+
+class TestImageProcessing:
+    """测试图片在进程池中处理"""
+
+    @pytest.mark.asyncio
+    async def test_process_in_pool(self):
+        """测试函数在子进程中执行"""
+        import os
+
+        try:
+            assert await media.process_in_pool(os.getpid) != os.getpid()
+        finally:
+            await media.close()
+
+    def test_transcode_image(self):
+        """测试大图缩放到最长边不超过上限，不支持的格式转为 JPEG"""
+        import io
+
+        Image = pytest.importorskip("PIL.Image")
+        output = io.BytesIO()
+        Image.new("RGB", (3000, 1500)).save(output, format="BMP")
+
+        data, mime = media.transcode_image(output.getvalue(), max_side=1024, quality=85)
+
+        assert mime == "image/jpeg"
+        assert Image.open(io.BytesIO(data)).size == (1024, 512)
+
+    @pytest.mark.asyncio
+    async def test_only_images_needing_work_go_to_pool(self, monkeypatch):
+        """测试已是支持的格式且尺寸不超限的图片只读文件头、原样返回，不传给进程池"""
+        import io
+
+        Image = pytest.importorskip("PIL.Image")
+        pool = AsyncMock(return_value=(b"resized", "image/jpeg"))
+        monkeypatch.setattr(media, "process_in_pool", pool)
+        monkeypatch.setattr(media.Config, "MEDIA_IMAGE_MAX_SIDE", 1024)
+        small, large = io.BytesIO(), io.BytesIO()
+        Image.new("RGB", (800, 600)).save(small, format="PNG")
+        Image.new("RGB", (3000, 1500)).save(large, format="JPEG")
+
+        assert await media.prepare_image(small.getvalue(), "image/png") == (small.getvalue(), "image/png")
+        assert pool.await_count == 0
+
+        assert await media.prepare_image(large.getvalue(), "image/jpeg") == (b"resized", "image/jpeg")
+        assert await media.prepare_image(b"not an image", "image/jpeg") == (b"resized", "image/jpeg")
+        assert pool.await_count == 2
@@ -0,0 +1,283 @@
+"""运行指标单元测试"""
+import asyncio
+import time
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+async def http_get(port: int, path: str) -> tuple:
+    """向本地端口发送 GET 请求，返回 (状态行, 响应头, 正文)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    status, *headers = head.decode().split("\r\n")
+    return status, headers, body.decode()
+
+
+class TestMetrics:
+    """测试计数器、仪表与直方图"""
+
+    def test_counter_with_labels(self):
+        """测试带标签的计数器按标签值分别累加"""
+        registry = Registry()
+        calls = Counter("calls_total", "调用次数", ["handler"], registry=registry)
+
+        calls.labels("start").inc()
+        calls.labels("start").inc()
+        calls.labels("chat").inc(3)
+
+        text = registry.render()
+        assert "# TYPE calls_total counter" in text
+        assert 'calls_total{handler="start"} 2' in text
+        assert 'calls_total{handler="chat"} 3' in text
+
+    def test_labels_count_must_match(self):
+        """测试标签数量不符时报错"""
+        calls = Counter("calls_total", "调用次数", ["handler"], registry=Registry())
+
+        with pytest.raises(ValueError):
+            calls.labels("start", "extra")
+
+    def test_label_values_are_escaped(self):
+        """测试标签值中的引号与换行被转义"""
+        registry = Registry()
+        Counter("calls_total", "调用次数", ["handler"], registry=registry).labels('a"b\nc').inc()
+
+        assert 'calls_total{handler="a\\"b\\nc"} 1' in registry.render()
+
+    def test_duplicate_registration(self):
+        """测试同名指标重复注册时报错"""
+        registry = Registry()
+        Counter("calls_total", "调用次数", registry=registry)
+
+        with pytest.raises(ValueError):
+            Gauge("calls_total", "调用次数", registry=registry)
+
+    def test_gauge_function(self):
+        """测试仪表在采集时调用取值函数"""
+        registry = Registry()
+        sessions = {}
+        gauge = Gauge("sessions", "会话数", registry=registry)
+        gauge.set_function(lambda: len(sessions))
+
+        sessions.update({1: "a", 2: "b"})
+
+        assert gauge.get() == 2
+        assert "sessions 2" in registry.render()
+
+    def test_gauge_function_failure_skips_sample(self):
+        """测试取值函数出错时跳过该指标，不影响其他指标输出"""
+        registry = Registry()
+        Gauge("broken", "出错的仪表", registry=registry).set_function(lambda: 1 / 0)
+        Gauge("ok", "正常的仪表", registry=registry).set(5)
+
+        text = registry.render()
+        assert "\nbroken " not in text
+        assert "ok 5" in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        """测试直方图按 le 上界累计输出，并带 _sum 与 _count"""
+        registry = Registry()
+        histogram = Histogram("latency_seconds", "耗时", buckets=(0.1, 1.0), registry=registry)
+
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        text = registry.render()
+        assert 'latency_seconds_bucket{le="0.1"} 2' in text
+        assert 'latency_seconds_bucket{le="1"} 3' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+        assert "latency_seconds_sum 2.65" in text
+        assert "latency_seconds_count 4" in text
+
+    def test_histogram_with_labels(self):
+        """测试带标签的直方图 le 排在其他标签之后"""
+        registry = Registry()
+        histogram = Histogram("api_seconds", "耗时", ["method"], buckets=(1.0,), registry=registry)
+
+        histogram.labels("sendMessage").observe(0.2)
+
+        text = registry.render()
+        assert 'api_seconds_bucket{method="sendMessage",le="1"} 1' in text
+        assert 'api_seconds_count{method="sendMessage"} 1' in text
+
+
+class TestMetricsServer:
+    """测试 /metrics 端点"""
+
+    @pytest.mark.asyncio
+    async def test_serves_metrics(self):
+        """测试 GET /metrics 返回文本格式"""
+        registry = Registry()
+        Counter("calls_total", "调用次数", registry=registry).inc()
+        server = MetricsServer(registry, port=0)
+        await server.start()
+        try:
+            status, headers, body = await http_get(server.port, "/metrics")
+        finally:
+            await server.stop()
+
+        assert status == "HTTP/1.1 200 OK"
+        assert "Content-Type: text/plain; version=0.0.4; charset=utf-8" in headers
+        assert "calls_total 1" in body
+
+    @pytest.mark.asyncio
+    async def test_unknown_path(self):
+        """测试其他路径返回 404"""
+        server = MetricsServer(Registry(), port=0)
+        await server.start()
+        try:
+            status, _, _ = await http_get(server.port, "/")
+        finally:
+            await server.stop()
+
+        assert status == "HTTP/1.1 404 Not Found"
+
+
+class TestInstrumentation:
+    """测试热路径上的埋点"""
+
+    @pytest.mark.asyncio
+    async def test_handler_counters(self):
+        """测试处理器包装记录调用次数、异常次数与耗时"""
+        from bot.app import HANDLER_CALLS, HANDLER_ERRORS, HANDLER_SECONDS, instrumented
+
+        async def flaky(update, context):
+            if update == "boom":
+                raise RuntimeError("boom")
+            return "ok"
+
+        wrapped = instrumented(flaky, "test_flaky")
+        calls = HANDLER_CALLS.labels("test_flaky").value
+        errors = HANDLER_ERRORS.labels("test_flaky").value
+        observed = HANDLER_SECONDS.labels("test_flaky").count
+
+        assert await wrapped("fine", None) == "ok"
+        with pytest.raises(RuntimeError):
+            await wrapped("boom", None)
+
+        assert wrapped.__name__ == "flaky"
+        assert HANDLER_CALLS.labels("test_flaky").value == calls + 2
+        assert HANDLER_ERRORS.labels("test_flaky").value == errors + 1
+        assert HANDLER_SECONDS.labels("test_flaky").count == observed + 2
+
+    @pytest.mark.asyncio
+    async def test_update_latency(self, mocker):
+        """测试每条更新的处理耗时被记录"""
+        from telegram.ext import Application
+
+        from bot.server import UPDATE_SECONDS, DrainingApplication
+
+        mocker.patch.object(Application, "process_update", AsyncMock())
+        app = DrainingApplication.__new__(DrainingApplication)
+        app._in_flight = set()
+        mocker.patch.object(DrainingApplication, "concurrent_updates", 1)
+        observed = UPDATE_SECONDS.count
+
+        await app.process_update(MagicMock())
+
+        assert UPDATE_SECONDS.count == observed + 1
+
+    @pytest.mark.asyncio
+    async def test_telegram_api_latency(self, mocker):
+        """测试 Bot API 调用耗时按方法名分组记录"""
+        from telegram.request import HTTPXRequest
+
+        from bot.server import TELEGRAM_API_SECONDS, InstrumentedRequest
+
+        mocker.patch.object(HTTPXRequest, "do_request", AsyncMock(return_value=(200, b"{}")))
+        request = InstrumentedRequest()
+        observed = TELEGRAM_API_SECONDS.labels("sendMessage").count
+
+        result = await request.do_request("https://api.telegram.org/botTOKEN/sendMessage", "POST")
+
+        assert result == (200, b"{}")
+        assert TELEGRAM_API_SECONDS.labels("sendMessage").count == observed + 1
+
+    def test_gauges_track_state(self):
+        """测试会话数与提醒数仪表反映当前状态"""
+        from bot.app import ACTIVE_SESSIONS, SCHEDULED_REMINDERS
+        from bot.services import ai
+        from bot.services.reminder import reminder_engine
+
+        ai.user_chats.put(1, MagicMock())
+        reminder_engine.subscribe(1, "23:30")
+
+        assert ACTIVE_SESSIONS.get() == len(ai.user_chats) == 1
+        assert SCHEDULED_REMINDERS.get() == 1
+
+    @pytest.mark.asyncio
+    async def test_component_stats_are_exported(self, mocker):
+        """测试会话存储、收件箱、限流器、回复缓存、重试 / 对冲与模型路由的统计出现在 /metrics 中"""
+        from bot import app as app_module
+        from bot.services import ai
+        from bot.services.cache import ResponseCache
+        from bot.services.metrics import REGISTRY
+
+        mocker.patch.object(ai, "response_cache", ResponseCache(max_entries=10, ttl=60))
+        ai.user_chats.put(1, MagicMock())
+        ai.call_stats["hedge_wins"] = 2
+        ai.limiter.throttled = 3
+        async with app_module.chat_inbox.turn(1, "hi"):
+            pass
+
+        text = REGISTRY.render()
+
+        assert 'bot_session_store{stat="sessions"} 1' in text
+        assert 'bot_inbox{stat="coalesce_ratio"} 1' in text
+        assert 'bot_model_limiter{stat="throttled"} 3' in text
+        assert 'bot_model_calls{stat="hedge_wins"} 2' in text
+        assert 'bot_response_cache{stat="hit_rate"} 0' in text
+        assert 'bot_broadcaster{stat="sent"} 0' in text
+        assert f'bot_model_route_in_flight{{model="{ai.prompts.registry.default.model}"}} 0' in text
+
+    @pytest.mark.asyncio
+    async def test_startup_starts_metrics_server(self, mocker):
+        """测试配置了端口时随启动开启端点，退出时关闭"""
+        from bot import app as app_module
+
+        mocker.patch.object(app_module.Config, "METRICS_PORT", 1)
+        mocker.patch.object(app_module.Config, "AI_WARMUP", False)
+        mocker.patch.object(app_module, "_metrics_server", None)
+        mocker.patch.object(app_module, "close_storage")
+        server = MagicMock(start=AsyncMock(), stop=AsyncMock())
+        server_class = mocker.patch.object(app_module, "MetricsServer", return_value=server)
+
+        await app_module.on_startup(MagicMock())
+        await app_module.on_shutdown(MagicMock())
+
+        server_class.assert_called_once_with(listen=app_module.Config.METRICS_LISTEN, port=1)
+        server.start.assert_awaited_once()
+        server.stop.assert_awaited_once()
+        assert app_module._metrics_server is None
+
+    @pytest.mark.slow
+    def test_overhead(self):
+        """微基准：单次埋点开销（纳秒），应远小于一次更新的处理时间"""
+        registry = Registry()
+        counter = Counter("calls_total", "调用次数", ["handler"], registry=registry).labels("chat")
+        histogram = Histogram("latency_seconds", "耗时", registry=registry)
+        n = 200_000
+
+        def measure(operation) -> float:
+            started = time.perf_counter()
+            for _ in range(n):
+                operation()
+            return (time.perf_counter() - started) / n * 1e9
+
+        baseline = measure(lambda: None)
+        inc = measure(counter.inc) - baseline
+        observe = measure(lambda: histogram.observe(0.3)) - baseline
+        timed = measure(lambda: histogram.observe(time.perf_counter() - time.perf_counter())) - baseline
+
+        print(f"Counter.inc: {inc:.0f}ns, Histogram.observe: {observe:.0f}ns, 计时+observe: {timed:.0f}ns")
+
+        # 一条更新的处理时间在毫秒级，每条更新数次埋点的开销应低于 10 微秒
+        assert inc < 10_000
+        assert timed < 10_000
@@ -0,0 +1,126 @@
+"""模型配置与系统提示词模板单元测试"""
+import json
+
+import pytest
+
+from bot.services import prompts
+from bot.services.groups import session_key
+from bot.services.prompts import ModelProfile, compile_prompt, generation_config, load_profiles
+
+
+class TestCompilePrompt:
+    """测试系统提示词模板的编译"""
+
+    def test_substitutes_placeholders(self):
+        """测试替换 {{name}} 占位符（允许空格）"""
+        text = compile_prompt("你是{{bot_name}}，使用{{ language }}回答。", {"bot_name": "小助手", "language": "中文"})
+
+        assert text == "你是小助手，使用中文回答。"
+
+    def test_unknown_placeholder_fails(self):
+        """测试未知占位符在启动时报错"""
+        with pytest.raises(ValueError, match="user"):
+            compile_prompt("你好 {{user}}", {"bot_name": "x"})
+
+    def test_other_braces_are_kept(self):
+        """测试提示词中的其他花括号与 $ 原样保留"""
+        template = '输出 JSON：{"a": {{ "b" }}}，价格 $5'
+
+        assert compile_prompt(template, {}) == template
+
+    def test_reads_file(self, tmp_path):
+        """测试 @path 从文件读取模板"""
+        path = tmp_path / "prompt.txt"
+        path.write_text("我是{{bot_name}}\n", encoding="utf-8")
+
+        assert compile_prompt(f"@{path}", {"bot_name": "Bot"}) == "我是Bot"
+
+    def test_default_prompt_compiled(self):
+        """测试内置模板在启动时编译为最终文本"""
+        instruction = prompts.registry.default.system_instruction
+
+        assert "{{" not in instruction
+        assert prompts.Config.BOT_NAME in instruction
+
+
+class TestGenerationConfig:
+    """测试生成参数的校验"""
+
+    def test_converts_and_skips_unset(self):
+        """测试转换类型并去掉未设置的项"""
+        assert generation_config({"temperature": "0.3", "max_output_tokens": "", "top_k": 40}) == {
+            "temperature": 0.3, "top_k": 40,
+        }
+
+    def test_unknown_field_fails(self):
+        """测试未知参数报错"""
+        with pytest.raises(ValueError):
+            generation_config({"temprature": 0.3})
+
+
+class TestModelProfile:
+    """测试模型配置"""
+
+    def test_key_by_content(self):
+        """测试内容相同的配置缓存键相同，与名称无关"""
+        a = ModelProfile("a", "gemini-2.5-pro", "写代码", {"temperature": 0.2, "top_k": 10})
+        b = ModelProfile("b", "gemini-2.5-pro", "写代码", {"top_k": 10, "temperature": 0.2})
+        c = ModelProfile("c", "gemini-2.5-pro", "写代码", {"temperature": 0.3})
+
+        assert a.key == b.key
+        assert a.key != c.key
+
+    def test_model_kwargs_omit_unset(self):
+        """测试未设置的项不传给 GenerativeModel"""
+        assert ModelProfile("a", "m").model_kwargs() == {}
+        assert ModelProfile("a", "m", "提示", {"temperature": 0.5}).model_kwargs() == {
+            "system_instruction": "提示", "generation_config": {"temperature": 0.5},
+        }
+
+
+class TestLoadProfiles:
+    """测试按对话配置文件的加载"""
+
+    def write(self, tmp_path, data):
+        path = tmp_path / "profiles.json"
+        path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        return str(path)
+
+    def test_without_file(self):
+        """测试未配置文件时全部对话使用部署配置"""
+        registry = load_profiles("")
+
+        assert registry.profile_for(42) is registry.default
+        assert registry.default.model == prompts.Config.AI_MODEL
+
+    def test_chat_profiles(self, tmp_path, mocker):
+        """测试命名配置继承部署配置，对话与论坛话题映射到配置"""
+        mocker.patch.object(prompts.Config, "AI_TEMPERATURE", "0.7")
+        path = self.write(tmp_path, {
+            "profiles": {
+                "coder": {"model": "gemini-2.5-pro", "system_prompt": "{{bot_name}} 只写代码",
+                          "generation_config": {"max_output_tokens": 2048}},
+                "calm": {"generation_config": {"temperature": 0.1}},
+            },
+            "chats": {"-100": "coder", "-100:7": "calm", "42": "calm"},
+        })
+
+        registry = load_profiles(path)
+
+        coder = registry.profile_for(-100)
+        assert coder.model == "gemini-2.5-pro"
+        assert coder.system_instruction == f"{prompts.Config.BOT_NAME} 只写代码"
+        assert coder.generation_config == {"temperature": 0.7, "max_output_tokens": 2048}
+        calm = registry.profile_for(session_key(-100, 7))
+        assert calm is registry.profile_for(42)
+        assert calm.model == registry.default.model
+        assert calm.system_instruction == registry.default.system_instruction
+        assert calm.generation_config == {"temperature": 0.1}
+        assert registry.profile_for(-200) is registry.default
+
+    def test_undefined_profile_fails(self, tmp_path):
+        """测试对话使用未定义的配置时启动失败"""
+        path = self.write(tmp_path, {"profiles": {}, "chats": {"1": "missing"}})
+
+        with pytest.raises(ValueError, match="missing"):
+            load_profiles(path)
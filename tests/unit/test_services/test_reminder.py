@@ -1,9 +1,20 @@
 """睡眠提醒服务单元测试"""
+import asyncio
+
 import pytest
 from datetime import time
 from unittest.mock import AsyncMock
 
-from bot.services.reminder import parse_time, send_sleep_reminder, sleep_reminder_users
+import pytz
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from bot.services.reminder import (
+    get_zone,
+    parse_time,
+    reminder_engine,
+    send_sleep_reminder,
+    sleep_reminder_users,
+)
 
 
 class TestParseTime:
@@ -94,10 +105,9 @@ class TestSendSleepReminder:
     @pytest.mark.asyncio
     async def test_send_reminder_success(self, mock_context):
         """测试成功发送睡眠提醒"""
-        mock_context.job.data = {"chat_id": 12345, "time_str": "23:30"}
         mock_context.bot.send_message = AsyncMock()
 
-        await send_sleep_reminder(mock_context)
+        assert await send_sleep_reminder(mock_context.bot, 12345, "23:30") is True
 
         mock_context.bot.send_message.assert_called_once_with(
             chat_id=12345,
@@ -107,10 +117,9 @@ class TestSendSleepReminder:
     @pytest.mark.asyncio
     async def test_send_reminder_with_different_time(self, mock_context):
         """测试发送不同时间的提醒"""
-        mock_context.job.data = {"chat_id": 99999, "time_str": "22:00"}
         mock_context.bot.send_message = AsyncMock()
 
-        await send_sleep_reminder(mock_context)
+        await send_sleep_reminder(mock_context.bot, 99999, "22:00")
 
         mock_context.bot.send_message.assert_called_once()
         call_args = mock_context.bot.send_message.call_args
@@ -120,40 +129,423 @@ class TestSendSleepReminder:
     @pytest.mark.asyncio
     async def test_send_reminder_failure_logs_error(self, mock_context, mocker):
         """测试发送失败时记录错误日志"""
-        mock_context.job.data = {"chat_id": 12345, "time_str": "23:30"}
         mock_context.bot.send_message = AsyncMock(side_effect=Exception("Network error"))
 
         mock_logger = mocker.patch('bot.services.reminder.logging.error')
 
-        await send_sleep_reminder(mock_context)
+        assert await send_sleep_reminder(mock_context.bot, 12345, "23:30") is False
 
         mock_logger.assert_called_once()
         assert "发送睡眠提醒给 12345 失败" in mock_logger.call_args[0][0]
 
     @pytest.mark.asyncio
-    async def test_send_reminder_failure_removes_job(self, mock_context, mocker):
-        """测试发送失败时移除任务"""
-        mock_context.job.data = {"chat_id": 12345, "time_str": "23:30"}
-        mock_context.bot.send_message = AsyncMock(side_effect=Exception("Network error"))
-        mock_context.job.schedule_removal = mocker.MagicMock()
+    async def test_send_reminder_blocked_unsubscribes(self, mock_context):
+        """测试被用户拉黑（永久错误）时取消订阅"""
+        chat_id = 12345
+        mock_context.bot.send_message = AsyncMock(
+            side_effect=Forbidden("Forbidden: bot was blocked by the user")
+        )
+        reminder_engine.subscribe(chat_id, "23:30")
 
-        await send_sleep_reminder(mock_context)
+        assert await send_sleep_reminder(mock_context.bot, chat_id, "23:30") is False
 
-        mock_context.job.schedule_removal.assert_called_once()
+        assert chat_id not in sleep_reminder_users
+        assert chat_id not in reminder_engine.due(23, 30)
 
     @pytest.mark.asyncio
-    async def test_send_reminder_failure_removes_user_from_dict(self, mock_context):
-        """测试发送失败时从字典中移除用户"""
+    async def test_send_reminder_transient_failure_keeps_subscription(self, mock_context):
+        """测试限流、网络等非永久错误时保留订阅"""
         chat_id = 12345
-        mock_context.job.data = {"chat_id": chat_id, "time_str": "23:30"}
         mock_context.bot.send_message = AsyncMock(side_effect=Exception("Network error"))
+        reminder_engine.subscribe(chat_id, "23:30")
 
-        # 先添加用户到字典
-        sleep_reminder_users[chat_id] = {"time": time(23, 30)}
+        await send_sleep_reminder(mock_context.bot, chat_id, "23:30")
 
-        await send_sleep_reminder(mock_context)
+        assert chat_id in reminder_engine.due(23, 30)
 
-        assert chat_id not in sleep_reminder_users
+    @pytest.mark.asyncio
+    async def test_send_reminder_retries_after_flood_limit(self, mock_context):
+        """测试收到 RetryAfter 后等待并重发"""
+        mock_context.bot.send_message = AsyncMock(side_effect=[RetryAfter(0.05), None])
+        reminder_engine.subscribe(12345, "23:30")
+
+        assert await send_sleep_reminder(mock_context.bot, 12345, "23:30") is True
+
+        assert mock_context.bot.send_message.await_count == 2
+        assert 12345 in sleep_reminder_users
+
+
+class TestReminderEngine:
+    """测试按分钟分桶的提醒调度器"""
+
+    def test_subscribe_adds_to_minute_bucket(self):
+        """测试订阅后进入对应分钟的桶"""
+        reminder_engine.subscribe(1, "23:30")
+        reminder_engine.subscribe(2, "23:30")
+        reminder_engine.subscribe(3, "9:05")
+
+        assert reminder_engine.due(23, 30) == {1, 2}
+        assert reminder_engine.due(9, 5) == {3}
+        assert reminder_engine.status(3)["time_str"] == "9:05"
+        assert reminder_engine.stats()["buckets"] == 2
+
+    def test_resubscribe_moves_bucket(self):
+        """测试修改时间时从旧桶移到新桶"""
+        reminder_engine.subscribe(1, "23:30")
+        reminder_engine.subscribe(1, "22:00")
+
+        assert reminder_engine.due(23, 30) == set()
+        assert reminder_engine.due(22, 0) == {1}
+        assert len(reminder_engine) == 1
+
+    def test_invalid_time_keeps_existing_subscription(self):
+        """测试时间格式错误时保留原订阅"""
+        reminder_engine.subscribe(1, "23:30")
+
+        with pytest.raises(ValueError):
+            reminder_engine.subscribe(1, "25:00")
+
+        assert reminder_engine.due(23, 30) == {1}
+
+    def test_unsubscribe(self):
+        """测试取消订阅"""
+        reminder_engine.subscribe(1, "23:30")
+
+        assert reminder_engine.unsubscribe(1) is True
+        assert reminder_engine.unsubscribe(1) is False
+        assert reminder_engine.status(1) is None
+        assert reminder_engine.stats()["buckets"] == 0
+
+    def test_next_run(self):
+        """测试下次提醒时间：今天未到则今天，已过则明天"""
+        from datetime import datetime
+        from bot.services import reminder
+
+        tz = reminder.Config.BEIJING_TZ
+        reminder_engine.subscribe(1, "23:30")
+        now = tz.localize(datetime(2024, 1, 1, 22, 0))
+
+        assert reminder_engine.next_run(1, now) == tz.localize(datetime(2024, 1, 1, 23, 30))
+        later = tz.localize(datetime(2024, 1, 1, 23, 30))
+        assert reminder_engine.next_run(1, later) == tz.localize(datetime(2024, 1, 2, 23, 30))
+        assert reminder_engine.next_run(2, now) is None
+
+    def test_start_registers_single_repeating_job(self, mock_context):
+        """测试只注册一个每分钟触发的任务"""
+        reminder_engine.start(mock_context.job_queue)
+        reminder_engine.start(mock_context.job_queue)
+
+        mock_context.job_queue.run_repeating.assert_called_once()
+        assert mock_context.job_queue.run_repeating.call_args[1]["interval"] == 60
+
+    @pytest.mark.asyncio
+    async def test_dispatch_sends_whole_bucket(self, mock_context):
+        """测试一次发送整个分钟桶"""
+        mock_context.bot.send_message = AsyncMock()
+        for chat_id in (1, 2, 3):
+            reminder_engine.subscribe(chat_id, "23:30")
+        reminder_engine.subscribe(4, "22:00")
+
+        delivered = await reminder_engine.dispatch(mock_context.bot, 23, 30)
+
+        assert delivered == 3
+        sent_to = {c[1]["chat_id"] for c in mock_context.bot.send_message.call_args_list}
+        assert sent_to == {1, 2, 3}
+
+    def test_minutes_to_dispatch_catches_up_and_skips_duplicates(self):
+        """测试错过的分钟补发、重复触发的分钟跳过"""
+        from datetime import datetime
+
+        first = datetime(2024, 1, 1, 23, 0)
+        assert reminder_engine._minutes_to_dispatch(first) == [first]
+        assert reminder_engine._minutes_to_dispatch(first) == []
+
+        later = datetime(2024, 1, 1, 23, 3)
+        assert [m.minute for m in reminder_engine._minutes_to_dispatch(later)] == [1, 2, 3]
+
+        much_later = datetime(2024, 1, 2, 1, 0)
+        assert len(reminder_engine._minutes_to_dispatch(much_later)) == 10
+
+    @pytest.mark.asyncio
+    async def test_tick_dispatches_current_minute(self, mock_context, mocker):
+        """测试定时任务按最近的整分钟发送"""
+        from datetime import datetime
+        from bot.services import reminder
+
+        fake_now = reminder.Config.BEIJING_TZ.localize(datetime(2024, 1, 1, 23, 29, 59, 900000))
+        mocker.patch.object(reminder_engine, "_utc_now", return_value=fake_now.astimezone(pytz.utc))
+        mock_context.bot.send_message = AsyncMock()
+        reminder_engine.subscribe(1, "23:30")
+
+        await reminder_engine._tick(mock_context)
+        await asyncio.gather(*mock_context.application.tasks)
+
+        mock_context.bot.send_message.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_large_bucket_does_not_delay_next_minute(self, mock_context, mocker):
+        """测试大的分钟桶在后台发送：定时任务立即返回，下一分钟的提醒不等上一分钟发完"""
+        from datetime import datetime, timedelta
+        from bot.services import reminder
+
+        minute = reminder.Config.BEIJING_TZ.localize(datetime(2024, 1, 1, 23, 30)).astimezone(pytz.utc)
+        now = mocker.patch.object(reminder_engine, "_utc_now", return_value=minute)
+        for chat_id in range(200):
+            reminder_engine.subscribe(chat_id, "23:30")
+        reminder_engine.subscribe(999, "23:31")
+        # 23:30 的发送一直没有完成（相当于限速发送需要数分钟）
+        stalled = asyncio.Event()
+
+        async def send_message(chat_id, text):
+            if chat_id != 999:
+                await stalled.wait()
+
+        mock_context.bot.send_message = AsyncMock(side_effect=send_message)
+
+        # 定时任务不等待发送完成
+        await asyncio.wait_for(reminder_engine._tick(mock_context), timeout=1)
+        now.return_value = minute + timedelta(minutes=1)
+        await asyncio.wait_for(reminder_engine._tick(mock_context), timeout=1)
+
+        big, small = mock_context.application.tasks
+        assert await asyncio.wait_for(small, timeout=1) == 1
+        assert not big.done()
+        stalled.set()
+        assert await big == 200
+
+    @pytest.mark.asyncio
+    async def test_drain_cancels_unfinished_batches(self, mock_context, mocker):
+        """测试退出时限时等待后台发送：超时的批次被取消并返回其分钟，已完成的批次不受影响"""
+        from datetime import datetime
+        from bot.services import reminder
+
+        minute = reminder.Config.BEIJING_TZ.localize(datetime(2024, 1, 1, 23, 30)).astimezone(pytz.utc)
+        mocker.patch.object(reminder_engine, "_utc_now", return_value=minute)
+        for chat_id in range(20):
+            reminder_engine.subscribe(chat_id, "23:30")
+        stalled = asyncio.Event()
+
+        async def send_message(chat_id, text):
+            await stalled.wait()
+
+        mock_context.bot.send_message = AsyncMock(side_effect=send_message)
+        await reminder_engine._tick(mock_context)
+        await asyncio.sleep(0)
+
+        assert await reminder_engine.drain(0.05) == ["15:30"]
+        assert mock_context.application.tasks[0].cancelled()
+        assert await reminder_engine.drain(0.05) == []
+
+
+class TestTimezones:
+    """测试按用户时区的提醒"""
+
+    def test_subscribe_with_timezone(self):
+        """测试指定时区订阅：按该时区的本地时间提醒"""
+        reminder_engine.subscribe(1, "23:30 Europe/Berlin")
+
+        assert reminder_engine.status(1)["tz"] == "Europe/Berlin"
+        assert reminder_engine.spec(1) == "23:30 Europe/Berlin"
+        assert reminder_engine.due(23, 30, get_zone("Europe/Berlin")) == {1}
+        assert reminder_engine.due(23, 30) == set()
+
+    def test_default_timezone_spec_has_no_zone(self):
+        """测试默认时区只保存时间，兼容已有的存储数据"""
+        reminder_engine.subscribe(1, "23:30")
+
+        assert reminder_engine.status(1)["tz"] == "Asia/Shanghai"
+        assert reminder_engine.spec(1) == "23:30"
+
+    def test_unknown_timezone_rejected(self):
+        """测试未知时区"""
+        with pytest.raises(ValueError, match="未知的时区"):
+            reminder_engine.subscribe(1, "23:30 Mars/Olympus")
+        assert 1 not in sleep_reminder_users
+
+    def test_zones_share_utc_bucket(self):
+        """测试不同时区的同一 UTC 时刻落在同一个桶"""
+        reminder_engine.subscribe(1, "22:30")
+        reminder_engine.subscribe(2, "23:30 Asia/Tokyo")
+
+        assert reminder_engine.due(22, 30) == {1, 2}
+        assert reminder_engine.due(14, 30, pytz.utc) == {1, 2}
+        assert reminder_engine.stats()["buckets"] == 1
+        assert reminder_engine.stats()["zones"] == 2
+
+    def test_unsubscribe_drops_empty_zone(self):
+        """测试时区没有订阅后移除"""
+        reminder_engine.subscribe(1, "23:30 Europe/Berlin")
+        reminder_engine.unsubscribe(1)
+
+        assert reminder_engine.stats()["zones"] == 0
+        assert reminder_engine.stats()["buckets"] == 0
+
+    def test_dst_transition_moves_only_affected_zone(self, mocker):
+        """测试夏令时切换时只移动该时区的订阅"""
+        from datetime import datetime
+        from bot.services.reminder import ReminderEngine
+
+        engine = ReminderEngine({})
+        before = pytz.utc.localize(datetime(2024, 3, 30, 12, 0))
+        mocker.patch.object(engine, "_utc_now", return_value=before)
+        engine.subscribe(1, "23:30 Europe/Berlin")
+        engine.subscribe(2, "23:30")
+
+        assert engine.due(22, 30, pytz.utc) == {1}
+
+        # 柏林 2024-03-31 01:00 UTC 切换到夏令时（UTC+2）
+        assert engine.refresh(pytz.utc.localize(datetime(2024, 3, 31, 0, 59))) == 0
+        moved = engine.refresh(pytz.utc.localize(datetime(2024, 3, 31, 1, 0)))
+
+        assert moved == 1
+        assert engine._buckets[21 * 60 + 30] == {1}
+        assert 22 * 60 + 30 not in engine._buckets
+        assert engine._buckets[15 * 60 + 30] == {2}
+        assert engine.stats()["rebuilds"] == 1
+
+    def test_resubscribe_keeps_one_pending_transition_per_zone(self, mocker):
+        """测试反复订阅、取消同一时区时切换堆不增长，切换仍按时处理"""
+        from datetime import datetime
+        from bot.services.reminder import ReminderEngine
+
+        engine = ReminderEngine({})
+        mocker.patch.object(engine, "_utc_now", return_value=pytz.utc.localize(datetime(2024, 3, 30, 12, 0)))
+        for _ in range(1000):
+            engine.subscribe(1, "23:30 Europe/Berlin")
+            engine.unsubscribe(1)
+        for chat_id in range(50):
+            engine.subscribe(chat_id, "23:30 America/New_York")
+            engine.unsubscribe(chat_id)
+
+        assert engine.stats()["zones"] == 0
+        assert len(engine._transitions) == 2
+
+        engine.subscribe(1, "23:30 Europe/Berlin")
+        assert len(engine._transitions) == 2
+        assert engine.refresh(pytz.utc.localize(datetime(2024, 3, 31, 1, 0))) == 1
+        assert engine._buckets[21 * 60 + 30] == {1}
+        # 纽约没有订阅，出堆后不再登记下一次切换；柏林登记下一次切换
+        assert engine.refresh(pytz.utc.localize(datetime(2024, 11, 4))) == 1
+        assert [zone for _, zone in engine._transitions] == ["Europe/Berlin"]
+
+    def test_next_run_in_user_timezone(self):
+        """测试下次提醒时间按用户所在时区计算"""
+        from datetime import datetime
+
+        reminder_engine.subscribe(1, "23:30 America/New_York")
+        now = pytz.utc.localize(datetime(2024, 1, 1, 12, 0))
+
+        next_run = reminder_engine.next_run(1, now)
+
+        assert next_run.tzinfo.zone == "America/New_York"
+        assert (next_run.hour, next_run.minute, next_run.day) == (23, 30, 1)
+
+    def test_zone_objects_are_cached(self, mocker):
+        """测试时区对象被缓存，不重复调用 pytz.timezone"""
+        get_zone("Europe/Berlin")
+        spy = mocker.spy(pytz, "timezone")
+
+        reminder_engine.subscribe(1, "23:30 Europe/Berlin")
+        reminder_engine.subscribe(2, "22:00 Europe/Berlin")
+
+        spy.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_reminder_text_names_timezone(self, mock_context):
+        """测试提醒内容展示用户所在时区"""
+        mock_context.bot.send_message = AsyncMock()
+
+        await send_sleep_reminder(mock_context.bot, 1, "23:30", tz="Europe/Berlin")
+
+        assert "Europe/Berlin" in mock_context.bot.send_message.call_args[1]["text"]
+
+    def test_restore_and_export_keep_timezone(self, mock_context):
+        """测试持久化与交接时保留时区"""
+        from bot.services.reminder import export_reminders, restore_reminders
+        from bot.services.storage import get_storage
+
+        get_storage().save_reminder(1, "23:30 Europe/Berlin")
+        restore_reminders(mock_context.job_queue)
+
+        assert reminder_engine.status(1)["tz"] == "Europe/Berlin"
+        assert export_reminders(keep=lambda chat_id: False) == [(1, "23:30 Europe/Berlin")]
+
+    @pytest.mark.asyncio
+    async def test_reminder_text_uses_subscriber_locale(self, mock_context):
+        """测试提醒按订阅时的语言发送，未记录语言时使用默认语言"""
+        mock_context.bot.send_message = AsyncMock()
+        reminder_engine.subscribe(1, "22:30 UTC", locale="en")
+        reminder_engine.subscribe(2, "22:30 UTC")
+
+        assert await reminder_engine.dispatch(mock_context.bot, 22, 30, pytz.utc) == 2
+
+        texts = {call.kwargs["chat_id"]: call.kwargs["text"] for call in mock_context.bot.send_message.call_args_list}
+        assert texts[1].startswith("🌙 Good night! It's 22:30 UTC time")
+        assert texts[2].startswith("🌙 晚安！现在是UTC 时间 22:30")
+
+    def test_locale_survives_restore_and_export(self, mock_context):
+        """测试非默认语言随设置持久化与交接，默认语言不写入"""
+        from bot.services.reminder import export_reminders, schedule_reminders
+
+        reminder_engine.subscribe(1, "23:30 Europe/Berlin", locale="en")
+        reminder_engine.subscribe(2, "23:30", locale="en")
+        reminder_engine.subscribe(3, "23:30", locale="zh")
+
+        assert [reminder_engine.spec(chat_id) for chat_id in (1, 2, 3)] == ["23:30 Europe/Berlin en", "23:30 en", "23:30"]
+
+        rows = export_reminders(keep=lambda chat_id: False)
+        assert schedule_reminders(rows) == 3
+        assert reminder_engine.status(1)["tz"] == "Europe/Berlin"
+        assert [reminder_engine.status(chat_id)["locale"] for chat_id in (1, 2)] == ["en", "en"]
+
+    def test_spec_errors_are_localized(self):
+        """测试设置错误按语言展示，str() 为默认语言"""
+        from bot.services.reminder import ReminderSpecError
+        from bot.services.texts import catalogs
+
+        with pytest.raises(ReminderSpecError) as error:
+            reminder_engine.subscribe(1, "23:30 Mars/Olympus")
+
+        assert str(error.value) == "未知的时区: Mars/Olympus"
+        assert error.value.message(catalogs["en"]) == "Unknown timezone: Mars/Olympus"
+
+    @pytest.mark.slow
+    def test_lookup_cost_independent_of_zone_count(self):
+        """基准：10 万订阅分布在 1 个时区与全部常用时区时的订阅耗时、分钟查询耗时与夏令时重建量"""
+        import time as timer
+        from datetime import datetime, timedelta
+        from bot.services.reminder import ReminderEngine
+
+        count = 100_000
+        start = pytz.utc.localize(datetime(2024, 1, 1))
+
+        def build(zones):
+            engine = ReminderEngine({})
+            engine._utc_now = lambda: start
+            started = timer.perf_counter()
+            for chat_id in range(count):
+                engine.subscribe(chat_id, f"{chat_id % 24}:{chat_id % 60:02d} {zones[chat_id % len(zones)]}")
+            return engine, timer.perf_counter() - started
+
+        def lookup_us(engine):
+            started = timer.perf_counter()
+            for minute in range(24 * 60):
+                engine.due(minute // 60, minute % 60, pytz.utc)
+            return (timer.perf_counter() - started) / (24 * 60) * 1e6
+
+        results = {}
+        for label, zones in (("单时区", ["Asia/Shanghai"]), ("全部时区", pytz.common_timezones)):
+            engine, elapsed = build(zones)
+            # 模拟一年内每小时的检查，统计夏令时切换移动的订阅数
+            started = timer.perf_counter()
+            moved = sum(engine.refresh(start + timedelta(hours=h)) for h in range(366 * 24))
+            refresh_elapsed = timer.perf_counter() - started
+            results[label] = lookup_us(engine)
+            print(f"\n{label}（{engine.stats()['zones']} 个时区）: 订阅 {elapsed:.2f}s，"
+                  f"查询 {results[label]:.1f}µs，一年内重建 {engine.stats()['rebuilds']} 次、"
+                  f"移动 {moved} 个订阅，耗时 {refresh_elapsed:.2f}s")
+
+        assert results["全部时区"] < results["单时区"] * 5
 
 
 class TestSleepReminderUsers:
@@ -188,3 +580,145 @@ class TestSleepReminderUsers:
         del sleep_reminder_users[chat_id]
 
         assert chat_id not in sleep_reminder_users
+
+
+class TestRestoreReminders:
+    """测试 restore_reminders 函数"""
+
+    def test_restore_schedules_stored_reminders(self, mock_context):
+        """测试从存储恢复提醒任务"""
+        from bot.services.reminder import restore_reminders
+        from bot.services.storage import get_storage
+
+        get_storage().save_reminder(1, "22:00")
+        get_storage().save_reminder(2, "23:30")
+
+        restored = restore_reminders(mock_context.job_queue)
+
+        assert restored == 2
+        assert reminder_engine.due(22, 0) == {1}
+        assert reminder_engine.due(23, 30) == {2}
+        assert sleep_reminder_users[1]["time"].hour == 22
+        # 无论多少个提醒，只注册一个每分钟触发的任务
+        mock_context.job_queue.run_repeating.assert_called_once()
+        mock_context.job_queue.run_daily.assert_not_called()
+
+    def test_restore_skips_invalid_rows(self, mock_context):
+        """测试跳过无效的提醒设置"""
+        from bot.services.reminder import restore_reminders
+        from bot.services.storage import get_storage
+
+        get_storage().save_reminder(1, "bad")
+
+        assert restore_reminders(mock_context.job_queue) == 0
+
+    def test_restore_only_owned_reminders(self, mock_context):
+        """测试多进程分片时只恢复归属本进程的提醒"""
+        from bot.services.reminder import restore_reminders
+        from bot.services.storage import get_storage
+
+        for chat_id in (1, 2, 3, 4):
+            get_storage().save_reminder(chat_id, "22:00")
+
+        restored = restore_reminders(mock_context.job_queue, owns=lambda chat_id: chat_id % 2 == 0)
+
+        assert restored == 2
+        assert set(sleep_reminder_users) == {2, 4}
+
+    def test_export_reminders_hands_off_subscriptions(self):
+        """测试交出不再归属本进程的提醒：取消订阅并返回原始时间字符串"""
+        from bot.services.reminder import export_reminders, schedule_reminders
+
+        schedule_reminders([(1, "9:05"), (2, "23:30")])
+
+        moved = export_reminders(keep=lambda chat_id: chat_id == 2)
+
+        assert moved == [(1, "9:05")]
+        assert set(sleep_reminder_users) == {2}
+        assert reminder_engine.due(9, 5) == set()
+
+    @pytest.mark.asyncio
+    async def test_send_reminder_failure_deletes_stored_reminder(self, mock_context):
+        """测试会话不存在时删除持久化的提醒"""
+        from bot.services.storage import get_storage
+
+        get_storage().save_reminder(12345, "23:30")
+        mock_context.bot.send_message = AsyncMock(side_effect=BadRequest("Chat not found"))
+
+        await send_sleep_reminder(mock_context.bot, 12345, "23:30")
+
+        assert get_storage().load_reminders() == []
+
+    @pytest.mark.slow
+    def test_restore_100k_reminders_startup_time(self, tmp_path, mocker):
+        """启动基准：从 SQLite 恢复 10 万个提醒到真实 JobQueue"""
+        import time as timer
+        from telegram.ext import ApplicationBuilder
+        from bot.services import storage as storage_module
+        from bot.services.reminder import restore_reminders
+
+        storage = storage_module.SQLiteStorage(str(tmp_path / "bot.db"))
+        for chat_id in range(100_000):
+            storage.save_reminder(chat_id, f"{chat_id % 24}:{chat_id % 60:02d}")
+        storage.flush()
+        mocker.patch.object(storage_module, "_storage", storage)
+
+        app = ApplicationBuilder().token("123:test").build()
+        started = timer.perf_counter()
+        restored = restore_reminders(app.job_queue)
+        elapsed = timer.perf_counter() - started
+        storage.close()
+
+        print(f"\n恢复 {restored} 个提醒耗时 {elapsed:.2f}s")
+        assert restored == 100_000
+        assert len(sleep_reminder_users) == 100_000
+        assert len(app.job_queue.jobs()) == 1
+
+    @pytest.mark.slow
+    def test_bucketed_vs_per_job_scheduling(self):
+        """基准：10 万订阅下分钟分桶与每用户一个 run_daily 任务的注册耗时、查询延迟与内存"""
+        import time as timer
+        import tracemalloc
+        from telegram.ext import ApplicationBuilder
+        from bot.services.reminder import ReminderEngine
+
+        count = 100_000
+        rows = [(chat_id, f"{chat_id % 24}:{chat_id % 60:02d}") for chat_id in range(count)]
+
+        def measure(schedule, lookup):
+            tracemalloc.start()
+            started = timer.perf_counter()
+            schedule()
+            elapsed = timer.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            started = timer.perf_counter()
+            for chat_id in range(0, count, 100):
+                lookup(chat_id)
+            lookup_us = (timer.perf_counter() - started) / (count // 100) * 1e6
+            return elapsed, memory, lookup_us
+
+        app = ApplicationBuilder().token("123:test").build()
+        job_queue = app.job_queue
+
+        def per_job():
+            for chat_id, time_str in rows:
+                job_queue.run_daily(
+                    send_sleep_reminder, time=parse_time(time_str),
+                    chat_id=chat_id, name=f"sleep_reminder_{chat_id}",
+                )
+
+        engine = ReminderEngine({})
+
+        def bucketed():
+            for chat_id, time_str in rows:
+                engine.subscribe(chat_id, time_str)
+
+        job_result = measure(per_job, lambda c: job_queue.get_jobs_by_name(f"sleep_reminder_{c}"))
+        bucket_result = measure(bucketed, engine.status)
+
+        for label, (elapsed, memory, lookup_us) in (("每用户任务", job_result), ("分钟分桶", bucket_result)):
+            print(f"\n{label}: 注册 {elapsed:.2f}s，内存 {memory / 1e6:.1f}MB，查询 {lookup_us:.1f}µs")
+        assert engine.stats()["buckets"] == 120
+        assert bucket_result[0] < job_result[0]
+        assert bucket_result[2] < job_result[2]
@@ -0,0 +1,292 @@
+"""渐进式回复服务单元测试"""
+import asyncio
+
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from telegram.error import BadRequest, RetryAfter
+
+from bot.services.reply import PipelinedReply, ReplyStreamer
+
+
+@pytest.fixture
+def sent_message():
+    """占位消息 mock"""
+    sent = MagicMock()
+    sent.edit_text = AsyncMock()
+    return sent
+
+
+@pytest.fixture
+def source_message(sent_message):
+    """用户消息 mock，reply_text 返回占位消息"""
+    message = MagicMock()
+    message.reply_text = AsyncMock(return_value=sent_message)
+    return message
+
+
+@pytest.fixture
+def clock(mocker):
+    """可控的单调时钟"""
+    now = [1000.0]
+    mocker.patch('bot.services.reply.time.monotonic', side_effect=lambda: now[0])
+    return now
+
+
+class TestReplyStreamer:
+    """测试 ReplyStreamer 类"""
+
+    @pytest.mark.asyncio
+    async def test_start_sends_placeholder(self, source_message):
+        """测试开始时发送占位消息"""
+        streamer = ReplyStreamer(source_message, placeholder="…")
+
+        await streamer.start()
+
+        source_message.reply_text.assert_called_once_with("…")
+
+    @pytest.mark.asyncio
+    async def test_first_chunk_is_shown_immediately(self, source_message, sent_message, clock):
+        """测试首个分块立即编辑展示"""
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=100)
+        await streamer.start()
+
+        await streamer.feed("Hello")
+
+        sent_message.edit_text.assert_called_once_with("Hello")
+
+    @pytest.mark.asyncio
+    async def test_edits_are_coalesced_within_interval(self, source_message, sent_message, clock):
+        """测试间隔内的分块被合并，不触发编辑"""
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=1)
+        await streamer.start()
+
+        await streamer.feed("a")
+        for chunk in "bcdef":
+            clock[0] += 0.1
+            await streamer.feed(chunk)
+
+        assert sent_message.edit_text.call_count == 1
+
+        clock[0] += 1.0
+        await streamer.feed("g")
+
+        assert sent_message.edit_text.call_count == 2
+        sent_message.edit_text.assert_called_with("abcdefg")
+
+    @pytest.mark.asyncio
+    async def test_waits_for_byte_budget(self, source_message, sent_message, clock):
+        """测试间隔到达但字节数不足时继续等待"""
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=10)
+        await streamer.start()
+        await streamer.feed("a")
+
+        clock[0] += 1.2
+        await streamer.feed("b")
+        assert sent_message.edit_text.call_count == 1
+
+        clock[0] += 0.1
+        await streamer.feed("0123456789")
+        assert sent_message.edit_text.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_finish_flushes_remaining_text(self, source_message, sent_message, clock):
+        """测试结束时展示完整文本"""
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=100)
+        await streamer.start()
+        await streamer.feed("Hello ")
+        await streamer.feed("world")
+
+        clock[0] += 1.0
+        text = await streamer.finish()
+
+        assert text == "Hello world"
+        sent_message.edit_text.assert_called_with("Hello world")
+
+    @pytest.mark.asyncio
+    async def test_retry_after_slows_down(self, source_message, sent_message, clock, mocker):
+        """测试限流时推迟编辑并加大间隔"""
+        mocker.patch('bot.services.reply.asyncio.sleep', new_callable=AsyncMock)
+        sent_message.edit_text = AsyncMock(side_effect=[RetryAfter(3), None])
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=1)
+        await streamer.start()
+
+        await streamer.feed("a")
+
+        assert streamer.interval >= 3
+        clock[0] += 1.0
+        await streamer.feed("b")
+        # 仍处于限流窗口内，不应再次编辑
+        assert sent_message.edit_text.call_count == 1
+
+        await streamer.finish()
+        sent_message.edit_text.assert_called_with("ab")
+
+    @pytest.mark.asyncio
+    async def test_not_modified_error_is_ignored(self, source_message, sent_message, clock):
+        """测试内容未变化的错误被忽略"""
+        sent_message.edit_text = AsyncMock(side_effect=BadRequest("Message is not modified"))
+        streamer = ReplyStreamer(source_message)
+        await streamer.start()
+
+        await streamer.feed("a")
+
+        assert streamer.edits == 1
+
+    @pytest.mark.asyncio
+    async def test_chunks_are_joined_only_on_flush(self, source_message, clock):
+        """测试分块在刷新时才拼接"""
+        streamer = ReplyStreamer(source_message, min_interval=1.0, min_bytes=100)
+        await streamer.start()
+        await streamer.feed("a")
+        await streamer.feed("b")
+        await streamer.feed("c")
+
+        assert streamer._chunks == ["a", "b", "c"]
+        assert streamer.text == "abc"
+
+    @pytest.mark.asyncio
+    async def test_rolls_over_to_new_message(self, source_message, sent_message, clock):
+        """测试超过上限时定稿当前消息，后续内容在新消息中继续"""
+        streamer = ReplyStreamer(source_message, min_interval=0, min_bytes=1, limit=100)
+        await streamer.start()
+
+        await streamer.feed("a" * 60 + "\n\n")
+        await streamer.feed("b" * 60)
+        await streamer.feed("c")
+        text = await streamer.finish()
+
+        assert streamer.parts == ["a" * 60]
+        assert [c.args[0] for c in source_message.reply_text.call_args_list] == ["…", "b" * 60]
+        sent_message.edit_text.assert_any_call("a" * 60)
+        sent_message.edit_text.assert_called_with("b" * 60 + "c")
+        assert text == "a" * 60 + "\n" + "b" * 60 + "c"
+
+
+class TestRichReply:
+    """测试以 HTML 渲染回复"""
+
+    @pytest.mark.asyncio
+    async def test_streamer_edits_with_html(self, source_message, sent_message, clock):
+        """测试流式编辑时发送渲染后的 HTML，未闭合的标签被补齐"""
+        streamer = ReplyStreamer(source_message, min_interval=0, min_bytes=1, rich=True)
+        await streamer.start()
+
+        await streamer.feed("这是 **重")
+        sent_message.edit_text.assert_called_with("这是 <b>重</b>", parse_mode="HTML")
+        await streamer.feed("点**")
+        text = await streamer.finish()
+
+        sent_message.edit_text.assert_called_with("这是 <b>重点</b>", parse_mode="HTML")
+        assert text == "这是 **重点**"
+
+    @pytest.mark.asyncio
+    async def test_parse_error_falls_back_to_plain(self, source_message, sent_message, clock):
+        """测试 Telegram 无法解析 HTML 时改为纯文本，之后不再尝试 HTML"""
+        async def edit_text(text, parse_mode=None):
+            if parse_mode:
+                raise BadRequest("Can't parse entities: unsupported start tag")
+
+        sent_message.edit_text = AsyncMock(side_effect=edit_text)
+        streamer = ReplyStreamer(source_message, min_interval=0, min_bytes=1, rich=True)
+        await streamer.start()
+
+        await streamer.feed("**a**")
+        await streamer.feed(" b")
+        await streamer.finish()
+
+        calls = [(c.args[0], c.kwargs.get("parse_mode")) for c in sent_message.edit_text.call_args_list]
+        assert calls == [("<b>a</b>", "HTML"), ("**a**", None), ("**a** b", None)]
+
+    @pytest.mark.asyncio
+    async def test_pipelined_parts_are_rendered(self, source_message):
+        """测试分条发送时每一部分单独渲染，代码块在各部分中都是闭合的"""
+        reply = PipelinedReply(source_message, limit=60, rich=True)
+        reply.feed("```py\n" + "\n".join(f"x = {i}" for i in range(12)) + "\n```")
+
+        await reply.finish()
+
+        sent = [c.args[0] for c in source_message.reply_text.call_args_list]
+        assert len(sent) > 1
+        assert all(part.startswith('<pre><code class="language-py">') for part in sent)
+        assert all(part.endswith("</code></pre>") for part in sent)
+        assert all(c.kwargs["parse_mode"] == "HTML" for c in source_message.reply_text.call_args_list)
+
+    @pytest.mark.asyncio
+    async def test_pipelined_parse_error_falls_back(self, source_message):
+        """测试发送时无法解析 HTML 则以纯文本发送"""
+        async def reply_text(text, parse_mode=None):
+            if parse_mode:
+                raise BadRequest("Can't parse entities")
+
+        source_message.reply_text = AsyncMock(side_effect=reply_text)
+        reply = PipelinedReply(source_message, rich=True)
+        reply.feed("*hi*")
+
+        await reply.finish()
+
+        source_message.reply_text.assert_called_with("*hi*")
+
+
+class TestPipelinedReply:
+    """测试 PipelinedReply 类"""
+
+    @pytest.mark.asyncio
+    async def test_short_reply_is_sent_once(self, source_message):
+        """测试未超过上限时只发送一条"""
+        reply = PipelinedReply(source_message)
+        reply.feed("Hello ")
+        reply.feed("world")
+
+        await reply.finish()
+
+        source_message.reply_text.assert_called_once_with("Hello world")
+
+    @pytest.mark.asyncio
+    async def test_first_part_is_sent_before_finish(self, source_message):
+        """测试第一部分在回复生成完之前就已发送，各部分按顺序发送"""
+        reply = PipelinedReply(source_message, limit=100)
+
+        reply.feed("a" * 60 + "\n\n")
+        reply.feed("b" * 60 + "\n\n")
+        await asyncio.sleep(0)
+        source_message.reply_text.assert_called_once_with("a" * 60)
+
+        reply.feed("c" * 60)
+        await reply.finish()
+
+        assert [c.args[0] for c in source_message.reply_text.call_args_list] == ["a" * 60, "b" * 60, "c" * 60]
+        assert reply.sent == 3
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_waited(self, source_message, mocker):
+        """测试发送被限流时等待后重试"""
+        sleep = mocker.patch('bot.services.reply.asyncio.sleep', new_callable=AsyncMock)
+        source_message.reply_text = AsyncMock(side_effect=[RetryAfter(2), None])
+        reply = PipelinedReply(source_message)
+        reply.feed("Hello")
+
+        await reply.finish()
+
+        sleep.assert_awaited_once_with(2.0)
+        assert source_message.reply_text.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_send_error_is_raised(self, source_message):
+        """测试发送失败时 finish 抛出异常"""
+        source_message.reply_text = AsyncMock(side_effect=BadRequest("Chat not found"))
+        reply = PipelinedReply(source_message)
+        reply.feed("Hello")
+
+        with pytest.raises(BadRequest):
+            await reply.finish()
+
+    @pytest.mark.asyncio
+    async def test_cancel_drops_pending_parts(self, source_message):
+        """测试取消后不再发送尚未发送的部分"""
+        reply = PipelinedReply(source_message, limit=100)
+        reply.feed("a" * 60 + "\n\n" + "b" * 60 + "\n\n" + "c" * 60)
+
+        await reply.cancel()
+
+        source_message.reply_text.assert_not_called()
@@ -0,0 +1,66 @@
+"""重试策略单元测试"""
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from bot.services.retry import RetryPolicy, is_retryable
+
+
+class TestIsRetryable:
+    """测试错误分类"""
+
+    @pytest.mark.parametrize("error", [
+        google_exceptions.ResourceExhausted("quota"),
+        google_exceptions.ServiceUnavailable("down"),
+        google_exceptions.DeadlineExceeded("slow"),
+        google_exceptions.InternalServerError("oops"),
+        ConnectionError("reset"),
+        TimeoutError(),
+    ])
+    def test_transient_errors_are_retryable(self, error):
+        """测试限流、不可用、超时等瞬时错误可重试"""
+        assert is_retryable(error)
+
+    @pytest.mark.parametrize("error", [
+        google_exceptions.InvalidArgument("bad"),
+        google_exceptions.PermissionDenied("no"),
+        ValueError("blocked"),
+    ])
+    def test_fatal_errors_are_not_retryable(self, error):
+        """测试参数、权限、内容拦截等错误不重试"""
+        assert not is_retryable(error)
+
+    def test_error_with_status_code(self):
+        """测试带 code 属性的错误按状态码判断"""
+        error = Exception("x")
+        error.code = 503
+        assert is_retryable(error)
+        error.code = 400
+        assert not is_retryable(error)
+
+
+class TestRetryPolicy:
+    """测试退避与次数上限"""
+
+    def test_should_retry_respects_max_attempts(self):
+        """测试达到最大次数后不再重试"""
+        policy = RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=1)
+        error = google_exceptions.ServiceUnavailable("down")
+
+        assert policy.should_retry(error, 1)
+        assert policy.should_retry(error, 2)
+        assert not policy.should_retry(error, 3)
+
+    def test_should_not_retry_fatal_error(self):
+        """测试致命错误第一次就放弃"""
+        policy = RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=1)
+        assert not policy.should_retry(ValueError("bad"), 1)
+
+    def test_delay_is_jittered_exponential(self):
+        """测试退避时间在指数上限内随机分布，且不超过 max_delay"""
+        policy = RetryPolicy(max_attempts=10, base_delay=0.5, max_delay=4)
+
+        for attempt, ceiling in [(1, 0.5), (2, 1.0), (3, 2.0), (4, 4.0), (8, 4.0)]:
+            delays = [policy.delay(attempt) for _ in range(200)]
+            assert all(0 <= d <= ceiling for d in delays)
+            # 抖动：各次退避时间不相同
+            assert len(set(delays)) > 1
@@ -0,0 +1,157 @@
+"""模型路由单元测试"""
+import time
+
+import pytest
+
+from bot.services.prompts import ModelProfile
+from bot.services.routing import ROUTE_DECISIONS, ModelRouter, parse_tiers
+
+BASE = ModelProfile("default", "gemini-2.5-flash", "你是助手", {"temperature": 0.5})
+
+
+class FakeChat:
+    def __init__(self, turns=0):
+        self.history = ["问", "答"] * turns
+
+
+def make_router(**kwargs):
+    options = {"strong_model": "gemini-2.5-pro", "long_prompt": 100, "deep_history": 5}
+    options.update(kwargs)
+    return ModelRouter(**options)
+
+
+class TestClassify:
+    """测试按廉价特征选择路由"""
+
+    @pytest.mark.parametrize("text, reason", [
+        ("今天天气怎么样？", "default"),
+        ("帮我看看这段代码：\n```python\nprint(1)\n```", "code"),
+        ("def add(a, b):\n    return a + b\n为什么报错", "code"),
+        ("`git rebase` 和 merge 有什么区别", "code"),
+        ("SELECT name FROM users 怎么加索引", "code"),
+        ("let me know what you think", "default"),
+        ("长" * 100, "length"),
+    ])
+    def test_prompt_features(self, text, reason):
+        """测试代码与提问长度"""
+        route, why = make_router().classify(text, 0)
+
+        assert why == reason
+        assert route == ("fast" if reason == "default" else "strong")
+
+    def test_history_depth(self):
+        """测试历史达到轮数后使用强模型"""
+        router = make_router()
+
+        assert router.classify("继续", 8)[1] == "default"
+        assert router.classify("继续", 10) == ("strong", "history")
+
+    def test_user_tier_overrides(self):
+        """测试用户等级覆盖其他特征"""
+        router = make_router(user_tiers={1: "fast", 2: "strong"})
+
+        assert router.classify("```x```", 0, user_id=1) == ("fast", "tier")
+        assert router.classify("你好", 0, user_id=2) == ("strong", "tier")
+
+    def test_multimodal_uses_caption(self):
+        """测试多模态输入只看文字部分"""
+        assert make_router().classify([object(), "def f():\n  pass"], 0)[1] == "code"
+
+    def test_parse_tiers(self):
+        """测试解析用户等级配置"""
+        assert parse_tiers(" 1:strong, 2:fast ,") == {1: "strong", 2: "fast"}
+        with pytest.raises(ValueError):
+            parse_tiers("1:gold")
+
+
+class TestRoute:
+    """测试路由结果与备用模型"""
+
+    def test_strong_route_keeps_prompt_and_config(self):
+        """测试强模型沿用会话的系统提示词与生成参数，派生配置被复用"""
+        router = make_router()
+
+        route = router.route(FakeChat(), "长" * 200, 7, BASE)
+
+        assert route.name == "strong" and route.model == "gemini-2.5-pro"
+        assert route.profile.system_instruction == BASE.system_instruction
+        assert route.profile.generation_config == BASE.generation_config
+        assert router.route(FakeChat(), "长" * 200, 7, BASE).profile is route.profile
+        # 没有配置备用模型时退回会话的模型
+        assert route.fallback is BASE
+
+    def test_fast_route_uses_session_profile(self):
+        """测试便宜的路由直接使用会话的配置，配置了备用模型时带上备用模型"""
+        route = make_router(fallback_model="gemini-2.0-flash").route(FakeChat(), "你好", 7, BASE)
+
+        assert route.profile is BASE
+        assert route.fallback.model == "gemini-2.0-flash"
+        assert route.fall_back() and route.name == "fallback" and route.model == "gemini-2.0-flash"
+        assert not route.fall_back()
+
+    def test_fallback_only(self):
+        """测试只配置备用模型时每轮都用会话的模型"""
+        router = ModelRouter(fallback_model="gemini-2.0-flash")
+
+        assert router.enabled
+        assert router.route(FakeChat(20), "```x```", 7, BASE).profile is BASE
+
+    def test_decisions_are_counted(self):
+        """测试按路由与原因计数"""
+        child = ROUTE_DECISIONS.labels("strong", "length")
+        before = child.value
+
+        make_router().route(FakeChat(), "长" * 200, 7, BASE)
+
+        assert child.value == before + 1
+
+
+class TestHealth:
+    """测试饱和与熔断"""
+
+    def test_saturated_model_falls_back(self):
+        """测试在途请求达到上限时改用备用模型"""
+        router = make_router(fallback_model="gemini-2.0-flash", max_in_flight=2)
+        router.acquire(BASE.model)
+        router.acquire(BASE.model)
+
+        route = router.route(FakeChat(), "你好", 7, BASE)
+
+        assert (route.name, route.reason, route.model) == ("fallback", "unavailable", "gemini-2.0-flash")
+        router.release(BASE.model)
+        assert router.route(FakeChat(), "你好", 7, BASE).model == BASE.model
+
+    def test_consecutive_failures_open_circuit(self, mocker):
+        """测试连续失败达到阈值后冷却，冷却结束后恢复；成功会清零计数"""
+        now = [100.0]
+        mocker.patch("bot.services.routing.time.monotonic", side_effect=lambda: now[0])
+        router = make_router(failure_threshold=2, cooldown=10)
+        error = RuntimeError("503")
+
+        router.record("m", error)
+        router.record("m")
+        router.record("m", error)
+        assert router.available("m")
+        router.record("m", error)
+        assert not router.available("m")
+        assert router.stats()["cooling"] == {"m": 10}
+
+        now[0] += 10
+        assert router.available("m")
+
+    @pytest.mark.slow
+    def test_classify_benchmark(self):
+        """基准：每轮路由判断的耗时（廉价特征，不调用模型）"""
+        router = make_router(long_prompt=800, deep_history=10)
+        chat = FakeChat(6)
+        prompts = ["今天天气怎么样？", "帮我解释一下这段代码\n```python\nfor i in range(3):\n    print(i)\n```",
+                   "请详细介绍一下" + "分布式系统的一致性模型，" * 40]
+        rounds = 20000
+
+        started = time.perf_counter()
+        for i in range(rounds):
+            router.route(chat, prompts[i % 3], 7, BASE)
+        elapsed = time.perf_counter() - started
+
+        print(f"\n每轮路由判断: {elapsed / rounds * 1e6:.2f}µs")
+        assert elapsed / rounds < 0.001
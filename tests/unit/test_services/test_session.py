@@ -0,0 +1,202 @@
+"""会话存储单元测试"""
+import pytest
+from unittest.mock import MagicMock
+
+from vertexai.generative_models import Content, Part
+
+from bot.services.session import SessionStore, MemorySpill, history_bytes
+
+
+def make_history(*texts):
+    """构造 user/model 交替的聊天历史"""
+    roles = ["user", "model"]
+    return [Content(role=roles[i % 2], parts=[Part.from_text(t)]) for i, t in enumerate(texts)]
+
+
+class FakeSession:
+    """带可变历史的假会话"""
+
+    def __init__(self, history, user_id=None):
+        self.history = list(history)
+        self.user_id = user_id
+
+
+@pytest.fixture
+def clock(mocker):
+    """可控的单调时钟"""
+    now = [1000.0]
+    mocker.patch('bot.services.session.time.monotonic', side_effect=lambda: now[0])
+    return now
+
+
+def make_store(**kwargs):
+    options = {"max_sessions": 100, "ttl": 3600, "max_history_bytes": 10**6}
+    options.update(kwargs)
+    return SessionStore(factory=FakeSession, **options)
+
+
+class TestHistoryBytes:
+    """测试 history_bytes 函数"""
+
+    def test_counts_utf8_bytes(self):
+        """测试按 UTF-8 字节计数"""
+        assert history_bytes(make_history("ab", "你好")) == 2 + 6
+
+    def test_counts_inline_data(self):
+        """测试图片等内联数据按字节数计入"""
+        history = [Content(role="user", parts=[Part.from_data(b"abc", mime_type="image/png"), Part.from_text("ab")])]
+        assert history_bytes(history) == 3 + 2
+
+
+class TestSessionStore:
+    """测试 SessionStore 类"""
+
+    def test_get_creates_and_reuses_session(self):
+        """测试首次创建会话、再次访问命中"""
+        store = make_store()
+
+        first = store.get(1)
+        second = store.get(1)
+
+        assert first is second
+        assert store.stats()["misses"] == 1
+        assert store.stats()["hits"] == 1
+
+    def test_lru_eviction_by_session_count(self):
+        """测试超出会话数上限时淘汰最久未用的会话"""
+        store = make_store(max_sessions=2)
+
+        store.get(1)
+        store.get(2)
+        store.get(1)
+        store.get(3)
+
+        assert 1 in store
+        assert 2 not in store
+        assert 3 in store
+        assert store.stats()["evictions"] == 1
+
+    def test_idle_sessions_expire(self, clock):
+        """测试空闲超过 ttl 的会话过期"""
+        store = make_store(ttl=60)
+        store.get(1)
+
+        clock[0] += 61
+        store.get(2)
+
+        assert 1 not in store
+        assert store.stats()["expirations"] == 1
+
+    def test_history_byte_budget(self):
+        """测试历史总字节数超出上限时淘汰"""
+        store = make_store(max_history_bytes=10)
+        store.get(1).history.extend(make_history("12345678"))
+        store.touch(1)
+
+        store.get(2).history.extend(make_history("12345678"))
+        store.touch(2)
+
+        assert 1 not in store
+        assert 2 in store
+        assert store.history_bytes == 8
+
+    def test_evicted_session_is_rehydrated(self):
+        """测试被淘汰的会话在用户回来时透明恢复"""
+        store = make_store(max_sessions=1)
+        store.get(1).history.extend(make_history("hi", "hello"))
+
+        store.get(2)
+        assert 1 not in store
+
+        restored = store.get(1)
+
+        assert [c.parts[0].text for c in restored.history] == ["hi", "hello"]
+        assert store.stats()["rehydrations"] == 1
+
+    def test_reset_discards_spilled_history(self):
+        """测试重置会同时丢弃冷存储中的历史"""
+        store = make_store(max_sessions=1)
+        store.get(1).history.extend(make_history("hi", "hello"))
+        store.get(2)
+
+        session = store.reset(1)
+
+        assert session.history == []
+        store.get(2)
+        assert store.get(1).history == []
+
+    def test_put_replaces_session(self):
+        """测试替换会话"""
+        store = make_store()
+        replacement = FakeSession([])
+
+        store.put(1, replacement)
+
+        assert store[1] is replacement
+
+    def test_handoff_returns_sessions_no_longer_owned(self):
+        """测试交出不再归本进程的会话（热存储与进程内冷存储），保留其余会话"""
+        store = make_store(max_sessions=2)
+        for user_id in (1, 2, 3):
+            store.get(user_id).history.extend(make_history(f"hi {user_id}"))
+            store.touch(user_id)
+        assert len(store.spill) == 1  # 用户 1 被淘汰到冷存储
+
+        moved = store.handoff(keep=lambda user_id: user_id == 2)
+
+        assert set(moved) == {1, 3}
+        assert moved[3][0].parts[0].text == "hi 3"
+        assert moved[1][0].parts[0].text == "hi 1"
+        assert 2 in store and 3 not in store
+        assert len(store.spill) == 0
+
+    def test_clear_resets_everything(self):
+        """测试清空会话与统计"""
+        store = make_store()
+        store.get(1)
+
+        store.clear()
+
+        assert len(store) == 0
+        assert store.stats()["misses"] == 0
+
+
+class TestMemorySpill:
+    """测试 MemorySpill 冷存储"""
+
+    def test_save_and_load_round_trip(self):
+        """测试保存后可以恢复"""
+        spill = MemorySpill(max_bytes=10**6)
+        spill.save(1, make_history("hi", "你好"))
+
+        history = spill.load(1)
+
+        assert [c.role for c in history] == ["user", "model"]
+        assert history[1].parts[0].text == "你好"
+        assert spill.load(1) is None
+
+    def test_drops_oldest_when_over_budget(self):
+        """测试超出字节上限时丢弃最早的记录"""
+        spill = MemorySpill(max_bytes=120)
+        spill.save(1, make_history("a" * 50))
+        spill.save(2, make_history("b" * 50))
+        spill.save(3, make_history("c" * 50))
+
+        assert spill.load(1) is None
+        assert spill.load(3) is not None
+        assert spill.total_bytes <= 120
+
+
+class TestSessionStoreMemory:
+    """会话存储内存基准"""
+
+    @pytest.mark.slow
+    def test_memory_stays_bounded_with_many_users(self):
+        """测试大量一次性用户不会让热存储无限增长"""
+        store = make_store(max_sessions=1000, max_history_bytes=10**9)
+
+        for user_id in range(20000):
+            store.get(user_id)
+
+        assert len(store) == 1000
+        assert store.stats()["evictions"] == 19000
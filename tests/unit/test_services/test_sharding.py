@@ -0,0 +1,92 @@
+"""分片路由单元测试"""
+import pytest
+from telegram import Update
+
+from bot.services.groups import session_key
+from bot.services.sharding import HashRing, shard_key
+from tests.fixtures.telegram_api import make_update
+
+
+class TestHashRing:
+    """测试一致性哈希环"""
+
+    def test_empty_ring(self):
+        """测试空环没有归属节点"""
+        assert HashRing().node_for(1) is None
+
+    def test_same_key_same_node(self):
+        """测试同一个键总是映射到同一节点"""
+        ring = HashRing(["a", "b", "c"])
+
+        assert all(ring.node_for(k) == ring.node_for(k) for k in range(100))
+        assert ring.node_for(42) == HashRing(["c", "a", "b"]).node_for(42)
+
+    def test_keys_spread_evenly(self):
+        """测试键在节点间分布大致均匀"""
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for key in range(20000):
+            node = ring.node_for(key)
+            counts[node] = counts.get(node, 0) + 1
+
+        assert set(counts) == {"a", "b", "c", "d"}
+        assert min(counts.values()) > 20000 / 4 * 0.7
+
+    def test_adding_node_moves_only_its_share(self):
+        """测试加入节点时只有约 1/N 的键改变归属，且都迁移到新节点"""
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in range(10000)}
+
+        ring.add("d")
+        moved = {key for key in before if ring.node_for(key) != before[key]}
+
+        assert all(ring.node_for(key) == "d" for key in moved)
+        assert 0.15 < len(moved) / 10000 < 0.35
+
+    def test_removing_node_only_moves_its_keys(self):
+        """测试移除节点时只有该节点的键改变归属"""
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in range(10000)}
+
+        ring.remove("b")
+
+        for key, node in before.items():
+            if node != "b":
+                assert ring.node_for(key) == node
+        assert "b" not in ring
+        assert len(ring) == 2
+
+
+class TestShardKey:
+    """测试更新的路由键"""
+
+    def test_private_message_routes_by_user(self):
+        """测试私聊消息按 user_id 路由"""
+        data = make_update(1, 100, "hello")
+        data["message"]["chat"] = {"id": 100, "type": "private"}
+
+        assert shard_key(Update.de_json(data, None)) == 100
+
+    def test_group_message_routes_by_conversation(self):
+        """测试群组消息按群组共享的会话路由，论坛话题各自独立"""
+        data = make_update(1, 100, "hello")
+        data["message"]["chat"] = {"id": -500, "type": "supergroup"}
+        assert shard_key(Update.de_json(data, None)) == -500
+
+        data["message"].update(message_thread_id=7, is_topic_message=True)
+        assert shard_key(Update.de_json(data, None)) == session_key(-500, 7)
+
+    @pytest.mark.parametrize("text", ["/sleepon 23:00", "/sleepoff", "/SleepStatus@test_bot"])
+    def test_reminder_commands_route_by_chat(self, text):
+        """测试提醒命令按 chat_id 路由（群组内共享提醒）"""
+        data = make_update(1, 100, text)
+        data["message"]["chat"] = {"id": -500, "type": "group"}
+
+        assert shard_key(Update.de_json(data, None)) == -500
+
+    def test_other_commands_route_by_conversation(self):
+        """测试其他命令（如重置上下文的 /start）在群组中按会话路由"""
+        data = make_update(1, 100, "/start")
+        data["message"]["chat"] = {"id": -500, "type": "group"}
+
+        assert shard_key(Update.de_json(data, None)) == -500
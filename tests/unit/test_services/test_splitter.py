@@ -0,0 +1,91 @@
+"""长回复拆分单元测试"""
+import random
+
+from bot.services.splitter import ReplySplitter, message_length, split_reply
+
+
+def paragraphs(count: int, size: int = 300) -> str:
+    return "\n\n".join(f"第{i}段" + "字" * size for i in range(count))
+
+
+class TestMessageLength:
+    """测试按 UTF-16 计算长度"""
+
+    def test_bmp_characters(self):
+        """测试中文与 ASCII 各占 1"""
+        assert message_length("你好 hi") == 5
+
+    def test_astral_characters(self):
+        """测试 emoji 占 2"""
+        assert message_length("👍a") == 3
+
+
+class TestSplitReply:
+    """测试 split_reply"""
+
+    def test_short_reply_is_single_part(self):
+        """测试未超过上限时不拆分"""
+        assert split_reply("Hello") == ["Hello"]
+
+    def test_empty_reply(self):
+        """测试空回复没有任何部分"""
+        assert split_reply("") == []
+        assert split_reply("  \n") == []
+
+    def test_split_on_paragraph_boundary(self):
+        """测试在段落边界处拆分，每部分不超过上限且不丢内容"""
+        text = paragraphs(40)
+
+        parts = split_reply(text)
+
+        assert len(parts) > 1
+        assert all(message_length(part) <= 4096 for part in parts)
+        assert all(part.startswith("第") and part.endswith("字") for part in parts)
+        assert "\n\n".join(parts) == text
+
+    def test_split_inside_code_block(self):
+        """测试在代码块内拆分时补上围栏，下一部分以同一语言重新打开"""
+        code = "\n".join(f"print({i})" for i in range(1000))
+        text = f"示例：\n\n```python\n{code}\n```\n\n完毕"
+
+        parts = split_reply(text, limit=1000)
+
+        assert all(message_length(part) <= 1000 for part in parts)
+        for part in parts[:-1]:
+            assert part.endswith("```")
+        for part in parts[1:-1]:
+            assert part.startswith("```python\n")
+        assert all(part.count("```") % 2 == 0 for part in parts)
+        lines = [line for part in parts for line in part.splitlines() if line.startswith("print")]
+        assert lines == code.splitlines()
+
+    def test_astral_characters_fit(self):
+        """测试按 UTF-16 计算时 emoji 较多的回复也不超过上限"""
+        parts = split_reply("👍" * 5000)
+
+        assert all(message_length(part) <= 4096 for part in parts)
+        assert "".join(parts) == "👍" * 5000
+
+    def test_incremental_matches_whole(self):
+        """测试按随机分块增量拆分与一次性拆分结果相同"""
+        code = "\n".join(f"x = {i}" for i in range(300))
+        text = paragraphs(10, 200) + f"\n\n```js\n{code}\n```\n\n" + paragraphs(10, 200)
+        rng = random.Random(1)
+        splitter = ReplySplitter(limit=800)
+        parts = []
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 50)
+            parts += splitter.feed(text[position:position + size])
+            position += size
+        parts += splitter.finish()
+
+        assert parts == split_reply(text, limit=800)
+
+    def test_feed_returns_parts_before_finish(self):
+        """测试缓冲超过上限时立即切出，不等待回复结束"""
+        splitter = ReplySplitter(limit=100)
+
+        assert splitter.feed("a" * 50 + "\n\n") == []
+        assert splitter.feed("b" * 80) == ["a" * 50]
+        assert splitter.finish() == ["b" * 80]
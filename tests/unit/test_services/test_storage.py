@@ -0,0 +1,174 @@
+"""持久化存储单元测试"""
+import time
+
+import pytest
+from unittest.mock import MagicMock
+
+from vertexai.generative_models import Content, Part
+
+from bot.services import storage as storage_module
+from bot.services.session import SessionStore
+from bot.services.storage import MemoryStorage, SQLiteStorage, StorageSpill
+
+
+def make_history(*texts):
+    """构造 user/model 交替的聊天历史"""
+    roles = ["user", "model"]
+    return [Content(role=roles[i % 2], parts=[Part.from_text(t)]) for i, t in enumerate(texts)]
+
+
+class FakeSession:
+    """带可变历史的假会话"""
+
+    def __init__(self, history, user_id=None):
+        self.history = list(history)
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    """临时目录中的 SQLite 存储（关闭后台自动刷新，便于断言）"""
+    storage = SQLiteStorage(str(tmp_path / "bot.db"), flush_interval=3600)
+    yield storage
+    storage.close()
+
+
+class TestSQLiteStorage:
+    """测试 SQLiteStorage 类"""
+
+    def test_uses_wal_journal_mode(self, sqlite_storage):
+        """测试启用 WAL 模式"""
+        mode = sqlite_storage._reader_conn.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+
+    def test_writes_are_deferred_until_flush(self, sqlite_storage):
+        """测试写入先进入队列，刷新后才落盘"""
+        sqlite_storage.save_reminder(1, "23:30")
+
+        assert sqlite_storage._reader_conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0] == 0
+
+        sqlite_storage.flush()
+
+        assert sqlite_storage._reader_conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0] == 1
+
+    def test_repeated_writes_are_coalesced(self, sqlite_storage):
+        """测试同一键的多次写入合并为一次"""
+        for time_str in ["22:00", "22:30", "23:00"]:
+            sqlite_storage.save_reminder(1, time_str)
+
+        assert len(sqlite_storage._pending) == 1
+        assert sqlite_storage.load_reminders() == [(1, "23:00")]
+
+    def test_session_read_your_writes(self, sqlite_storage):
+        """测试未落盘的会话也能读到"""
+        sqlite_storage.save_session(1, make_history("hi", "hello"))
+
+        history = sqlite_storage.load_session(1)
+
+        assert [c.parts[0].text for c in history] == ["hi", "hello"]
+
+    def test_session_round_trip_through_disk(self, sqlite_storage):
+        """测试会话落盘后可以恢复"""
+        sqlite_storage.save_session(1, make_history("hi", "你好"))
+        sqlite_storage.flush()
+
+        history = sqlite_storage.load_session(1)
+
+        assert history[1].parts[0].text == "你好"
+        assert sqlite_storage.count_sessions() == 1
+
+    def test_delete_session(self, sqlite_storage):
+        """测试删除会话"""
+        sqlite_storage.save_session(1, make_history("hi"))
+        sqlite_storage.flush()
+
+        sqlite_storage.delete_session(1)
+
+        assert sqlite_storage.load_session(1) is None
+        sqlite_storage.flush()
+        assert sqlite_storage.count_sessions() == 0
+
+    def test_data_survives_restart(self, tmp_path):
+        """测试重启后数据仍然存在"""
+        path = str(tmp_path / "bot.db")
+        first = SQLiteStorage(path)
+        first.save_reminder(42, "22:10")
+        first.save_session(7, make_history("hi", "hello"))
+        first.close()
+
+        second = SQLiteStorage(path)
+        try:
+            assert second.load_reminders() == [(42, "22:10")]
+            assert len(second.load_session(7)) == 2
+        finally:
+            second.close()
+
+    def test_background_writer_flushes(self, tmp_path):
+        """测试后台线程按间隔批量落盘"""
+        storage = SQLiteStorage(str(tmp_path / "bot.db"), flush_interval=0.05)
+        try:
+            storage.save_reminder(1, "23:30")
+            deadline = time.monotonic() + 2
+            while storage._pending and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            assert not storage._pending
+        finally:
+            storage.close()
+
+
+class TestStorageSpill:
+    """测试 StorageSpill 与 SessionStore 配合"""
+
+    def test_touch_writes_history_through(self, sqlite_storage):
+        """测试每轮对话后写入持久化存储"""
+        store = SessionStore(FakeSession, 100, 3600, 10**6, spill=StorageSpill(sqlite_storage))
+        store.get(1).history.extend(make_history("hi", "hello"))
+
+        store.touch(1)
+
+        assert len(sqlite_storage.load_session(1)) == 2
+
+    def test_new_process_rehydrates_from_storage(self, sqlite_storage):
+        """测试新的会话存储（模拟重启）从持久化存储恢复会话"""
+        sqlite_storage.save_session(1, make_history("hi", "hello"))
+        sqlite_storage.flush()
+
+        store = SessionStore(FakeSession, 100, 3600, 10**6, spill=StorageSpill(sqlite_storage))
+        session = store.get(1)
+
+        assert [c.parts[0].text for c in session.history] == ["hi", "hello"]
+        assert store.stats()["rehydrations"] == 1
+
+    def test_reset_deletes_persisted_history(self, sqlite_storage):
+        """测试重置会话时删除持久化历史"""
+        sqlite_storage.save_session(1, make_history("hi"))
+        store = SessionStore(FakeSession, 100, 3600, 10**6, spill=StorageSpill(sqlite_storage))
+
+        store.reset(1)
+
+        assert sqlite_storage.load_session(1) is None
+
+
+class TestCreateStorage:
+    """测试 create_storage 函数"""
+
+    def test_memory_backend(self, mocker):
+        """测试内存后端"""
+        mocker.patch.object(storage_module.Config, "STORAGE_BACKEND", "memory")
+        assert isinstance(storage_module.create_storage(), MemoryStorage)
+
+    def test_sqlite_backend(self, mocker, tmp_path):
+        """测试 SQLite 后端"""
+        mocker.patch.object(storage_module.Config, "STORAGE_BACKEND", "sqlite")
+        mocker.patch.object(storage_module.Config, "STORAGE_PATH", str(tmp_path / "bot.db"))
+        storage = storage_module.create_storage()
+        try:
+            assert isinstance(storage, SQLiteStorage)
+        finally:
+            storage.close()
+
+    def test_unknown_backend(self, mocker):
+        """测试未知后端抛出 ValueError"""
+        mocker.patch.object(storage_module.Config, "STORAGE_BACKEND", "redis")
+        with pytest.raises(ValueError, match="未知的存储后端"):
+            storage_module.create_storage()
@@ -0,0 +1,50 @@
+"""命令回复文本单元测试"""
+import pytest
+from unittest.mock import MagicMock
+
+from bot.services import texts
+from bot.services.texts import _CATALOG, build_catalogs, texts_for
+
+
+def update_with_language(code):
+    update = MagicMock()
+    update.effective_user.language_code = code
+    return update
+
+
+class TestCatalog:
+    """测试按语言预先生成的文本"""
+
+    def test_locales_have_same_keys(self):
+        """测试每种语言的文本齐全"""
+        keys = set(_CATALOG["zh"])
+        assert all(set(entries) == keys for entries in _CATALOG.values())
+
+    def test_static_texts_are_prebuilt(self, mocker):
+        """测试部署级变量在生成时替换，不含变量的文本是最终字符串"""
+        mocker.patch.object(texts.Config, "DEFAULT_REMINDER_TIME", "22:45")
+        catalog = build_catalogs()["zh"]
+
+        assert isinstance(catalog["help"], str)
+        assert "默认 22:45" in catalog["help"]
+        assert catalog["sleep_status_off"].endswith("默认时间：22:45")
+
+    def test_format_templates(self):
+        """测试含变量的文本替换变量"""
+        catalog = texts.catalogs["en"]
+
+        text = catalog.format("sleep_on", time="23:30", zone=catalog.zone_label("Europe/Berlin"))
+
+        assert "every day at 23:30 (Europe/Berlin time)" in text
+        assert catalog.zone_label("Asia/Shanghai") == "Beijing time"
+
+    @pytest.mark.parametrize("code, locale", [("en", "en"), ("en-US", "en"), ("zh-hans", "zh"), ("fr", "zh"), (None, "zh")])
+    def test_locale_from_user(self, code, locale):
+        """测试按用户的 Telegram 语言选择，不支持的语言使用默认语言"""
+        assert texts_for(update_with_language(code)).locale == locale
+
+    def test_default_locale(self, mocker):
+        """测试 BOT_LOCALE 决定默认语言"""
+        mocker.patch.object(texts.Config, "BOT_LOCALE", "en")
+
+        assert texts_for(update_with_language("fr")).locale == "en"
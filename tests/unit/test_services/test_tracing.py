@@ -0,0 +1,284 @@
+"""链路追踪单元测试"""
+import json
+import time
+
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services import tracing
+from bot.services.tracing import (
+    STATUS_ERROR,
+    BatchExporter,
+    FileExporter,
+    OTLPExporter,
+    Tracer,
+    otlp_payload,
+)
+
+
+class ListExporter:
+    """把导出的 trace 收集到列表"""
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(list(spans))
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    """启用全局追踪器，保留全部 trace"""
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(exporter, sample_rate=1.0))
+    for module in ("bot.services.ai", "bot.server", "bot.app"):
+        monkeypatch.setattr(f"{module}.tracer", tracing.tracer)
+    return exporter
+
+
+def by_name(spans) -> dict:
+    return {span.name: span for span in spans}
+
+
+class TestTracer:
+    """测试 span 层级与尾部采样"""
+
+    def test_child_spans_share_trace(self):
+        """测试子 span 与根 span 属于同一 trace，父子关系正确"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=1.0)
+
+        with tracer.trace("update", user_id=1) as root:
+            with tracer.span("telegram.sendChatAction") as action:
+                pass
+            stream = tracer.start_span("model.stream")
+            stream.add_event("first_chunk")
+            stream.end()
+
+        [spans] = exporter.traces
+        assert [span.name for span in spans] == ["telegram.sendChatAction", "model.stream", "update"]
+        assert {span.trace.trace_id for span in spans} == {root.trace.trace_id}
+        assert action.parent_id == root.span_id
+        assert stream.parent_id == root.span_id
+        assert root.parent_id is None
+        assert root.attributes == {"user_id": 1}
+
+    def test_span_outside_trace_is_noop(self):
+        """测试不在 trace 中时不创建 span（如长轮询的 getUpdates）"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=1.0)
+
+        with tracer.span("telegram.getUpdates") as span:
+            assert span is None
+        assert tracer.start_span("model.stream") is None
+        assert exporter.traces == []
+
+    def test_disabled_tracer(self):
+        """测试未配置导出时不记录"""
+        tracer = Tracer()
+
+        with tracer.trace("update") as span:
+            assert span is None
+
+    def test_fast_traces_are_sampled(self):
+        """测试未超过阈值的 trace 按比例采样"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=0.0, slow_threshold=1.0)
+
+        for _ in range(10):
+            with tracer.trace("update"):
+                pass
+
+        assert exporter.traces == []
+        assert tracer.dropped == 10
+
+    def test_slow_traces_are_kept(self):
+        """测试耗时超过阈值的 trace 一定保留"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=0.0, slow_threshold=0.02)
+
+        with tracer.trace("fast"):
+            pass
+        with tracer.trace("slow"):
+            time.sleep(0.03)
+
+        assert [spans[-1].name for spans in exporter.traces] == ["slow"]
+
+    def test_error_traces_are_kept(self):
+        """测试有 span 出错的 trace 一定保留，错误写入状态"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=0.0, slow_threshold=10)
+
+        with pytest.raises(RuntimeError):
+            with tracer.trace("update"):
+                with tracer.span("telegram.sendMessage"):
+                    raise RuntimeError("boom")
+
+        [spans] = exporter.traces
+        assert all(span.status == STATUS_ERROR for span in spans)
+        assert spans[0].status_message == "RuntimeError: boom"
+
+    def test_annotate_current_span(self):
+        """测试给当前 span 添加属性"""
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=1.0)
+
+        with tracer.trace("update"):
+            tracer.annotate(handler="chat_logic", skipped=None)
+
+        assert exporter.traces[0][0].attributes == {"handler": "chat_logic"}
+
+
+class TestExport:
+    """测试 OTLP JSON 与导出器"""
+
+    def make_spans(self):
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=1.0)
+        with tracer.trace("update", **{"telegram.user_id": 42}):
+            stream = tracer.start_span("model.stream")
+            stream.add_event("chunk", index=1, chars=5)
+            stream.end()
+        return exporter.traces[0]
+
+    def test_otlp_payload(self):
+        """测试 ExportTraceServiceRequest 的 JSON 结构"""
+        spans = self.make_spans()
+
+        payload = otlp_payload(spans, "bot", {"service.instance.id": "worker-0"})
+
+        [resource_spans] = payload["resourceSpans"]
+        resource = {a["key"]: a["value"] for a in resource_spans["resource"]["attributes"]}
+        assert resource == {"service.name": {"stringValue": "bot"},
+                            "service.instance.id": {"stringValue": "worker-0"}}
+        stream, root = resource_spans["scopeSpans"][0]["spans"]
+        assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+        assert "parentSpanId" not in root
+        assert stream["parentSpanId"] == root["spanId"]
+        assert root["attributes"] == [{"key": "telegram.user_id", "value": {"intValue": "42"}}]
+        assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+        [event] = stream["events"]
+        assert event["name"] == "chunk"
+        assert {"key": "chars", "value": {"intValue": "5"}} in event["attributes"]
+
+    def test_file_exporter(self, tmp_path):
+        """测试本地文件导出：后台线程攒批，停止时写出剩余的 trace"""
+        path = tmp_path / "traces.jsonl"
+        batch = BatchExporter(FileExporter(str(path), "bot"), interval=0.01)
+
+        batch.export(self.make_spans())
+        batch.export(self.make_spans())
+        batch.shutdown()
+
+        lines = path.read_text(encoding="utf-8").splitlines()
+        spans = [span for line in lines
+                 for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+        assert len(spans) == 4
+
+    def test_otlp_exporter(self):
+        """测试以 OTLP/HTTP JSON 发送到 /v1/traces"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={})
+
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        exporter = OTLPExporter("http://collector:4318/", "bot", client=client)
+
+        exporter.export(self.make_spans())
+
+        [request] = requests
+        assert str(request.url) == "http://collector:4318/v1/traces"
+        assert request.headers["content-type"] == "application/json"
+        assert len(json.loads(request.content)["resourceSpans"][0]["scopeSpans"][0]["spans"]) == 2
+
+
+class TestInstrumentation:
+    """测试更新、Bot API 调用与模型流式回复的 span"""
+
+    @pytest.mark.asyncio
+    async def test_model_stream_span(self, exporter):
+        """测试模型流式回复记录首个分块、每个分块与完成事件"""
+        from bot.services import ai
+        from tests.fixtures.vertex import FaultyModel
+
+        chat = FaultyModel(latency=0, chunks=["Hello ", "world"]).start_chat()
+
+        with tracing.tracer.trace("update"):
+            result = [text async for text in ai.stream_message(chat, "hi", user_id=7)]
+
+        assert result == ["Hello ", "world"]
+        stream = by_name(exporter.traces[0])["model.stream"]
+        assert stream.attributes == {"model.user_id": 7}
+        assert [name for _, name, _ in stream.events] == ["first_chunk", "chunk", "chunk", "completion"]
+        assert stream.events[-1][2] == {"chunks": 2, "chars": 11}
+
+    @pytest.mark.asyncio
+    async def test_model_error_span(self, exporter):
+        """测试模型调用失败时 span 标记为出错"""
+        from bot.services import ai
+
+        chat = MagicMock()
+        chat.send_message.side_effect = ValueError("blocked")
+
+        with pytest.raises(ValueError):
+            with tracing.tracer.trace("update"):
+                [text async for text in ai.stream_message(chat, "hi")]
+
+        assert by_name(exporter.traces[0])["model.stream"].status == STATUS_ERROR
+
+    @pytest.mark.asyncio
+    async def test_telegram_call_span(self, exporter, mocker):
+        """测试 Bot API 调用记录为 CLIENT 子 span"""
+        from telegram.request import HTTPXRequest
+
+        from bot.server import InstrumentedRequest
+
+        mocker.patch.object(HTTPXRequest, "do_request", AsyncMock(return_value=(200, b"{}")))
+        request = InstrumentedRequest()
+
+        with tracing.tracer.trace("update"):
+            await request.do_request("https://api.telegram.org/botTOKEN/sendChatAction", "POST")
+        await request.do_request("https://api.telegram.org/botTOKEN/getUpdates", "POST")
+
+        [spans] = exporter.traces
+        span = by_name(spans)["telegram.sendChatAction"]
+        assert span.kind == tracing.CLIENT
+        assert span.attributes == {"telegram.method": "sendChatAction", "http.status_code": 200}
+
+    @pytest.mark.asyncio
+    async def test_update_trace(self, exporter, mocker):
+        """测试处理更新时开始 trace，处理器名写入根 span，trace_id 写入日志上下文"""
+        from telegram.ext import Application
+
+        from bot.app import instrumented
+        from bot.server import DrainingApplication
+        from bot.services.logs import update_context
+
+        seen = []
+
+        async def handler(update, context):
+            seen.append(update_context.get()["trace_id"])
+
+        wrapped = instrumented(handler, "chat_logic")
+
+        async def process(self, update):
+            await wrapped(update, None)
+
+        mocker.patch.object(Application, "process_update", process)
+        app = DrainingApplication.__new__(DrainingApplication)
+        app._in_flight = set()
+        mocker.patch.object(DrainingApplication, "concurrent_updates", 1)
+        update = MagicMock(update_id=3)
+        update.effective_user.id = 42
+        update.effective_chat.id = 42
+
+        await app.process_update(update)
+
+        [[root]] = exporter.traces
+        assert root.name == "telegram.update"
+        assert root.attributes == {"telegram.update_id": 3, "telegram.user_id": 42,
+                                   "telegram.chat_id": 42, "handler": "chat_logic"}
+        assert seen == [root.trace.trace_id]